@@ -1 +1,6 @@
-# Django core module
\ No newline at end of file
+# Django core module
+
+# Garante que a aplicação Celery seja carregada junto com o Django (para @shared_task)
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -0,0 +1,16 @@
+"""
+Aplicação Celery do projeto.
+
+As configurações vêm do settings.py com o prefixo CELERY_ e as tarefas são
+descobertas automaticamente nos módulos tasks.py dos apps instalados.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+app = Celery('core')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -201,13 +201,18 @@ if os.getenv('REDIS_HOST'):
     SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
     SESSION_CACHE_ALIAS = 'default'
 else:
-    # Local development - sem cache
+    # Local development - cache em memória do processo (um único processo, ex: runserver)
     CACHES = {
         'default': {
-            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'cte_mdfe',
         }
     }
 
+# Respostas dos painéis/dashboards (transport/services/cache_paineis.py).
+# A invalidação é feita pela versão dos dados; o timeout só limita o tempo que entradas antigas ocupam o cache.
+PAINEIS_CACHE_TIMEOUT = int(os.getenv('PAINEIS_CACHE_TIMEOUT', str(60 * 60 * 24)))
+
 # Celery Configuration (para tarefas assíncronas)
 if os.getenv('CELERY_BROKER_URL') or os.getenv('REDIS_HOST'):
     CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', f"redis://{os.getenv('REDIS_HOST', 'localhost')}:6379/0")
@@ -216,6 +221,24 @@ if os.getenv('CELERY_BROKER_URL') or os.getenv('REDIS_HOST'):
     CELERY_TASK_SERIALIZER = 'json'
     CELERY_RESULT_SERIALIZER = 'json'
     CELERY_TIMEZONE = TIME_ZONE
+else:
+    # Local development - sem broker, as tarefas rodam no próprio processo
+    CELERY_TASK_ALWAYS_EAGER = True
+    CELERY_TASK_EAGER_PROPAGATES = True
+
+# Relatórios gerados em segundo plano (/api/relatorios/tarefas/)
+# Por quantos minutos um relatório concluído é reaproveitado para os mesmos parâmetros
+RELATORIOS_REUSO_MINUTOS = int(os.getenv('RELATORIOS_REUSO_MINUTOS', '15'))
+# Tarefa na fila (desde a criação) ou gerando (desde o início) há mais que isso é dada como perdida (broker fora, worker morto)
+RELATORIOS_EXPIRACAO_MINUTOS = int(os.getenv('RELATORIOS_EXPIRACAO_MINUTOS', '120'))
+# Arquivos de relatório mais antigos que isso são removidos pelo comando limpar_relatorios
+RELATORIOS_RETENCAO_DIAS = int(os.getenv('RELATORIOS_RETENCAO_DIAS', '7'))
+
+# Ingestão de XMLs em lote (upload em lote e comando importar_xmls)
+# Número de processos do pool de parsing; no SQLite o padrão é 1 (escrita concorrente bloqueia o arquivo)
+INGESTAO_PROCESSOS = int(os.getenv('INGESTAO_PROCESSOS', '0')) or (
+    1 if DATABASES['default']['ENGINE'].endswith('sqlite3') else (os.cpu_count() or 1)
+)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
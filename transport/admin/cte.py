@@ -127,13 +127,16 @@ class CTeDocumentoAdmin(admin.ModelAdmin):
     @admin.action(description="Reprocessar CT-es selecionados")
     def reprocessar_ctes_selecionados(self, request, queryset):
         from ..services.parser_cte import parse_cte_completo
+        from ..services.fatos_cte import registrar_alteracao_cte
         
         success = 0
         failed = 0
         for cte in queryset:
-            cte.processado = False
-            cte.save(update_fields=['processado'])
-            if parse_cte_completo(cte):
+            with registrar_alteracao_cte(cte.chave):
+                cte.processado = False
+                cte.save(update_fields=['processado'])
+                ok = parse_cte_completo(cte)
+            if ok:
                 success += 1
             else:
                 failed += 1
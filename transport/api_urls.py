@@ -22,7 +22,7 @@ from .views.dashboard_views import (
 )
 from .views.config_views import (
     ConfiguracaoEmpresaViewSet, ParametroSistemaViewSet,
-    BackupAPIView, RelatorioAPIView
+    BackupAPIView, RelatorioAPIView, TarefaRelatorioViewSet
 )
 
 # --- Configuração Swagger (Schema View) ---
@@ -56,6 +56,7 @@ router.register(r"usuarios", UserViewSet, basename="usuario")
 router.register(r"configuracoes/empresa", ConfiguracaoEmpresaViewSet, basename="configuracao-empresa")
 router.register(r"configuracoes/parametros", ParametroSistemaViewSet, basename="parametros-sistema")
 router.register(r"backup", BackupAPIView, basename="backup")
+router.register(r"relatorios/tarefas", TarefaRelatorioViewSet, basename="tarefa-relatorio")
 
 # Rotas aninhadas para manutenções de veículos
 veiculos_router = routers.NestedSimpleRouter(router, r"veiculos", lookup="veiculo")
@@ -0,0 +1,33 @@
+# transport/management/commands/atualizar_status_documentos.py
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from transport.models import CTeDocumento, MDFeDocumento
+from transport.services.status_documento import TAMANHO_LOTE_STATUS, recalcular_status_documentos
+
+
+class Command(BaseCommand):
+    help = (
+        "Preenche/recalcula a coluna status de CT-e e MDF-e a partir de protocolo, cancelamento "
+        "e encerramento, refazendo os fatos diários dos meses com CT-e alterados. A migração 0009 "
+        "já faz isso uma vez; use o comando se a coluna sair de sincronia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', choices=['cte', 'mdfe', 'todos'], default='todos', help="Documentos a atualizar.")
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_STATUS, help="Documentos por UPDATE.")
+
+    def handle(self, *args, **options):
+        alterados = recalcular_status_documentos(
+            cte=options['tipo'] in ('cte', 'todos'),
+            mdfe=options['tipo'] in ('mdfe', 'todos'),
+            tamanho_lote=max(1, options['lote']),
+        )
+        for modelo, tipo in ((CTeDocumento, 'cte'), (MDFeDocumento, 'mdfe')):
+            if tipo not in alterados:
+                continue
+            contagens = modelo.objects.values('status').annotate(total=Count('pk')).order_by('status')
+            resumo = ", ".join(f"{c['status']}: {c['total']}" for c in contagens) or "nenhum documento"
+            self.stdout.write(f"{modelo._meta.verbose_name_plural}: {alterados[tipo]} alterados ({resumo})")
+        self.stdout.write(self.style.SUCCESS("Status dos documentos atualizado."))
@@ -0,0 +1,72 @@
+# transport/management/commands/importar_xmls.py
+
+import os
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from transport.services.ingestao_xml import pre_classificar_arquivo, montar_fases, contar_resultados
+from transport.services.ingestao_paralela import executar_fases
+
+
+class Command(BaseCommand):
+    help = "Importa XMLs de CT-e, MDF-e e eventos de arquivos/diretórios, em paralelo por chave de documento."
+
+    def add_arguments(self, parser):
+        parser.add_argument('caminhos', nargs='+', help="Arquivos XML ou diretórios (lidos recursivamente).")
+        parser.add_argument(
+            '--processos', type=int, default=settings.INGESTAO_PROCESSOS,
+            help=f"Número de processos de parsing (padrão: {settings.INGESTAO_PROCESSOS})."
+        )
+        parser.add_argument('--detalhes', action='store_true', help="Lista o resultado de cada arquivo com erro/ignorado.")
+
+    def _listar_arquivos(self, caminhos):
+        for caminho in caminhos:
+            if os.path.isdir(caminho):
+                for raiz, _dirs, nomes in os.walk(caminho):
+                    for nome in sorted(nomes):
+                        if nome.lower().endswith('.xml'):
+                            yield os.path.join(raiz, nome)
+            elif os.path.isfile(caminho):
+                yield caminho
+            else:
+                raise CommandError(f"Caminho não encontrado: {caminho}")
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        arquivos = list(self._listar_arquivos(options['caminhos']))
+        if not arquivos:
+            raise CommandError("Nenhum arquivo XML encontrado.")
+        self.stdout.write(f"Classificando {len(arquivos)} arquivos...")
+
+        resultados = []
+        classificados = []
+        for caminho in arquivos:
+            with open(caminho, 'rb') as f:
+                arq_info, error_msg = pre_classificar_arquivo(File(f, name=os.path.basename(caminho)))
+            if error_msg:
+                resultados.append({'arquivo_principal_nome': caminho, 'status': 'ignorado', 'erro': error_msg})
+                continue
+            # Mantém apenas o caminho; o conteúdo é lido pelo processo que tratar o grupo
+            arq_info.update(obj=None, caminho=caminho)
+            classificados.append(arq_info)
+
+        fases, resultados_ignorados = montar_fases(classificados)
+        resultados.extend(resultados_ignorados)
+        total_grupos = sum(len(grupos) for grupos in fases)
+        self.stdout.write(f"Processando {total_grupos} grupos com {options['processos']} processo(s)...")
+        resultados.extend(executar_fases(fases, processos=options['processos']))
+
+        sucesso, erros, ignorados = contar_resultados(resultados)
+        if options['detalhes']:
+            for resultado in resultados:
+                if resultado['status'] != 'sucesso':
+                    self.stdout.write(
+                        f"  [{resultado['status']}] {resultado.get('arquivo_principal_nome') or resultado.get('arquivo_retorno_nome')}: "
+                        f"{resultado.get('erro') or resultado.get('aviso') or ''}"
+                    )
+        self.stdout.write(self.style.SUCCESS(
+            f"Concluído em {time.monotonic() - inicio:.1f}s: {sucesso} sucesso, {erros} erros, {ignorados} ignorados."
+        ))
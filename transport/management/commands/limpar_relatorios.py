@@ -0,0 +1,26 @@
+# transport/management/commands/limpar_relatorios.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from transport.services.relatorios import remover_relatorios_antigos
+
+
+class Command(BaseCommand):
+    help = (
+        "Marca como erro as tarefas de relatório paradas (RELATORIOS_EXPIRACAO_MINUTOS) e remove "
+        "as tarefas (e seus arquivos) mais antigas que a retenção (RELATORIOS_RETENCAO_DIAS). "
+        "Pode ser agendado diariamente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias', type=int, default=settings.RELATORIOS_RETENCAO_DIAS,
+            help="Idade mínima, em dias, das tarefas a remover.",
+        )
+
+    def handle(self, *args, **options):
+        expiradas, removidas = remover_relatorios_antigos(max(0, options['dias']))
+        if expiradas:
+            self.stdout.write(f"{expiradas} tarefa(s) parada(s) marcada(s) como erro.")
+        self.stdout.write(self.style.SUCCESS(f"{removidas} tarefa(s) de relatório removida(s)."))
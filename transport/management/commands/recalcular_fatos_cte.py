@@ -0,0 +1,39 @@
+# transport/management/commands/recalcular_fatos_cte.py
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transport.services.fatos_cte import recalcular_fatos_por_mes
+
+
+def _data(valor):
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f"Data inválida '{valor}'. Use YYYY-MM-DD.")
+
+
+class Command(BaseCommand):
+    help = "Recalcula a tabela de fatos diários dos CT-e (painéis) para um intervalo de datas, mês a mês."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-inicio', help="Primeiro dia (YYYY-MM-DD). Padrão: emissão mais antiga.")
+        parser.add_argument('--data-fim', help="Último dia (YYYY-MM-DD). Padrão: emissão mais recente.")
+
+    def handle(self, *args, **options):
+        data_inicio = _data(options['data_inicio']) if options['data_inicio'] else None
+        data_fim = _data(options['data_fim']) if options['data_fim'] else None
+        if data_inicio and data_fim and data_inicio > data_fim:
+            raise CommandError("--data-inicio deve ser anterior a --data-fim.")
+
+        meses = recalcular_fatos_por_mes(data_inicio, data_fim)
+        if not meses:
+            self.stdout.write("Nenhum CT-e para recalcular.")
+            return
+        for inicio_mes, linhas in meses:
+            self.stdout.write(f"{inicio_mes:%m/%Y}: {linhas} linhas")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Fatos recalculados a partir de {meses[0][0]:%d/%m/%Y}: {sum(linhas for _, linhas in meses)} linhas."
+        ))
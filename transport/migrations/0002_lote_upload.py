@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:26
+
+import django.db.models.deletion
+import transport.models
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoteUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('usuario', models.CharField(blank=True, max_length=150, verbose_name='Usuário')),
+                ('status', models.CharField(choices=[('recebido', 'Recebido'), ('processando', 'Processando'), ('concluido', 'Concluído')], db_index=True, default='recebido', max_length=20, verbose_name='Status')),
+                ('total_arquivos', models.PositiveIntegerField(default=0, verbose_name='Total de Arquivos')),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Lote de Upload',
+                'verbose_name_plural': 'Lotes de Upload',
+                'ordering': ['-criado_em'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArquivoLote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('arquivo', models.FileField(blank=True, null=True, upload_to=transport.models.caminho_arquivo_lote)),
+                ('nome', models.CharField(max_length=255, verbose_name='Nome do Arquivo')),
+                ('tipo_xml', models.CharField(blank=True, max_length=60, null=True, verbose_name='Tipo XML')),
+                ('chave', models.CharField(blank=True, max_length=44, null=True, verbose_name='Chave do Documento')),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('sucesso', 'Sucesso'), ('erro', 'Erro'), ('ignorado', 'Ignorado')], default='pendente', max_length=20, verbose_name='Status')),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('lote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='arquivos', to='transport.loteupload')),
+            ],
+            options={
+                'verbose_name': 'Arquivo do Lote',
+                'verbose_name_plural': 'Arquivos do Lote',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['lote', 'chave'], name='transport_a_lote_id_d88477_idx'), models.Index(fields=['lote', 'status'], name='transport_a_lote_id_0973d4_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0002_lote_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ctedocumento',
+            name='hash_conteudo',
+            field=models.CharField(blank=True, editable=False, help_text='Identifica reenvios do mesmo XML já processado.', max_length=64, null=True, verbose_name='Hash SHA-256 do XML'),
+        ),
+        migrations.AddField(
+            model_name='mdfedocumento',
+            name='hash_conteudo',
+            field=models.CharField(blank=True, editable=False, help_text='Identifica reenvios do mesmo XML já processado.', max_length=64, null=True, verbose_name='Hash SHA-256 do XML'),
+        ),
+    ]
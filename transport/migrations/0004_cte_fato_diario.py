@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0003_hash_conteudo_documentos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CTeFatoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='Data Emissão')),
+                ('situacao', models.CharField(choices=[('autorizado', 'Autorizado'), ('cancelado', 'Cancelado'), ('rejeitado', 'Rejeitado'), ('pendente', 'Sem Protocolo')], max_length=10, verbose_name='Situação')),
+                ('modalidade', models.CharField(blank=True, default='', max_length=3, verbose_name='Modalidade Frete')),
+                ('uf_ini', models.CharField(blank=True, default='', max_length=2, verbose_name='UF Início')),
+                ('codigo_mun_ini', models.CharField(blank=True, default='', max_length=7, verbose_name='Código Município Início')),
+                ('nome_mun_ini', models.CharField(blank=True, default='', max_length=60, verbose_name='Município Início')),
+                ('uf_fim', models.CharField(blank=True, default='', max_length=2, verbose_name='UF Fim')),
+                ('codigo_mun_fim', models.CharField(blank=True, default='', max_length=7, verbose_name='Código Município Fim')),
+                ('nome_mun_fim', models.CharField(blank=True, default='', max_length=60, verbose_name='Município Fim')),
+                ('destinatario_cnpj', models.CharField(blank=True, default='', max_length=14, verbose_name='CNPJ/CPF Destinatário')),
+                ('destinatario_nome', models.CharField(blank=True, default='', max_length=60, verbose_name='Destinatário')),
+                ('placa', models.CharField(blank=True, default='', max_length=7, verbose_name='Placa Principal')),
+                ('quantidade', models.PositiveIntegerField(default=0, verbose_name='Quantidade CT-e')),
+                ('valor_total', models.DecimalField(decimal_places=2, default=0, max_digits=17, verbose_name='Valor Total Prestado')),
+                ('dist_km', models.PositiveBigIntegerField(default=0, verbose_name='Distância Total KM')),
+            ],
+            options={
+                'verbose_name': 'CT-e – Fato Diário',
+                'verbose_name_plural': 'CT-e – Fatos Diários',
+                'db_table': 'cte_fato_diario',
+                'indexes': [models.Index(fields=['situacao', 'data'], name='cte_fato_di_situaca_f66069_idx')],
+                'constraints': [models.UniqueConstraint(fields=('data', 'situacao', 'modalidade', 'codigo_mun_ini', 'nome_mun_ini', 'uf_ini', 'codigo_mun_fim', 'nome_mun_fim', 'uf_fim', 'destinatario_cnpj', 'destinatario_nome', 'placa'), name='cte_fato_diario_dimensoes_unicas')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0004_cte_fato_diario'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mdfeidentificacao',
+            name='dh_emi',
+            field=models.DateTimeField(db_index=True, verbose_name='Data/Hora Emissão'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0005_mdfe_dh_emi_indice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ctedocumento',
+            name='status',
+            field=models.CharField(choices=[('pendente', 'Pendente'), ('autorizado', 'Autorizado'), ('rejeitado', 'Rejeitado'), ('cancelado', 'Cancelado')], db_index=True, default='pendente', editable=False, max_length=10, verbose_name='Status'),
+        ),
+        migrations.AddField(
+            model_name='mdfedocumento',
+            name='status',
+            field=models.CharField(choices=[('pendente', 'Pendente'), ('autorizado', 'Autorizado'), ('rejeitado', 'Rejeitado'), ('encerrado', 'Encerrado'), ('cancelado', 'Cancelado')], db_index=True, default='pendente', editable=False, max_length=10, verbose_name='Status'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0006_status_documentos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ctedocumento',
+            index=models.Index(fields=['data_upload', 'id'], name='cte_documen_data_up_2fc3f3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mdfedocumento',
+            index=models.Index(fields=['data_upload', 'id'], name='mdfe_docume_data_up_c29130_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:02
+
+import transport.models
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0007_indice_paginacao_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaRelatorio',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('usuario', models.CharField(blank=True, max_length=150, verbose_name='Usuário')),
+                ('tipo', models.CharField(max_length=30, verbose_name='Tipo de Relatório')),
+                ('formato', models.CharField(max_length=10, verbose_name='Formato')),
+                ('filtros', models.JSONField(blank=True, default=dict)),
+                ('assinatura', models.CharField(editable=False, max_length=64, verbose_name='Assinatura dos Parâmetros')),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluido', 'Concluído'), ('erro', 'Erro')], db_index=True, default='pendente', max_length=20, verbose_name='Status')),
+                ('arquivo', models.FileField(blank=True, null=True, upload_to=transport.models.caminho_arquivo_relatorio)),
+                ('total_linhas', models.PositiveIntegerField(blank=True, null=True, verbose_name='Total de Linhas')),
+                ('erro', models.TextField(blank=True, null=True, verbose_name='Erro')),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Tarefa de Relatório',
+                'verbose_name_plural': 'Tarefas de Relatório',
+                'ordering': ['-criado_em'],
+                'indexes': [models.Index(fields=['usuario', 'assinatura', 'status'], name='transport_t_usuario_755060_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def preencher_status(apps, schema_editor):
+    # Usa o serviço (modelos atuais) para que a regra do status e a reconstrução
+    # dos fatos diários sejam as mesmas do comando atualizar_status_documentos.
+    from transport.services.status_documento import recalcular_status_documentos
+
+    recalcular_status_documentos()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0008_tarefa_relatorio'),
+    ]
+
+    operations = [
+        migrations.RunPython(preencher_status, migrations.RunPython.noop),
+    ]
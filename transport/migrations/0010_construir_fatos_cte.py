@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def construir_fatos(apps, schema_editor):
+    # Bases anteriores à 0004 têm CT-e mas nenhum fato; roda depois do
+    # preenchimento do status (0009) porque a situação dos fatos é o status.
+    from transport.services.fatos_cte import recalcular_fatos_por_mes
+
+    recalcular_fatos_por_mes()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0009_preencher_status_documentos'),
+    ]
+
+    operations = [
+        migrations.RunPython(construir_fatos, migrations.RunPython.noop),
+    ]
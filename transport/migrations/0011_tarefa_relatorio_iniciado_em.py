@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0010_construir_fatos_cte'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarefarelatorio',
+            name='iniciado_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -45,6 +45,12 @@ class EntidadeFiscal(Endereco):
 class CTeDocumento(models.Model):
     """Raiz do CT-e – mantém a chave e o XML bruto."""
     MODALIDADE_CHOICES = [('CIF','CIF'), ('FOB','FOB')] # Novas Opções CIF/FOB
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('autorizado', 'Autorizado'),
+        ('rejeitado', 'Rejeitado'),
+        ('cancelado', 'Cancelado'),
+    ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     chave = models.CharField("Chave CT-e", max_length=44, unique=True, db_index=True)
@@ -53,7 +59,10 @@ class CTeDocumento(models.Model):
     arquivo_xml = models.FileField(upload_to='xml_ctes/', null=True, blank=True, verbose_name="Arquivo XML")
     data_upload = models.DateTimeField(auto_now_add=True)
     processado = models.BooleanField(default=False, help_text="Indica se o XML foi processado e os dados extraídos.")
+    hash_conteudo = models.CharField("Hash SHA-256 do XML", max_length=64, null=True, blank=True, editable=False, help_text="Identifica reenvios do mesmo XML já processado.")
     modalidade = models.CharField("Modalidade Frete", max_length=3, choices=MODALIDADE_CHOICES, null=True, blank=True, db_index=True) # NOVO CAMPO
+    # Mantido por services/status_documento.py a partir de protocolo/cancelamento (evita esses joins nos filtros)
+    status = models.CharField("Status", max_length=10, choices=STATUS_CHOICES, default='pendente', db_index=True, editable=False)
 
     # Relacionamento com MDF-e (definido mais abaixo via add_to_class)
     # mdfe_vinculado = models.ManyToManyField('MDFeDocumento', through='MDFeDocumentosVinculados', related_name='ctes_transportados')
@@ -66,6 +75,7 @@ class CTeDocumento(models.Model):
         indexes = [
             models.Index(fields=['modalidade', 'data_upload']),
             models.Index(fields=['processado', 'data_upload']),
+            models.Index(fields=['data_upload', 'id']),  # Paginação por cursor das listagens
         ]
 
     def __str__(self):
@@ -485,6 +495,14 @@ class CTeCancelamento(models.Model):
 
 class MDFeDocumento(models.Model):
    """Raiz do MDF-e – mantém a chave e o XML bruto."""
+   STATUS_CHOICES = [
+       ('pendente', 'Pendente'),
+       ('autorizado', 'Autorizado'),
+       ('rejeitado', 'Rejeitado'),
+       ('encerrado', 'Encerrado'),
+       ('cancelado', 'Cancelado'),
+   ]
+
    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
    chave = models.CharField("Chave MDF-e", max_length=44, unique=True, db_index=True)
    versao = models.CharField("Versão Schema", max_length=5)
@@ -492,6 +510,9 @@ class MDFeDocumento(models.Model):
    arquivo_xml = models.FileField(upload_to='xml_mdfes/', null=True, blank=True, verbose_name="Arquivo XML")
    data_upload = models.DateTimeField(auto_now_add=True)
    processado = models.BooleanField(default=False, help_text="Indica se o XML foi processado e os dados extraídos.")
+   hash_conteudo = models.CharField("Hash SHA-256 do XML", max_length=64, null=True, blank=True, editable=False, help_text="Identifica reenvios do mesmo XML já processado.")
+   # Mantido por services/status_documento.py a partir de protocolo/cancelamento/encerramento
+   status = models.CharField("Status", max_length=10, choices=STATUS_CHOICES, default='pendente', db_index=True, editable=False)
    
    # Campos para tratamento de encerramento - NOVOS CAMPOS
    encerrado = models.BooleanField("Encerrado", default=False, db_index=True)
@@ -505,6 +526,9 @@ class MDFeDocumento(models.Model):
        verbose_name = "MDF-e (Documento)"
        verbose_name_plural = "MDF-e (Documentos)"
        ordering = ['-identificacao__dh_emi']
+       indexes = [
+           models.Index(fields=['data_upload', 'id']),  # Paginação por cursor das listagens
+       ]
 
    def __str__(self):
        return self.chave
@@ -522,7 +546,7 @@ class MDFeIdentificacao(models.Model):
    c_mdf = models.CharField("Código Numérico Chave", max_length=8)
    c_dv = models.CharField("Dígito Verificador Chave", max_length=1)
    modal = models.CharField("Modal (1=Rodoviário, 2=Aéreo, 3=Aquaviário, 4=Ferroviário)", max_length=1)
-   dh_emi = models.DateTimeField("Data/Hora Emissão")
+   dh_emi = models.DateTimeField("Data/Hora Emissão", db_index=True)
    tp_emis = models.PositiveSmallIntegerField("Tipo Emissão (1=Normal, 2=Contingência)")
    proc_emi = models.PositiveSmallIntegerField("Processo Emissão")
    ver_proc = models.CharField("Versão Processo Emissão", max_length=20)
@@ -1076,12 +1100,19 @@ class PagamentoAgregado(models.Model):
        verbose_name_plural = "Pagamentos Agregados (CT-e)"
        ordering = ['-data_prevista', 'status']
 
+   @staticmethod
+   def calcular_repasse(valor_frete_total, percentual_repasse):
+       """
+       Valor do repasse já arredondado a centavos, como fica gravado (também usado
+       na geração em lote, que não passa pelo save(), e na simulação).
+       """
+       if valor_frete_total and percentual_repasse:
+           return ((valor_frete_total * percentual_repasse) / Decimal('100.0')).quantize(Decimal('0.01'))
+       return Decimal('0.00')
+
    def save(self, *args, **kwargs):
        # Calcula o valor do repasse automaticamente
-       if self.valor_frete_total and self.percentual_repasse:
-           self.valor_repassado = (self.valor_frete_total * self.percentual_repasse) / Decimal('100.0')
-       else:
-           self.valor_repassado = Decimal('0.00')
+       self.valor_repassado = self.calcular_repasse(self.valor_frete_total, self.percentual_repasse)
        super().save(*args, **kwargs)
 
    def __str__(self):
@@ -1273,6 +1304,161 @@ class AlertaSistema(models.Model):
         return f"[{self.prioridade.upper()}] {self.tipo or 'Alerta'}"
 
 
+def caminho_arquivo_lote(instance, filename):
+    """Arquivos de um lote ficam agrupados em uploads_lote/<id do lote>/."""
+    return f"uploads_lote/{instance.lote_id}/{filename}"
+
+
+class LoteUpload(models.Model):
+    """Lote de XMLs enviado para processamento em segundo plano."""
+    STATUS_CHOICES = [
+        ('recebido', 'Recebido'),
+        ('processando', 'Processando'),
+        ('concluido', 'Concluído'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.CharField("Usuário", max_length=150, blank=True)
+    status = models.CharField("Status", max_length=20, choices=STATUS_CHOICES, default='recebido', db_index=True)
+    total_arquivos = models.PositiveIntegerField("Total de Arquivos", default=0)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Lote de Upload"
+        verbose_name_plural = "Lotes de Upload"
+        ordering = ['-criado_em']
+
+    def __str__(self):
+        return f"Lote {self.id} ({self.get_status_display()})"
+
+
+class ArquivoLote(models.Model):
+    """Arquivo XML de um lote, com o resultado do seu processamento."""
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('sucesso', 'Sucesso'),
+        ('erro', 'Erro'),
+        ('ignorado', 'Ignorado'),
+    ]
+
+    lote = models.ForeignKey(LoteUpload, on_delete=models.CASCADE, related_name='arquivos')
+    arquivo = models.FileField(upload_to=caminho_arquivo_lote, null=True, blank=True)
+    nome = models.CharField("Nome do Arquivo", max_length=255)
+    tipo_xml = models.CharField("Tipo XML", max_length=60, null=True, blank=True)
+    chave = models.CharField("Chave do Documento", max_length=44, null=True, blank=True)
+    status = models.CharField("Status", max_length=20, choices=STATUS_CHOICES, default='pendente')
+    resultado = models.JSONField(null=True, blank=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Arquivo do Lote"
+        verbose_name_plural = "Arquivos do Lote"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['lote', 'chave']),
+            models.Index(fields=['lote', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.nome} [{self.status}]"
+
+
+def caminho_arquivo_relatorio(instance, filename):
+    """Arquivos gerados pelas tarefas de relatório ficam em relatorios/<id da tarefa>/."""
+    return f"relatorios/{instance.id}/{filename}"
+
+
+class TarefaRelatorio(models.Model):
+    """
+    Relatório gerado em segundo plano (services/relatorios.py).
+    Tarefas com os mesmos parâmetros (assinatura) são reaproveitadas enquanto
+    estão na fila ou, depois de concluídas, por RELATORIOS_REUSO_MINUTOS.
+    """
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('concluido', 'Concluído'),
+        ('erro', 'Erro'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.CharField("Usuário", max_length=150, blank=True)
+    tipo = models.CharField("Tipo de Relatório", max_length=30)
+    formato = models.CharField("Formato", max_length=10)
+    filtros = models.JSONField(default=dict, blank=True)
+    assinatura = models.CharField("Assinatura dos Parâmetros", max_length=64, editable=False)
+    status = models.CharField("Status", max_length=20, choices=STATUS_CHOICES, default='pendente', db_index=True)
+    arquivo = models.FileField(upload_to=caminho_arquivo_relatorio, null=True, blank=True)
+    total_linhas = models.PositiveIntegerField("Total de Linhas", null=True, blank=True)
+    erro = models.TextField("Erro", null=True, blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Tarefa de Relatório"
+        verbose_name_plural = "Tarefas de Relatório"
+        ordering = ['-criado_em']
+        indexes = [
+            models.Index(fields=['usuario', 'assinatura', 'status']),
+        ]
+
+    def __str__(self):
+        return f"Relatório {self.tipo}.{self.formato} ({self.get_status_display()})"
+
+
+class CTeFatoDiario(models.Model):
+    """
+    Agregado diário dos CT-e processados, usado pelos painéis.
+    Uma linha por dia e combinação de dimensões; dimensões ausentes ficam como ''
+    para que a restrição de unicidade funcione (NULLs não se repetem no índice).
+    Mantido por services/fatos_cte.py; pode ser recalculado com o comando recalcular_fatos_cte.
+    """
+    SITUACAO_CHOICES = [
+        ('autorizado', 'Autorizado'),
+        ('cancelado', 'Cancelado'),
+        ('rejeitado', 'Rejeitado'),
+        ('pendente', 'Sem Protocolo'),
+    ]
+
+    data = models.DateField("Data Emissão")
+    situacao = models.CharField("Situação", max_length=10, choices=SITUACAO_CHOICES)
+    modalidade = models.CharField("Modalidade Frete", max_length=3, blank=True, default='')
+    uf_ini = models.CharField("UF Início", max_length=2, blank=True, default='')
+    codigo_mun_ini = models.CharField("Código Município Início", max_length=7, blank=True, default='')
+    nome_mun_ini = models.CharField("Município Início", max_length=60, blank=True, default='')
+    uf_fim = models.CharField("UF Fim", max_length=2, blank=True, default='')
+    codigo_mun_fim = models.CharField("Código Município Fim", max_length=7, blank=True, default='')
+    nome_mun_fim = models.CharField("Município Fim", max_length=60, blank=True, default='')
+    destinatario_cnpj = models.CharField("CNPJ/CPF Destinatário", max_length=14, blank=True, default='')
+    destinatario_nome = models.CharField("Destinatário", max_length=60, blank=True, default='')
+    placa = models.CharField("Placa Principal", max_length=7, blank=True, default='')
+
+    quantidade = models.PositiveIntegerField("Quantidade CT-e", default=0)
+    valor_total = models.DecimalField("Valor Total Prestado", max_digits=17, decimal_places=2, default=0)
+    dist_km = models.PositiveBigIntegerField("Distância Total KM", default=0)
+
+    class Meta:
+        db_table = "cte_fato_diario"
+        verbose_name = "CT-e – Fato Diário"
+        verbose_name_plural = "CT-e – Fatos Diários"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['data', 'situacao', 'modalidade', 'codigo_mun_ini', 'nome_mun_ini', 'uf_ini',
+                        'codigo_mun_fim', 'nome_mun_fim', 'uf_fim', 'destinatario_cnpj', 'destinatario_nome', 'placa'],
+                name='cte_fato_diario_dimensoes_unicas',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['situacao', 'data']),
+        ]
+
+    def __str__(self):
+        return f"{self.data} {self.situacao}: {self.quantidade} CT-e"
+
+
 # --------------------------------------------------
 #  R E L A C I O N A M E N T O S   F I N A I S
 # --------------------------------------------------
@@ -0,0 +1,143 @@
+# transport/pagination.py
+
+"""
+Paginação das listagens de CT-e e MDF-e.
+
+Por padrão continua a paginação por número de página (PAGE_SIZE). Com
+?paginacao=cursor (ou um ?cursor= recebido em `next`) a listagem passa a ser
+paginada por chave (keyset) em (data_upload, id), do mais recente para o mais
+antigo: cada página é um "WHERE (data_upload, id) < último visto LIMIT n", sem
+OFFSET, então a página 1000 custa o mesmo que a primeira.
+
+No modo cursor o total não é calculado, a não ser que seja pedido:
+?contagem=aproximada usa a estimativa do planejador no PostgreSQL (count()
+exato nos demais bancos) e ?contagem=exata faz o count().
+"""
+
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+TAMANHO_MAXIMO_PAGINA_CURSOR = 200
+
+
+def contagem_aproximada(queryset):
+    """Estimativa de linhas do planejador (PostgreSQL). Nos demais bancos faz o count() exato."""
+    if connection.vendor == 'postgresql':
+        try:
+            plano = json.loads(queryset.explain(format='json'))
+            return int(plano[0]['Plan']['Plan Rows'])
+        except (DatabaseError, ValueError, KeyError, IndexError, TypeError):
+            pass
+    return queryset.count()
+
+
+class CursorDocumentosPagination(BasePagination):
+    """Paginação keyset em (-data_upload, -id); só avança (o cliente guarda as páginas já lidas)."""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    contagem_query_param = 'contagem'
+    ordenacao = ('-data_upload', '-id')
+
+    def _tamanho_pagina(self, request):
+        try:
+            tamanho = int(request.query_params.get(self.page_size_query_param, ''))
+        except ValueError:
+            return settings.REST_FRAMEWORK.get('PAGE_SIZE') or 20
+        return max(1, min(tamanho, TAMANHO_MAXIMO_PAGINA_CURSOR))
+
+    def _decodificar_cursor(self, valor):
+        try:
+            data_upload, pk = json.loads(base64.urlsafe_b64decode(valor.encode('ascii')))
+            return datetime.fromisoformat(data_upload), uuid.UUID(pk)
+        except (ValueError, TypeError, AttributeError, UnicodeError):
+            raise NotFound("Cursor inválido.")
+
+    def _codificar_cursor(self, obj):
+        bruto = json.dumps([obj.data_upload.isoformat(), str(obj.pk)])
+        return base64.urlsafe_b64encode(bruto.encode('ascii')).decode('ascii')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        tamanho = self._tamanho_pagina(request)
+
+        # A contagem (se pedida) é sobre o conjunto filtrado inteiro, sem ordenação
+        contagem = request.query_params.get(self.contagem_query_param)
+        self.count = None
+        if contagem == 'aproximada':
+            self.count = contagem_aproximada(queryset.order_by())
+        elif contagem == 'exata':
+            self.count = queryset.order_by().count()
+
+        queryset = queryset.order_by(*self.ordenacao)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            data_upload, pk = self._decodificar_cursor(cursor)
+            queryset = queryset.filter(Q(data_upload__lt=data_upload) | Q(data_upload=data_upload, pk__lt=pk))
+
+        # Um registro a mais indica se existe próxima página
+        itens = list(queryset[:tamanho + 1])
+        self.proximo = self._codificar_cursor(itens[tamanho - 1]) if len(itens) > tamanho else None
+        return itens[:tamanho]
+
+    def get_next_link(self):
+        if not self.proximo:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.proximo)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class DocumentosPagination(PageNumberPagination):
+    """
+    Paginação por página (padrão) ou por cursor, quando a requisição traz
+    ?paginacao=cursor ou ?cursor=.
+    """
+    modo_query_param = 'paginacao'
+
+    def _usa_cursor(self, request):
+        params = request.query_params
+        return params.get(self.modo_query_param) == 'cursor' or CursorDocumentosPagination.cursor_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor = CursorDocumentosPagination() if self._usa_cursor(request) else None
+        if self.cursor:
+            return self.cursor.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor:
+            return self.cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if self.cursor:
+            return self.cursor.get_next_link()
+        return super().get_next_link()
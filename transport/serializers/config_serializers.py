@@ -1,9 +1,11 @@
 # transport/serializers/config_serializers.py
 
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 
 # Importar modelos relevantes
-from ..models import ParametroSistema, ConfiguracaoEmpresa, RegistroBackup
+from ..models import ParametroSistema, ConfiguracaoEmpresa, RegistroBackup, TarefaRelatorio
+from ..services.relatorios import FORMATOS_RELATORIO, RELATORIOS, datas_filtros
 
 # =====================================================
 # === Serializadores para Configurações do Sistema ===
@@ -88,4 +90,35 @@ class RegistroBackupSerializer(serializers.ModelSerializer):
         else:
             return f"{bytes_size / gb:.2f} GB"
 
-# Adicione aqui serializers para Relatórios se/quando forem implementados
\ No newline at end of file
+# Adicione aqui serializers para Relatórios se/quando forem implementados
+
+class SolicitacaoRelatorioSerializer(serializers.Serializer):
+    """Parâmetros para gerar um relatório em segundo plano."""
+    tipo = serializers.ChoiceField(choices=list(RELATORIOS))
+    formato = serializers.ChoiceField(choices=FORMATOS_RELATORIO, default='csv')
+    filtros = serializers.DictField(required=False, default=dict)
+
+    def validate_filtros(self, value):
+        try:
+            datas_filtros(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+
+class TarefaRelatorioSerializer(serializers.ModelSerializer):
+    """Situação de um relatório gerado em segundo plano, com o link de download quando concluído."""
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TarefaRelatorio
+        fields = [
+            'id', 'tipo', 'formato', 'filtros', 'status', 'usuario', 'total_linhas',
+            'erro', 'criado_em', 'iniciado_em', 'concluido_em', 'download_url'
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != 'concluido' or not obj.arquivo:
+            return None
+        return reverse('tarefa-relatorio-download', kwargs={'pk': str(obj.pk)}, request=self.context.get('request'))
@@ -13,6 +13,7 @@ from ..models import (
     CTeResponsavelTecnico, CTeProtocoloAutorizacao, CTeSuplementar,
     CTeCancelamento,
 )
+from ..services.status_documento import rotulo_status
 
 # Importar serializers base (se houver - como EnderecoSerializer)
 # from .base_serializers import EnderecoSerializer # Descomente se EnderecoSerializer foi criado em base_serializers.py
@@ -214,21 +215,22 @@ class CTeDocumentoListSerializer(serializers.ModelSerializer):
 
     def get_placa_principal(self, obj):
         """ Pega a placa do primeiro veículo associado ao modal rodoviário, se existir. """
+        # CTeDocumentoViewSet anota a placa na própria consulta (fatos_cte.placa_principal)
+        if hasattr(obj, 'placa_principal_annotation'):
+            return obj.placa_principal_annotation
         try:
-             # Acessa o modal e depois a lista de veículos, pegando o primeiro
-             return obj.modal_rodoviario.veiculos.first().placa
-        except AttributeError: # Caso modal_rodoviario ou veiculos não existam
+             # .all() aproveita o prefetch_related('modal_rodoviario__veiculos'); .first() faria nova consulta
+             veiculos = obj.modal_rodoviario.veiculos.all()
+        except AttributeError: # Caso modal_rodoviario não exista
              return None
+        veiculo = min(veiculos, key=lambda v: v.pk, default=None)
+        return veiculo.placa if veiculo else None
 
     def get_status(self, obj):
-        """ Determina o status consolidado do CT-e. """
-        if hasattr(obj, 'cancelamento') and obj.cancelamento and obj.cancelamento.c_stat == 135:
-            return "Cancelado"
-        if hasattr(obj, 'protocolo') and obj.protocolo:
-            return "Autorizado" if obj.protocolo.codigo_status == 100 else f"Rejeitado ({obj.protocolo.codigo_status})"
-        if obj.processado:
-            return "Processado (s/ Prot.)"
-        return "Pendente"
+        """ Determina o status consolidado do CT-e a partir da coluna status. """
+        # Só a rejeição precisa do protocolo, para exibir o código
+        protocolo = getattr(obj, 'protocolo', None) if obj.status == 'rejeitado' else None
+        return rotulo_status(obj.status, obj.processado, protocolo.codigo_status if protocolo else None)
 
 
 class CTeDocumentoDetailSerializer(serializers.ModelSerializer):
@@ -17,6 +17,7 @@ from ..models import (
     # Modelo CT-e necessário para MDFeDocumentosVinculadosSerializer
     CTeDocumento
 )
+from ..services.status_documento import rotulo_status
 
 # Importar serializers base e de outros módulos se necessário
 # from .base_serializers import EnderecoSerializer # Descomente se usar
@@ -220,19 +221,11 @@ class MDFeDocumentoListSerializer(serializers.ModelSerializer):
         read_only_fields = fields # Garante que a lista seja apenas leitura
 
     def get_status(self, obj):
-        """ Determina o status consolidado do MDF-e. """
-        if hasattr(obj, 'cancelamento') and obj.cancelamento and obj.cancelamento.c_stat == 135:
-            return "Cancelado"
-        if obj.encerrado: # Checa o campo 'encerrado' do modelo
-             # Verifica se o encerramento foi cancelado
-             if hasattr(obj, 'cancelamento_encerramento') and obj.cancelamento_encerramento and obj.cancelamento_encerramento.c_stat == 135:
-                 return "Enc. Cancelado"
-             return "Encerrado"
-        if hasattr(obj, 'protocolo') and obj.protocolo:
-            return "Autorizado" if obj.protocolo.codigo_status == 100 else f"Rejeitado ({obj.protocolo.codigo_status})"
-        if obj.processado:
-            return "Processado (s/ Prot.)"
-        return "Pendente"
+        """ Determina o status consolidado do MDF-e a partir da coluna status. """
+        # O cancelamento do encerramento volta o MDF-e para 'autorizado' (encerrado=False)
+        # Só a rejeição precisa do protocolo, para exibir o código
+        protocolo = getattr(obj, 'protocolo', None) if obj.status == 'rejeitado' else None
+        return rotulo_status(obj.status, obj.processado, protocolo.codigo_status if protocolo else None)
 
     def get_documentos_count(self, obj):
         """ Retorna a contagem de documentos vinculados (otimizado se pré-carregado). """
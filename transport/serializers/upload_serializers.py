@@ -1,7 +1,10 @@
 # transport/serializers/upload_serializers.py
 
+from django.db.models import Count
 from rest_framework import serializers
 
+from ..models import LoteUpload, ArquivoLote
+
 class UploadXMLSerializer(serializers.Serializer):
     # ... (mantido como antes)
     arquivo_xml = serializers.FileField(
@@ -32,4 +35,55 @@ class BatchUploadXMLSerializer(serializers.Serializer): # CONTINUAÇÃO
         help_text="Selecione todos os arquivos XML para processamento em lote."
     )
     # O campo arquivos_xml_retorno foi removido daqui.
-    # A lógica de emparelhamento será feita no backend.
\ No newline at end of file
+    # A lógica de emparelhamento será feita no backend.
+    assincrono = serializers.BooleanField(
+        required=False,
+        default=False,
+        label="Processar em segundo plano",
+        help_text="Se verdadeiro, os arquivos são enfileirados e o progresso é consultado pelo id do lote."
+    )
+
+
+
+class ArquivoCompactadoUploadSerializer(serializers.Serializer):
+    """
+    Serializer para a action 'archive_upload' da UnifiedUploadViewSet.
+    Recebe um único arquivo ZIP ou tar (opcionalmente .tar.gz/.tgz/.tar.bz2/.tar.xz) com os XMLs do lote.
+    """
+    arquivo = serializers.FileField(
+        required=True,
+        allow_empty_file=False,
+        label="Arquivo compactado (ZIP ou tar)",
+        help_text="Arquivo com os XMLs (CT-e, MDF-e, Eventos, Retornos); entradas que não são XML são ignoradas."
+    )
+    assincrono = serializers.BooleanField(
+        required=False,
+        default=False,
+        label="Processar em segundo plano",
+        help_text="Se verdadeiro, os XMLs extraídos são enfileirados e o progresso é consultado pelo id do lote."
+    )
+
+class ArquivoLoteSerializer(serializers.ModelSerializer):
+    """Situação de um arquivo dentro do lote."""
+    class Meta:
+        model = ArquivoLote
+        fields = ['id', 'nome', 'tipo_xml', 'chave', 'status', 'resultado', 'atualizado_em']
+
+
+class LoteUploadSerializer(serializers.ModelSerializer):
+    """Lote de upload com o progresso consolidado e o resultado de cada arquivo."""
+    progresso = serializers.SerializerMethodField()
+    arquivos = ArquivoLoteSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = LoteUpload
+        fields = ['id', 'status', 'usuario', 'total_arquivos', 'criado_em', 'concluido_em', 'progresso', 'arquivos']
+
+    def get_progresso(self, obj):
+        contagem = {s: 0 for s, _ in ArquivoLote.STATUS_CHOICES}
+        for item in obj.arquivos.values('status').annotate(total=Count('id')):
+            contagem[item['status']] = item['total']
+        finalizados = contagem['sucesso'] + contagem['erro'] + contagem['ignorado']
+        contagem['finalizados'] = finalizados
+        contagem['percentual'] = round(finalizados * 100 / obj.total_arquivos, 1) if obj.total_arquivos else 100.0
+        return contagem
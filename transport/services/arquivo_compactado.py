@@ -0,0 +1,113 @@
+# transport/services/arquivo_compactado.py
+
+"""
+Extração de XMLs de arquivos compactados (ZIP e tar, com ou sem gzip/bz2/xz)
+para o upload em lote.
+
+As entradas são descompactadas em blocos direto para um SpoolLote: nenhuma
+entrada fica inteira em memória e o arquivo compactado não é desempacotado
+em disco. Cada XML vira um UploadedFile apontando para o seu trecho do spool,
+pronto para a mesma classificação/agrupamento do batch_upload.
+"""
+
+import tarfile
+import zipfile
+
+from django.core.files.uploadedfile import UploadedFile
+
+from .spool_lote import TrechoSpool
+
+TAMANHO_BLOCO_EXTRACAO = 64 * 1024
+# Entradas maiores que isso (descompactadas) são ignoradas; protege contra "zip bombs"
+LIMITE_ENTRADA = 50 * 1024 * 1024
+
+
+def _resultado_ignorado(nome, erro):
+    return {'arquivo_principal_nome': nome, 'status': 'ignorado', 'erro': erro}
+
+
+def _copiar_para_spool(origem, spool, nome):
+    """
+    Copia a entrada para o spool em blocos, respeitando LIMITE_ENTRADA.
+    Retorna (UploadedFile, erro).
+    """
+    offset = spool.posicao()
+    tamanho = 0
+    while True:
+        bloco = origem.read(TAMANHO_BLOCO_EXTRACAO)
+        if not bloco:
+            break
+        tamanho += len(bloco)
+        if tamanho > LIMITE_ENTRADA:
+            # O que já foi gravado fica órfão no spool, que é descartado ao fim do request
+            return None, f"Entrada excede o limite de {LIMITE_ENTRADA // (1024 * 1024)} MB descompactada."
+        spool.escrever(bloco)
+    if tamanho == 0:
+        return None, "Entrada vazia."
+    return UploadedFile(
+        file=TrechoSpool(spool, offset, tamanho), name=nome,
+        content_type='application/xml', size=tamanho,
+    ), None
+
+
+def _entradas_zip(arquivo):
+    with zipfile.ZipFile(arquivo) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            if info.file_size > LIMITE_ENTRADA:
+                yield info.filename, None
+                continue
+            with zf.open(info) as origem:
+                yield info.filename, origem
+
+
+def _entradas_tar(arquivo):
+    # 'r|*' lê o tar como stream (sem seek), detectando a compressão
+    with tarfile.open(fileobj=arquivo, mode='r|*') as tf:
+        for membro in tf:
+            if not membro.isfile():
+                continue
+            if membro.size > LIMITE_ENTRADA:
+                yield membro.name, None
+                continue
+            yield membro.name, tf.extractfile(membro)
+
+
+def extrair_xmls(arquivo, spool):
+    """
+    Percorre as entradas do arquivo compactado gravando os XMLs no spool.
+    Retorna (arquivos, resultados_ignorados, erro): os UploadedFile dos XMLs,
+    o resultado de cada entrada descartada e a mensagem de erro se o arquivo
+    não puder ser lido como ZIP/tar.
+    """
+    arquivo.seek(0)
+    if zipfile.is_zipfile(arquivo):
+        entradas = _entradas_zip
+    else:
+        entradas = _entradas_tar
+    arquivo.seek(0)
+
+    arquivos = []
+    resultados_ignorados = []
+    try:
+        for nome, origem in entradas(arquivo):
+            if not nome.lower().endswith('.xml'):
+                resultados_ignorados.append(_resultado_ignorado(nome, "Entrada não é um arquivo XML."))
+                continue
+            if origem is None:
+                resultados_ignorados.append(_resultado_ignorado(
+                    nome, f"Entrada excede o limite de {LIMITE_ENTRADA // (1024 * 1024)} MB descompactada."
+                ))
+                continue
+            arq_obj, erro = _copiar_para_spool(origem, spool, nome)
+            if erro:
+                resultados_ignorados.append(_resultado_ignorado(nome, erro))
+                continue
+            arquivos.append(arq_obj)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        if not arquivos and not resultados_ignorados:
+            return [], [], f"Arquivo compactado inválido ou formato não suportado (use ZIP ou tar): {str(e)}"
+        # Arquivo truncado: processa o que foi extraído e registra o problema
+        resultados_ignorados.append(_resultado_ignorado(getattr(arquivo, 'name', None), f"Leitura interrompida: {str(e)}"))
+    return arquivos, resultados_ignorados, None
@@ -0,0 +1,82 @@
+# transport/services/cache_paineis.py
+
+"""
+Cache das respostas dos painéis/dashboards, invalidado por versão de dados.
+
+Cada painel é uma função de (endpoint, parâmetros, dados). A chave do cache
+junta o nome da view, os parâmetros normalizados e a versão atual de cada
+domínio de dados de que a view depende ('cte', 'mdfe', 'pagamento'). Quem
+grava nesses domínios chama invalidar_paineis(), que incrementa a versão
+depois do commit; as entradas antigas deixam de ser lidas e expiram sozinhas.
+
+Funciona com qualquer backend do Django (LocMemCache em desenvolvimento/testes,
+Redis em produção). Com vários processos e LocMemCache cada processo tem as
+suas próprias versões, por isso em produção o cache deve ser compartilhado.
+"""
+
+import hashlib
+import time
+from datetime import date
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+DOMINIOS = ('cte', 'mdfe', 'pagamento')
+PREFIXO_VERSAO = 'paineis:versao:'
+PREFIXO_RESPOSTA = 'paineis:resposta:'
+
+
+def versao_dados(dominio):
+    """Versão atual do domínio. Começa em um valor baseado no relógio para não reaproveitar versões após um flush."""
+    chave = PREFIXO_VERSAO + dominio
+    versao = cache.get(chave)
+    if versao is None:
+        cache.add(chave, time.time_ns(), timeout=None)
+        versao = cache.get(chave)
+    return versao
+
+
+def _incrementar_versoes(dominios):
+    for dominio in dominios:
+        try:
+            cache.incr(PREFIXO_VERSAO + dominio)
+        except ValueError:
+            # Versão ainda não existe (ou foi despejada): a próxima leitura cria uma nova
+            cache.add(PREFIXO_VERSAO + dominio, time.time_ns(), timeout=None)
+
+
+def invalidar_paineis(*dominios):
+    """Incrementa a versão dos domínios informados quando a transação corrente for confirmada."""
+    transaction.on_commit(lambda: _incrementar_versoes(dominios))
+
+
+def chave_painel(nome, params, dominios):
+    """Chave do cache para a view `nome` com os parâmetros da requisição e as versões atuais dos domínios."""
+    normalizados = sorted((k, sorted(params.getlist(k))) for k in params.keys())
+    versoes = [(d, versao_dados(d)) for d in dominios]
+    # Sem data_inicio/data_fim os painéis usam o mês/ano corrente: o dia entra na chave
+    bruto = repr((nome, normalizados, versoes, date.today().isoformat()))
+    return PREFIXO_RESPOSTA + hashlib.sha256(bruto.encode('utf-8')).hexdigest()
+
+
+def cache_painel(*dominios):
+    """
+    Decorator para o get() das APIViews de painel: devolve a resposta em cache
+    para os mesmos parâmetros e versões de dados; só respostas 200 são guardadas.
+    """
+    def decorator(get):
+        @wraps(get)
+        def wrapper(self, request, *args, **kwargs):
+            chave = chave_painel(type(self).__name__, request.query_params, dominios)
+            dados = cache.get(chave)
+            if dados is not None:
+                return Response(dados)
+            response = get(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(chave, response.data, settings.PAINEIS_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,221 @@
+# transport/services/fatos_cte.py
+
+"""
+Manutenção da tabela de fatos diários dos CT-e (CTeFatoDiario).
+
+Os painéis leem os totais por dia/dimensão dessa tabela em vez de refazer o
+join de CTeDocumento com identificação, prestação, protocolo e cancelamento a
+cada requisição.
+
+A tabela é mantida de forma incremental: quem altera um CT-e (parser,
+cancelamento, reprocessamento) o faz dentro de registrar_alteracao_cte(chave),
+que lê a contribuição do documento nos fatos antes e depois da alteração e
+aplica a diferença (sai a contribuição antiga, entra a nova) na mesma
+transação. recalcular_fatos() refaz um intervalo inteiro a partir dos
+documentos, para carga inicial ou reparo (comando recalcular_fatos_cte).
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    CharField, Count, DecimalField, F, IntegerField, Max, Min, OuterRef, Subquery, Sum, Value,
+)
+from django.db.models.functions import Coalesce, Greatest, TruncDate
+from django.utils import timezone
+
+from ..models import CTeDocumento, CTeFatoDiario, CTeIdentificacao, CTeVeiculoRodoviario
+from ..utils import filtro_periodo
+from .cache_paineis import invalidar_paineis
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE_FATOS = 1000
+
+# Campos de CTeFatoDiario -> expressão sobre CTeDocumento
+DIMENSOES = {
+    'modalidade': 'modalidade',
+    'uf_ini': 'identificacao__uf_ini',
+    'codigo_mun_ini': 'identificacao__codigo_mun_ini',
+    'nome_mun_ini': 'identificacao__nome_mun_ini',
+    'uf_fim': 'identificacao__uf_fim',
+    'codigo_mun_fim': 'identificacao__codigo_mun_fim',
+    'nome_mun_fim': 'identificacao__nome_mun_fim',
+    'destinatario_cnpj': 'destinatario__cnpj',
+    'destinatario_nome': 'destinatario__razao_social',
+}
+
+
+def situacao_expr():
+    """Situação do CT-e para os painéis: a coluna status (ver services/status_documento.py)."""
+    return F('status')
+
+
+def placa_principal():
+    """Subconsulta com a placa principal do CT-e (primeiro veículo do modal rodoviário)."""
+    # Um único valor por CT-e mantém as somas dos fatos aditivas
+    return Subquery(
+        CTeVeiculoRodoviario.objects.filter(modal__cte=OuterRef('pk')).order_by('id').values('placa')[:1]
+    )
+
+
+def _agregar(ctes):
+    anotacoes = {f'f_{campo}': Coalesce(expr, Value(''), output_field=CharField()) for campo, expr in DIMENSOES.items()}
+    anotacoes['f_placa'] = Coalesce(placa_principal(), Value(''), output_field=CharField())
+    anotacoes['f_situacao'] = situacao_expr()
+    anotacoes['f_data'] = TruncDate('identificacao__data_emissao')
+    chaves = list(anotacoes)
+    return ctes.annotate(**anotacoes).values(*chaves).annotate(
+        quantidade=Count('id'),
+        valor_total=Coalesce(Sum('prestacao__valor_total_prestado'), Value(0), output_field=DecimalField(max_digits=17, decimal_places=2)),
+        dist_km=Coalesce(Sum('identificacao__dist_km'), Value(0), output_field=IntegerField()),
+    ).order_by()
+
+
+def recalcular_fatos(data_inicio, data_fim):
+    """
+    Refaz os fatos do intervalo [data_inicio, data_fim] a partir dos CT-e processados
+    e invalida os painéis de CT-e em cache. Retorna a quantidade de linhas gravadas.
+    """
+    ctes = CTeDocumento.objects.filter(
+        filtro_periodo('identificacao__data_emissao', data_inicio, data_fim),
+        processado=True,
+    )
+    with transaction.atomic():
+        CTeFatoDiario.objects.filter(data__gte=data_inicio, data__lte=data_fim).delete()
+        fatos = []
+        gravados = 0
+        for linha in _agregar(ctes).iterator():
+            fatos.append(CTeFatoDiario(
+                data=linha['f_data'], situacao=linha['f_situacao'], placa=linha['f_placa'],
+                quantidade=linha['quantidade'], valor_total=linha['valor_total'], dist_km=linha['dist_km'],
+                **{campo: linha[f'f_{campo}'] for campo in DIMENSOES},
+            ))
+            if len(fatos) >= TAMANHO_LOTE_FATOS:
+                CTeFatoDiario.objects.bulk_create(fatos)
+                gravados += len(fatos)
+                fatos = []
+        CTeFatoDiario.objects.bulk_create(fatos)
+        gravados += len(fatos)
+        # Os painéis em cache ainda refletem os fatos anteriores ao recálculo
+        invalidar_paineis('cte')
+    return gravados
+
+
+def recalcular_fatos_por_mes(data_inicio=None, data_fim=None):
+    """
+    Refaz os fatos de [data_inicio, data_fim] um mês por transação (padrão: da emissão
+    mais antiga à mais recente). Retorna [(primeiro dia do trecho, linhas gravadas)].
+    """
+    if data_inicio is None or data_fim is None:
+        limites = CTeIdentificacao.objects.aggregate(inicio=Min('data_emissao'), fim=Max('data_emissao'))
+        data_inicio = data_inicio or data_fato(limites['inicio'])
+        data_fim = data_fim or data_fato(limites['fim'])
+    resultado = []
+    if not data_inicio or not data_fim:
+        return resultado
+    inicio_mes = data_inicio
+    while inicio_mes <= data_fim:
+        proximo_mes = date(inicio_mes.year + inicio_mes.month // 12, inicio_mes.month % 12 + 1, 1)
+        fim_mes = min(proximo_mes - timedelta(days=1), data_fim)
+        resultado.append((inicio_mes, recalcular_fatos(inicio_mes, fim_mes)))
+        inicio_mes = proximo_mes
+    return resultado
+
+
+def data_fato(data_emissao):
+    """Dia (no fuso local, como o __date das consultas) em que o CT-e entra nos fatos."""
+    if not data_emissao:
+        return None
+    return timezone.localdate(data_emissao) if timezone.is_aware(data_emissao) else data_emissao.date()
+
+
+def contribuicao_cte(chave):
+    """
+    Linha de fato (dimensões + medidas) com que o CT-e entra na tabela, ou None
+    se ele não entra (não processado ou sem identificação).
+    """
+    linhas = list(_agregar(CTeDocumento.objects.filter(chave=chave, processado=True))[:1])
+    linha = linhas[0] if linhas else None
+    if not linha or not linha['f_data']:
+        return None
+    dimensoes = {'data': linha['f_data'], 'situacao': linha['f_situacao'], 'placa': linha['f_placa']}
+    dimensoes.update({campo: linha[f'f_{campo}'] for campo in DIMENSOES})
+    return dimensoes, (linha['quantidade'], linha['valor_total'], linha['dist_km'])
+
+
+def calcular_deltas(antes, depois):
+    """Diferença entre duas contribuições: [(dimensões, (qtd, valor, km))], sem entradas nulas."""
+    deltas = {}
+    for contribuicao, sinal in ((antes, -1), (depois, 1)):
+        if not contribuicao:
+            continue
+        dimensoes, medidas = contribuicao
+        chave = tuple(sorted(dimensoes.items()))
+        atual = deltas.get(chave, (0, Decimal('0'), 0))
+        deltas[chave] = tuple(a + sinal * m for a, m in zip(atual, medidas))
+    return [(dict(chave), medidas) for chave, medidas in deltas.items() if any(medidas)]
+
+
+def _atualizar_fato(dimensoes, incremento, medidas):
+    """UPDATE da linha de fato; se a linha estiver fora de sincronia e ficaria negativa, limita a zero."""
+    fatos = CTeFatoDiario.objects.filter(**dimensoes)
+    if min(medidas) >= 0:
+        return fatos.update(**incremento)
+    # Em savepoint: uma violação de CHECK não pode desfazer a alteração do CT-e inteira
+    try:
+        with transaction.atomic():
+            return fatos.update(**incremento)
+    except IntegrityError:
+        logger.warning("Fato diário de CT-e ficaria negativo (%s); limitado a zero. Use recalcular_fatos_cte.", dimensoes.get('data'))
+    limitado = {campo: Greatest(expr, Value(0)) for campo, expr in incremento.items() if campo != 'valor_total'}
+    return fatos.update(valor_total=incremento['valor_total'], **limitado)
+
+
+def aplicar_delta(dimensoes, medidas):
+    quantidade, valor, km = medidas
+    incremento = dict(quantidade=F('quantidade') + quantidade, valor_total=F('valor_total') + valor, dist_km=F('dist_km') + km)
+    if _atualizar_fato(dimensoes, incremento, medidas):
+        if quantidade < 0:
+            CTeFatoDiario.objects.filter(quantidade__lte=0, **dimensoes).delete()
+        return
+    if quantidade <= 0:
+        # A linha já não existe: a tabela está fora de sincronia para este dia
+        logger.warning("Fato diário de CT-e não encontrado ao remover contribuição (%s). Use recalcular_fatos_cte.", dimensoes.get('data'))
+        return
+    try:
+        with transaction.atomic():
+            CTeFatoDiario.objects.create(quantidade=quantidade, valor_total=valor, dist_km=km, **dimensoes)
+    except IntegrityError:
+        # Outra transação criou a linha entre o UPDATE e o INSERT
+        CTeFatoDiario.objects.filter(**dimensoes).update(**incremento)
+
+
+_alteracoes = threading.local()
+
+
+@contextmanager
+def registrar_alteracao_cte(chave):
+    """
+    Envolve uma alteração do CT-e em uma transação e aplica aos fatos a diferença
+    da sua contribuição. Reentrante: blocos internos para a mesma chave (ex:
+    parse_cte_completo chamado pelo reprocessamento) não medem de novo.
+    """
+    ativas = _alteracoes.__dict__.setdefault('chaves', set())
+    if chave in ativas:
+        yield
+        return
+    ativas.add(chave)
+    try:
+        with transaction.atomic():
+            antes = contribuicao_cte(chave)
+            yield
+            for dimensoes, medidas in calcular_deltas(antes, contribuicao_cte(chave)):
+                aplicar_delta(dimensoes, medidas)
+            invalidar_paineis('cte')
+    finally:
+        ativas.discard(chave)
@@ -0,0 +1,59 @@
+# transport/services/ingestao_paralela.py
+
+"""
+Execução das unidades de trabalho da ingestão (ver ingestao_xml.montar_fases)
+em um pool de processos.
+
+O parsing dos XMLs é Python puro (limitado a um núcleo por processo), então
+os grupos de documentos são distribuídos entre processos independentes, cada
+um com a sua conexão ao banco. Este módulo não importa modelos no nível do
+módulo: os processos filhos (spawn) o importam antes de chamar django.setup().
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+
+def _inicializar_processo():
+    import django
+    django.setup()
+
+
+def _processar_itens(itens):
+    from .ingestao_xml import processar_itens
+    return processar_itens(itens)
+
+
+def executar_fases(fases, processos=None):
+    """
+    Processa as fases em ordem; dentro de cada fase os grupos rodam em paralelo.
+    Com um único processo os arquivos já classificados são usados diretamente;
+    para o pool eles são convertidos em itens serializáveis (nome + bytes/caminho).
+    Retorna a lista de resultados de todos os grupos.
+    """
+    if processos is None:
+        processos = settings.INGESTAO_PROCESSOS
+    total_grupos = sum(len(grupos) for grupos in fases)
+    processos = max(1, min(processos, total_grupos))
+
+    resultados = []
+    if processos == 1:
+        for grupos in fases:
+            for itens in grupos:
+                resultados.extend(_processar_itens(itens))
+        return resultados
+
+    from .ingestao_xml import item_de_arquivo
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processos, mp_context=contexto, initializer=_inicializar_processo) as pool:
+        for grupos in fases:
+            if not grupos:
+                continue
+            itens_por_grupo = [[item_de_arquivo(a) for a in arquivos] for arquivos in grupos]
+            chunksize = max(1, len(grupos) // (processos * 4))
+            # map() só termina a fase quando todos os grupos dela terminam
+            for parcial in pool.map(_processar_itens, itens_por_grupo, chunksize=chunksize):
+                resultados.extend(parcial)
+    return resultados
@@ -0,0 +1,912 @@
+# transport/services/ingestao_xml.py
+
+"""
+Ingestão de XMLs (CT-e, MDF-e e eventos) recebidos por upload.
+
+Reúne a identificação dos arquivos, o agrupamento por chave de acesso e o
+processamento de cada grupo (documento principal seguido dos seus eventos).
+É usado tanto pelo upload síncrono (UnifiedUploadViewSet) quanto pelos lotes
+processados em segundo plano (transport/tasks.py).
+
+As funções de processamento devolvem (status_http, dados) para que a view
+monte a Response e as tarefas apenas registrem o resultado.
+"""
+
+import hashlib
+import re
+import traceback
+import logging
+
+import xml.etree.ElementTree as ET
+
+import xmltodict
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+
+from ..models import (
+    CTeDocumento, CTeCancelamento,
+    MDFeDocumento, MDFeCancelamento,
+    LoteUpload, ArquivoLote,
+)
+from .parser_cte import parse_cte_completo, indexar_cte
+from .parser_mdfe import parse_mdfe_completo
+from .parser_eventos import parse_evento
+from .fatos_cte import registrar_alteracao_cte
+from .xml_engine import _nome_local
+from .spool_lote import TrechoSpool
+
+logger = logging.getLogger(__name__)
+
+RAIZES_CTE = ('CTe', 'procCTe', 'cteProc')
+RAIZES_MDFE = ('MDFe', 'procMDFe', 'mdfeProc')
+RAIZES_PROC_EVENTO = ('procEventoCTe', 'procEventoMDFe')
+RAIZES_RET_EVENTO = ('retEventoCTe', 'retEventoMDFe')
+RAIZES_EVENTO = ('eventoCTe', 'eventoMDFe')
+
+# Pré-classificação: leitura incremental do início do arquivo
+TAMANHO_BLOCO_PRE_CLASSIFICACAO = 8 * 1024
+LIMITE_PRE_CLASSIFICACAO = 64 * 1024
+
+
+class DocumentoXML:
+    """
+    XML lido uma única vez na classificação e repassado até o parser.
+    CT-e: índice de passagem única (parser_cte.indexar_cte); MDF-e e eventos: dicionário do xmltodict.
+    """
+
+    __slots__ = ('raiz', 'dados', 'indice')
+
+    def __init__(self, raiz, dados=None, indice=None):
+        self.raiz = raiz        # Tag raiz sem namespace
+        self.dados = dados      # xmltodict.parse(texto) - MDF-e e eventos
+        self.indice = indice    # XMLIndex - CT-e
+
+
+# --- Helper Functions ---
+def safe_get(data_dict, key, default=None):
+    """Versão do safe_get que ignora prefixos de namespace nas chaves do xmltodict."""
+    keys = key.split('.')
+    val = data_dict
+    for k_part in keys:
+        # Para lidar com namespaces, verificamos se alguma chave no dict atual termina com a parte da chave desejada
+        if isinstance(val, dict):
+            found_key = None
+            if k_part in val: # Tentativa direta primeiro
+                found_key = k_part
+            else: # Tenta encontrar ignorando namespace
+                for dict_key in val.keys():
+                    if dict_key.endswith(f':{k_part}') or dict_key == k_part:
+                        found_key = dict_key
+                        break
+            if found_key:
+                val = val.get(found_key)
+            else:
+                return default # Chave não encontrada
+            if val is None: return default
+        elif isinstance(val, list) and k_part.isdigit() and int(k_part) < len(val):
+            val = val[int(k_part)]
+        else:
+            return default # Não é dict nem lista acessível
+
+    if isinstance(val, dict) and '#text' in val and len(val) == 1: return val['#text']
+    if isinstance(val, dict) and keys[-1].startswith('@'):
+        attr_key_no_ns = keys[-1] # o '@' já está no nome da chave em xmltodict
+        found_attr_key = None
+        if attr_key_no_ns in val:
+            found_attr_key = attr_key_no_ns
+        else:
+            for dict_key in val.keys():
+                 if dict_key.endswith(f':{attr_key_no_ns}') or dict_key == attr_key_no_ns:
+                      found_attr_key = dict_key
+                      break
+        return val.get(found_attr_key, default) if found_attr_key else default
+
+    return val if val is not None else default
+
+def _get_chave_from_filename(filename):
+    if not filename: return None
+    match = re.search(r'(\d{44})', filename)
+    return match.group(1) if match else None
+
+def _get_tag_sem_namespace(tag_com_ns):
+    """Retorna a tag sem o prefixo de namespace, se houver."""
+    return tag_com_ns.split(':')[-1] if ':' in tag_com_ns else tag_com_ns
+
+def _raiz_do_xml(content):
+    """Nome local do elemento raiz, lendo apenas até a primeira tag."""
+    parser = ET.XMLPullParser(events=('start',))
+    for inicio in range(0, len(content), 4096):
+        parser.feed(content[inicio:inicio + 4096])
+        for _evento, elem in parser.read_events():
+            return _nome_local(elem.tag)
+    return None
+
+def _chave_do_id(id_completo):
+    """'CTe3519...' -> '3519...' (44 dígitos), ou None."""
+    if id_completo and isinstance(id_completo, str):
+        chave_numerica = ''.join(filter(str.isdigit, id_completo))
+        if len(chave_numerica) == 44:
+            return chave_numerica
+    return None
+
+def _dados(arq_info):
+    documento = arq_info.get('documento')
+    return documento.dados if documento else None
+# --- Fim Helper Functions ---
+
+
+# === Leitura e Identificação ===
+
+def ler_conteudo_arquivo(file_obj):
+    """Lê o arquivo enviado como texto (UTF-8 ou Latin-1). Retorna (conteudo, erro)."""
+    if not file_obj: return None, "Objeto de arquivo não fornecido."
+    try:
+        file_obj.seek(0)
+        content = None
+        try:
+            content = file_obj.read().decode('utf-8').strip()
+        except UnicodeDecodeError:
+            file_obj.seek(0)
+            content = file_obj.read().decode('latin-1').strip()
+
+        # Remover BOM (Byte Order Mark) se presente
+        if content and content.startswith('\ufeff'):
+            content = content[1:]
+        return content, None
+    except Exception as e:
+        return None, f"Erro ao ler conteúdo do arquivo {file_obj.name}: {str(e)}"
+
+def hash_conteudo_xml(xml_content):
+    """SHA-256 do XML (texto já normalizado por ler_conteudo_arquivo)."""
+    return hashlib.sha256(xml_content.encode('utf-8')).hexdigest() if xml_content else None
+
+def documento_inalterado(modelo, chave, hash_conteudo):
+    """Id do documento já processado a partir deste mesmo XML, ou None."""
+    if not chave or not hash_conteudo: return None
+    return modelo.objects.filter(chave=chave, hash_conteudo=hash_conteudo, processado=True).values_list('id', flat=True).first()
+
+def _inf_principal(xml_dict, tipo_doc_prefix):
+    """Nó <infCte>/<infMDFe> do documento principal, com ou sem o envelope de protocolo."""
+    tag_inf = 'infCte' if tipo_doc_prefix == 'CTe' else f'inf{tipo_doc_prefix}'
+    inf_node_data = safe_get(xml_dict, f'proc{tipo_doc_prefix}.{tipo_doc_prefix}.{tag_inf}') or \
+                    safe_get(xml_dict, f'{tipo_doc_prefix.lower()}Proc.{tipo_doc_prefix}.{tag_inf}') or \
+                    safe_get(xml_dict, f'{tipo_doc_prefix}.{tag_inf}')
+    return inf_node_data if isinstance(inf_node_data, dict) else None
+
+def get_chave_from_dict(xml_dict, tipo_doc_prefix):
+    # Usado para MDF-e principais (o CT-e usa o índice de passagem única)
+    inf_node_data = _inf_principal(xml_dict, tipo_doc_prefix)
+    if not inf_node_data:
+        return None
+    return _chave_do_id(safe_get(inf_node_data, '@Id')) # safe_get lida com namespace no atributo
+
+def get_chave_from_regex(xml_content, tipo_doc_prefix_or_evento_base):
+    # Para documentos principais
+    pattern_id_principal = rf'<inf(?:{tipo_doc_prefix_or_evento_base})[^>]*\sId\s*=\s*["\'](?:{tipo_doc_prefix_or_evento_base})?(\d{{44}})["\']'
+    match_id = re.search(pattern_id_principal, xml_content, re.IGNORECASE)
+    if match_id and len(match_id.group(1)) == 44:
+        return match_id.group(1)
+
+    # Para chaves de eventos (chCTe, chMDFe em infEvento)
+    # Esta regex é mais genérica e pode ser usada para extrair a chave do documento principal de um evento
+    pattern_ch_evento = rf'<infEvento[^>]*>.*?<ch(?:CTe|MDFe)>(\d{{44}})</ch(?:CTe|MDFe)>.*?</infEvento>'
+    match_ch_evento = re.search(pattern_ch_evento, xml_content, re.DOTALL | re.IGNORECASE)
+    if match_ch_evento and len(match_ch_evento.group(1)) == 44:
+        return match_ch_evento.group(1)
+
+    return None
+
+def identificar_xml(filename, content):
+    """
+    Classifica o XML e extrai a chave do documento principal.
+    O XML é lido uma única vez: o DocumentoXML devolvido é repassado aos parsers.
+    Retorna (tipo_xml, chave_doc, is_retorno_confirmado, documento, root_tag_no_ns).
+    """
+    chave_doc = None
+    tipo_xml = "DESCONHECIDO"
+    is_retorno_confirmado = False # True se for um retEvento* ou procEvento* com confirmação SEFAZ
+    documento = None
+    root_tag_no_ns = None
+
+    try:
+        if not content: # Se o conteúdo estiver vazio após a leitura
+            tipo_xml = "CONTEUDO_VAZIO"
+            return tipo_xml, None, False, None, None
+
+        root_tag_no_ns = _raiz_do_xml(content)
+        if root_tag_no_ns in RAIZES_CTE:
+            documento = DocumentoXML(root_tag_no_ns, indice=indexar_cte(content))
+        else:
+            xml_dict = xmltodict.parse(content)
+            documento = DocumentoXML(root_tag_no_ns, dados=xml_dict)
+            root_tag_com_ns = next(iter(xml_dict), "")
+
+        # 1. Documentos Principais (CT-e, MDF-e)
+        if root_tag_no_ns in RAIZES_CTE:
+            tipo_xml = "CT"
+            chave_doc = _chave_do_id(documento.indice.get('infCte.@Id')) or get_chave_from_regex(content, "CTe")
+        elif root_tag_no_ns in RAIZES_MDFE:
+            tipo_xml = "MDFE"
+            chave_doc = get_chave_from_dict(xml_dict, "MDFe") or get_chave_from_regex(content, "MDFe")
+
+        # 2. Eventos (envio, procEvento, retEvento)
+        # Prioriza a identificação mais específica (procEvento, retEvento) sobre evento de envio puro
+        elif root_tag_no_ns in ('procEventoCTe', 'procEventoMDFe'):
+            is_retorno_confirmado = True # procEvento já contém a resposta
+            path_prefix_ns = root_tag_com_ns # Mantenha o namespace para safe_get
+
+            # Tentativa 1: Estrutura padrão <procEvento*><evento*><infEvento>
+            evento_node_name_sem_ns = 'eventoCTe' if 'CTe' in root_tag_no_ns else 'eventoMDFe'
+            inf_evento = safe_get(xml_dict, f'{path_prefix_ns}.{evento_node_name_sem_ns}.infEvento')
+
+            # Tentativa 2: Estrutura alternativa <procEvento*><infEvento> (sem o wrapper <evento*>)
+            if not inf_evento:
+                inf_evento = safe_get(xml_dict, f'{path_prefix_ns}.infEvento')
+                if inf_evento:
+                    logger.info(
+                        "INFO (Identificar): Encontrado <infEvento> diretamente sob <%s> para %s",
+                        root_tag_no_ns,
+                        filename,
+                    )
+
+            if inf_evento:
+                chave_doc_principal_evento = safe_get(inf_evento, 'chCTe') or safe_get(inf_evento, 'chMDFe')
+                tp_evento = safe_get(inf_evento, 'tpEvento')
+                if chave_doc_principal_evento and tp_evento:
+                    chave_doc = chave_doc_principal_evento
+                    doc_tipo_base = "CT" if safe_get(inf_evento, 'chCTe') else "MDFE"
+                    tipo_xml = f"PROC_EVENTO_{doc_tipo_base}_{tp_evento}"
+                    logger.info(
+                        "INFO (Identificar): Arq %s (root: %s) classificado como %s, Chave: %s",
+                        filename,
+                        root_tag_no_ns,
+                        tipo_xml,
+                        chave_doc,
+                    )
+
+        elif root_tag_no_ns in ('retEventoCTe', 'retEventoMDFe'):
+            is_retorno_confirmado = True
+            path_prefix_ns = root_tag_com_ns
+            inf_evento_ret = safe_get(xml_dict, f'{path_prefix_ns}.infEvento')
+            if inf_evento_ret:
+                chave_doc = safe_get(inf_evento_ret, 'chCTe') or safe_get(inf_evento_ret, 'chMDFe')
+                tp_evento = safe_get(inf_evento_ret, 'tpEvento')
+                if chave_doc and tp_evento:
+                    doc_tipo_base = "CT" if safe_get(inf_evento_ret, 'chCTe') else "MDFE"
+                    tipo_xml = f"RET_EVENTO_{doc_tipo_base}_{tp_evento}"
+            elif safe_get(xml_dict, f'{path_prefix_ns}.infProt'): # Fallback para retornos mais simples
+                inf_prot = safe_get(xml_dict, f'{path_prefix_ns}.infProt')
+                chave_doc = safe_get(inf_prot, 'chCTe') or safe_get(inf_prot, 'chMDFe')
+                if chave_doc:
+                     doc_tipo_base = "CT" if safe_get(inf_prot, 'chCTe') else "MDFE"
+                     tipo_xml = f"RET_EVENTO_{doc_tipo_base}_GENERICO"
+
+        elif root_tag_no_ns in ('eventoCTe', 'eventoMDFe'): # Evento de envio puro
+            path_prefix_ns = root_tag_com_ns
+            inf_evento = safe_get(xml_dict, f'{path_prefix_ns}.infEvento')
+            if inf_evento:
+                chave_doc_principal_evento = safe_get(inf_evento, 'chCTe') or safe_get(inf_evento, 'chMDFe')
+                tp_evento = safe_get(inf_evento, 'tpEvento')
+                if chave_doc_principal_evento and tp_evento:
+                    chave_doc = chave_doc_principal_evento
+                    doc_tipo_base = "CT" if safe_get(inf_evento, 'chCTe') else "MDFE"
+                    tipo_xml = f"EVENTO_{doc_tipo_base}_{tp_evento}"
+                    is_retorno_confirmado = False # É apenas o envio
+
+        if not chave_doc: # Fallback final para chave no nome do arquivo
+            chave_doc = _get_chave_from_filename(filename)
+            if chave_doc and tipo_xml == "DESCONHECIDO": # Se encontrou chave no nome e ainda não classificou
+                if "procEvento" in filename.lower() or "retEvento" in filename.lower():
+                    is_retorno_confirmado = True; tipo_xml = "RET_EVENTO_NOME" # Indica que é um retorno/processado
+                elif "evento" in filename.lower(): # Se nome tem "evento" mas não "proc" ou "ret"
+                    tipo_xml = "EVENTO_NOME" # Evento de envio por nome
+                # Se tem chave no nome, mas tipo ainda desconhecido e não parece evento/retorno pelo nome
+                # Deixa como DESCONHECIDO, o agrupamento tentará como principal se o root_tag for CT/MDFE
+                elif root_tag_no_ns in RAIZES_CTE + RAIZES_MDFE:
+                    # Isso não deveria acontecer se a extração por dict/regex funcionou
+                    logger.warning(
+                        "WARN (Identificar-FallbackNome): Arq %s com chave %s (nome) e root '%s' suspeito de ser principal, mas não classificado antes.",
+                        filename,
+                        chave_doc,
+                        root_tag_no_ns,
+                    )
+
+    except Exception as e:
+        logger.warning(
+            "WARN (Identificar XML): Erro crítico ao parsear/identificar %s: %s.",
+            filename,
+            e,
+        )
+        traceback.print_exc()
+        # Tenta pegar chave pelo nome como último recurso
+        if not chave_doc: chave_doc = _get_chave_from_filename(filename)
+        if chave_doc and ("ret" in filename.lower() or "procevento" in filename.lower()) and tipo_xml == "DESCONHECIDO":
+            is_retorno_confirmado = True; tipo_xml = "RET_EVENTO_NOME"
+
+    if tipo_xml == "DESCONHECIDO" and chave_doc:
+        logger.warning(
+            "WARN (Lote - Identificar Final): Arq %s com chave %s (root: %s), mas tipo final DESCONHECIDO.",
+            filename,
+            chave_doc,
+            root_tag_no_ns,
+        )
+
+    return tipo_xml, chave_doc, is_retorno_confirmado, documento, root_tag_no_ns
+
+
+# === Processamento de Documentos ===
+
+def processar_cte(xml_content, arquivo_obj, documento):
+    """Grava/atualiza o CTeDocumento e executa o parser. Retorna (status_http, dados)."""
+    indice = documento.indice if documento else None
+    chave = (indice and _chave_do_id(indice.get('infCte.@Id'))) or get_chave_from_regex(xml_content, 'CTe')
+    if not chave: return status.HTTP_400_BAD_REQUEST, {"error": "Chave CT-e não identificada.", "filename": arquivo_obj.name}
+    hash_conteudo = hash_conteudo_xml(xml_content)
+    id_inalterado = documento_inalterado(CTeDocumento, chave, hash_conteudo)
+    if id_inalterado:
+        return status.HTTP_200_OK, {"message": "CT-e inalterado.", "id": str(id_inalterado), "chave": chave, "inalterado": True, "filename": arquivo_obj.name}
+    versao = (indice and (indice.get('infCte.@versao') or indice.raiz_attrs.get('versao'))) or '4.00'
+    # A contribuição antiga do CT-e nos fatos diários é medida antes de ele voltar a "não processado".
+    # Erros de banco saem do bloco: a transação é desfeita inteira, sem consultar os fatos numa transação quebrada.
+    erro_parser = None
+    try:
+        with registrar_alteracao_cte(chave):
+            cte, created = CTeDocumento.objects.update_or_create(chave=chave, defaults={'xml_original': xml_content, 'hash_conteudo': hash_conteudo, 'processado': False, 'versao': versao})
+            if arquivo_obj and (created or not cte.arquivo_xml): cte.arquivo_xml.save(arquivo_obj.name, arquivo_obj, save=False)
+            cte.save()
+            try:
+                sucesso = parse_cte_completo(cte, indice=indice)
+            except Exception as parse_err:
+                erro_parser = parse_err
+                cte.processado = False; cte.save(update_fields=['processado'])
+    except Exception as db_err: return status.HTTP_500_INTERNAL_SERVER_ERROR, {"error": f"DB Error (CTe {chave}): {str(db_err)}", "filename": arquivo_obj.name}
+    if erro_parser is not None:
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {"error": f"Erro parser CT-e: {str(erro_parser)}", "chave": chave, "filename": arquivo_obj.name}
+    if sucesso:
+        return (status.HTTP_200_OK if not created else status.HTTP_201_CREATED), {"message": f"CT-e {'reprocessado' if not created else 'processado'}.", "id": str(cte.id), "chave": cte.chave, "reprocessamento": not created, "filename": arquivo_obj.name}
+    return status.HTTP_500_INTERNAL_SERVER_ERROR, {"error": "Falha parser CT-e.", "chave": chave, "filename": arquivo_obj.name}
+
+def processar_mdfe(xml_content, arquivo_obj, documento):
+    """Grava/atualiza o MDFeDocumento e executa o parser. Retorna (status_http, dados)."""
+    xml_dict = documento.dados if documento else None
+    chave = (xml_dict and get_chave_from_dict(xml_dict, 'MDFe')) or get_chave_from_regex(xml_content, 'MDFe')
+    if not chave: return status.HTTP_400_BAD_REQUEST, {"error": "Chave MDF-e não identificada.", "filename": arquivo_obj.name}
+    hash_conteudo = hash_conteudo_xml(xml_content)
+    id_inalterado = documento_inalterado(MDFeDocumento, chave, hash_conteudo)
+    if id_inalterado:
+        return status.HTTP_200_OK, {"message": "MDF-e inalterado.", "id": str(id_inalterado), "chave": chave, "inalterado": True, "filename": arquivo_obj.name}
+    versao = safe_get(_inf_principal(xml_dict, 'MDFe') if xml_dict else None, '@versao') or '3.00'
+    try:
+        mdfe, created = MDFeDocumento.objects.update_or_create(chave=chave, defaults={'xml_original': xml_content, 'hash_conteudo': hash_conteudo, 'processado': False, 'versao': versao})
+        if arquivo_obj and (created or not mdfe.arquivo_xml): mdfe.arquivo_xml.save(arquivo_obj.name, arquivo_obj, save=False)
+        mdfe.save()
+    except Exception as db_err: return status.HTTP_500_INTERNAL_SERVER_ERROR, {"error": f"DB Error (MDF-e {chave}): {str(db_err)}", "filename": arquivo_obj.name}
+    try:
+        if parse_mdfe_completo(mdfe, xml_dict=xml_dict):
+            return (status.HTTP_200_OK if not created else status.HTTP_201_CREATED), {"message": f"MDF-e {'reprocessado' if not created else 'processado'}.", "id": str(mdfe.id), "chave": mdfe.chave, "reprocessamento": not created, "filename": arquivo_obj.name}
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {"error": "Falha parser MDF-e.", "chave": chave, "filename": arquivo_obj.name}
+    except Exception as parse_err:
+        mdfe.processado = False; mdfe.save(update_fields=['processado'])
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {"error": f"Erro parser MDF-e: {str(parse_err)}", "chave": chave, "filename": arquivo_obj.name}
+
+def processar_evento(xml_content_principal_evento, xml_content_retorno_opcional, arquivo_obj_principal_evento, doc_evento=None, doc_retorno=None):
+    """
+    Aplica um evento (cancelamento, encerramento, etc.) via parse_evento. Retorna (status_http, dados).
+    doc_evento/doc_retorno: dicionários já lidos na classificação, repassados ao parser.
+    """
+    # `parse_evento` deve ser capaz de usar `xml_content_principal_evento` se ele for um procEvento*
+    # e `xml_content_retorno_opcional` for None.
+    filename = arquivo_obj_principal_evento.name if arquivo_obj_principal_evento else "N/A"
+    try:
+        result = parse_evento(xml_content_principal_evento, xml_content_retorno_opcional, doc_evento=doc_evento, doc_retorno=doc_retorno)
+        if result is None:
+             return status.HTTP_202_ACCEPTED, {"message": f"Evento (arq: {filename}) recebido, mas não efetivado.", "warning": "Verifique SEFAZ ou doc. principal."}
+        evento_tipo_str, doc_chave_afetada, doc_id_afetado, dados_adicionais = "Evento", "N/A", None, {}
+        if isinstance(result, CTeCancelamento): evento_tipo_str, doc_chave_afetada, doc_id_afetado, dados_adicionais['protocolo_evento'] = "Cancelamento CT-e", result.cte.chave, str(result.cte.id), result.n_prot_retorno
+        elif isinstance(result, MDFeCancelamento): evento_tipo_str, doc_chave_afetada, doc_id_afetado, dados_adicionais['protocolo_evento'] = "Cancelamento MDF-e", result.mdfe.chave, str(result.mdfe.id), result.n_prot_retorno
+        elif result is True : evento_tipo_str = "Evento Genérico Processado" # Melhorar
+        return status.HTTP_201_CREATED, {
+            "message": f"{evento_tipo_str} para '{doc_chave_afetada}' (arq: {filename}) processado.",
+            "documento_chave": doc_chave_afetada, "documento_id": doc_id_afetado,
+            "detalhes_evento": dados_adicionais, "filename": filename
+        }
+    except ValueError as ve: return status.HTTP_400_BAD_REQUEST, {"error": str(ve), "filename": filename}
+    except Exception as e:
+        traceback.print_exc()
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {"error": f"Erro ao processar evento: {str(e)}", "filename": filename}
+
+
+# === Lotes: Classificação, Agrupamento e Processamento por Grupo ===
+
+def classificar_arquivo(arq_obj):
+    """Lê e identifica um arquivo do lote. Retorna (arq_info, erro_leitura)."""
+    content, error_msg = ler_conteudo_arquivo(arq_obj)
+    if error_msg:
+        return None, error_msg
+    tipo, chave, is_ret, documento, root_tag = identificar_xml(arq_obj.name, content)
+    return {
+        'obj': arq_obj, 'content': content, 'name': arq_obj.name,
+        'tipo_xml': tipo, 'chave_doc': chave,
+        'is_retorno_confirmado': is_ret,
+        'documento': documento, 'root_tag': root_tag
+    }, None
+
+def _ler_cabecalho(arq_obj):
+    """
+    Lê o início do arquivo com um pull parser até encontrar o necessário para
+    classificá-lo: raiz, Id do infCte/infMDFe, chCTe/chMDFe e tpEvento.
+    Para no máximo em LIMITE_PRE_CLASSIFICACAO bytes. Pode levantar ET.ParseError.
+    """
+    fatos = {'raiz': None, 'id': None, 'ch': None, 'ch_tipo': None, 'tp_evento': None}
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    arq_obj.seek(0)
+    lidos = 0
+    while lidos < LIMITE_PRE_CLASSIFICACAO:
+        bloco = arq_obj.read(TAMANHO_BLOCO_PRE_CLASSIFICACAO)
+        if not bloco:
+            break
+        lidos += len(bloco)
+        parser.feed(bloco)
+        for evento, elem in parser.read_events():
+            nome = _nome_local(elem.tag)
+            if evento == 'start':
+                if fatos['raiz'] is None:
+                    fatos['raiz'] = nome
+                elif nome in ('infCte', 'infMDFe') and fatos['id'] is None:
+                    fatos['id'] = elem.get('Id')
+                continue
+            if nome in ('chCTe', 'chMDFe') and fatos['ch'] is None:
+                fatos['ch'] = (elem.text or '').strip()
+                fatos['ch_tipo'] = "CT" if nome == 'chCTe' else "MDFE"
+            elif nome == 'tpEvento' and fatos['tp_evento'] is None:
+                fatos['tp_evento'] = (elem.text or '').strip()
+            elem.clear()
+
+        raiz = fatos['raiz']
+        if raiz is None:
+            continue
+        if raiz in RAIZES_CTE + RAIZES_MDFE:
+            if fatos['id']: break
+        elif raiz in RAIZES_PROC_EVENTO + RAIZES_RET_EVENTO + RAIZES_EVENTO:
+            if fatos['ch'] and fatos['tp_evento']: break
+        else:
+            break # Raiz não reconhecida: nada mais a procurar
+    return fatos
+
+def _tipo_pelo_cabecalho(fatos):
+    """Mesma classificação de identificar_xml(), a partir dos fatos do cabeçalho. Retorna (tipo, chave, is_ret)."""
+    raiz = fatos['raiz']
+    if raiz in RAIZES_CTE:
+        return "CT", _chave_do_id(fatos['id']), False
+    if raiz in RAIZES_MDFE:
+        return "MDFE", _chave_do_id(fatos['id']), False
+    chave = fatos['ch'] if fatos['ch'] and len(fatos['ch']) == 44 else None
+    if not chave:
+        return "DESCONHECIDO", None, False
+    base, tp_evento = fatos['ch_tipo'], fatos['tp_evento']
+    if raiz in RAIZES_PROC_EVENTO and tp_evento:
+        return f"PROC_EVENTO_{base}_{tp_evento}", chave, True
+    if raiz in RAIZES_RET_EVENTO:
+        return f"RET_EVENTO_{base}_{tp_evento or 'GENERICO'}", chave, True
+    if raiz in RAIZES_EVENTO and tp_evento:
+        return f"EVENTO_{base}_{tp_evento}", chave, False
+    return "DESCONHECIDO", None, False
+
+def pre_classificar_arquivo(arq_obj):
+    """
+    Classificação rápida para o agrupamento do lote: lê só o início do arquivo,
+    sem montar o documento. O XML completo é lido depois, uma vez, no processamento
+    do grupo (processar_itens). Arquivos que o cabeçalho não resolve (sem chave,
+    raiz desconhecida, XML inválido) passam pela classificação completa.
+    Retorna (arq_info, erro_leitura), com 'content' e 'documento' vazios.
+    """
+    try:
+        fatos = _ler_cabecalho(arq_obj)
+        tipo, chave, is_ret = _tipo_pelo_cabecalho(fatos)
+    except ET.ParseError:
+        tipo, chave = "DESCONHECIDO", None
+    except Exception as e:
+        return None, f"Erro ao ler conteúdo do arquivo {arq_obj.name}: {str(e)}"
+
+    if tipo == "DESCONHECIDO" or not chave:
+        arq_info, error_msg = classificar_arquivo(arq_obj)
+        if arq_info:
+            arq_info.update(content=None, documento=None)
+        return arq_info, error_msg
+
+    return {
+        'obj': arq_obj, 'content': None, 'name': arq_obj.name,
+        'tipo_xml': tipo, 'chave_doc': chave,
+        'is_retorno_confirmado': is_ret,
+        'documento': None, 'root_tag': fatos['raiz']
+    }, None
+
+def agrupar_por_chave(arquivos_classificados):
+    """
+    Agrupa os arquivos classificados pela chave do documento principal.
+    Retorna (arquivos_por_chave, arquivos_sem_chave_validos, resultados_ignorados).
+    """
+    arquivos_por_chave = {}
+    arquivos_sem_chave_validos = []
+    resultados_ignorados = []
+
+    for arq_info in arquivos_classificados:
+        if arq_info['chave_doc']:
+            chave = arq_info['chave_doc']
+            if chave not in arquivos_por_chave:
+                arquivos_por_chave[chave] = {'principais': [], 'eventos_envio': [], 'retornos_e_proc_eventos': []}
+
+            grupo = arquivos_por_chave[chave]
+            if arq_info['tipo_xml'] in ["CT", "MDFE"]:
+                # Evita duplicidade de principais com o mesmo nome de arquivo
+                if not any(p['name'] == arq_info['name'] for p in grupo['principais']):
+                    grupo['principais'].append(arq_info)
+            elif "PROC_EVENTO" in arq_info['tipo_xml'] or "RET_EVENTO" in arq_info['tipo_xml'] or arq_info['is_retorno_confirmado']:
+                grupo['retornos_e_proc_eventos'].append(arq_info)
+            elif "EVENTO" in arq_info['tipo_xml']: # Evento de envio puro
+                grupo['eventos_envio'].append(arq_info)
+            else: # DESCONHECIDO com chave
+                logger.warning(
+                    "WARN (Lote - Agrupamento): Arq %s com chave %s mas tipo %s. Tentando como principal.",
+                    arq_info['name'],
+                    chave,
+                    arq_info['tipo_xml'],
+                )
+                if not any(p['name'] == arq_info['name'] for p in grupo['principais']):
+                    grupo['principais'].append(arq_info)
+        else: # Sem chave
+            if arq_info['tipo_xml'] in ["CT", "MDFE"]:
+                 arquivos_sem_chave_validos.append(arq_info)
+            elif arq_info['tipo_xml'] != "CONTEUDO_VAZIO": # Não ignorar conteúdo vazio silenciosamente
+                resultados_ignorados.append({'arquivo_principal_nome': arq_info['name'], 'status': 'ignorado', 'erro': f"Sem chave e tipo ({arq_info['tipo_xml']}) não é CT/MDFE principal.", 'chave': None})
+
+    return arquivos_por_chave, arquivos_sem_chave_validos, resultados_ignorados
+
+def ordem_grupo(grupo):
+    """Ordem de processamento entre grupos: CT-e, depois MDF-e (que referencia CT-e), depois só eventos."""
+    tipos = {p['tipo_xml'] for p in grupo['principais']}
+    if 'CT' in tipos: return 0
+    if 'MDFE' in tipos: return 1
+    return 2
+
+def _processar_principal(arq_info):
+    if arq_info['tipo_xml'] == "CT":
+        return processar_cte(arq_info['content'], arq_info['obj'], arq_info['documento'])
+    if arq_info['tipo_xml'] == "MDFE":
+        return processar_mdfe(arq_info['content'], arq_info['obj'], arq_info['documento'])
+    return None, None
+
+def processar_grupo(chave, grupo):
+    """
+    Processa o documento principal da chave e, em seguida, os seus eventos.
+    Retorna a lista de resultados (um por documento/par de evento).
+    """
+    resultados = []
+
+    # Documento principal: se houver "procCTe" e "CTe" para a mesma chave, o "proc" é o mais completo
+    if grupo['principais']:
+        grupo['principais'].sort(key=lambda x: 0 if 'proc' in (x.get('root_tag') or '').lower() else 1)
+        doc_principal = grupo['principais'][0]
+
+        for principal_cand in grupo['principais'][1:]:
+            resultados.append({'arquivo_principal_nome': principal_cand['name'], 'status': 'ignorado',
+                               'erro': f'Múltiplos XMLs principais para chave {chave}, priorizando {doc_principal["name"]}.', 'chave': chave})
+
+        logger.info(
+            "INFO (Lote): Processando principal %s para chave %s",
+            doc_principal['name'],
+            chave,
+        )
+        resultado_p = {'arquivo_principal_nome': doc_principal['name'], 'chave': chave, 'status': 'erro'}
+        try:
+            codigo, dados = _processar_principal(doc_principal)
+            if codigo is None:
+                resultado_p['erro'] = f"Tipo principal inesperado '{doc_principal['tipo_xml']}' para processamento."
+            elif status.is_success(codigo):
+                resultado_p.update(dados); resultado_p['status'] = 'sucesso'
+            else:
+                resultado_p['erro'] = dados.get('error', 'Falha processador doc. principal.')
+                if dados.get('warning'): resultado_p['aviso'] = dados.get('warning')
+        except Exception as e_p:
+            logger.error(f"Erro crítico: {str(e_p)} {chave}")
+            resultado_p['erro'] = f"Exceção processando principal {doc_principal['name']}: {str(e_p)}"
+        resultados.append(resultado_p)
+
+    # Eventos: retornos e procEventos primeiro, tentando emparelhar com envios puros
+    eventos_envio_restantes = list(grupo['eventos_envio'])
+    for ret_proc_info in grupo['retornos_e_proc_eventos']:
+        xml_envio_content = None
+        obj_envio = None
+        nome_arq_envio_final = None
+        doc_envio = None
+
+        xml_retorno_content_para_parser = ret_proc_info['content'] # Para RET_EVENTO ou PROC_EVENTO
+        nome_arq_retorno_final_display = ret_proc_info['name']
+
+        if "PROC_EVENTO" in ret_proc_info['tipo_xml']:
+            # Para PROC_EVENTO, o próprio arquivo é o "principal" para parse_evento, e também o "retorno"
+            xml_envio_content = ret_proc_info['content']
+            obj_envio = ret_proc_info['obj']
+            nome_arq_envio_final = ret_proc_info['name']
+            doc_envio = _dados(ret_proc_info)
+        else: # É um RET_EVENTO puro, precisa de um EVENTO_ENVIO correspondente
+            tp_evento_ret = ret_proc_info['tipo_xml'].split('_')[-1] if ret_proc_info['tipo_xml'] else None
+            doc_base_ret = "_".join(ret_proc_info['tipo_xml'].split('_')[2:-1]) if ret_proc_info['tipo_xml'] else None
+            par_idx = -1
+            for i, evt_envio_info in enumerate(eventos_envio_restantes):
+                tp_evento_env = evt_envio_info['tipo_xml'].split('_')[-1] if evt_envio_info['tipo_xml'] else None
+                doc_base_env = "_".join(evt_envio_info['tipo_xml'].split('_')[1:-1]) if evt_envio_info['tipo_xml'] else None # EVENTO_CT -> CT
+                if tp_evento_env and tp_evento_ret and tp_evento_env == tp_evento_ret and \
+                   doc_base_env and doc_base_ret and doc_base_env == doc_base_ret:
+                    xml_envio_content, obj_envio, nome_arq_envio_final = evt_envio_info['content'], evt_envio_info['obj'], evt_envio_info['name']
+                    doc_envio = _dados(evt_envio_info)
+                    par_idx = i; break
+            if par_idx != -1: eventos_envio_restantes.pop(par_idx)
+            else:
+                resultados.append({'arquivo_principal_nome': None, 'arquivo_retorno_nome': ret_proc_info['name'], 'chave': chave, 'status': 'ignorado', 'erro': 'Retorno de evento sem envio correspondente no lote.'})
+                continue
+
+        if not xml_envio_content: # Segurança
+            resultados.append({'arquivo_principal_nome': nome_arq_envio_final, 'arquivo_retorno_nome': nome_arq_retorno_final_display, 'chave': chave, 'status': 'ignorado', 'erro': 'XML de envio do evento não determinado.'})
+            continue
+
+        resultado_e = {'arquivo_principal_nome': nome_arq_envio_final,
+                       'arquivo_retorno_nome': nome_arq_retorno_final_display if nome_arq_retorno_final_display != nome_arq_envio_final else None,
+                       'chave': chave, 'status': 'erro'}
+        try:
+            # O obj_envio é o do arquivo que contém o <evento*> (seja evento puro ou procEvento)
+            codigo, dados = processar_evento(xml_envio_content, xml_retorno_content_para_parser, obj_envio,
+                                             doc_evento=doc_envio, doc_retorno=_dados(ret_proc_info))
+            if status.is_success(codigo):
+                resultado_e.update(dados); resultado_e['status'] = 'sucesso'
+            else:
+                resultado_e['erro'] = dados.get('error', 'Falha ao processar evento.')
+        except Exception as e_e:
+            resultado_e['erro'] = f"Exceção evento {nome_arq_envio_final}: {str(e_e)}"
+        resultados.append(resultado_e)
+
+    # Eventos de envio puros que sobraram (sem retorno explícito/procEvento no lote)
+    for evt_envio_sozinho in eventos_envio_restantes:
+        resultado_es = {'arquivo_principal_nome': evt_envio_sozinho['name'], 'arquivo_retorno_nome': None, 'chave': chave, 'status': 'erro'}
+        try:
+            codigo, dados = processar_evento(evt_envio_sozinho['content'], None, evt_envio_sozinho['obj'], doc_evento=_dados(evt_envio_sozinho))
+            if codigo == status.HTTP_202_ACCEPTED:
+                resultado_es['status'] = 'ignorado'; resultado_es['aviso'] = dados.get('warning')
+            elif status.is_success(codigo):
+                resultado_es.update(dados); resultado_es['status'] = 'sucesso'
+            else:
+                resultado_es['erro'] = dados.get('error', 'Falha ao processar evento.')
+        except Exception as e_es:
+            resultado_es['erro'] = f"Exceção evento {evt_envio_sozinho['name']} (sem ret.): {str(e_es)}"
+        resultados.append(resultado_es)
+
+    return resultados
+
+def processar_sem_chave(arq_info):
+    """Processa um CT-e/MDF-e cuja chave não foi identificada na classificação."""
+    resultado_sc = {'arquivo_principal_nome': arq_info['name'], 'chave': None, 'status': 'erro'}
+    try:
+        codigo, dados = _processar_principal(arq_info)
+        if codigo is not None and status.is_success(codigo):
+            resultado_sc.update(dados); resultado_sc['status'] = 'sucesso'
+            resultado_sc['chave'] = dados.get('chave')
+        else:
+            resultado_sc['erro'] = dados.get('error', 'Falha proc. ind. sem chave.') if dados else 'Proc. ind. sem chave não retornou.'
+    except Exception as e_sc:
+        resultado_sc['erro'] = f"Exceção proc. ind. {arq_info['name']}: {str(e_sc)}"
+    return resultado_sc
+
+def contar_resultados(resultados):
+    """Retorna (sucesso, erros, ignorados) a partir do status de cada resultado."""
+    sucesso = sum(1 for r in resultados if r['status'] == 'sucesso')
+    ignorados = sum(1 for r in resultados if r['status'] == 'ignorado')
+    return sucesso, len(resultados) - sucesso - ignorados, ignorados
+
+
+def montar_fases(arquivos_classificados):
+    """
+    Divide os arquivos em unidades de trabalho independentes: uma por chave
+    (principal + eventos) e uma por CT-e/MDF-e sem chave.
+    Retorna ([fase_1, fase_2], resultados_ignorados). Os MDF-e ficam na segunda
+    fase para encontrar já gravados os CT-e do mesmo lote que eles referenciam.
+    """
+    arquivos_por_chave, arquivos_sem_chave_validos, resultados_ignorados = agrupar_por_chave(arquivos_classificados)
+    fases = [[], []]
+    for grupo in arquivos_por_chave.values():
+        arquivos = grupo['principais'] + grupo['eventos_envio'] + grupo['retornos_e_proc_eventos']
+        fases[1 if ordem_grupo(grupo) == 1 else 0].append(arquivos)
+    for arq_info in arquivos_sem_chave_validos:
+        fases[1 if arq_info['tipo_xml'] == "MDFE" else 0].append([arq_info])
+    return fases, resultados_ignorados
+
+def item_de_arquivo(arq_info):
+    """
+    Representação leve e serializável do arquivo: caminho (+ offset/tamanho no spool
+    do lote) ou, para uploads fora do spool, o próprio conteúdo em bytes.
+    """
+    item = {'nome': arq_info['name'], 'tipo_xml': arq_info.get('tipo_xml'), 'chave_doc': arq_info.get('chave_doc')}
+    if arq_info.get('caminho'):
+        item['caminho'] = arq_info['caminho']
+        return item
+    trecho = getattr(arq_info['obj'], 'file', None)
+    if isinstance(trecho, TrechoSpool):
+        item.update(caminho=trecho.caminho, offset=trecho.offset, tamanho=trecho.tamanho)
+        return item
+    arq_info['obj'].seek(0)
+    item['dados'] = arq_info['obj'].read()
+    return item
+
+def _classificar_item(item, dados):
+    """
+    Classificação completa de um item lido do disco/spool. Um CT-e/MDF-e cuja
+    pré-classificação já trouxe a chave e que já foi processado com este mesmo
+    conteúdo não é parseado: segue sem o documento e processar_cte/processar_mdfe
+    o devolvem como "inalterado". Retorna (arq_info, erro_leitura).
+    """
+    arq_obj = ContentFile(dados, name=item['nome'])
+    content, error_msg = ler_conteudo_arquivo(arq_obj)
+    if error_msg:
+        return None, error_msg
+    modelo = {'CT': CTeDocumento, 'MDFE': MDFeDocumento}.get(item.get('tipo_xml'))
+    if modelo and documento_inalterado(modelo, item.get('chave_doc'), hash_conteudo_xml(content)):
+        return {
+            'obj': arq_obj, 'content': content, 'name': item['nome'],
+            'tipo_xml': item['tipo_xml'], 'chave_doc': item['chave_doc'],
+            'is_retorno_confirmado': False, 'documento': None, 'root_tag': None
+        }, None
+    tipo, chave, is_ret, documento, root_tag = identificar_xml(item['nome'], content)
+    return {
+        'obj': arq_obj, 'content': content, 'name': item['nome'],
+        'tipo_xml': tipo, 'chave_doc': chave,
+        'is_retorno_confirmado': is_ret,
+        'documento': documento, 'root_tag': root_tag
+    }, None
+
+def processar_itens(itens):
+    """
+    Processa uma unidade de trabalho montada por montar_fases().
+    Aceita arquivos já classificados (no mesmo processo, sem reler o XML) ou
+    itens de item_de_arquivo() (em outro processo), que são lidos e classificados aqui.
+    Cada documento principal (com os seus eventos) é gravado na sua própria transação.
+    """
+    resultados = []
+    classificados = []
+    for item in itens:
+        if item.get('content') is not None:
+            classificados.append(item)
+            continue
+        if 'nome' not in item:
+            item = item_de_arquivo(item)
+        try:
+            dados = item.get('dados')
+            if dados is None:
+                with open(item['caminho'], 'rb') as f:
+                    if 'offset' in item:
+                        f.seek(item['offset'])
+                        dados = f.read(item['tamanho'])
+                    else:
+                        dados = f.read()
+        except OSError as e:
+            resultados.append({'arquivo_principal_nome': item['nome'], 'status': 'erro', 'erro': f"Erro ao ler arquivo: {str(e)}"})
+            continue
+        arq_info, error_msg = _classificar_item(item, dados)
+        if error_msg:
+            resultados.append({'arquivo_principal_nome': item['nome'], 'status': 'ignorado', 'erro': error_msg})
+            continue
+        classificados.append(arq_info)
+
+    arquivos_por_chave, arquivos_sem_chave_validos, resultados_ignorados = agrupar_por_chave(classificados)
+    resultados.extend(resultados_ignorados)
+    for chave, grupo in arquivos_por_chave.items():
+        with transaction.atomic():
+            resultados.extend(processar_grupo(chave, grupo))
+    for arq_info in arquivos_sem_chave_validos:
+        with transaction.atomic():
+            resultados.append(processar_sem_chave(arq_info))
+    return resultados
+
+
+# === Lotes em Segundo Plano ===
+
+def criar_lote(arquivos, usuario=''):
+    """
+    Grava os arquivos enviados em um LoteUpload, classificando cada um.
+    Retorna (lote, chaves_a_processar, ids_sem_chave) para o enfileiramento das tarefas.
+    """
+    lote = LoteUpload.objects.create(usuario=usuario or '', total_arquivos=len(arquivos))
+
+    registros = []
+    classificados = []
+    for arq_obj in arquivos:
+        registro = ArquivoLote(lote=lote, nome=arq_obj.name)
+        arq_info, error_msg = pre_classificar_arquivo(arq_obj)
+        if error_msg:
+            registro.status = 'ignorado'
+            registro.resultado = {'arquivo_principal_nome': arq_obj.name, 'status': 'ignorado', 'erro': error_msg}
+        else:
+            registro.tipo_xml = arq_info['tipo_xml']
+            registro.chave = arq_info['chave_doc']
+            arq_info['registro'] = registro
+            classificados.append(arq_info)
+        registro.arquivo.save(arq_obj.name, arq_obj, save=False)
+        registros.append(registro)
+
+    arquivos_por_chave, arquivos_sem_chave_validos, resultados_ignorados = agrupar_por_chave(classificados)
+    ignorados_por_nome = {r['arquivo_principal_nome']: r for r in resultados_ignorados}
+    for arq_info in classificados:
+        resultado = ignorados_por_nome.get(arq_info['name'])
+        if resultado and not arq_info['chave_doc']:
+            arq_info['registro'].status = 'ignorado'
+            arq_info['registro'].resultado = resultado
+        elif arq_info['tipo_xml'] == "CONTEUDO_VAZIO":
+            arq_info['registro'].status = 'ignorado'
+            arq_info['registro'].resultado = {'arquivo_principal_nome': arq_info['name'], 'status': 'ignorado', 'erro': 'Arquivo sem conteúdo.'}
+
+    ArquivoLote.objects.bulk_create(registros)
+
+    chaves = sorted(arquivos_por_chave, key=lambda c: ordem_grupo(arquivos_por_chave[c]))
+    ids_sem_chave = [arq_info['registro'].id for arq_info in arquivos_sem_chave_validos]
+    if not chaves and not ids_sem_chave:
+        lote.status = 'concluido'
+        lote.concluido_em = timezone.now()
+        lote.save(update_fields=['status', 'concluido_em'])
+    return lote, chaves, ids_sem_chave
+
+def _registrar_resultados(lote, registros, resultados):
+    """Associa cada resultado aos arquivos do lote pelo nome e finaliza o lote se não houver pendências."""
+    por_nome = {}
+    for registro in registros:
+        por_nome.setdefault(registro.nome, []).append(registro)
+    for resultado in resultados:
+        for nome in (resultado.get('arquivo_principal_nome'), resultado.get('arquivo_retorno_nome')):
+            for registro in por_nome.get(nome) or []:
+                registro.status = resultado['status']
+                registro.resultado = resultado
+    for registro in registros:
+        if registro.status == 'processando': # Não coberto por nenhum resultado
+            registro.status = 'erro'
+            registro.resultado = {'arquivo_principal_nome': registro.nome, 'status': 'erro', 'erro': 'Arquivo não processado.'}
+        registro.atualizado_em = timezone.now()
+    ArquivoLote.objects.bulk_update(registros, ['status', 'resultado', 'atualizado_em'])
+
+    if not lote.arquivos.filter(status__in=['pendente', 'processando']).exists():
+        LoteUpload.objects.filter(pk=lote.pk).exclude(status='concluido').update(status='concluido', concluido_em=timezone.now())
+
+def _iniciar_processamento(lote, registros):
+    LoteUpload.objects.filter(pk=lote.pk, status='recebido').update(status='processando')
+    ArquivoLote.objects.filter(pk__in=[r.pk for r in registros]).update(status='processando')
+    for registro in registros:
+        registro.status = 'processando'
+
+def _processar_registros_lote(lote, registros, chave=None):
+    _iniciar_processamento(lote, registros)
+    itens = []
+    for registro in registros:
+        with registro.arquivo.open('rb') as f:
+            itens.append({'nome': registro.nome, 'tipo_xml': registro.tipo_xml, 'chave_doc': registro.chave, 'dados': f.read()})
+    try:
+        resultados = processar_itens(itens)
+    except Exception as e:
+        logger.error(f"Erro crítico no lote {lote.pk}, chave {chave}: {str(e)}")
+        traceback.print_exc()
+        resultados = [{'arquivo_principal_nome': r.nome, 'chave': chave, 'status': 'erro', 'erro': f"Exceção no grupo: {str(e)}"} for r in registros]
+    _registrar_resultados(lote, registros, resultados)
+    return resultados
+
+def processar_grupo_lote(lote_id, chave):
+    """Processa todos os arquivos pendentes de uma chave do lote (principal e depois eventos)."""
+    lote = LoteUpload.objects.get(pk=lote_id)
+    registros = list(lote.arquivos.filter(chave=chave, status='pendente'))
+    if not registros:
+        return []
+    return _processar_registros_lote(lote, registros, chave)
+
+def processar_arquivo_sem_chave_lote(arquivo_id):
+    """Processa um CT-e/MDF-e do lote cuja chave não foi identificada na classificação."""
+    registro = ArquivoLote.objects.select_related('lote').get(pk=arquivo_id)
+    if registro.status != 'pendente':
+        return None
+    resultados = _processar_registros_lote(registro.lote, [registro])
+    return resultados[0] if resultados else None
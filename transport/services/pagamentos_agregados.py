@@ -0,0 +1,168 @@
+# transport/services/pagamentos_agregados.py
+
+"""
+Geração em lote dos pagamentos de agregados (PagamentoAgregado) a partir dos CT-e.
+
+Elegíveis: CT-e autorizados no período, com veículo agregado (tipo_proprietario
+'02') no modal rodoviário e ainda sem pagamento. As chaves elegíveis são lidas
+de uma vez e processadas em blocos de TAMANHO_LOTE_PAGAMENTOS: cada bloco carrega
+os CT-e com prestação, veículos agregados e motoristas em poucas consultas, calcula
+o repasse em Python (PagamentoAgregado.calcular_repasse) e grava tudo com um
+bulk_create na sua própria transação, sem uma transação longa para o período
+inteiro. Com simular=True nada é gravado e o resultado traz uma prévia.
+"""
+
+import logging
+from decimal import Decimal
+
+from django.db import DatabaseError, transaction
+from django.db.models import Exists, OuterRef, Prefetch
+
+from ..models import CTeDocumento, CTeMotorista, CTeVeiculoRodoviario, PagamentoAgregado
+from ..utils import filtro_periodo
+from .cache_paineis import invalidar_paineis
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE_PAGAMENTOS = 1000
+# Pagamentos listados na prévia da simulação (os totais consideram todos)
+TAMANHO_PREVIA = 200
+
+TIPO_PROPRIETARIO_AGREGADO = '02'
+
+
+def ctes_elegiveis(data_inicio, data_fim):
+    """CT-e autorizados do período, com veículo agregado e ainda sem pagamento."""
+    return CTeDocumento.objects.filter(
+        filtro_periodo('identificacao__data_emissao', data_inicio, data_fim),
+        Exists(CTeVeiculoRodoviario.objects.filter(
+            modal__cte=OuterRef('pk'), tipo_proprietario=TIPO_PROPRIETARIO_AGREGADO
+        )),
+        ~Exists(PagamentoAgregado.objects.filter(cte=OuterRef('pk'))),
+        processado=True, status='autorizado',
+    )
+
+
+def _carregar_bloco(ids):
+    # Veículos agregados e motoristas em ordem de id: o primeiro de cada é o usado no pagamento
+    return CTeDocumento.objects.filter(pk__in=ids).select_related(
+        'prestacao', 'modal_rodoviario'
+    ).prefetch_related(
+        Prefetch(
+            'modal_rodoviario__veiculos',
+            queryset=CTeVeiculoRodoviario.objects.filter(tipo_proprietario=TIPO_PROPRIETARIO_AGREGADO).order_by('id'),
+            to_attr='veiculos_agregados',
+        ),
+        Prefetch('modal_rodoviario__motoristas', queryset=CTeMotorista.objects.order_by('id'), to_attr='motoristas_ordenados'),
+    ).order_by('chave')
+
+
+def _montar_pagamento(cte, percentual, data_prevista, avisos):
+    """PagamentoAgregado (não salvo) do CT-e, ou None com o motivo em avisos."""
+    prestacao = getattr(cte, 'prestacao', None)
+    if not prestacao:
+        avisos.append(f"CT-e {cte.chave}: Sem dados de prestação, ignorado.")
+        return None
+    modal = getattr(cte, 'modal_rodoviario', None)
+    if not modal:
+        avisos.append(f"CT-e {cte.chave}: Sem dados de modal rodoviário, ignorado.")
+        return None
+    veiculo = modal.veiculos_agregados[0] if modal.veiculos_agregados else None
+    if not veiculo:
+        avisos.append(f"CT-e {cte.chave}: Nenhum veículo com tipo '02' (Agregado) encontrado, ignorado.")
+        return None
+
+    motorista = modal.motoristas_ordenados[0] if modal.motoristas_ordenados else None
+    return PagamentoAgregado(
+        cte=cte,
+        placa=veiculo.placa,
+        condutor_nome=motorista.nome if motorista else (veiculo.prop_razao_social or "Motorista Agregado"),
+        condutor_cpf=motorista.cpf if motorista else None,
+        valor_frete_total=prestacao.valor_total_prestado,
+        percentual_repasse=percentual,
+        valor_repassado=PagamentoAgregado.calcular_repasse(prestacao.valor_total_prestado, percentual),
+        data_prevista=data_prevista,
+        status='pendente',
+    )
+
+
+def _gravar_bloco(pagamentos, erros):
+    """
+    Grava o bloco; se o bulk_create falhar (ex: pagamento criado em paralelo, valor
+    fora do tamanho da coluna), grava um a um e registra em erros os que falharem.
+    """
+    try:
+        with transaction.atomic():
+            PagamentoAgregado.objects.bulk_create(pagamentos)
+        return len(pagamentos)
+    except DatabaseError:
+        logger.warning("Falha no bulk_create de %d pagamentos de agregados; gravando individualmente.", len(pagamentos))
+    criados = 0
+    for pagamento in pagamentos:
+        try:
+            with transaction.atomic():
+                pagamento.save()
+            criados += 1
+        except DatabaseError as e:
+            erros.append(f"CT-e {pagamento.cte.chave}: {e}")
+    return criados
+
+
+def gerar_pagamentos_agregados(data_inicio, data_fim, percentual, data_prevista, simular=False):
+    """
+    Gera os pagamentos dos CT-e elegíveis do período. Retorna dict com os
+    contadores (criados, erros, avisos) e os detalhes; com simular=True não grava
+    e inclui valor_total_repasse e uma prévia dos pagamentos. Os painéis de
+    pagamento são invalidados sempre que algum bloco foi gravado, mesmo que um
+    bloco seguinte falhe.
+    """
+    ids = list(ctes_elegiveis(data_inicio, data_fim).order_by('chave').values_list('pk', flat=True))
+    criados = 0
+    erros, avisos = [], []
+    valor_total = Decimal('0.00')
+    previa = []
+
+    try:
+        for i in range(0, len(ids), TAMANHO_LOTE_PAGAMENTOS):
+            pagamentos = []
+            for cte in _carregar_bloco(ids[i:i + TAMANHO_LOTE_PAGAMENTOS]):
+                pagamento = _montar_pagamento(cte, percentual, data_prevista, avisos)
+                if pagamento:
+                    pagamentos.append(pagamento)
+            if simular:
+                criados += len(pagamentos)
+                for pagamento in pagamentos:
+                    valor_total += pagamento.valor_repassado
+                    if len(previa) < TAMANHO_PREVIA:
+                        previa.append({
+                            'cte_chave': pagamento.cte.chave,
+                            'placa': pagamento.placa,
+                            'condutor_nome': pagamento.condutor_nome,
+                            'condutor_cpf': pagamento.condutor_cpf,
+                            'valor_frete_total': pagamento.valor_frete_total,
+                            'percentual_repasse': pagamento.percentual_repasse,
+                            'valor_repassado': pagamento.valor_repassado,
+                        })
+            elif pagamentos:
+                criados += _gravar_bloco(pagamentos, erros)
+    finally:
+        # Blocos anteriores já foram confirmados, cada um na sua transação
+        if criados and not simular:
+            invalidar_paineis('pagamento')
+
+    resultado = {
+        'criados': criados,
+        'erros': len(erros),
+        'avisos': len(avisos),
+        'detalhes_erros': erros,
+        'detalhes_avisos': avisos,
+    }
+    if simular:
+        # Soma dos valores já arredondados: bate com o que a geração real grava
+        resultado['valor_total_repasse'] = valor_total
+        resultado['previa'] = previa
+    logger.info(
+        "Pagamentos de agregados %s: %d criados, %d erros, %d avisos (%d CT-e elegíveis).",
+        "simulados" if simular else "gerados", criados, len(erros), len(avisos), len(ids),
+    )
+    return resultado
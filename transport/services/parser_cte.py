@@ -1,9 +1,10 @@
 # transport/services/parser_cte.py
 
-import xmltodict
 import traceback
+from dataclasses import dataclass, field
 from decimal import Decimal, InvalidOperation
 from datetime import datetime
+from typing import Any, Dict, List, Optional
 from dateutil import parser as date_parser # pip install python-dateutil
 from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
@@ -20,8 +21,11 @@ from transport.models import (
     CTeCarga, CTeQuantidadeCarga, CTeDocumentoTransportado, CTeSeguro,
     CTeModalRodoviario, CTeVeiculoRodoviario, CTeMotorista, CTeAutXML,
     CTeResponsavelTecnico, CTeProtocoloAutorizacao, CTeSuplementar,
-    CTeCancelamento
+    CTeCancelamento, MDFeDocumentosVinculados
 )
+from .xml_engine import indexar_xml
+from .fatos_cte import registrar_alteracao_cte
+from .status_documento import atualizar_status_cte
 
 # --- Helper Functions (Funções Auxiliares) ---
 
@@ -176,104 +180,674 @@ def get_cte_suplementar(xml_dict):
         return safe_get(cte_node, 'infCTeSupl')
     return None
 
-# --- Parser Functions por Seção do Modelo ---
+# --- Extração em passagem única (XML -> registro intermediário) ---
+
+# Âncoras: reiniciam o caminho, tornando-o independente da raiz (cteProc, procCTe ou CTe)
+ANCORAS_CTE = ('infCte', 'protCTe', 'infCTeSupl')
+
+# Containers onde <infCarga>/<infDoc> podem aparecer, em ordem de preferência
+# (o leiaute oficial usa <infCTeNorm>; mantemos a grafia antiga por compatibilidade)
+CONTAINERS_INF_CTE = ('infCTeNorm', 'infCteNorm', 'infCteComp', 'infCteAnu')
+CONTAINERS_NORMAL = ('infCTeNorm', 'infCteNorm')
+
+# Caminhos de blocos repetíveis (coletados como listas de itens)
+GRUPOS_CTE = (
+    'infCte.compl.ObsCont',
+    'infCte.compl.ObsFisco',
+    'infCte.vPrest.Comp',
+    'infCte.imp.ICMS',
+    'infCte.infModal.rodo.veic',
+    'infCte.infModal.rodo.moto',
+    'infCte.autXML',
+) + tuple(
+    f'infCte.{container}.{bloco}'
+    for container in CONTAINERS_NORMAL
+    for bloco in ('seg', 'infModal.rodo.veic', 'infModal.rodo.moto')
+) + tuple(
+    f'infCte.{container}.{bloco}'
+    for container in CONTAINERS_INF_CTE
+    for bloco in ('infCarga.infQ', 'infDoc.infNFe', 'infDoc.infNF', 'infDoc.infOutros')
+)
 
-@transaction.atomic
-def parse_cte_identificacao(cte_doc, infcte):
-    """Parseia o bloco <ide> e salva em CTeIdentificacao."""
-    ide = safe_get(infcte, 'ide')
-    if not ide:
-        print(f"WARN: Bloco <ide> não encontrado para CT-e {cte_doc.chave}")
-        return None
+# Tipos de ICMS aceitos, na ordem de verificação
+TIPOS_ICMS = ('ICMS00', 'ICMS20', 'ICMS45', 'ICMS60', 'ICMS90', 'ICMSOutraUF', 'ICMSSN', 'ICMSST')
+
+# Tag de endereço de cada entidade (o remetente usa <enderReme>)
+ENDERECO_ENTIDADE = {
+    'emit': 'enderEmit',
+    'rem': 'enderReme',
+    'dest': 'enderDest',
+    'exped': 'enderExped',
+    'receb': 'enderReceb',
+}
+
+
+@dataclass
+class CTeRecord:
+    """
+    Registro intermediário de um CT-e: um dicionário de campos por modelo CTe*,
+    já convertidos e com os valores padrão aplicados. Não acessa o banco.
+    """
+    versao: Optional[str] = None
+    identificacao: Optional[Dict[str, Any]] = None           # CTeIdentificacao
+    tomador_endereco: Optional[Dict[str, Any]] = None        # Endereco (toma=4)
+    complemento: Optional[Dict[str, Any]] = None             # CTeComplemento
+    obs_contribuinte: List[Dict[str, Any]] = field(default_factory=list)  # CTeObservacaoContribuinte
+    obs_fisco: List[Dict[str, Any]] = field(default_factory=list)         # CTeObservacaoFisco
+    entidades: Dict[str, Optional[Dict[str, Any]]] = field(default_factory=dict)  # CTeEmitente, CTeRemetente...
+    prestacao: Optional[Dict[str, Any]] = None               # CTePrestacaoServico
+    componentes: List[Dict[str, Any]] = field(default_factory=list)       # CTeComponenteValor
+    tributos: Optional[Dict[str, Any]] = None                # CTeTributos
+    carga: Optional[Dict[str, Any]] = None                   # CTeCarga
+    quantidades: List[Dict[str, Any]] = field(default_factory=list)       # CTeQuantidadeCarga
+    documentos: List[Dict[str, Any]] = field(default_factory=list)        # CTeDocumentoTransportado
+    seguros: List[Dict[str, Any]] = field(default_factory=list)           # CTeSeguro
+    modal: Optional[Dict[str, Any]] = None                   # CTeModalRodoviario
+    veiculos: List[Dict[str, Any]] = field(default_factory=list)          # CTeVeiculoRodoviario
+    motoristas: List[Dict[str, Any]] = field(default_factory=list)        # CTeMotorista
+    autorizados: List[Dict[str, Any]] = field(default_factory=list)       # CTeAutXML
+    responsavel_tecnico: Optional[Dict[str, Any]] = None     # CTeResponsavelTecnico
+    chave_protocolo: Optional[str] = None
+    protocolo: Optional[Dict[str, Any]] = None               # CTeProtocoloAutorizacao
+    suplementar: Optional[Dict[str, Any]] = None             # CTeSuplementar
+
+
+def _sem_nulos(dados):
+    """Remove chaves com valor None para não sobrescrever com null no update_or_create."""
+    return {k: v for k, v in dados.items() if v is not None}
+
+
+def _endereco_do_indice(idx, prefixo):
+    """Equivalente a parse_endereco() lendo direto do índice."""
+    return {
+        'logradouro': idx.get(f'{prefixo}.xLgr'),
+        'numero': idx.get(f'{prefixo}.nro'),
+        'complemento': idx.get(f'{prefixo}.xCpl'),
+        'bairro': idx.get(f'{prefixo}.xBairro'),
+        'codigo_municipio': idx.get(f'{prefixo}.cMun'),
+        'nome_municipio': idx.get(f'{prefixo}.xMun'),
+        'cep': idx.get(f'{prefixo}.CEP'),
+        'uf': idx.get(f'{prefixo}.UF'),
+        'codigo_pais': idx.get(f'{prefixo}.cPais', '1058'),
+        'nome_pais': idx.get(f'{prefixo}.xPais', 'BRASIL'),
+    }
+
+
+def _extrair_identificacao(idx, chave, rec):
+    """Bloco <ide> -> CTeIdentificacao (e Endereco do tomador, se toma=4)."""
+    if not idx.tem('infCte.ide'):
+        print(f"WARN: Bloco <ide> não encontrado para CT-e {chave}")
+        return
 
     # Tratamento do Tomador (pode ser <toma3> ou <toma4>)
-    toma_node = None
-    toma_tipo = None
-    if safe_get(ide, 'toma3'):
-        toma_node = safe_get(ide, 'toma3')
-        toma_tipo = safe_get(toma_node, 'toma')
-    elif safe_get(ide, 'toma4'):
-        toma_node = safe_get(ide, 'toma4')
-        toma_tipo = safe_get(toma_node, 'toma')
+    if idx.tem('infCte.ide.toma3'):
+        toma = 'infCte.ide.toma3'
+        toma_tipo = idx.get(f'{toma}.toma')
+    elif idx.tem('infCte.ide.toma4'):
+        toma = 'infCte.ide.toma4'
+        toma_tipo = idx.get(f'{toma}.toma')
     else:
-        toma_node = {} # Default vazio se não encontrar
+        toma = 'infCte.ide.toma'  # Caminho inexistente: todas as leituras retornam None
         toma_tipo = '0'  # Default 0 (Remetente)
-        print(f"WARN: Tomador <toma3> ou <toma4> não encontrado para CT-e {cte_doc.chave}. Usando padrão '0'.")
+        print(f"WARN: Tomador <toma3> ou <toma4> não encontrado para CT-e {chave}. Usando padrão '0'.")
 
-    # Preparar dados do endereço do tomador (somente se toma=4)
-    tomador_endereco = None
-    if toma_tipo == '4':
-        endereco_tomador_data = parse_endereco(safe_get(toma_node, 'enderToma'))
-        if any(endereco_tomador_data.values()):
-            # Cria um novo endereço para o tomador.
-            # Considerar get_or_create se houver chance de reutilização e um critério único.
-            tomador_endereco = Endereco.objects.create(**endereco_tomador_data)
+    tomador_4 = toma_tipo == '4'
+    if tomador_4:
+        if idx.tem(f'{toma}.enderToma'):
+            rec.tomador_endereco = _endereco_do_indice(idx, f'{toma}.enderToma')
 
     # Garantir campos obrigatórios
-    codigo_uf = to_int(safe_get(ide, 'cUF'))
+    codigo_uf = to_int(idx.get('infCte.ide.cUF'))
     if not codigo_uf:
         codigo_uf = 42  # SC (valor padrão)
-        print(f"WARN: <cUF> não encontrado para CT-e {cte_doc.chave}. Usando valor padrão.")
+        print(f"WARN: <cUF> não encontrado para CT-e {chave}. Usando valor padrão.")
 
-    cfop = safe_get(ide, 'CFOP')
+    cfop = idx.get('infCte.ide.CFOP')
     if not cfop:
         cfop = "6353"  # Prestação de serviço de transporte (valor padrão)
-        print(f"WARN: <CFOP> não encontrado para CT-e {cte_doc.chave}. Usando valor padrão.")
+        print(f"WARN: <CFOP> não encontrado para CT-e {chave}. Usando valor padrão.")
 
-    ident_data = {
+    ide = 'infCte.ide'
+    rec.identificacao = _sem_nulos({
         'codigo_uf': codigo_uf,
-        'codigo_control': safe_get(ide, 'cCT'),
+        'codigo_control': idx.get(f'{ide}.cCT'),
         'cfop': cfop,
-        'natureza_operacao': safe_get(ide, 'natOp') or "PRESTAÇÃO DE SERVIÇO DE TRANSPORTE",
-        'modelo': safe_get(ide, 'mod') or "57",
-        'serie': to_int(safe_get(ide, 'serie')) or 0,
-        'numero': to_int(safe_get(ide, 'nCT')) or 0,
-        'data_emissao': parse_datetime(safe_get(ide, 'dhEmi')) or datetime.now(),
-        'tipo_impressao': to_int(safe_get(ide, 'tpImp')) or 1,
-        'tipo_emissao': to_int(safe_get(ide, 'tpEmis')) or 1,
-        'digito_verificador': to_int(safe_get(ide, 'cDV')) or 0,
-        'ambiente': to_int(safe_get(ide, 'tpAmb')) or 2,  # 2 = Homologação padrão
-        'tipo_cte': to_int(safe_get(ide, 'tpCTe')) or 0,  # 0 = Normal padrão
-        'processo_emissao': to_int(safe_get(ide, 'procEmi')) or 0,
-        'versao_processo': safe_get(ide, 'verProc') or "1.0",
+        'natureza_operacao': idx.get(f'{ide}.natOp') or "PRESTAÇÃO DE SERVIÇO DE TRANSPORTE",
+        'modelo': idx.get(f'{ide}.mod') or "57",
+        'serie': to_int(idx.get(f'{ide}.serie')) or 0,
+        'numero': to_int(idx.get(f'{ide}.nCT')) or 0,
+        'data_emissao': parse_datetime(idx.get(f'{ide}.dhEmi')) or datetime.now(),
+        'tipo_impressao': to_int(idx.get(f'{ide}.tpImp')) or 1,
+        'tipo_emissao': to_int(idx.get(f'{ide}.tpEmis')) or 1,
+        'digito_verificador': to_int(idx.get(f'{ide}.cDV')) or 0,
+        'ambiente': to_int(idx.get(f'{ide}.tpAmb')) or 2,  # 2 = Homologação padrão
+        'tipo_cte': to_int(idx.get(f'{ide}.tpCTe')) or 0,  # 0 = Normal padrão
+        'processo_emissao': to_int(idx.get(f'{ide}.procEmi')) or 0,
+        'versao_processo': idx.get(f'{ide}.verProc') or "1.0",
         # Chave referenciada pode estar em locais diferentes dependendo do tipo de CT-e
-        'chave_referenciada': safe_get(ide, 'infCteAnu.chCte') or \
-                             safe_get(ide, 'infCTeNorm.infDocRef.chCTe') or \
-                             safe_get(ide, 'infCteComp.chCTe'), # Verificar outros casos se necessário
-        'codigo_mun_envio': safe_get(ide, 'cMunEnv') or "4200000",  # Município padrão
-        'nome_mun_envio': safe_get(ide, 'xMunEnv') or "MUNICÍPIO NÃO INFORMADO",
-        'uf_envio': safe_get(ide, 'UFEnv') or "SC",  # UF padrão
-        'modal': safe_get(ide, 'modal') or "01",  # Rodoviário padrão
-        'tipo_servico': safe_get(ide, 'tpServ') or "0",  # Normal padrão
-        'codigo_mun_ini': safe_get(ide, 'cMunIni') or "4200000",
-        'nome_mun_ini': safe_get(ide, 'xMunIni') or "MUNICÍPIO NÃO INFORMADO",
-        'uf_ini': safe_get(ide, 'UFIni') or "SC",
-        'codigo_mun_fim': safe_get(ide, 'cMunFim') or "4200000",
-        'nome_mun_fim': safe_get(ide, 'xMunFim') or "MUNICÍPIO NÃO INFORMADO",
-        'uf_fim': safe_get(ide, 'UFFim') or "SC",
-        'retira': to_boolean(safe_get(ide, 'retira', '0')), # Default '0' se ausente
-        'detalhes_retira': safe_get(ide, 'xDetRetira'),
-        'ind_ie_tomador': to_int(safe_get(toma_node, 'indIEToma')) or 9, # Padrão 9 = Não contribuinte
-        'toma': to_int(toma_tipo) or 0, # 0=Rem, 1=Exp, 2=Rec, 3=Dest, 4=Outros
+        'chave_referenciada': idx.first(
+            f'{ide}.infCteAnu.chCte', f'{ide}.infCTeNorm.infDocRef.chCTe', f'{ide}.infCteComp.chCTe'
+        ),
+        'codigo_mun_envio': idx.get(f'{ide}.cMunEnv') or "4200000",  # Município padrão
+        'nome_mun_envio': idx.get(f'{ide}.xMunEnv') or "MUNICÍPIO NÃO INFORMADO",
+        'uf_envio': idx.get(f'{ide}.UFEnv') or "SC",  # UF padrão
+        'modal': idx.get(f'{ide}.modal') or "01",  # Rodoviário padrão
+        'tipo_servico': idx.get(f'{ide}.tpServ') or "0",  # Normal padrão
+        'codigo_mun_ini': idx.get(f'{ide}.cMunIni') or "4200000",
+        'nome_mun_ini': idx.get(f'{ide}.xMunIni') or "MUNICÍPIO NÃO INFORMADO",
+        'uf_ini': idx.get(f'{ide}.UFIni') or "SC",
+        'codigo_mun_fim': idx.get(f'{ide}.cMunFim') or "4200000",
+        'nome_mun_fim': idx.get(f'{ide}.xMunFim') or "MUNICÍPIO NÃO INFORMADO",
+        'uf_fim': idx.get(f'{ide}.UFFim') or "SC",
+        'retira': to_boolean(idx.get(f'{ide}.retira', '0')),  # Default '0' se ausente
+        'detalhes_retira': idx.get(f'{ide}.xDetRetira'),
+        'ind_ie_tomador': to_int(idx.first(f'{toma}.indIEToma', f'{ide}.indIEToma')) or 9,  # Padrão 9 = Não contribuinte
+        'toma': to_int(toma_tipo) or 0,  # 0=Rem, 1=Exp, 2=Rec, 3=Dest, 4=Outros
         # Dados do Tomador (se toma=4)
-        'tomador_cnpj': safe_get(toma_node, 'CNPJ') if toma_tipo == '4' else None,
-        'tomador_cpf': safe_get(toma_node, 'CPF') if toma_tipo == '4' else None,
-        'tomador_ie': safe_get(toma_node, 'IE') if toma_tipo == '4' else None,
-        'tomador_razao_social': safe_get(toma_node, 'xNome') if toma_tipo == '4' else None,
-        'tomador_nome_fantasia': safe_get(toma_node, 'xFant') if toma_tipo == '4' else None,
-        'tomador_telefone': safe_get(toma_node, 'fone') if toma_tipo == '4' else None,
-        'tomador_endereco': tomador_endereco, # Objeto Endereco ou None
-        # Novo campo de distância KM
-        'dist_km': to_int(safe_get(ide, 'infGlobalizado.distCont') or safe_get(ide, 'infCTeNorm.infModal.rodo.dist')) or 0,
+        'tomador_cnpj': idx.get(f'{toma}.CNPJ') if tomador_4 else None,
+        'tomador_cpf': idx.get(f'{toma}.CPF') if tomador_4 else None,
+        'tomador_ie': idx.get(f'{toma}.IE') if tomador_4 else None,
+        'tomador_razao_social': idx.get(f'{toma}.xNome') if tomador_4 else None,
+        'tomador_nome_fantasia': idx.get(f'{toma}.xFant') if tomador_4 else None,
+        'tomador_telefone': idx.get(f'{toma}.fone') if tomador_4 else None,
+        'dist_km': to_int(idx.first(f'{ide}.infGlobalizado.distCont', f'{ide}.infCTeNorm.infModal.rodo.dist')) or 0,
+    })
+
+
+def _extrair_complemento(idx, rec):
+    """Bloco <compl> -> CTeComplemento, ObsCont e ObsFisco."""
+    if not idx.tem('infCte.compl'):
+        return
+
+    ent = 'infCte.compl.Entrega'
+    periodo_data = idx.get(f'{ent}.noPeriodo.@tpPer') == '2' or idx.get(f'{ent}.noData.@tpPer') == '2'
+    periodo_hora = idx.get(f'{ent}.noInter.@tpHor') == '2' or idx.get(f'{ent}.noHora.@tpHor') == '2'
+
+    rec.complemento = _sem_nulos({
+        'x_carac_ad': idx.get('infCte.compl.xCaracAd'),
+        'x_carac_ser': idx.get('infCte.compl.xCaracSer'),
+        'x_emi': idx.get('infCte.compl.xEmi'),
+        # Entrega: Verifica o tipo de período/hora antes de pegar o valor
+        'entrega_sem_data': idx.get(f'{ent}.semData.@tpPer') == '0',
+        'entrega_com_data_d_prev': parse_date(idx.get(f'{ent}.comData.dProg')) if idx.get(f'{ent}.comData.@tpPer') == '1' else None,
+        # Versões diferentes podem usar noPeriodo ou noData
+        'entrega_no_periodo_d_ini': parse_date(idx.first(f'{ent}.noPeriodo.dIni', f'{ent}.noData.dIni')) if periodo_data else None,
+        'entrega_no_periodo_d_fin': parse_date(idx.first(f'{ent}.noPeriodo.dFim', f'{ent}.noData.dFim')) if periodo_data else None,
+        'entrega_sem_hora': idx.get(f'{ent}.semHora.@tpHor') == '0',
+        'entrega_com_hora_h_prev': parse_time(idx.get(f'{ent}.comHora.hProg')) if idx.get(f'{ent}.comHora.@tpHor') == '1' else None,
+        # Versões diferentes podem usar noInter ou noHora
+        'entrega_no_periodo_h_ini': parse_time(idx.first(f'{ent}.noInter.hIni', f'{ent}.noHora.hIni')) if periodo_hora else None,
+        'entrega_no_periodo_h_fin': parse_time(idx.first(f'{ent}.noInter.hFim', f'{ent}.noHora.hFim')) if periodo_hora else None,
+        # Orig/Dest Calc
+        'orig_cod_mun': idx.get('infCte.compl.origCalc.cMunOrig'),
+        'orig_nome_mun': idx.get('infCte.compl.origCalc.xMunOrig'),
+        'orig_uf': idx.get('infCte.compl.origCalc.UFOrig'),
+        'dest_cod_mun': idx.get('infCte.compl.destCalc.cMunDest'),
+        'dest_nome_mun': idx.get('infCte.compl.destCalc.xMunDest'),
+        'dest_uf': idx.get('infCte.compl.destCalc.UFDest'),
+        'x_obs': idx.get('infCte.compl.xObs'),
+    })
+
+    rec.obs_contribuinte = [
+        {'campo': obs.get('@xCampo') or "CAMPO_PADRAO", 'texto': obs.get('xTexto') or ""}
+        for obs in idx.grupo('infCte.compl.ObsCont')
+    ]
+    rec.obs_fisco = [
+        {'campo': obs.get('@xCampo') or "CAMPO_PADRAO", 'texto': obs.get('xTexto') or ""}
+        for obs in idx.grupo('infCte.compl.ObsFisco')
+    ]
+
+
+def _extrair_entidade(idx, chave, tag):
+    """Bloco de entidade fiscal (<emit>, <rem>, <dest>, <exped>, <receb>)."""
+    base = f'infCte.{tag}'
+    if not idx.tem(base):
+        # É normal expedidor e recebedor não existirem, não logar warning para eles
+        if tag not in ['exped', 'receb']:
+            print(f"WARN: Bloco <{tag}> não encontrado para CT-e {chave}")
+        return None
+
+    endereco_tag = ENDERECO_ENTIDADE.get(tag, 'ender' + tag.capitalize())
+    endereco_data = _endereco_do_indice(idx, f'{base}.{endereco_tag}')
+
+    cnpj = idx.get(f'{base}.CNPJ')
+    cpf = idx.get(f'{base}.CPF')
+    cnpj_padrao = cpf_padrao = None
+    # Garante que pelo menos um identificador (CNPJ/CPF) exista
+    if not cnpj and not cpf:
+        print(f"WARN: Nem CNPJ nem CPF informados para <{tag}> no CT-e {chave}. Usando valores padrão.")
+        if tag == 'emit':  # Para emitente, usamos CNPJ padrão
+            cnpj_padrao = "00000000000000"
+        else:  # Para outros, usamos CPF padrão
+            cpf_padrao = "00000000000"
+
+    razao_social = idx.get(f'{base}.xNome')
+    if not razao_social:
+        razao_social = f"{tag.upper()} NÃO INFORMADO"
+        print(f"WARN: Razão social não informada para <{tag}> no CT-e {chave}. Usando valor padrão.")
+
+    entidade_data = {
+        'cnpj': cnpj or cnpj_padrao,
+        'cpf': cpf or cpf_padrao,
+        'ie': idx.get(f'{base}.IE'),
+        'razao_social': razao_social,
+        'nome_fantasia': idx.get(f'{base}.xFant'),
+        'telefone': idx.get(f'{base}.fone'),
+        'email': idx.get(f'{base}.email'),
+        # Campos específicos por entidade
+        'crt': idx.get(f'{base}.CRT') if tag == 'emit' else None,
+        'isuf': idx.get(f'{base}.ISUF') if tag == 'dest' else None,
+        **endereco_data
     }
+    # Se nome_municipio ou uf estiverem ausentes no endereco, define valores padrão
+    if not endereco_data['nome_municipio']:
+        entidade_data['nome_municipio'] = "MUNICÍPIO NÃO INFORMADO"
+    if not endereco_data['uf']:
+        entidade_data['uf'] = "SC"  # UF padrão
+
+    return _sem_nulos(entidade_data)
+
+
+def _extrair_valores(idx, chave, rec):
+    """Blocos <vPrest> e <imp> -> CTePrestacaoServico, CTeComponenteValor e CTeTributos."""
+    if not idx.tem('infCte.vPrest'):
+        return
+
+    # Garante que valores obrigatórios estejam presentes
+    valor_total = to_decimal(idx.get('infCte.vPrest.vTPrest'))
+    if valor_total is None or valor_total == 0:
+        valor_total = Decimal('0.01')  # Valor mínimo positivo
+        print(f"WARN: Valor total da prestação não informado ou zero para CT-e {chave}. Usando valor padrão.")
+
+    valor_recebido = to_decimal(idx.get('infCte.vPrest.vRec'))
+    if valor_recebido is None:
+        valor_recebido = valor_total  # Usa o mesmo valor do total se não informado
+        print(f"WARN: Valor a receber não informado para CT-e {chave}. Usando valor total.")
+
+    rec.prestacao = _sem_nulos({
+        'valor_total_prestado': valor_total,
+        'valor_recebido': valor_recebido,
+        'valor_cif': to_decimal(idx.get('infCte.vPrest.vCIF')),  # Só se existir no XML
+        'valor_fob': to_decimal(idx.get('infCte.vPrest.vFOB')),  # Só se existir no XML
+    })
+
+    for comp in idx.grupo('infCte.vPrest.Comp'):
+        nome_comp = comp.get('xNome')
+        valor_comp = to_decimal(comp.get('vComp'))
+        if nome_comp and valor_comp is not None:
+            rec.componentes.append({'nome': nome_comp, 'valor': valor_comp})
+
+    # --- Impostos ---
+    if not idx.tem('infCte.imp'):
+        return
+
+    # A estrutura do ICMS varia muito; armazenar como JSON é a abordagem mais flexível
+    icms_data = {}
+    icms_itens = idx.grupo('infCte.imp.ICMS')
+    if icms_itens:
+        icms_item = icms_itens[0]
+        for tipo in TIPOS_ICMS:
+            prefixo = tipo + '.'
+            dados_tipo = {k[len(prefixo):]: v for k, v in icms_item.items() if k.startswith(prefixo)}
+            if dados_tipo:
+                icms_data = dados_tipo
+                break
+            if tipo in icms_item:
+                icms_data = {'raw': icms_item[tipo]}  # Guarda o valor bruto se não for bloco
+                break
+
+    rec.tributos = _sem_nulos({
+        'icms': icms_data if icms_data else None,
+        'valor_total_tributos': to_decimal(idx.get('infCte.imp.vTotTrib')),
+        'info_ad_fisco': idx.get('infCte.imp.infAdFisco'),
+    })
+
+
+def _extrair_carga_e_documentos(idx, chave, rec):
+    """Blocos <infCarga> e <infDoc> (dentro de <infCteNorm>, <infCteComp> ou <infCteAnu>)."""
+    container_carga = next(
+        (c for c in CONTAINERS_INF_CTE if idx.tem(f'infCte.{c}.infCarga')), None
+    )
+    if container_carga:
+        carga = f'infCte.{container_carga}.infCarga'
+        valor_carga = to_decimal(idx.get(f'{carga}.vCarga'))
+        if valor_carga is None or valor_carga == 0:
+            valor_carga = Decimal('0.01')  # Valor mínimo
+            print(f"WARN: Valor da carga não informado ou zero para CT-e {chave}. Usando valor padrão.")
+
+        produto_predominante = idx.get(f'{carga}.proPred')
+        if not produto_predominante:
+            produto_predominante = "MERCADORIA DIVERSA"
+            print(f"WARN: Produto predominante não informado para CT-e {chave}. Usando valor padrão.")
+
+        rec.carga = _sem_nulos({
+            'valor_carga': valor_carga,
+            'produto_predominante': produto_predominante,
+            'outras_caracteristicas': idx.get(f'{carga}.xOutCat'),
+            'valor_carga_averbada': to_decimal(idx.get(f'{carga}.vCargaAverb')),
+        })
+
+        for inf_q in idx.grupo(f'{carga}.infQ'):
+            codigo = inf_q.get('cUnid')
+            tipo = inf_q.get('tpMed')
+            quantidade = to_decimal(inf_q.get('qCarga'))
+            if codigo and tipo and quantidade is not None:
+                rec.quantidades.append({
+                    'codigo_unidade': codigo,
+                    'tipo_medida': tipo,
+                    'quantidade': quantidade,
+                })
+
+    container_doc = next(
+        (c for c in CONTAINERS_INF_CTE if idx.tem(f'infCte.{c}.infDoc')), None
+    )
+    if not container_doc:
+        return
+    inf_doc = f'infCte.{container_doc}.infDoc'
+
+    # Notas Fiscais Eletrônicas <infNFe>
+    for nfe in idx.grupo(f'{inf_doc}.infNFe'):
+        chave_nfe = nfe.get('chave')
+        if chave_nfe:
+            rec.documentos.append({
+                'tipo_documento': 'NFe',
+                'chave_nfe': chave_nfe,
+                'pin_suframa_nf': nfe.get('PIN'),
+            })
+
+    # Notas Fiscais (Papel) <infNF>
+    for nf in idx.grupo(f'{inf_doc}.infNF'):
+        modelo = nf.get('mod')
+        numero = nf.get('nDoc')
+        if modelo and numero:
+            rec.documentos.append({
+                'tipo_documento': 'NF',
+                'modelo_nf': modelo,
+                'serie_nf': nf.get('serie'),
+                'numero_nf': numero,
+                'data_emissao_nf': parse_date(nf.get('dEmi')),
+                'bc_icms_nf': to_decimal(nf.get('vBC')),
+                'valor_icms_nf': to_decimal(nf.get('vICMS')),
+                'bc_st_nf': to_decimal(nf.get('vBCST')),
+                'valor_st_nf': to_decimal(nf.get('vST')),
+                'valor_produtos_nf': to_decimal(nf.get('vProd')),
+                'valor_total_nf': to_decimal(nf.get('vNF')),
+                'cfop_pred_nf': nf.get('nCFOP'),  # Mapeia nCFOP para cfop_pred_nf
+                'peso_total_kg_nf': to_decimal(nf.get('nPeso'), default=Decimal('0.000')),
+                'pin_suframa_nf': nf.get('PIN'),
+            })
+
+    # Outros Documentos <infOutros>
+    for outro in idx.grupo(f'{inf_doc}.infOutros'):
+        tipo_doc = outro.get('tpDoc')
+        numero = outro.get('nDoc')
+        if tipo_doc and numero:
+            rec.documentos.append({
+                'tipo_documento': 'Outros',
+                'tipo_doc_outros': tipo_doc,
+                'desc_outros': outro.get('descOutros'),
+                'numero_outros': numero,
+                'data_emissao_outros': parse_date(outro.get('dEmi')),
+                'valor_doc_outros': to_decimal(outro.get('vDocFisc')),
+            })
+
+
+def _extrair_seguros(idx, chave, rec):
+    """Bloco <seg> -> CTeSeguro."""
+    seguros = [seg for c in CONTAINERS_NORMAL for seg in idx.grupo(f'infCte.{c}.seg')]
+    for seg in seguros:
+        responsavel = seg.get('respSeg')
+        if not responsavel:
+            responsavel = '5'  # 5 = Emitente CT-e (valor padrão)
+            print(f"WARN: Responsável pelo seguro não informado para CT-e {chave}. Usando valor padrão.")
+
+        nome_seguradora = seg.get('xSeg')
+        if not nome_seguradora:
+            nome_seguradora = "SEGURADORA NÃO INFORMADA"
+            print(f"WARN: Nome da seguradora não informado para CT-e {chave}. Usando valor padrão.")
+
+        numero_apolice = seg.get('nApol')
+        if not numero_apolice:
+            numero_apolice = "APÓLICE NÃO INFORMADA"
+            print(f"WARN: Número da apólice não informado para CT-e {chave}. Usando valor padrão.")
+
+        valor_carga = to_decimal(seg.get('vCarga'))
+        if valor_carga is None or valor_carga == 0:
+            valor_carga = Decimal('0.01')  # Valor mínimo
+            print(f"WARN: Valor da carga no seguro não informado para CT-e {chave}. Usando valor padrão.")
+
+        rec.seguros.append({
+            'responsavel': responsavel,
+            'nome_seguradora': nome_seguradora,
+            'numero_apolice': numero_apolice,
+            'numero_averbacao': seg.get('nAver'),
+            'valor_carga_averbada': valor_carga,
+        })
+
+
+def _extrair_modal_rodoviario(idx, chave, rec):
+    """Bloco <infModal versaoModal='x.xx'><rodo> -> modal, veículos e motoristas."""
+    caminhos_modal = tuple(f'infCte.{c}.infModal' for c in CONTAINERS_NORMAL) + ('infCte.infModal',)
+    inf_modal = next((p for p in caminhos_modal if idx.tem(p)), None)
+    if not inf_modal or idx.get(f'{inf_modal}.@versaoModal') is None:
+        return
+    rodo = f'{inf_modal}.rodo'
+    if not idx.tem(rodo):
+        return  # Não é modal rodoviário
+
+    rntrc = idx.get(f'{rodo}.RNTRC')
+    if not rntrc:
+        rntrc = "00000000"  # Valor padrão
+        print(f"WARN: RNTRC não informado para CT-e {chave}. Usando valor padrão.")
+
+    rec.modal = _sem_nulos({
+        'rntrc': rntrc,
+        'data_prevista_entrega': parse_date(idx.get(f'{rodo}.dPrev')),
+        'lotacao': to_boolean(idx.get(f'{rodo}.lota', '0')),  # Indicador de Lotação
+    })
+
+    for veic in idx.grupo(f'{rodo}.veic'):
+        placa = veic.get('placa')
+        if placa:  # Garante que pelo menos placa exista
+            rec.veiculos.append(_sem_nulos({
+                'placa': placa,
+                'renavam': veic.get('RENAVAM'),
+                'tara': to_int(veic.get('tara')) or 0,
+                'cap_kg': to_int(veic.get('capKG')),
+                'cap_m3': to_int(veic.get('capM3')),
+                'tipo_proprietario': veic.get('tpProp'),
+                'tipo_veiculo': veic.get('tpVeic'),
+                'tipo_rodado': veic.get('tpRod'),
+                'tipo_carroceria': veic.get('tpCar'),
+                'uf_licenciamento': veic.get('UF'),
+                # Proprietário (se houver dentro de <veic>)
+                'prop_cnpj': veic.get('prop.CNPJ'),
+                'prop_cpf': veic.get('prop.CPF'),
+                'prop_rntrc': veic.get('prop.RNTRC'),
+                'prop_razao_social': veic.get('prop.xNome'),
+                'prop_ie': veic.get('prop.IE'),
+                'prop_uf': veic.get('prop.UF'),
+            }))
+
+    for moto in idx.grupo(f'{rodo}.moto'):
+        nome = moto.get('xNome')
+        cpf = moto.get('CPF')
+        if nome and cpf:  # Garante que nome e CPF existam
+            rec.motoristas.append({'nome': nome, 'cpf': cpf})
+
+
+def _extrair_responsavel_tecnico(idx, chave, rec):
+    """Bloco <infRespTec> -> CTeResponsavelTecnico."""
+    if not idx.tem('infCte.infRespTec'):
+        return
+    resp = 'infCte.infRespTec'
+
+    cnpj = idx.get(f'{resp}.CNPJ')
+    if not cnpj:
+        cnpj = "00000000000000"  # Valor padrão
+        print(f"WARN: CNPJ do responsável técnico não informado para CT-e {chave}. Usando valor padrão.")
+
+    contato = idx.get(f'{resp}.xContato')
+    if not contato:
+        contato = "CONTATO NÃO INFORMADO"
+        print(f"WARN: Nome do contato técnico não informado para CT-e {chave}. Usando valor padrão.")
+
+    email = idx.get(f'{resp}.email')
+    if not email:
+        email = "email@nao.informado"
+        print(f"WARN: Email do contato técnico não informado para CT-e {chave}. Usando valor padrão.")
+
+    telefone = idx.get(f'{resp}.fone')
+    if not telefone:
+        telefone = "0000000000"
+        print(f"WARN: Telefone do contato técnico não informado para CT-e {chave}. Usando valor padrão.")
+
+    rec.responsavel_tecnico = _sem_nulos({
+        'cnpj': cnpj,
+        'contato': contato,
+        'email': email,
+        'telefone': telefone,
+        'id_csr': idx.get(f'{resp}.idCSRT'),
+        'hash_csr': idx.get(f'{resp}.hashCSRT'),
+    })
+
+
+def _extrair_protocolo(idx, chave, rec):
+    """Bloco <protCTe><infProt> (fora do <infCte>)."""
+    if not idx.tem('protCTe.infProt'):
+        return
+    prot = 'protCTe.infProt'
+    rec.chave_protocolo = idx.get(f'{prot}.chCTe')
+
+    codigo_status = to_int(idx.get(f'{prot}.cStat'))
+    if codigo_status is None:
+        codigo_status = 0  # Valor padrão
+        print(f"WARN: Código de status não informado no protocolo para CT-e {chave}. Usando valor padrão.")
+
+    motivo_status = idx.get(f'{prot}.xMotivo')
+    if not motivo_status:
+        motivo_status = "MOTIVO NÃO INFORMADO"
+        print(f"WARN: Motivo do status não informado no protocolo para CT-e {chave}. Usando valor padrão.")
+
+    rec.protocolo = _sem_nulos({
+        'ambiente': to_int(idx.get(f'{prot}.tpAmb')) or 2,  # 2 = Homologação padrão
+        'versao_aplic': idx.get(f'{prot}.verAplic') or "VERSÃO NÃO INFORMADA",
+        'data_recebimento': parse_datetime(idx.get(f'{prot}.dhRecbto')) or datetime.now(),
+        'numero_protocolo': idx.get(f'{prot}.nProt') or "PROTOCOLO NÃO INFORMADO",
+        'digest_value': idx.get(f'{prot}.digVal'),
+        'codigo_status': codigo_status,
+        'motivo_status': motivo_status,
+    })
+
+
+def indexar_cte(xml_text):
+    """Índice de passagem única do XML do CT-e, reutilizável entre a classificação do upload e o parser."""
+    return indexar_xml(xml_text, ancoras=ANCORAS_CTE, grupos=GRUPOS_CTE)
+
+
+def extrair_cte(xml_text, chave=None, indice=None):
+    """
+    Lê o XML do CT-e em uma única passagem e devolve um CTeRecord.
+    Se o índice já foi montado (ex: na classificação do upload), o XML não é lido de novo.
+    Não acessa o banco. Levanta ValueError se não houver bloco <infCte>.
+    """
+    idx = indice if indice is not None else indexar_cte(xml_text)
+    if not idx.tem('infCte'):
+        raise ValueError("Não foi possível encontrar o bloco <infCte> ou <CTe> no XML.")
+
+    rec = CTeRecord()
+    # Versão: do proc (cteProc/procCTe/CTe) ou do próprio infCte
+    rec.versao = idx.raiz_attrs.get('versao') or idx.get('infCte.@versao', '4.00')
+
+    _extrair_identificacao(idx, chave, rec)
+    _extrair_complemento(idx, rec)
+    for tag in ENDERECO_ENTIDADE:
+        rec.entidades[tag] = _extrair_entidade(idx, chave, tag)
+    _extrair_valores(idx, chave, rec)
+    _extrair_carga_e_documentos(idx, chave, rec)
+    _extrair_seguros(idx, chave, rec)
+    _extrair_modal_rodoviario(idx, chave, rec)
+
+    for aut in idx.grupo('infCte.autXML'):
+        cnpj = aut.get('CNPJ')
+        cpf = aut.get('CPF')
+        if cnpj or cpf:  # Pelo menos um identificador é obrigatório
+            rec.autorizados.append({'cnpj': cnpj, 'cpf': cpf})
+
+    _extrair_responsavel_tecnico(idx, chave, rec)
+    _extrair_protocolo(idx, chave, rec)
+
+    if idx.tem('infCTeSupl'):
+        rec.suplementar = {'qr_code_url': idx.get('infCTeSupl.qrCodCTe')}
+
+    return rec
+
+
+def determinar_modalidade(rec):
+    """
+    Determina a modalidade (CIF/FOB) a partir do registro extraído:
+    tomador, nomes dos componentes de valor e observações do contribuinte.
+    """
+    toma = (rec.identificacao or {}).get('toma')
+    if toma == 0:  # Remetente paga = CIF (geralmente)
+        return 'CIF'
+    if toma == 3:  # Destinatário paga = FOB (geralmente)
+        return 'FOB'
+    if toma is not None and rec.prestacao:
+        # Olhar em <vPrest><Comp> por componentes nomeados como CIF/FOB
+        for comp in rec.componentes:
+            if 'CIF' in comp['nome'].upper():
+                return 'CIF'
+            elif 'FOB' in comp['nome'].upper():
+                return 'FOB'
+    # Tentar também por observações contribuinte
+    if rec.complemento is not None:
+        for obs in rec.obs_contribuinte:
+            if 'CIF' in obs['campo'].upper() or 'CIF' in obs['texto'].upper():
+                return 'CIF'
+            elif 'FOB' in obs['campo'].upper() or 'FOB' in obs['texto'].upper():
+                return 'FOB'
+    return None
+
+
+# --- Persistência por Seção do Modelo (registro -> banco) ---
+
+# Tamanho dos lotes de INSERT para tabelas filhas (bulk_create)
+BULK_BATCH_SIZE = 500
 
-    # Remove chaves com valor None para evitar sobrescrever com null no update_or_create
-    ident_data_cleaned = {k: v for k, v in ident_data.items() if v is not None}
+
+def substituir_filhos(model_class, linhas, **pai):
+    """
+    Substitui as linhas filhas de um registro pai: um DELETE e um bulk_create
+    por tabela, em vez de um INSERT por linha.
+    Ex: substituir_filhos(CTeSeguro, rec.seguros, cte=cte_doc)
+    """
+    model_class.objects.filter(**pai).delete()
+    if not linhas:
+        return 0
+    model_class.objects.bulk_create(
+        [model_class(**pai, **dados) for dados in linhas],
+        batch_size=BULK_BATCH_SIZE
+    )
+    return len(linhas)
+
+
+@transaction.atomic
+def parse_cte_identificacao(cte_doc, rec):
+    """Salva CTeIdentificacao (e o Endereco do tomador, se toma=4)."""
+    if rec.identificacao is None:
+        return None
+
+    ident_data = dict(rec.identificacao)
+    if rec.tomador_endereco:
+        # Cria um novo endereço para o tomador.
+        # Considerar get_or_create se houver chance de reutilização e um critério único.
+        ident_data['tomador_endereco'] = Endereco.objects.create(**rec.tomador_endereco)
 
     try:
         identificacao, created = CTeIdentificacao.objects.update_or_create(
             cte=cte_doc,
-            defaults=ident_data_cleaned
+            defaults=ident_data
         )
         return identificacao
     except Exception as e:
@@ -282,76 +856,21 @@ def parse_cte_identificacao(cte_doc, infcte):
         raise
 
 @transaction.atomic
-def parse_cte_complemento(cte_doc, infcte):
-    """Parseia o bloco <compl> e salva em CTeComplemento e relacionados."""
-    compl = safe_get(infcte, 'compl')
-    if not compl:
+def parse_cte_complemento(cte_doc, rec):
+    """Salva CTeComplemento e as observações relacionadas."""
+    if rec.complemento is None:
         CTeComplemento.objects.filter(cte=cte_doc).delete()  # Limpa qualquer complemento existente
         return None
 
-    # Dados da Entrega
-    entrega_data = safe_get(compl, 'Entrega', {})
-    # Dados de Origem/Destino Cálculo (podem não existir)
-    orig_data = safe_get(compl, 'origCalc', {})
-    dest_data = safe_get(compl, 'destCalc', {})
-
-    compl_data = {
-        'x_carac_ad': safe_get(compl, 'xCaracAd'),
-        'x_carac_ser': safe_get(compl, 'xCaracSer'),
-        'x_emi': safe_get(compl, 'xEmi'),
-        # Entrega: Verifica o tipo de período/hora antes de pegar o valor
-        'entrega_sem_data': safe_get(entrega_data, 'semData.@tpPer') == '0',
-        'entrega_com_data_d_prev': parse_date(safe_get(entrega_data, 'comData.dProg')) if safe_get(entrega_data, 'comData.@tpPer') == '1' else None,
-        'entrega_no_periodo_d_ini': parse_date(safe_get(entrega_data, 'noPeriodo.dIni') or safe_get(entrega_data, 'noData.dIni')) if safe_get(entrega_data, 'noPeriodo.@tpPer') == '2' or safe_get(entrega_data, 'noData.@tpPer') == '2' else None,
-        'entrega_no_periodo_d_fin': parse_date(safe_get(entrega_data, 'noPeriodo.dFim') or safe_get(entrega_data, 'noData.dFim')) if safe_get(entrega_data, 'noPeriodo.@tpPer') == '2' or safe_get(entrega_data, 'noData.@tpPer') == '2' else None,
-        # Ajustado para versões diferentes que podem usar noPeriodo ou noData
-
-        'entrega_sem_hora': safe_get(entrega_data, 'semHora.@tpHor') == '0',
-        'entrega_com_hora_h_prev': parse_time(safe_get(entrega_data, 'comHora.hProg')) if safe_get(entrega_data, 'comHora.@tpHor') == '1' else None,
-        'entrega_no_periodo_h_ini': parse_time(safe_get(entrega_data, 'noInter.hIni') or safe_get(entrega_data, 'noHora.hIni')) if safe_get(entrega_data, 'noInter.@tpHor') == '2' or safe_get(entrega_data, 'noHora.@tpHor') == '2' else None,
-        'entrega_no_periodo_h_fin': parse_time(safe_get(entrega_data, 'noInter.hFim') or safe_get(entrega_data, 'noHora.hFim')) if safe_get(entrega_data, 'noInter.@tpHor') == '2' or safe_get(entrega_data, 'noHora.@tpHor') == '2' else None,
-        # Ajustado para versões diferentes que podem usar noInter ou noHora
-
-        # Orig/Dest Calc
-        'orig_cod_mun': safe_get(orig_data, 'cMunOrig'),
-        'orig_nome_mun': safe_get(orig_data, 'xMunOrig'),
-        'orig_uf': safe_get(orig_data, 'UFOrig'),
-        'dest_cod_mun': safe_get(dest_data, 'cMunDest'),
-        'dest_nome_mun': safe_get(dest_data, 'xMunDest'),
-        'dest_uf': safe_get(dest_data, 'UFDest'),
-        'x_obs': safe_get(compl, 'xObs'),
-    }
-    compl_data_cleaned = {k: v for k, v in compl_data.items() if v is not None}
-
     try:
         complemento, created = CTeComplemento.objects.update_or_create(
             cte=cte_doc,
-            defaults=compl_data_cleaned
+            defaults=rec.complemento
         )
 
-        # --- Observações Contribuinte <ObsCont> ---
-        obs_cont_list = safe_get(compl, 'ObsCont', [])
-        if not isinstance(obs_cont_list, list): obs_cont_list = [obs_cont_list] # Garante que seja lista
-        CTeObservacaoContribuinte.objects.filter(complemento=complemento).delete() # Limpa anteriores
-        for obs in obs_cont_list:
-            if isinstance(obs, dict):
-                CTeObservacaoContribuinte.objects.create(
-                    complemento=complemento,
-                    campo=safe_get(obs, '@xCampo') or "CAMPO_PADRAO",
-                    texto=safe_get(obs, 'xTexto') or ""
-                )
-
-        # --- Observações Fisco <ObsFisco> ---
-        obs_fisco_list = safe_get(compl, 'ObsFisco', [])
-        if not isinstance(obs_fisco_list, list): obs_fisco_list = [obs_fisco_list]
-        CTeObservacaoFisco.objects.filter(complemento=complemento).delete() # Limpa anteriores
-        for obs in obs_fisco_list:
-             if isinstance(obs, dict):
-                CTeObservacaoFisco.objects.create(
-                    complemento=complemento,
-                    campo=safe_get(obs, '@xCampo') or "CAMPO_PADRAO",
-                    texto=safe_get(obs, 'xTexto') or ""
-                )
+        # --- Observações Contribuinte <ObsCont> e Fisco <ObsFisco> ---
+        substituir_filhos(CTeObservacaoContribuinte, rec.obs_contribuinte, complemento=complemento)
+        substituir_filhos(CTeObservacaoFisco, rec.obs_fisco, complemento=complemento)
 
         return complemento
     except Exception as e:
@@ -359,70 +878,20 @@ def parse_cte_complemento(cte_doc, infcte):
         raise
 
 @transaction.atomic
-def parse_entidade(cte_doc, infcte, tag, model_class):
-    """Parseia um bloco de entidade fiscal (<emit>, <rem>, <dest>, <exped>, <receb>)."""
-    entidade_dict = safe_get(infcte, tag)
-    if not entidade_dict:
-        # É normal expedidor e recebedor não existirem, não logar warning para eles
-        if tag not in ['exped', 'receb']:
-           print(f"WARN: Bloco <{tag}> não encontrado para CT-e {cte_doc.chave}")
+def parse_entidade(cte_doc, rec, tag, model_class):
+    """Salva uma entidade fiscal (<emit>, <rem>, <dest>, <exped>, <receb>)."""
+    entidade_data = rec.entidades.get(tag)
+    if entidade_data is None:
         # Garante que qualquer registro antigo seja deletado se o bloco não vier mais
         model_class.objects.filter(cte=cte_doc).delete()
         return None
 
-    # Define o nome da tag do endereço (ex: enderEmit, enderReme)
-    endereco_tag = 'ender' + tag.capitalize()
-    endereco_data = parse_endereco(safe_get(entidade_dict, endereco_tag))
-
-    # Garante que pelo menos um identificador (CNPJ/CPF) e nome existam
-    if not safe_get(entidade_dict, 'CNPJ') and not safe_get(entidade_dict, 'CPF'):
-        print(f"WARN: Nem CNPJ nem CPF informados para <{tag}> no CT-e {cte_doc.chave}. Usando valores padrão.")
-        if tag == 'emit':  # Para emitente, usamos CNPJ padrão
-            cnpj_padrao = "00000000000000"
-            cpf_padrao = None
-        else:  # Para outros, usamos CPF padrão
-            cnpj_padrao = None
-            cpf_padrao = "00000000000"
-    else:
-        cnpj_padrao = None
-        cpf_padrao = None
-
-    razao_social = safe_get(entidade_dict, 'xNome')
-    if not razao_social:
-        razao_social = f"{tag.upper()} NÃO INFORMADO"
-        print(f"WARN: Razão social não informada para <{tag}> no CT-e {cte_doc.chave}. Usando valor padrão.")
-
-    entidade_data = {
-        'cnpj': safe_get(entidade_dict, 'CNPJ') or cnpj_padrao,
-        'cpf': safe_get(entidade_dict, 'CPF') or cpf_padrao,
-        'ie': safe_get(entidade_dict, 'IE'),
-        'razao_social': razao_social,
-        'nome_fantasia': safe_get(entidade_dict, 'xFant'),
-        'telefone': safe_get(entidade_dict, 'fone'),
-        'email': safe_get(entidade_dict, 'email'), # Campo adicionado ao modelo base
-        # Campos específicos por entidade
-        'crt': safe_get(entidade_dict, 'CRT') if tag == 'emit' else None,
-        'isuf': safe_get(entidade_dict, 'ISUF') if tag == 'dest' else None,
-        # Adiciona os campos do endereço extraído
-        **endereco_data
-    }
-    
-    # Se nome_municipio ou uf estiverem ausentes no endereco, define valores padrão
-    if 'nome_municipio' not in endereco_data or not endereco_data['nome_municipio']:
-        entidade_data['nome_municipio'] = "MUNICÍPIO NÃO INFORMADO"
-    
-    if 'uf' not in endereco_data or not endereco_data['uf']:
-        entidade_data['uf'] = "SC"  # UF padrão
-
-    entidade_data_cleaned = {k: v for k, v in entidade_data.items() if v is not None}
-
     try:
-        # Cria ou atualiza a entidade.
         # Como Endereco é a base concreta, o update_or_create lida com a herança.
         # Ele criará/atualizará a linha em Endereco e a linha na tabela específica (CTeEmitente, etc.)
         obj, created = model_class.objects.update_or_create(
             cte=cte_doc,
-            defaults=entidade_data_cleaned
+            defaults=entidade_data
         )
         return obj
     except Exception as e:
@@ -430,95 +899,33 @@ def parse_entidade(cte_doc, infcte, tag, model_class):
         raise
 
 @transaction.atomic
-def parse_cte_valores(cte_doc, infcte):
-    """Parseia os blocos <vPrest> e <imp>."""
-    vprest = safe_get(infcte, 'vPrest')
-    if not vprest:
+def parse_cte_valores(cte_doc, rec):
+    """Salva prestação (com componentes) e tributos."""
+    if rec.prestacao is None:
         # Limpa registros anteriores se o bloco não existir
         CTePrestacaoServico.objects.filter(cte=cte_doc).delete()
         CTeTributos.objects.filter(cte=cte_doc).delete()
         return None, None # Retorna None para prestacao e tributos
 
-    # Garante que valores obrigatórios estejam presentes
-    valor_total = to_decimal(safe_get(vprest, 'vTPrest'))
-    if valor_total is None or valor_total == 0:
-        valor_total = Decimal('0.01')  # Valor mínimo positivo
-        print(f"WARN: Valor total da prestação não informado ou zero para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-    valor_recebido = to_decimal(safe_get(vprest, 'vRec'))
-    if valor_recebido is None:
-        valor_recebido = valor_total  # Usa o mesmo valor do total se não informado
-        print(f"WARN: Valor a receber não informado para CT-e {cte_doc.chave}. Usando valor total.")
-
-    # --- Prestação de Serviço ---
-    prest_data = {
-        'valor_total_prestado': valor_total,
-        'valor_recebido': valor_recebido,
-        # Campos CIF/FOB - Detectar modalidade baseado no tomador ou outros valores
-        'valor_cif': to_decimal(safe_get(vprest, 'vCIF')), # Só se existir no XML
-        'valor_fob': to_decimal(safe_get(vprest, 'vFOB')), # Só se existir no XML
-    }
-    prest_data_cleaned = {k: v for k, v in prest_data.items() if v is not None}
-    
     try:
         prestacao, created_prest = CTePrestacaoServico.objects.update_or_create(
             cte=cte_doc,
-            defaults=prest_data_cleaned
+            defaults=rec.prestacao
         )
 
         # Componentes de Valor <Comp>
-        comp_list = safe_get(vprest, 'Comp', [])
-        if not isinstance(comp_list, list): comp_list = [comp_list]
-        CTeComponenteValor.objects.filter(prestacao=prestacao).delete() # Limpa anteriores
-        for comp in comp_list:
-             if isinstance(comp, dict):
-                nome_comp = safe_get(comp, 'xNome')
-                valor_comp = to_decimal(safe_get(comp, 'vComp'))
-                
-                if nome_comp and valor_comp is not None:
-                    CTeComponenteValor.objects.create(
-                        prestacao=prestacao,
-                        nome=nome_comp,
-                        valor=valor_comp
-                    )
+        substituir_filhos(CTeComponenteValor, rec.componentes, prestacao=prestacao)
     except Exception as e:
         print(f"ERRO ao processar valores de prestação para CT-e {cte_doc.chave}: {e}")
         raise
 
     # --- Impostos ---
-    imp = safe_get(infcte, 'imp')
     tributos = None
-    if imp:
-        # Tenta extrair a estrutura do ICMS (pode variar muito)
-        # Armazenar como JSON é a abordagem mais flexível
-        icms_node = safe_get(imp, 'ICMS', {})
-        icms_data = {}
-        # Verifica qual tipo de ICMS está presente
-        if 'ICMS00' in icms_node: icms_data = safe_get(icms_node, 'ICMS00')
-        elif 'ICMS20' in icms_node: icms_data = safe_get(icms_node, 'ICMS20')
-        elif 'ICMS45' in icms_node: icms_data = safe_get(icms_node, 'ICMS45')
-        elif 'ICMS60' in icms_node: icms_data = safe_get(icms_node, 'ICMS60')
-        elif 'ICMS90' in icms_node: icms_data = safe_get(icms_node, 'ICMS90')
-        elif 'ICMSOutraUF' in icms_node: icms_data = safe_get(icms_node, 'ICMSOutraUF')
-        elif 'ICMSSN' in icms_node: icms_data = safe_get(icms_node, 'ICMSSN')
-        # Adicionar ICMSST se necessário
-        elif 'ICMSST' in icms_node: icms_data = safe_get(icms_node, 'ICMSST')
-
-        # Verifica se icms_data é um dicionário antes de usar
-        if not isinstance(icms_data, dict):
-             icms_data = {'raw': icms_data} # Guarda o valor bruto se não for dict
-
+    if rec.tributos is not None:
         try:
-            trib_data = {
-                'icms': icms_data if icms_data else None,
-                'valor_total_tributos': to_decimal(safe_get(imp, 'vTotTrib')),
-                'info_ad_fisco': safe_get(imp, 'infAdFisco'),
-                # ICMSUFFim (<ICMSUFFim>) é complexo, pode ser adicionado como JSON se necessário
-            }
-            trib_data_cleaned = {k: v for k, v in trib_data.items() if v is not None}
             tributos, created_trib = CTeTributos.objects.update_or_create(
                 cte=cte_doc,
-                defaults=trib_data_cleaned
+                defaults=rec.tributos
             )
         except Exception as e:
             print(f"ERRO ao processar tributos para CT-e {cte_doc.chave}: {e}")
@@ -531,283 +938,60 @@ def parse_cte_valores(cte_doc, infcte):
     return prestacao, tributos
 
 @transaction.atomic
-def parse_cte_carga(cte_doc, infcte):
-    """Parseia o bloco <infCarga>."""
-    # O bloco pode estar dentro de <infCteNorm> ou <infCteComp> etc.
-    inf_carga = safe_get(infcte, 'infCteNorm.infCarga') or \
-                safe_get(infcte, 'infCteComp.infCarga') or \
-                safe_get(infcte, 'infCteAnu.infCarga') # Adicione outros se necessário
-    if not inf_carga:
+def parse_cte_carga(cte_doc, rec):
+    """Salva CTeCarga e as quantidades <infQ>."""
+    if rec.carga is None:
         CTeCarga.objects.filter(cte=cte_doc).delete() # Limpa carga anterior
         return None
 
-    # Garantir que campos obrigatórios existam
-    valor_carga = to_decimal(safe_get(inf_carga, 'vCarga'))
-    if valor_carga is None or valor_carga == 0:
-        valor_carga = Decimal('0.01')  # Valor mínimo
-        print(f"WARN: Valor da carga não informado ou zero para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-    produto_predominante = safe_get(inf_carga, 'proPred')
-    if not produto_predominante:
-        produto_predominante = "MERCADORIA DIVERSA"
-        print(f"WARN: Produto predominante não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
     try:
-        carga_data = {
-            'valor_carga': valor_carga,
-            'produto_predominante': produto_predominante,
-            'outras_caracteristicas': safe_get(inf_carga, 'xOutCat'),
-            'valor_carga_averbada': to_decimal(safe_get(inf_carga, 'vCargaAverb')),
-        }
-        carga_data_cleaned = {k: v for k, v in carga_data.items() if v is not None}
         carga, created = CTeCarga.objects.update_or_create(
             cte=cte_doc,
-            defaults=carga_data_cleaned
+            defaults=rec.carga
         )
 
         # Quantidades de Carga <infQ>
-        inf_q_list = safe_get(inf_carga, 'infQ', [])
-        if not isinstance(inf_q_list, list): inf_q_list = [inf_q_list]
-        CTeQuantidadeCarga.objects.filter(carga=carga).delete() # Limpa anteriores
-        for inf_q in inf_q_list:
-             if isinstance(inf_q, dict):
-                codigo = safe_get(inf_q, 'cUnid')
-                tipo = safe_get(inf_q, 'tpMed')
-                quantidade = to_decimal(safe_get(inf_q, 'qCarga'))
-                
-                if codigo and tipo and quantidade is not None:
-                    CTeQuantidadeCarga.objects.create(
-                        carga=carga,
-                        codigo_unidade=codigo,
-                        tipo_medida=tipo,
-                        quantidade=quantidade
-                    )
+        substituir_filhos(CTeQuantidadeCarga, rec.quantidades, carga=carga)
         return carga
     except Exception as e:
         print(f"ERRO ao processar carga para CT-e {cte_doc.chave}: {e}")
         raise
 
 @transaction.atomic
-def parse_cte_documentos(cte_doc, infcte):
-    """Parseia o bloco <infDoc> (NF-e, NF, Outros)."""
-    # O bloco pode estar dentro de <infCteNorm> ou <infCteComp> etc.
-    inf_doc = safe_get(infcte, 'infCteNorm.infDoc') or \
-              safe_get(infcte, 'infCteComp.infDoc') or \
-              safe_get(infcte, 'infCteAnu.infDoc') # Adicione outros se necessário
-
-    CTeDocumentoTransportado.objects.filter(cte=cte_doc).delete() # Limpa todos os anteriores para este CT-e
-    if not inf_doc:
-        return 0 # Retorna 0 documentos processados
-
+def parse_cte_documentos(cte_doc, rec):
+    """Salva os documentos transportados (NF-e, NF, Outros)."""
     try:
-        count = 0
-
-        # Notas Fiscais Eletrônicas <infNFe>
-        inf_nfe_list = safe_get(inf_doc, 'infNFe', [])
-        if not isinstance(inf_nfe_list, list): inf_nfe_list = [inf_nfe_list]
-        for nfe in inf_nfe_list:
-             if isinstance(nfe, dict):
-                # dPrev não mapeado diretamente, pode ir para observações se necessário
-                # infUnidCarga e infUnidTransp omitidos por complexidade
-                chave_nfe = safe_get(nfe, 'chave')
-                if chave_nfe:
-                    CTeDocumentoTransportado.objects.create(
-                        cte=cte_doc,
-                        tipo_documento='NFe',
-                        chave_nfe=chave_nfe,
-                        pin_suframa_nf=safe_get(nfe, 'PIN'),
-                    )
-                    count += 1
-
-        # Notas Fiscais (Papel) <infNF>
-        inf_nf_list = safe_get(inf_doc, 'infNF', [])
-        if not isinstance(inf_nf_list, list): inf_nf_list = [inf_nf_list]
-        for nf in inf_nf_list:
-             if isinstance(nf, dict):
-                # Remetente/Dest da NF omitidos (usar os do CT-e)
-                # infUnidCarga e infUnidTransp omitidos por complexidade
-                modelo = safe_get(nf, 'mod')
-                numero = safe_get(nf, 'nDoc')
-                
-                if modelo and numero:
-                    CTeDocumentoTransportado.objects.create(
-                        cte=cte_doc,
-                        tipo_documento='NF',
-                        modelo_nf=modelo,
-                        serie_nf=safe_get(nf, 'serie'),
-                        numero_nf=numero,
-                        data_emissao_nf=parse_date(safe_get(nf, 'dEmi')),
-                        valor_bc_icms_nf=to_decimal(safe_get(nf, 'vBC')),
-                        valor_icms_nf=to_decimal(safe_get(nf, 'vICMS')),
-                        valor_bc_st_nf=to_decimal(safe_get(nf, 'vBCST')),
-                        valor_st_nf=to_decimal(safe_get(nf, 'vST')),
-                        valor_produtos_nf=to_decimal(safe_get(nf, 'vProd')),
-                        valor_total_nf=to_decimal(safe_get(nf, 'vNF')),
-                        cfop_pred_nf=safe_get(nf, 'nCFOP'), # Mapeia nCFOP para cfop_pred_nf
-                        peso_total_kg_nf=to_decimal(safe_get(nf, 'nPeso'), default=Decimal('0.000')),
-                        pin_suframa_nf=safe_get(nf, 'PIN'),
-                    )
-                    count += 1
-
-        # Outros Documentos <infOutros>
-        inf_outros_list = safe_get(inf_doc, 'infOutros', [])
-        if not isinstance(inf_outros_list, list): inf_outros_list = [inf_outros_list]
-        for outro in inf_outros_list:
-             if isinstance(outro, dict):
-                # infUnidCarga e infUnidTransp omitidos
-                tipo_doc = safe_get(outro, 'tpDoc')
-                numero = safe_get(outro, 'nDoc')
-                
-                if tipo_doc and numero:
-                    CTeDocumentoTransportado.objects.create(
-                        cte=cte_doc,
-                        tipo_documento='Outros',
-                        tipo_doc_outros=tipo_doc,
-                        desc_outros=safe_get(outro, 'descOutros'),
-                        numero_outros=numero,
-                        data_emissao_outros=parse_date(safe_get(outro, 'dEmi')),
-                        valor_doc_outros=to_decimal(safe_get(outro, 'vDocFisc')),
-                    )
-                    count += 1
-
-        return count
+        # Um DELETE e INSERTs em lote, mesmo para CT-es com centenas de NF-es
+        return substituir_filhos(CTeDocumentoTransportado, rec.documentos, cte=cte_doc)
     except Exception as e:
         print(f"ERRO ao processar documentos transportados para CT-e {cte_doc.chave}: {e}")
         raise
 
 @transaction.atomic
-def parse_cte_seguro(cte_doc, infcte):
-    """Parseia o bloco <seg>."""
-    # O bloco pode estar dentro de <infCteNorm>
-    seg_list = safe_get(infcte, 'infCteNorm.seg', [])
-    if not isinstance(seg_list, list): seg_list = [seg_list]
-
-    # Se não tiver seguro, limpa os anteriores
-    if not seg_list or all(not isinstance(seg, dict) for seg in seg_list):
-        CTeSeguro.objects.filter(cte=cte_doc).delete()
-        return 0
-
+def parse_cte_seguro(cte_doc, rec):
+    """Salva os seguros <seg>."""
     try:
-        CTeSeguro.objects.filter(cte=cte_doc).delete() # Limpa anteriores
-        count = 0
-        for seg in seg_list:
-             if isinstance(seg, dict):
-                # Garantir valores obrigatórios
-                responsavel = safe_get(seg, 'respSeg')
-                if not responsavel:
-                    responsavel = '5'  # 5 = Emitente CT-e (valor padrão)
-                    print(f"WARN: Responsável pelo seguro não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-                nome_seguradora = safe_get(seg, 'xSeg')
-                if not nome_seguradora:
-                    nome_seguradora = "SEGURADORA NÃO INFORMADA"
-                    print(f"WARN: Nome da seguradora não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-                numero_apolice = safe_get(seg, 'nApol')
-                if not numero_apolice:
-                    numero_apolice = "APÓLICE NÃO INFORMADA"
-                    print(f"WARN: Número da apólice não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-                # Valor da carga é obrigatório
-                valor_carga = to_decimal(safe_get(seg, 'vCarga'))
-                if valor_carga is None or valor_carga == 0:
-                    valor_carga = Decimal('0.01')  # Valor mínimo
-                    print(f"WARN: Valor da carga no seguro não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-                CTeSeguro.objects.create(
-                    cte=cte_doc,
-                    responsavel=responsavel,
-                    nome_seguradora=nome_seguradora,
-                    numero_apolice=numero_apolice,
-                    numero_averbacao=safe_get(seg, 'nAver'),
-                    valor_carga_averbada=valor_carga,
-                )
-                count += 1
-        return count
+        return substituir_filhos(CTeSeguro, rec.seguros, cte=cte_doc)
     except Exception as e:
         print(f"ERRO ao processar seguro para CT-e {cte_doc.chave}: {e}")
         raise
 
 @transaction.atomic
-def parse_cte_modal_rodoviario(cte_doc, infcte):
-    """Parseia o bloco <infModal versaoModal='x.xx'><rodo>."""
-    # O bloco pode estar dentro de <infCteNorm> etc.
-    inf_modal = safe_get(infcte, 'infCteNorm.infModal') or safe_get(infcte, 'infModal')
-    if not inf_modal or safe_get(inf_modal, '@versaoModal') is None:
+def parse_cte_modal_rodoviario(cte_doc, rec):
+    """Salva CTeModalRodoviario com veículos e motoristas."""
+    if rec.modal is None:
         CTeModalRodoviario.objects.filter(cte=cte_doc).delete() # Limpa anterior
         return None
 
-    rodo = safe_get(inf_modal, 'rodo')
-    if not rodo:
-        CTeModalRodoviario.objects.filter(cte=cte_doc).delete() # Limpa anterior
-        return None # Não é modal rodoviário
-
     try:
-        # Garantir RNTRC obrigatório
-        rntrc = safe_get(rodo, 'RNTRC')
-        if not rntrc:
-            rntrc = "00000000"  # Valor padrão
-            print(f"WARN: RNTRC não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-        modal_data = {
-            'rntrc': rntrc,
-            'data_prevista_entrega': parse_date(safe_get(rodo, 'dPrev')),
-            'lotacao': to_boolean(safe_get(rodo, 'lota', '0')), # Indicador de Lotação
-            # <occ> (Ordem de Coleta) omitido
-        }
-        modal_data_cleaned = {k: v for k, v in modal_data.items() if v is not None}
         modal, created = CTeModalRodoviario.objects.update_or_create(
             cte=cte_doc,
-            defaults=modal_data_cleaned
+            defaults=rec.modal
         )
 
-        # --- Veículos <veic> ---
-        veic_list = safe_get(rodo, 'veic', [])
-        if not isinstance(veic_list, list): veic_list = [veic_list]
-        CTeVeiculoRodoviario.objects.filter(modal=modal).delete() # Limpa anteriores
-        for veic in veic_list:
-             if isinstance(veic, dict):
-                prop = safe_get(veic, 'prop') # Dados do proprietário (opcional)
-                placa = safe_get(veic, 'placa')
-                
-                if placa:  # Garante que pelo menos placa exista
-                    veic_data = {
-                        'placa': placa,
-                        'renavam': safe_get(veic, 'RENAVAM'),
-                        'tara': to_int(safe_get(veic, 'tara')) or 0,  # Garante valor default
-                        'cap_kg': to_int(safe_get(veic, 'capKG')),
-                        'cap_m3': to_int(safe_get(veic, 'capM3')),
-                        'tipo_proprietario': safe_get(veic, 'tpProp'),
-                        'tipo_veiculo': safe_get(veic, 'tpVeic'),
-                        'tipo_rodado': safe_get(veic, 'tpRod'),
-                        'tipo_carroceria': safe_get(veic, 'tpCar'),
-                        'uf_licenciamento': safe_get(veic, 'UF'),
-                        # Proprietário (se houver dentro de <veic>)
-                        'prop_cnpj': safe_get(prop, 'CNPJ') if prop else None,
-                        'prop_cpf': safe_get(prop, 'CPF') if prop else None,
-                        'prop_rntrc': safe_get(prop, 'RNTRC') if prop else None,
-                        'prop_razao_social': safe_get(prop, 'xNome') if prop else None,
-                        'prop_ie': safe_get(prop, 'IE') if prop else None,
-                        'prop_uf': safe_get(prop, 'UF') if prop else None,
-                    }
-                    veic_data_cleaned = {k: v for k, v in veic_data.items() if v is not None}
-                    CTeVeiculoRodoviario.objects.create(modal=modal, **veic_data_cleaned)
-
-        # --- Motoristas <moto> ---
-        moto_list = safe_get(rodo, 'moto', [])
-        if not isinstance(moto_list, list): moto_list = [moto_list]
-        CTeMotorista.objects.filter(modal=modal).delete() # Limpa anteriores
-        for moto in moto_list:
-            if isinstance(moto, dict):
-                nome = safe_get(moto, 'xNome')
-                cpf = safe_get(moto, 'CPF')
-                
-                if nome and cpf:  # Garante que nome e CPF existam
-                    CTeMotorista.objects.create(
-                        modal=modal,
-                        nome=nome,
-                        cpf=cpf
-                    )
+        # --- Veículos <veic> e Motoristas <moto> ---
+        substituir_filhos(CTeVeiculoRodoviario, rec.veiculos, modal=modal)
+        substituir_filhos(CTeMotorista, rec.motoristas, modal=modal)
 
         return modal
     except Exception as e:
@@ -815,74 +999,25 @@ def parse_cte_modal_rodoviario(cte_doc, infcte):
         raise
 
 @transaction.atomic
-def parse_cte_autorizados_xml(cte_doc, infcte):
-    """Parseia o bloco <autXML>."""
-    aut_list = safe_get(infcte, 'autXML', [])
-    if not isinstance(aut_list, list): aut_list = [aut_list]
-
+def parse_cte_autorizados_xml(cte_doc, rec):
+    """Salva os autorizados <autXML>."""
     try:
-        CTeAutXML.objects.filter(cte=cte_doc).delete() # Limpa anteriores
-        count = 0
-        for aut in aut_list:
-             if isinstance(aut, dict):
-                cnpj = safe_get(aut, 'CNPJ')
-                cpf = safe_get(aut, 'CPF')
-                # Pelo menos um identificador é obrigatório
-                if cnpj or cpf:
-                    CTeAutXML.objects.create(
-                        cte=cte_doc,
-                        cnpj=cnpj,
-                        cpf=cpf
-                    )
-                    count += 1
-        return count
+        return substituir_filhos(CTeAutXML, rec.autorizados, cte=cte_doc)
     except Exception as e:
         print(f"ERRO ao processar autorizados XML para CT-e {cte_doc.chave}: {e}")
         raise
 
 @transaction.atomic
-def parse_cte_responsavel_tecnico(cte_doc, infcte):
-    """Parseia o bloco <infRespTec>."""
-    resp_tec = safe_get(infcte, 'infRespTec')
-    if not resp_tec:
+def parse_cte_responsavel_tecnico(cte_doc, rec):
+    """Salva CTeResponsavelTecnico."""
+    if rec.responsavel_tecnico is None:
         CTeResponsavelTecnico.objects.filter(cte=cte_doc).delete() # Limpa anterior
         return None
 
     try:
-        # Garantir campos obrigatórios
-        cnpj = safe_get(resp_tec, 'CNPJ')
-        if not cnpj:
-            cnpj = "00000000000000"  # Valor padrão
-            print(f"WARN: CNPJ do responsável técnico não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-        contato = safe_get(resp_tec, 'xContato')
-        if not contato:
-            contato = "CONTATO NÃO INFORMADO"
-            print(f"WARN: Nome do contato técnico não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-        email = safe_get(resp_tec, 'email')
-        if not email:
-            email = "email@nao.informado"
-            print(f"WARN: Email do contato técnico não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-        telefone = safe_get(resp_tec, 'fone')
-        if not telefone:
-            telefone = "0000000000"
-            print(f"WARN: Telefone do contato técnico não informado para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-        resp_data = {
-            'cnpj': cnpj,
-            'contato': contato,
-            'email': email,
-            'telefone': telefone,
-            'id_csr': safe_get(resp_tec, 'idCSRT'),
-            'hash_csr': safe_get(resp_tec, 'hashCSRT'),
-        }
-        resp_data_cleaned = {k: v for k, v in resp_data.items() if v is not None}
-
         obj, created = CTeResponsavelTecnico.objects.update_or_create(
             cte=cte_doc,
-            defaults=resp_data_cleaned
+            defaults=rec.responsavel_tecnico
         )
         return obj
     except Exception as e:
@@ -890,55 +1025,22 @@ def parse_cte_responsavel_tecnico(cte_doc, infcte):
         raise
 
 @transaction.atomic
-def parse_cte_protocolo(cte_doc, prot_cte):
-    """Parseia o bloco <protCTe> que vem dentro de <procCTe> ou <cteProc>."""
-    if not prot_cte or not isinstance(prot_cte, dict):
+def parse_cte_protocolo(cte_doc, rec):
+    """Salva o protocolo <protCTe> que vem dentro de <procCTe> ou <cteProc>."""
+    if rec.protocolo is None:
         # Não deleta, pois pode já ter sido salvo antes sem protocolo
-        # CTeProtocoloAutorizacao.objects.filter(cte=cte_doc).delete()
-        return None
-
-    inf_prot = safe_get(prot_cte, 'infProt')
-    if not inf_prot:
-        # CTeProtocoloAutorizacao.objects.filter(cte=cte_doc).delete()
         return None
 
     # Verifica se a chave do protocolo bate com a chave do documento
-    chave_protocolo = safe_get(inf_prot, 'chCTe')
-    if chave_protocolo and chave_protocolo != cte_doc.chave:
-        print(f"ERROR: Chave no protocolo ({chave_protocolo}) diferente da chave do CT-e ({cte_doc.chave})")
-        # Decidir como tratar: ignorar protocolo, logar erro, etc.
+    if rec.chave_protocolo and rec.chave_protocolo != cte_doc.chave:
+        print(f"ERROR: Chave no protocolo ({rec.chave_protocolo}) diferente da chave do CT-e ({cte_doc.chave})")
         return None # Ignora protocolo inconsistente
 
     try:
-        # Garantir campos obrigatórios
-        codigo_status = to_int(safe_get(inf_prot, 'cStat'))
-        if codigo_status is None:
-            codigo_status = 0  # Valor padrão
-            print(f"WARN: Código de status não informado no protocolo para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-        motivo_status = safe_get(inf_prot, 'xMotivo')
-        if not motivo_status:
-            motivo_status = "MOTIVO NÃO INFORMADO"
-            print(f"WARN: Motivo do status não informado no protocolo para CT-e {cte_doc.chave}. Usando valor padrão.")
-
-        prot_data = {
-            'ambiente': to_int(safe_get(inf_prot, 'tpAmb')) or 2,  # 2 = Homologação padrão
-            'versao_aplic': safe_get(inf_prot, 'verAplic') or "VERSÃO NÃO INFORMADA",
-            'data_recebimento': parse_datetime(safe_get(inf_prot, 'dhRecbto')) or datetime.now(),
-            'numero_protocolo': safe_get(inf_prot, 'nProt') or "PROTOCOLO NÃO INFORMADO",
-            'digest_value': safe_get(inf_prot, 'digVal'),
-            'codigo_status': codigo_status,
-            'motivo_status': motivo_status,
-        }
-
-        prot_data_cleaned = {k: v for k, v in prot_data.items() if v is not None}
-
         # Protocolo deve ser único por CT-e, mas número de protocolo é globalmente único
         obj, created = CTeProtocoloAutorizacao.objects.update_or_create(
             cte=cte_doc,
-            # Usar numero_protocolo como chave de busca alternativa se necessário garantir unicidade
-            # numero_protocolo=prot_data_cleaned.get('numero_protocolo'),
-            defaults=prot_data_cleaned
+            defaults=rec.protocolo
         )
         return obj
     except Exception as e:
@@ -947,28 +1049,21 @@ def parse_cte_protocolo(cte_doc, prot_cte):
         return None
 
 @transaction.atomic
-def parse_cte_suplementar(cte_doc, inf_supl):
-    """Parseia o bloco <infCTeSupl>."""
-    if not inf_supl:
-        CTeSuplementar.objects.filter(cte=cte_doc).delete() # Limpa anterior
+def parse_cte_suplementar(cte_doc, rec):
+    """Salva o bloco <infCTeSupl>."""
+    if rec.suplementar is None:
         return None
 
     try:
         # Garantir URL QR Code obrigatória
-        qr_code_url = safe_get(inf_supl, 'qrCodCTe')
-        if not qr_code_url:
+        if not rec.suplementar.get('qr_code_url'):
             print(f"WARN: QR Code não informado para CT-e {cte_doc.chave}. Ignorando bloco suplementar.")
             CTeSuplementar.objects.filter(cte=cte_doc).delete()
             return None
 
-        supl_data = {
-            'qr_code_url': qr_code_url,
-        }
-        supl_data_cleaned = {k: v for k, v in supl_data.items() if v is not None}
-
         obj, created = CTeSuplementar.objects.update_or_create(
             cte=cte_doc,
-            defaults=supl_data_cleaned
+            defaults=rec.suplementar
         )
         return obj
     except Exception as e:
@@ -978,12 +1073,19 @@ def parse_cte_suplementar(cte_doc, inf_supl):
 
 # --- Main Parser Orchestrator ---
 
-def parse_cte_completo(cte_doc):
+def parse_cte_completo(cte_doc, indice=None):
     """
     Função principal para parsear todo o XML do CTeDocumento.
     Assume que cte_doc.xml_original contém o texto do XML.
+    O XML é lido uma única vez por extrair_cte(); aqui apenas persistimos o registro.
+    indice: índice de indexar_cte() já montado para este XML (evita uma nova leitura).
     Retorna True se o processamento foi bem-sucedido (mesmo que parcial), False se houve erro crítico.
     """
+    # A contribuição do CT-e nos fatos diários dos painéis é ajustada pela diferença antes/depois
+    with registrar_alteracao_cte(cte_doc.chave):
+        return _parse_cte_completo(cte_doc, indice)
+
+def _parse_cte_completo(cte_doc, indice):
     if not cte_doc.xml_original:
         print(f"ERROR: CT-e {cte_doc.chave} não possui XML original para processar.")
         cte_doc.processado = False
@@ -991,14 +1093,11 @@ def parse_cte_completo(cte_doc):
         return False
 
     try:
-        xml_dict = xmltodict.parse(cte_doc.xml_original)
-        infcte, versao_proc = get_cte_infcte(xml_dict) # Pode levantar ValueError
-        prot_cte = get_cte_protocolo(xml_dict) # Pode ser None
-        inf_supl = get_cte_suplementar(xml_dict) # Pode ser None
+        rec = extrair_cte(cte_doc.xml_original, cte_doc.chave, indice=indice) # Pode levantar ValueError
 
         # Atualiza a versão no documento principal se não foi pega na view
         if not cte_doc.versao or cte_doc.versao == 'N/A':
-            cte_doc.versao = versao_proc or infcte.get('@versao', '4.00') # Pega do proc ou do infCte
+            cte_doc.versao = rec.versao
 
     except Exception as e:
         print(f"ERROR: Falha ao parsear XML base ou encontrar <infCte> para CT-e {cte_doc.chave}: {e}")
@@ -1009,78 +1108,49 @@ def parse_cte_completo(cte_doc):
     try:
         # --- Processamento dentro de uma única transação ---
         with transaction.atomic():
-            # Parsear seções principais - na ordem correta para evitar problemas de referência
-            identificacao = parse_cte_identificacao(cte_doc, infcte)
-            parse_cte_complemento(cte_doc, infcte)
-            parse_entidade(cte_doc, infcte, 'emit', CTeEmitente)
-            parse_entidade(cte_doc, infcte, 'rem', CTeRemetente)
-            parse_entidade(cte_doc, infcte, 'dest', CTEDestinatario)
-           # Parsear opcionais
-            parse_entidade(cte_doc, infcte, 'exped', CTeExpedidor)
-            parse_entidade(cte_doc, infcte, 'receb', CTeRecebedor)
+            # Persistir seções principais - na ordem correta para evitar problemas de referência
+            parse_cte_identificacao(cte_doc, rec)
+            parse_cte_complemento(cte_doc, rec)
+            parse_entidade(cte_doc, rec, 'emit', CTeEmitente)
+            parse_entidade(cte_doc, rec, 'rem', CTeRemetente)
+            parse_entidade(cte_doc, rec, 'dest', CTEDestinatario)
+            # Opcionais
+            parse_entidade(cte_doc, rec, 'exped', CTeExpedidor)
+            parse_entidade(cte_doc, rec, 'receb', CTeRecebedor)
             # Valores e Impostos
-            prestacao, tributos = parse_cte_valores(cte_doc, infcte)
+            parse_cte_valores(cte_doc, rec)
             # Carga
-            parse_cte_carga(cte_doc, infcte)
+            parse_cte_carga(cte_doc, rec)
             # Documentos Transportados
-            parse_cte_documentos(cte_doc, infcte)
+            parse_cte_documentos(cte_doc, rec)
             # Seguro
-            parse_cte_seguro(cte_doc, infcte)
+            parse_cte_seguro(cte_doc, rec)
             # Modal Rodoviário
-            parse_cte_modal_rodoviario(cte_doc, infcte)
+            parse_cte_modal_rodoviario(cte_doc, rec)
             # Outros
-            parse_cte_autorizados_xml(cte_doc, infcte)
-            parse_cte_responsavel_tecnico(cte_doc, infcte)
+            parse_cte_autorizados_xml(cte_doc, rec)
+            parse_cte_responsavel_tecnico(cte_doc, rec)
 
-            # --- Parsear Protocolo e Suplementar (fora do infCte) ---
-            if prot_cte:
-                 parse_cte_protocolo(cte_doc, prot_cte)
-            if inf_supl:
-                 parse_cte_suplementar(cte_doc, inf_supl)
+            # --- Protocolo e Suplementar (fora do infCte) ---
+            parse_cte_protocolo(cte_doc, rec)
+            parse_cte_suplementar(cte_doc, rec)
 
             # --- Atualizar o CTeDocumento ---
-            # Atualiza a modalidade (CIF/FOB) - Lógica de exemplo:
-            # Determina a modalidade a partir do XML ou dados extraídos
-            modalidade_frete = None
-            if identificacao and identificacao.toma is not None:
-                 # Lógica baseada no tomador ou documentos transportados
-                 if identificacao.toma == 0: # Remetente paga = CIF (geralmente)
-                     modalidade_frete = 'CIF'
-                 elif identificacao.toma == 3: # Destinatário paga = FOB (geralmente)
-                      modalidade_frete = 'FOB'
-                 else:
-                      # Tentar detectar de outras formas
-                      # Olhar em <vPrest><Comp> por componentes nomeados como CIF/FOB
-                      if prestacao:
-                          comp_values = CTeComponenteValor.objects.filter(prestacao=prestacao)
-                          for comp in comp_values:
-                              if 'CIF' in comp.nome.upper():
-                                  modalidade_frete = 'CIF'
-                                  break
-                              elif 'FOB' in comp.nome.upper():
-                                  modalidade_frete = 'FOB'
-                                  break
-            
-            # Tentar também por observações contribuinte
-            if not modalidade_frete and hasattr(cte_doc, 'complemento') and cte_doc.complemento:
-                obs_list = CTeObservacaoContribuinte.objects.filter(complemento=cte_doc.complemento)
-                for obs in obs_list:
-                    if 'CIF' in obs.campo.upper() or 'CIF' in obs.texto.upper():
-                        modalidade_frete = 'CIF'
-                        break
-                    elif 'FOB' in obs.campo.upper() or 'FOB' in obs.texto.upper():
-                        modalidade_frete = 'FOB'
-                        break
-            
-            # Valor padrão se não conseguiu detectar
+            modalidade_frete = determinar_modalidade(rec)
             if not modalidade_frete:
                 modalidade_frete = 'CIF'  # Valor padrão se não identificar
                 print(f"INFO: Não foi possível determinar modalidade CIF/FOB para CT-e {cte_doc.chave}. Usando valor padrão CIF.")
 
             cte_doc.modalidade = modalidade_frete
             cte_doc.processado = True # Marcar como processado se chegou até aqui
+            atualizar_status_cte(cte_doc, salvar=False)
             cte_doc.save() # Salva CTeDocumento com status e modalidade
 
+            # MDF-e processados antes deste CT-e (ex: lotes em segundo plano) ficam sem o vínculo
+            MDFeDocumentosVinculados.objects.filter(
+                chave_documento=cte_doc.chave, cte_relacionado__isnull=True
+            ).update(cte_relacionado=cte_doc)
+
         print(f"INFO: CT-e {cte_doc.chave} processado com sucesso.")
         return True # Sucesso
 
@@ -1088,14 +1158,12 @@ def parse_cte_completo(cte_doc):
         # Log detalhado do erro
         print(f"ERROR: Falha ao processar dados detalhados do CT-e {cte_doc.chave}. Erro: {e}")
         print(traceback.format_exc())
-        # A transação será revertida automaticamente pelo @transaction.atomic
+        # A transação será revertida automaticamente pelo transaction.atomic
         # Garante que o status processado continue False (ou volte a False se já tinha sido salvo)
-        # Tenta salvar o status de erro mesmo com o rollback
         try:
             cte_doc_error = CTeDocumento.objects.get(pk=cte_doc.pk)
             cte_doc_error.processado = False
             cte_doc_error.save(update_fields=['processado'])
         except Exception as save_err:
              print(f"ERROR: Falha ao salvar status de erro para CT-e {cte_doc.chave}: {save_err}")
-
-        return False # Indica falha no processamento
\ No newline at end of file
+        return False
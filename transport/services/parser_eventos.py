@@ -41,6 +41,9 @@ from transport.models import (
     CTeDocumento, CTeCancelamento,
     MDFeDocumento, MDFeCancelamento, MDFeCondutor, MDFeCancelamentoEncerramento
 )
+from .fatos_cte import registrar_alteracao_cte
+from .cache_paineis import invalidar_paineis
+from .status_documento import atualizar_status_cte, atualizar_status_mdfe
 
 # === Constantes de Tipos de Evento (Manter como referência) ===
 EVENTO_CANCELAMENTO = '110111'
@@ -137,7 +140,7 @@ def _get_retorno_evento_info(ret_evento_raiz):
 # === Handlers Específicos por Tipo de Evento ===
 
 @transaction.atomic
-def _handle_cancelamento_cte(cte_doc, evento_info, ret_evento_info, xml_evento_original):
+def _handle_cancelamento_cte(cte_doc, evento_info, ret_evento_info, xml_evento_original, doc_evento=None):
     """Processa um evento de Cancelamento de CT-e (110111)."""
     det_evento = safe_get(evento_info, 'det_evento')
     if not det_evento:
@@ -183,7 +186,7 @@ def _handle_cancelamento_cte(cte_doc, evento_info, ret_evento_info, xml_evento_o
         # Para o caso de "evento sem retorno" (o arquivo é o próprio procEventoCTe com o retEvento dentro):
         # Tenta parsear o xml_evento_original para ver se ele contém o retEvento.
         try:
-            doc_evento_completo = xmltodict.parse(xml_evento_original)
+            doc_evento_completo = doc_evento if doc_evento is not None else xmltodict.parse(xml_evento_original)
             # Verifica se existe um 'retEventoCTe' dentro de 'procEventoCTe'
             ret_evento_raiz_no_proc = None
             if 'procEventoCTe' in doc_evento_completo and 'retEventoCTe' in doc_evento_completo['procEventoCTe']:
@@ -239,10 +242,13 @@ def _handle_cancelamento_cte(cte_doc, evento_info, ret_evento_info, xml_evento_o
     }
     evento_data_cleaned = {k: v for k, v in evento_data.items() if v is not None}
 
-    cancelamento, created = CTeCancelamento.objects.update_or_create(
-        cte=cte_doc,
-        defaults=evento_data_cleaned
-    )
+    # O CT-e passa para a situação 'cancelado' nos fatos diários dos painéis
+    with registrar_alteracao_cte(cte_doc.chave):
+        cancelamento, created = CTeCancelamento.objects.update_or_create(
+            cte=cte_doc,
+            defaults=evento_data_cleaned
+        )
+        atualizar_status_cte(cte_doc)
     print(f"INFO: Evento de Cancelamento registrado com sucesso para CT-e {cte_doc.chave} (Protocolo Evento: {retorno_data.get('n_prot_retorno')}).")
     return cancelamento
 
@@ -292,7 +298,7 @@ def _handle_cce_cte(cte_doc, evento_info, ret_evento_info, xml_evento_original):
 
 
 @transaction.atomic
-def _handle_cancelamento_mdfe(mdfe_doc, evento_info, ret_evento_info, xml_evento_original):
+def _handle_cancelamento_mdfe(mdfe_doc, evento_info, ret_evento_info, xml_evento_original, doc_evento=None):
     """Processa um evento de Cancelamento de MDF-e (110111)."""
     det_evento = safe_get(evento_info, 'det_evento')
     if not det_evento:
@@ -325,7 +331,7 @@ def _handle_cancelamento_mdfe(mdfe_doc, evento_info, ret_evento_info, xml_evento
             return None
     else: # Sem XML de retorno explícito, tenta encontrar no próprio XML do evento
         try:
-            doc_evento_completo = xmltodict.parse(xml_evento_original)
+            doc_evento_completo = doc_evento if doc_evento is not None else xmltodict.parse(xml_evento_original)
             ret_evento_raiz_no_proc = None
             if 'procEventoMDFe' in doc_evento_completo and 'retEventoMDFe' in doc_evento_completo['procEventoMDFe']:
                 ret_evento_raiz_no_proc = doc_evento_completo['procEventoMDFe']['retEventoMDFe']
@@ -378,6 +384,7 @@ def _handle_cancelamento_mdfe(mdfe_doc, evento_info, ret_evento_info, xml_evento
         mdfe=mdfe_doc,
         defaults=evento_data_cleaned
     )
+    atualizar_status_mdfe(mdfe_doc)
     print(f"INFO: Evento de Cancelamento registrado com sucesso para MDF-e {mdfe_doc.chave} (Protocolo Evento: {retorno_data.get('n_prot_retorno')}).")
     return cancelamento
 
@@ -423,6 +430,7 @@ def _handle_encerramento_mdfe(mdfe_doc, evento_info, ret_evento_info, xml_evento
             'encerrado', 'data_encerramento', 'municipio_encerramento_cod',
             'uf_encerramento', 'protocolo_encerramento'
         ])
+        atualizar_status_mdfe(mdfe_doc)
         print(f"INFO: Evento de Encerramento (Data: {dt_enc}, Mun: {c_mun_enc}/{uf_enc}, Prot: {protocolo_encerramento}) registrado com sucesso para MDF-e {mdfe_doc.chave}.")
         return True # Indica sucesso na atualização
     except Exception as e:
@@ -553,6 +561,7 @@ def _handle_cancel_encerramento_mdfe(mdfe_doc, evento_info, ret_evento_info, xml
         'encerrado', 'data_encerramento', 'municipio_encerramento_cod',
         'uf_encerramento', 'protocolo_encerramento'
     ])
+    atualizar_status_mdfe(mdfe_doc)
     
     print(f"INFO: Evento de Cancelamento de Encerramento registrado com sucesso para MDF-e {mdfe_doc.chave} (Protocolo: {retorno_data.get('n_prot_retorno')}).")
     return cancelamento_enc
@@ -560,13 +569,15 @@ def _handle_cancel_encerramento_mdfe(mdfe_doc, evento_info, ret_evento_info, xml
 
 # === Função Principal de Parsing de Eventos ===
 
-def parse_evento(xml_evento_text, xml_retorno_text=None):
+def parse_evento(xml_evento_text, xml_retorno_text=None, doc_evento=None, doc_retorno=None):
     """
     Função principal para parsear um XML de evento e seu possível retorno.
 
     Args:
         xml_evento_text (str): Conteúdo do XML do evento (ex: <eventoCTe>, <procEventoCTe>).
         xml_retorno_text (str, optional): Conteúdo do XML de retorno do evento (ex: <retEventoCTe>).
+        doc_evento (dict, optional): xmltodict.parse() de xml_evento_text, se já disponível.
+        doc_retorno (dict, optional): xmltodict.parse() de xml_retorno_text, se já disponível.
 
     Returns:
         object: O objeto do modelo criado/atualizado ou True/None.
@@ -578,7 +589,8 @@ def parse_evento(xml_evento_text, xml_retorno_text=None):
 
     try:
         # Parseia XML do evento
-        doc_evento = xmltodict.parse(xml_evento_text)
+        if doc_evento is None:
+            doc_evento = xmltodict.parse(xml_evento_text)
         evento_raiz = _get_raiz_evento(doc_evento) # Pode levantar ValueError
         evento_info = _get_evento_info(evento_raiz) # Pode levantar ValueError
 
@@ -586,7 +598,8 @@ def parse_evento(xml_evento_text, xml_retorno_text=None):
         ret_evento_info = None
         if xml_retorno_text:
             try:
-                doc_retorno = xmltodict.parse(xml_retorno_text)
+                if doc_retorno is None:
+                    doc_retorno = xmltodict.parse(xml_retorno_text)
                 ret_evento_raiz = _get_raiz_retorno_evento(doc_retorno)
                 if ret_evento_raiz:
                      ret_evento_info = _get_retorno_evento_info(ret_evento_raiz)
@@ -616,12 +629,15 @@ def parse_evento(xml_evento_text, xml_retorno_text=None):
                 # Erro Crítico: O documento ao qual o evento se refere não existe no banco
                 raise ValueError(f"Documento principal (CT-e/MDF-e) com chave {chave_doc} não encontrado no banco de dados.")
 
+        # Eventos alteram a situação exibida nos painéis (cache invalidado após o commit)
+        invalidar_paineis('cte' if tipo_doc == 'CTE' else 'mdfe')
+
         # --- Chama o handler apropriado ---
         tp_evento = evento_info.get('tp_evento')
 
         if tipo_doc == 'CTE':
             if tp_evento == EVENTO_CANCELAMENTO:
-                return _handle_cancelamento_cte(doc_principal, evento_info, ret_evento_info, xml_evento_text)
+                return _handle_cancelamento_cte(doc_principal, evento_info, ret_evento_info, xml_evento_text, doc_evento=doc_evento)
             elif tp_evento == EVENTO_CARTA_CORRECAO:
                 return _handle_cce_cte(doc_principal, evento_info, ret_evento_info, xml_evento_text)
             # Adicionar handlers para outros eventos CT-e (EPEC, etc.)
@@ -634,7 +650,7 @@ def parse_evento(xml_evento_text, xml_retorno_text=None):
 
         elif tipo_doc == 'MDFE':
             if tp_evento == EVENTO_CANCELAMENTO:
-                return _handle_cancelamento_mdfe(doc_principal, evento_info, ret_evento_info, xml_evento_text)
+                return _handle_cancelamento_mdfe(doc_principal, evento_info, ret_evento_info, xml_evento_text, doc_evento=doc_evento)
             elif tp_evento == EVENTO_MDFE_ENCERRAMENTO:
                 return _handle_encerramento_mdfe(doc_principal, evento_info, ret_evento_info, xml_evento_text)
             elif tp_evento == EVENTO_MDFE_INC_CONDUTOR:
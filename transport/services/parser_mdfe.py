@@ -133,6 +133,10 @@ from transport.models import (
     MDFeResponsavelTecnico, MDFeProtocoloAutorizacao, MDFeSuplementar,
     MDFeCancelamento
 )
+# Persistência em lote das tabelas filhas (um DELETE + bulk_create por tabela)
+from .parser_cte import BULK_BATCH_SIZE, substituir_filhos
+from .cache_paineis import invalidar_paineis
+from .status_documento import atualizar_status_mdfe
 
 # --- Helper Functions Específicas (se necessário) ---
 
@@ -327,22 +331,23 @@ def parse_mdfe_modal_rodoviario(mdfe_doc, infmdfe):
         # --- Condutores <condutor> associados ao veículo de tração ---
         # Salva no MDFeCondutor principal, ligado ao MDFeDocumento
         # Limpa todos os condutores ANTES de processar para evitar duplicação se vierem em eventos também
-        MDFeCondutor.objects.filter(mdfe=mdfe_doc).delete()
+        condutores = {} # CPF -> nome (evita duplicar se o CPF se repetir no XML)
         for condutor in condutor_list_tracao:
             if isinstance(condutor, dict):
                 cpf_condutor = safe_get(condutor, 'CPF')
                 nome_condutor = safe_get(condutor, 'xNome')
                 if cpf_condutor and nome_condutor:
-                    MDFeCondutor.objects.update_or_create( # Evita duplicar se CPF já existe
-                        mdfe=mdfe_doc,
-                        cpf=cpf_condutor,
-                        defaults={'nome': nome_condutor}
-                    )
+                    condutores[cpf_condutor] = nome_condutor
+        substituir_filhos(
+            MDFeCondutor,
+            [{'cpf': cpf, 'nome': nome} for cpf, nome in condutores.items()],
+            mdfe=mdfe_doc
+        )
 
     # --- Veículos Reboque <veicReboque> (ForeignKey com Modal) ---
     reboque_list = safe_get(rodo, 'veicReboque', [])
     if not isinstance(reboque_list, list): reboque_list = [reboque_list]
-    MDFeVeiculoReboque.objects.filter(modal=modal).delete() # Limpa anteriores
+    reboques = []
     for reboque_dict in reboque_list:
         if isinstance(reboque_dict, dict):
             prop_reboque = safe_get(reboque_dict, 'prop') # Opcional
@@ -363,26 +368,26 @@ def parse_mdfe_modal_rodoviario(mdfe_doc, infmdfe):
                 'prop_uf': safe_get(prop_reboque, 'UF') if prop_reboque else None,
                 'prop_tp': safe_get(prop_reboque, 'tpProp') if prop_reboque else None,
             }
-            reboque_data_cleaned = {k: v for k, v in reboque_data.items() if v is not None}
-            MDFeVeiculoReboque.objects.create(modal=modal, **reboque_data_cleaned)
+            reboques.append({k: v for k, v in reboque_data.items() if v is not None})
+    substituir_filhos(MDFeVeiculoReboque, reboques, modal=modal)
 
     # --- CIOT <infANTT><infCIOT> ---
     ciot_list = safe_get(inf_antt, 'infCIOT', []) # Pega de dentro de infANTT
     if not isinstance(ciot_list, list): ciot_list = [ciot_list]
-    MDFeCIOT.objects.filter(modal=modal).delete() # Limpa anteriores
-    for ciot_dict in ciot_list:
-        if isinstance(ciot_dict, dict):
-            MDFeCIOT.objects.create(
-                modal=modal,
-                ciot=safe_get(ciot_dict, 'CIOT'),
-                cnpj_responsavel=safe_get(ciot_dict, 'CNPJ'), # CNPJ/CPF do responsável pelo CIOT
-                cpf_responsavel=safe_get(ciot_dict, 'CPF')
-            )
+    ciots = [
+        {
+            'ciot': safe_get(ciot_dict, 'CIOT'),
+            'cnpj_responsavel': safe_get(ciot_dict, 'CNPJ'), # CNPJ/CPF do responsável pelo CIOT
+            'cpf_responsavel': safe_get(ciot_dict, 'CPF'),
+        }
+        for ciot_dict in ciot_list if isinstance(ciot_dict, dict)
+    ]
+    substituir_filhos(MDFeCIOT, ciots, modal=modal)
 
     # --- Vale Pedágio <infANTT><valePed> ---
     vale_list = safe_get(inf_antt, 'valePed', []) # Pega de dentro de infANTT
     if not isinstance(vale_list, list): vale_list = [vale_list]
-    MDFeValePedagio.objects.filter(modal=modal).delete() # Limpa anteriores
+    vales = []
     for vale_dict in vale_list:
         if isinstance(vale_dict, dict):
             # <disp> é uma lista dentro de <valePed>
@@ -390,154 +395,142 @@ def parse_mdfe_modal_rodoviario(mdfe_doc, infmdfe):
             if not isinstance(disp_list, list): disp_list = [disp_list]
             for disp in disp_list:
                  if isinstance(disp, dict):
-                     MDFeValePedagio.objects.create(
-                         modal=modal,
-                         cnpj_fornecedor=safe_get(disp, 'CNPJForn'),
-                         cnpj_pagador=safe_get(disp, 'CNPJPg'),
-                         cpf_pagador=safe_get(disp, 'CPFPg'),
-                         numero_compra=safe_get(disp, 'nCompra'),
-                         valor_vale=to_decimal(safe_get(disp, 'vValePed')),
+                     vales.append({
+                         'cnpj_fornecedor': safe_get(disp, 'CNPJForn'),
+                         'cnpj_pagador': safe_get(disp, 'CNPJPg'),
+                         'cpf_pagador': safe_get(disp, 'CPFPg'),
+                         'numero_compra': safe_get(disp, 'nCompra'),
+                         'valor_vale': to_decimal(safe_get(disp, 'vValePed')),
                          # tpValePed não mapeado
-                     )
+                     })
+    substituir_filhos(MDFeValePedagio, vales, modal=modal)
 
     # --- Contratantes <infANTT><infContratante> ---
     contratante_list = safe_get(inf_antt, 'infContratante', []) # Pega de dentro de infANTT
     if not isinstance(contratante_list, list): contratante_list = [contratante_list]
-    MDFeContratante.objects.filter(modal=modal).delete() # Limpa anteriores
-    for cont_dict in contratante_list:
-        if isinstance(cont_dict, dict):
-            MDFeContratante.objects.create(
-                modal=modal,
-                cnpj=safe_get(cont_dict, 'CNPJ'),
-                cpf=safe_get(cont_dict, 'CPF')
-            )
+    contratantes = [
+        {'cnpj': safe_get(cont_dict, 'CNPJ'), 'cpf': safe_get(cont_dict, 'CPF')}
+        for cont_dict in contratante_list if isinstance(cont_dict, dict)
+    ]
+    substituir_filhos(MDFeContratante, contratantes, modal=modal)
 
     return modal
 
 
+def _parse_produtos_perigosos(doc_dict):
+    """Extrai a lista de <peri> de um <infCTe>/<infNFe> como dicionários de campos."""
+    peri_list = safe_get(doc_dict, 'peri', [])
+    if not isinstance(peri_list, list): peri_list = [peri_list]
+    return [
+        {
+            'n_onu': safe_get(peri_dict, 'nONU'),
+            'x_nome_ae': safe_get(peri_dict, 'xNomeAE'),
+            'x_cla_risco': safe_get(peri_dict, 'xClaRisco'),
+            'gr_emb': safe_get(peri_dict, 'grEmb'),
+            'q_tot_prod': safe_get(peri_dict, 'qTotProd'),
+            'q_vol_tipo': safe_get(peri_dict, 'qVolTipo'),
+            # pontoFulgor omitido
+        }
+        for peri_dict in peri_list if isinstance(peri_dict, dict)
+    ]
+
+
 @transaction.atomic
 def parse_mdfe_documentos(mdfe_doc, infmdfe):
-    """Parseia o bloco <infDoc> (municípios de descarga e documentos vinculados)."""
-    inf_doc = safe_get(infmdfe, 'infDoc')
-    if not inf_doc:
-        # Limpa registros antigos se bloco não existir
-        MDFeDocumentosVinculados.objects.filter(mdfe=mdfe_doc).delete()
-        MDFeMunicipioDescarga.objects.filter(mdfe=mdfe_doc).delete()
-        return 0 # Nenhum documento processado
-
+    """
+    Parseia o bloco <infDoc> (municípios de descarga e documentos vinculados).
+    Processamento em lote: uma consulta para resolver todas as chaves de CT-e
+    e bulk_create para municípios, vínculos e produtos perigosos.
+    """
     # Limpa todos os vínculos e municípios antigos ANTES de processar o bloco atual
+    # (os produtos perigosos são removidos em cascata junto com os vínculos)
     MDFeDocumentosVinculados.objects.filter(mdfe=mdfe_doc).delete()
     MDFeMunicipioDescarga.objects.filter(mdfe=mdfe_doc).delete()
 
+    inf_doc = safe_get(infmdfe, 'infDoc')
+    if not inf_doc:
+        return 0 # Nenhum documento processado
+
     mun_descarga_list = safe_get(inf_doc, 'infMunDescarga', [])
     if not isinstance(mun_descarga_list, list): mun_descarga_list = [mun_descarga_list]
 
-    total_docs_vinculados = 0
+    # --- 1ª passada: coleta municípios e vínculos (sem acessar o banco) ---
+    municipios = {} # c_mun -> dados do município (primeira ocorrência vence, como no get_or_create)
+    vinculos = {}   # chave_documento -> (c_mun, dados, perigosos) (última ocorrência vence, como no update_or_create)
+    chaves_cte = set()
 
     for mun_dict in mun_descarga_list:
         if not isinstance(mun_dict, dict): continue
 
-        # Cria o Município de Descarga
         c_mun = safe_get(mun_dict, 'cMunDescarga')
         if not c_mun:
             print(f"WARN: Município de descarga sem código para MDF-e {mdfe_doc.chave}. Pulando...")
             continue
+        municipios.setdefault(c_mun, {'x_mun_descarga': safe_get(mun_dict, 'xMunDescarga')})
+
+        # --- CT-es Vinculados <infCTe> e NF-es Vinculadas <infNFe> ---
+        for tag, tag_chave in (('infCTe', 'chCTe'), ('infNFe', 'chNFe')):
+            doc_list = safe_get(mun_dict, tag, [])
+            if not isinstance(doc_list, list): doc_list = [doc_list]
+            for doc_dict in doc_list:
+                if not isinstance(doc_dict, dict): continue
+
+                chave_doc = safe_get(doc_dict, tag_chave)
+                if not chave_doc: continue
+
+                if tag == 'infCTe':
+                    chaves_cte.add(chave_doc)
+                vinculos.pop(chave_doc, None) # Reinsere no final, preservando a ordem do XML
+                vinculos[chave_doc] = (
+                    c_mun,
+                    {
+                        'seg_cod_barras': safe_get(doc_dict, 'segCodBarra'),
+                        'ind_reentrega': to_boolean(safe_get(doc_dict, 'indReentrega', '0')),
+                        'eh_cte': tag == 'infCTe',
+                        # infUnidCarga/infUnidTransp omitidos
+                    },
+                    _parse_produtos_perigosos(doc_dict),
+                )
 
-        municipio, created_mun = MDFeMunicipioDescarga.objects.get_or_create(
-            mdfe=mdfe_doc,
-            c_mun_descarga=c_mun,
-            defaults={'x_mun_descarga': safe_get(mun_dict, 'xMunDescarga')}
-        )
-
-        # Processa Documentos Vinculados a este município
-        # --- CT-es Vinculados <infCTe> ---
-        inf_cte_list = safe_get(mun_dict, 'infCTe', [])
-        if not isinstance(inf_cte_list, list): inf_cte_list = [inf_cte_list]
-        for cte_dict in inf_cte_list:
-            if not isinstance(cte_dict, dict): continue
-
-            chave_cte = safe_get(cte_dict, 'chCTe')
-            if not chave_cte: continue
+        # --- MDF-e Anteriores <infMDFeTransp> --- (Omitido por complexidade)
 
-            # Tenta encontrar o CT-e no banco
-            cte_relacionado_obj = CTeDocumento.objects.filter(chave=chave_cte).first()
+    if not municipios:
+        return 0
 
-            doc_vinculado, created_doc = MDFeDocumentosVinculados.objects.update_or_create(
-                mdfe=mdfe_doc,
-                chave_documento=chave_cte, # Chave única para o vínculo no MDF-e
-                defaults={
-                    'municipio_descarga': municipio, # Associa ao município atual
-                    'seg_cod_barras': safe_get(cte_dict, 'segCodBarra'),
-                    'ind_reentrega': to_boolean(safe_get(cte_dict, 'indReentrega', '0')),
-                    'cte_relacionado': cte_relacionado_obj # Associa se encontrou
-                    # infUnidCarga/infUnidTransp omitidos
-                }
-            )
-            total_docs_vinculados += 1
-
-            # Produtos Perigosos <peri> dentro de <infCTe>
-            peri_list = safe_get(cte_dict, 'peri', [])
-            if not isinstance(peri_list, list): peri_list = [peri_list]
-            # Limpa perigosos antigos para este doc específico
-            MDFeProdutoPerigoso.objects.filter(documento_vinculado=doc_vinculado).delete()
-            for peri_dict in peri_list:
-                 if isinstance(peri_dict, dict):
-                     MDFeProdutoPerigoso.objects.create(
-                         documento_vinculado=doc_vinculado,
-                         n_onu=safe_get(peri_dict, 'nONU'),
-                         x_nome_ae=safe_get(peri_dict, 'xNomeAE'),
-                         x_cla_risco=safe_get(peri_dict, 'xClaRisco'),
-                         gr_emb=safe_get(peri_dict, 'grEmb'),
-                         q_tot_prod=safe_get(peri_dict, 'qTotProd'),
-                         q_vol_tipo=safe_get(peri_dict, 'qVolTipo')
-                         # pontoFulgor omitido
-                     )
-
-        # --- NF-es Vinculadas <infNFe> ---
-        inf_nfe_list = safe_get(mun_dict, 'infNFe', [])
-        if not isinstance(inf_nfe_list, list): inf_nfe_list = [inf_nfe_list]
-        for nfe_dict in inf_nfe_list:
-             if not isinstance(nfe_dict, dict): continue
-
-             chave_nfe = safe_get(nfe_dict, 'chNFe')
-             if not chave_nfe: continue
-
-             # Tenta encontrar a NF-e no banco (se houver modelo NFeDocumento)
-             # nfe_relacionada_obj = NFeDocumento.objects.filter(chave=chave_nfe).first()
-
-             doc_vinculado, created_doc = MDFeDocumentosVinculados.objects.update_or_create(
-                 mdfe=mdfe_doc,
-                 chave_documento=chave_nfe, # Chave única para o vínculo no MDF-e
-                 defaults={
-                     'municipio_descarga': municipio,
-                     'seg_cod_barras': safe_get(nfe_dict, 'segCodBarra'),
-                     'ind_reentrega': to_boolean(safe_get(nfe_dict, 'indReentrega', '0')),
-                     # 'nfe_relacionada': nfe_relacionada_obj # Associa se encontrou
-                     # infUnidCarga/infUnidTransp omitidos
-                 }
-             )
-             total_docs_vinculados += 1
-
-             # Produtos Perigosos <peri> dentro de <infNFe>
-             peri_list = safe_get(nfe_dict, 'peri', [])
-             if not isinstance(peri_list, list): peri_list = [peri_list]
-             MDFeProdutoPerigoso.objects.filter(documento_vinculado=doc_vinculado).delete() # Limpa anteriores
-             for peri_dict in peri_list:
-                  if isinstance(peri_dict, dict):
-                      MDFeProdutoPerigoso.objects.create(
-                          documento_vinculado=doc_vinculado,
-                          n_onu=safe_get(peri_dict, 'nONU'),
-                          x_nome_ae=safe_get(peri_dict, 'xNomeAE'),
-                          x_cla_risco=safe_get(peri_dict, 'xClaRisco'),
-                          gr_emb=safe_get(peri_dict, 'grEmb'),
-                          q_tot_prod=safe_get(peri_dict, 'qTotProd'),
-                          q_vol_tipo=safe_get(peri_dict, 'qVolTipo')
-                          # pontoFulgor omitido
-                      )
+    # --- 2ª passada: persistência em lote ---
+    municipios_objs = MDFeMunicipioDescarga.objects.bulk_create(
+        [MDFeMunicipioDescarga(mdfe=mdfe_doc, c_mun_descarga=c_mun, **dados) for c_mun, dados in municipios.items()],
+        batch_size=BULK_BATCH_SIZE
+    )
+    municipio_por_codigo = {m.c_mun_descarga: m for m in municipios_objs}
 
-        # --- MDF-e Anteriores <infMDFeTransp> --- (Omitido por complexidade)
+    # Resolve todos os CT-es relacionados em uma única consulta (FK usa to_field='chave')
+    ctes_existentes = set(
+        CTeDocumento.objects.filter(chave__in=chaves_cte).values_list('chave', flat=True)
+    ) if chaves_cte else set()
 
-    return total_docs_vinculados
+    vinculos_objs = []
+    for chave_doc, (c_mun, dados, perigosos) in vinculos.items():
+        eh_cte = dados.pop('eh_cte')
+        vinculos_objs.append(MDFeDocumentosVinculados(
+            mdfe=mdfe_doc,
+            chave_documento=chave_doc,
+            municipio_descarga=municipio_por_codigo[c_mun],
+            cte_relacionado_id=chave_doc if (eh_cte and chave_doc in ctes_existentes) else None,
+            **dados
+        ))
+    vinculos_objs = MDFeDocumentosVinculados.objects.bulk_create(vinculos_objs, batch_size=BULK_BATCH_SIZE)
+
+    # Produtos Perigosos <peri> (precisa dos IDs dos vínculos retornados pelo bulk_create)
+    perigosos_objs = [
+        MDFeProdutoPerigoso(documento_vinculado=doc_vinculado, **peri)
+        for doc_vinculado, (_, _, perigosos) in zip(vinculos_objs, vinculos.values())
+        for peri in perigosos
+    ]
+    if perigosos_objs:
+        MDFeProdutoPerigoso.objects.bulk_create(perigosos_objs, batch_size=BULK_BATCH_SIZE)
+
+    return len(vinculos_objs)
 
 @transaction.atomic
 def parse_mdfe_seguro(mdfe_doc, infmdfe):
@@ -844,20 +837,24 @@ def parse_mdfe_suplementar(mdfe_doc, inf_supl):
 
 # --- Main Parser Orchestrator ---
 
-def parse_mdfe_completo(mdfe_doc):
+def parse_mdfe_completo(mdfe_doc, xml_dict=None):
     """
     Função principal para parsear todo o XML do MDFeDocumento.
     Assume que mdfe_doc.xml_original contém o texto do XML.
+    xml_dict: resultado de xmltodict.parse() já obtido para este XML (evita uma nova leitura).
     Retorna True se o processamento foi bem-sucedido, False caso contrário.
+    Os painéis de MDF-e só são invalidados depois que algo foi gravado.
     """
     if not mdfe_doc.xml_original:
         print(f"ERROR: MDF-e {mdfe_doc.chave} não possui XML original para processar.")
         mdfe_doc.processado = False
         mdfe_doc.save(update_fields=['processado'])
+        invalidar_paineis('mdfe')
         return False
 
     try:
-        xml_dict = xmltodict.parse(mdfe_doc.xml_original)
+        if xml_dict is None:
+            xml_dict = xmltodict.parse(mdfe_doc.xml_original)
         infmdfe, versao_proc = get_mdfe_infmdfe(xml_dict) # Pode levantar ValueError
         prot_mdfe = get_mdfe_protocolo(xml_dict) # Pode ser None
         inf_supl = get_mdfe_suplementar(xml_dict) # Pode ser None
@@ -870,6 +867,7 @@ def parse_mdfe_completo(mdfe_doc):
         print(f"ERROR: Falha ao parsear XML base ou encontrar <infMDFe> para MDF-e {mdfe_doc.chave}: {e}")
         mdfe_doc.processado = False
         mdfe_doc.save(update_fields=['processado', 'versao']) # Salva erro e versão
+        invalidar_paineis('mdfe')
         return False
 
     try:
@@ -897,7 +895,10 @@ def parse_mdfe_completo(mdfe_doc):
 
             # Marcar como processado
             mdfe_doc.processado = True
+            atualizar_status_mdfe(mdfe_doc, salvar=False)
             mdfe_doc.save() # Salva o documento com status processado e versão
+            # Dentro do atomic: o on_commit só dispara se tudo acima foi gravado
+            invalidar_paineis('mdfe')
 
         print(f"INFO: MDF-e {mdfe_doc.chave} processado com sucesso.")
         return True
@@ -910,6 +911,7 @@ def parse_mdfe_completo(mdfe_doc):
             mdfe_doc_error = MDFeDocumento.objects.get(pk=mdfe_doc.pk)
             mdfe_doc_error.processado = False
             mdfe_doc_error.save(update_fields=['processado'])
+            invalidar_paineis('mdfe')
         except Exception as save_err:
              print(f"ERROR: Falha ao salvar status de erro para MDF-e {mdfe_doc.chave}: {save_err}")
         return False
\ No newline at end of file
@@ -0,0 +1,757 @@
+# transport/services/relatorios.py
+
+"""
+Relatórios de /api/relatorios/ (RelatorioAPIView).
+
+Cada relatório é uma definição de colunas tipadas mais um gerador de linhas
+(dicts) que lê o banco em blocos com values().iterator(), sem montar a lista
+inteira em memória. Os escritores usam os tipos das colunas:
+
+- csv / json: valores simples (decimal -> número, datas em texto, como antes);
+- xlsx: openpyxl em modo write-only (datas e valores como células nativas);
+- parquet / arrow: pyarrow, gravado em lotes de TAMANHO_LOTE_RELATORIO linhas
+  com o schema derivado das colunas (decimal128, date32, timestamp...).
+
+openpyxl e pyarrow (requirements.txt) são importados sob demanda: se faltarem,
+o formato correspondente levanta FormatoIndisponivel.
+
+Relatórios grandes são gerados em segundo plano: solicitar_relatorio() cria
+(ou reaproveita) uma TarefaRelatorio, a tarefa Celery gerar_relatorio_task
+chama executar_tarefa_relatorio(), que grava o arquivo em MEDIA_ROOT, e o
+cliente consulta /api/relatorios/tarefas/<id>/ até poder baixar o arquivo.
+Nessas tarefas não se aplica o limite de linhas da geração na requisição.
+
+Tipos de coluna: 'texto', 'inteiro', 'decimal', 'data', 'data_hora', 'booleano'.
+Uma coluna é (nome, tipo) ou, para decimais com outra escala, (nome, 'decimal', casas).
+"""
+
+import hashlib
+import json
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from importlib import import_module
+
+from django.conf import settings
+from django.core.files import File
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from ..models import (
+    CTeDocumento, CTePrestacaoServico, CTeVeiculoRodoviario, MDFeCondutor, MDFeDocumento,
+    MDFeDocumentosVinculados, ManutencaoVeiculo, PagamentoAgregado,
+    PagamentoProprio, TarefaRelatorio, Veiculo,
+)
+from ..utils import blocos_csv, filtro_periodo
+from .fatos_cte import placa_principal
+
+logger = logging.getLogger(__name__)
+
+# Linhas lidas do banco por vez e linhas por lote (record batch) no Parquet/Arrow
+TAMANHO_LOTE_RELATORIO = 5000
+
+FORMATOS_RELATORIO = ('csv', 'json', 'xlsx', 'parquet', 'arrow')
+
+TIPOS_CONTEUDO = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+
+
+class FormatoIndisponivel(Exception):
+    """O formato pedido depende de uma biblioteca opcional que não está instalada."""
+
+
+# Biblioteca opcional exigida por formato
+DEPENDENCIAS_FORMATO = {'xlsx': 'openpyxl', 'parquet': 'pyarrow', 'arrow': 'pyarrow'}
+
+
+def verificar_formato(formato):
+    """Levanta FormatoIndisponivel se o formato depende de uma biblioteca que não está instalada."""
+    modulo = DEPENDENCIAS_FORMATO.get(formato)
+    if not modulo:
+        return
+    try:
+        import_module(modulo)
+    except ImportError:
+        raise FormatoIndisponivel(f"Formato {formato} requer a biblioteca {modulo} (pip install {modulo}).")
+
+
+def _casas(coluna):
+    return coluna[2] if len(coluna) > 2 else 2
+
+
+# ---------------------------------------------------------------
+# Definições dos relatórios
+# ---------------------------------------------------------------
+
+COLUNAS_FATURAMENTO = [('mes', 'texto'), ('valor', 'decimal')]
+
+
+def linhas_faturamento(data_inicio, data_fim, filtros, limite=None):
+    """Faturamento (valor total prestado) por mês de emissão."""
+    qs = CTePrestacaoServico.objects.filter(
+        filtro_periodo('cte__identificacao__data_emissao', data_inicio, data_fim)
+    )
+    agregados = qs.annotate(mes=TruncMonth('cte__identificacao__data_emissao'))\
+        .values('mes')\
+        .annotate(valor=Sum('valor_total_prestado'))\
+        .order_by('mes')
+    for item in agregados.iterator(chunk_size=TAMANHO_LOTE_RELATORIO):
+        yield {
+            'mes': item['mes'].strftime('%Y-%m') if item['mes'] else 'N/A',
+            'valor': item['valor'] or Decimal('0'),
+        }
+
+
+COLUNAS_VEICULOS = [
+    ('id', 'inteiro'), ('placa', 'texto'), ('renavam', 'texto'), ('tara', 'inteiro'),
+    ('capacidade_kg', 'inteiro'), ('capacidade_m3', 'inteiro'), ('tipo_proprietario', 'texto'),
+    ('proprietario_cnpj', 'texto'), ('proprietario_cpf', 'texto'), ('proprietario_nome', 'texto'),
+    ('rntrc_proprietario', 'texto'), ('uf_proprietario', 'texto'), ('ativo', 'booleano'),
+    ('criado_em', 'data_hora'), ('atualizado_em', 'data_hora'),
+]
+
+
+def linhas_veiculos(data_inicio, data_fim, filtros, limite=None):
+    """Cadastro de veículos (o período não se aplica)."""
+    qs = Veiculo.objects.all()
+    if 'ativo' in filtros:
+        qs = qs.filter(ativo=bool(filtros['ativo']))
+    if 'placa' in filtros:
+        qs = qs.filter(placa__icontains=filtros['placa'])
+    campos = [coluna[0] for coluna in COLUNAS_VEICULOS]
+    yield from qs.order_by('placa').values(*campos).iterator(chunk_size=TAMANHO_LOTE_RELATORIO)
+
+
+COLUNAS_CTES = [
+    ('chave', 'texto'), ('numero', 'inteiro'), ('data_emissao', 'data_hora'),
+    ('emitente', 'texto'), ('remetente', 'texto'), ('destinatario', 'texto'),
+    ('valor_total', 'decimal'), ('modalidade', 'texto'), ('processado', 'booleano'),
+    ('placa', 'texto'), ('km_distancia', 'inteiro'),
+]
+
+
+def linhas_ctes(data_inicio, data_fim, filtros, limite=None):
+    """CT-es do período, do mais recente para o mais antigo."""
+    qs = CTeDocumento.objects.filter(filtro_periodo('identificacao__data_emissao', data_inicio, data_fim))
+
+    if 'chave' in filtros and filtros['chave']:
+        qs = qs.filter(chave__icontains=filtros['chave'])
+    if 'numero' in filtros and filtros['numero']:
+        qs = qs.filter(identificacao__numero=filtros['numero'])
+    if 'emitente' in filtros and filtros['emitente']:
+        qs = qs.filter(emitente__razao_social__icontains=filtros['emitente'])
+    if 'modalidade' in filtros and filtros['modalidade']:
+        qs = qs.filter(modalidade=filtros['modalidade'])
+    if 'processado' in filtros:
+        qs = qs.filter(processado=bool(filtros['processado']))
+
+    linhas = qs.annotate(placa_relatorio=placa_principal()).values(
+        'chave', 'modalidade', 'processado', 'placa_relatorio',
+        'identificacao__numero', 'identificacao__data_emissao', 'identificacao__dist_km',
+        'emitente__razao_social', 'remetente__razao_social', 'destinatario__razao_social',
+        'prestacao__valor_total_prestado',
+    )
+    linhas = linhas.order_by('-identificacao__data_emissao')
+    if limite:
+        linhas = linhas[:limite]
+    for linha in linhas.iterator(chunk_size=TAMANHO_LOTE_RELATORIO):
+        yield {
+            'chave': linha['chave'],
+            'numero': linha['identificacao__numero'],
+            'data_emissao': linha['identificacao__data_emissao'],
+            'emitente': linha['emitente__razao_social'],
+            'remetente': linha['remetente__razao_social'],
+            'destinatario': linha['destinatario__razao_social'],
+            'valor_total': linha['prestacao__valor_total_prestado'] or Decimal('0'),
+            'modalidade': linha['modalidade'] or 'N/A',
+            'processado': linha['processado'],
+            'placa': linha['placa_relatorio'],
+            'km_distancia': linha['identificacao__dist_km'],
+        }
+
+
+COLUNAS_MDFES = [
+    ('chave', 'texto'), ('numero', 'inteiro'), ('data_emissao', 'data_hora'), ('emitente', 'texto'),
+    ('uf_inicio', 'texto'), ('uf_fim', 'texto'), ('placa_tracao', 'texto'), ('condutor', 'texto'),
+    ('qtd_ctes', 'inteiro'), ('valor_carga', 'decimal'), ('peso_carga', 'decimal', 4),
+    ('encerrado', 'booleano'), ('data_encerramento', 'data'), ('processado', 'booleano'),
+]
+
+
+def linhas_mdfes(data_inicio, data_fim, filtros, limite=None):
+    """MDF-es do período, com o primeiro condutor e a quantidade de documentos vinculados."""
+    qs = MDFeDocumento.objects.filter(filtro_periodo('identificacao__dh_emi', data_inicio, data_fim))
+
+    if 'chave' in filtros and filtros['chave']:
+        qs = qs.filter(chave__icontains=filtros['chave'])
+    if 'numero' in filtros and filtros['numero']:
+        qs = qs.filter(identificacao__n_mdf=filtros['numero'])
+    if 'emitente' in filtros and filtros['emitente']:
+        qs = qs.filter(emitente__razao_social__icontains=filtros['emitente'])
+    if 'encerrado' in filtros:
+        qs = qs.filter(encerrado=bool(filtros['encerrado']))
+    if 'processado' in filtros:
+        qs = qs.filter(processado=bool(filtros['processado']))
+
+    linhas = qs.annotate(
+        condutor_relatorio=Subquery(
+            MDFeCondutor.objects.filter(mdfe=OuterRef('pk')).order_by('pk').values('nome')[:1]
+        ),
+        qtd_ctes_relatorio=Coalesce(Subquery(
+            MDFeDocumentosVinculados.objects.filter(mdfe=OuterRef('pk'))
+            .values('mdfe').annotate(c=Count('id')).values('c')
+        ), Value(0), output_field=IntegerField()),
+    ).values(
+        'chave', 'encerrado', 'data_encerramento', 'processado',
+        'condutor_relatorio', 'qtd_ctes_relatorio',
+        'identificacao__n_mdf', 'identificacao__dh_emi', 'identificacao__uf_ini', 'identificacao__uf_fim',
+        'emitente__razao_social', 'modal_rodoviario__veiculo_tracao__placa',
+        'totais__v_carga', 'totais__q_carga',
+    )
+    linhas = linhas.order_by('-identificacao__dh_emi')
+    if limite:
+        linhas = linhas[:limite]
+    for linha in linhas.iterator(chunk_size=TAMANHO_LOTE_RELATORIO):
+        yield {
+            'chave': linha['chave'],
+            'numero': linha['identificacao__n_mdf'],
+            'data_emissao': linha['identificacao__dh_emi'],
+            'emitente': linha['emitente__razao_social'],
+            'uf_inicio': linha['identificacao__uf_ini'],
+            'uf_fim': linha['identificacao__uf_fim'],
+            'placa_tracao': linha['modal_rodoviario__veiculo_tracao__placa'],
+            'condutor': linha['condutor_relatorio'],
+            'qtd_ctes': linha['qtd_ctes_relatorio'],
+            'valor_carga': linha['totais__v_carga'] or Decimal('0'),
+            'peso_carga': linha['totais__q_carga'] or Decimal('0'),
+            'encerrado': linha['encerrado'],
+            'data_encerramento': linha['data_encerramento'],
+            'processado': linha['processado'],
+        }
+
+
+COLUNAS_PAGAMENTOS = [
+    ('tipo', 'texto'), ('id', 'inteiro'), ('cte_numero', 'inteiro'), ('placa', 'texto'),
+    ('condutor', 'texto'), ('cpf_condutor', 'texto'), ('valor_frete', 'decimal'),
+    ('percentual_repasse', 'decimal'), ('valor_repassado', 'decimal'), ('status', 'texto'),
+    ('data_prevista', 'data'), ('data_pagamento', 'data'), ('observacoes', 'texto'),
+    ('periodo', 'texto'), ('km_total', 'inteiro'), ('valor_base_faixa', 'decimal'), ('ajustes', 'decimal'),
+]
+
+
+def linhas_pagamentos(data_inicio, data_fim, filtros, limite=None):
+    """Pagamentos agregados e/ou próprios (filtros['tipo']: 'agregado', 'proprio' ou 'todos')."""
+    tipo_pagamento = filtros.get('tipo', 'todos')
+
+    if tipo_pagamento in ['agregado', 'todos']:
+        qs_agregados = PagamentoAgregado.objects.all()
+        # Filtros por data (usando data_prevista)
+        if data_inicio:
+            qs_agregados = qs_agregados.filter(data_prevista__gte=data_inicio)
+        if data_fim:
+            qs_agregados = qs_agregados.filter(data_prevista__lte=data_fim)
+        if 'status' in filtros and filtros['status']:
+            qs_agregados = qs_agregados.filter(status=filtros['status'])
+        if 'placa' in filtros and filtros['placa']:
+            qs_agregados = qs_agregados.filter(placa__icontains=filtros['placa'])
+        if 'condutor' in filtros and filtros['condutor']:
+            qs_agregados = qs_agregados.filter(condutor_nome__icontains=filtros['condutor'])
+
+        qs_agregados = qs_agregados.order_by('-data_prevista')
+        if limite:
+            qs_agregados = qs_agregados[:limite]
+
+        linhas = qs_agregados.values(
+            'id', 'cte__identificacao__numero', 'placa', 'condutor_nome', 'condutor_cpf',
+            'valor_frete_total', 'percentual_repasse', 'valor_repassado', 'status',
+            'data_prevista', 'data_pagamento', 'obs',
+        )
+        for pag in linhas.iterator(chunk_size=TAMANHO_LOTE_RELATORIO):
+            yield {
+                'tipo': 'Agregado',
+                'id': pag['id'],
+                'cte_numero': pag['cte__identificacao__numero'],
+                'placa': pag['placa'],
+                'condutor': pag['condutor_nome'],
+                'cpf_condutor': pag['condutor_cpf'],
+                'valor_frete': pag['valor_frete_total'],
+                'percentual_repasse': pag['percentual_repasse'],
+                'valor_repassado': pag['valor_repassado'],
+                'status': pag['status'],
+                'data_prevista': pag['data_prevista'],
+                'data_pagamento': pag['data_pagamento'],
+                'observacoes': pag['obs'] or '',
+            }
+
+    if tipo_pagamento in ['proprio', 'todos']:
+        qs_proprios = PagamentoProprio.objects.all()
+        # O período (AAAA-MM) é comparado como texto
+        if data_inicio:
+            qs_proprios = qs_proprios.filter(periodo__gte=data_inicio.strftime('%Y-%m'))
+        if data_fim:
+            qs_proprios = qs_proprios.filter(periodo__lte=data_fim.strftime('%Y-%m'))
+        if 'status' in filtros and filtros['status']:
+            qs_proprios = qs_proprios.filter(status=filtros['status'])
+        if 'placa' in filtros and filtros['placa']:
+            qs_proprios = qs_proprios.filter(veiculo__placa__icontains=filtros['placa'])
+
+        qs_proprios = qs_proprios.order_by('-periodo')
+        if limite:
+            qs_proprios = qs_proprios[:limite]
+
+        linhas = qs_proprios.values(
+            'id', 'veiculo__placa', 'valor_total_pagar', 'status', 'data_pagamento', 'obs',
+            'periodo', 'km_total_periodo', 'valor_base_faixa', 'ajustes',
+        )
+        for pag in linhas.iterator(chunk_size=TAMANHO_LOTE_RELATORIO):
+            yield {
+                'tipo': 'Próprio',
+                'id': pag['id'],
+                'placa': pag['veiculo__placa'],
+                'condutor': 'Condutor Próprio',
+                'valor_repassado': pag['valor_total_pagar'],
+                'status': pag['status'],
+                'data_pagamento': pag['data_pagamento'],
+                'observacoes': pag['obs'] or '',
+                'periodo': pag['periodo'],
+                'km_total': pag['km_total_periodo'],
+                'valor_base_faixa': pag['valor_base_faixa'] or Decimal('0'),
+                'ajustes': pag['ajustes'],
+            }
+
+
+COLUNAS_KM_RODADO = [
+    ('placa', 'texto'), ('km_ctes', 'inteiro'), ('km_manutencoes', 'inteiro'),
+    ('qtd_ctes', 'inteiro'), ('qtd_manutencoes', 'inteiro'), ('ultima_manutencao', 'data'),
+    ('km_total_estimado', 'inteiro'), ('veiculo_ativo', 'booleano'), ('proprietario', 'texto'),
+]
+
+
+def linhas_km_rodado(data_inicio, data_fim, filtros, limite=None):
+    """
+    KM rodado por placa a partir dos CT-es (dist_km) e da quilometragem das manutenções.
+
+    Calculado por agregação no banco: soma/contagem por placa dos veículos do
+    modal rodoviário, maior quilometragem por veículo nas manutenções e uma
+    única consulta aos veículos cadastrados.
+    """
+    placa_filtro = filtros.get('placa')
+
+    # KM dos CT-es (campo dist_km): cada veículo do CT-e conta o KM do documento
+    veiculos_cte = CTeVeiculoRodoviario.objects.filter(
+        filtro_periodo('modal__cte__identificacao__data_emissao', data_inicio, data_fim)
+    )
+    if placa_filtro:
+        veiculos_cte = veiculos_cte.filter(placa__icontains=placa_filtro)
+    por_cte = veiculos_cte.values('placa').annotate(
+        km_ctes=Coalesce(Sum('modal__cte__identificacao__dist_km'), Value(0), output_field=IntegerField()),
+        qtd_ctes=Count('id'),
+    ).order_by('placa')
+
+    # KM das manutenções (quilometragem registrada): a maior como referência
+    manutencoes = ManutencaoVeiculo.objects.all()
+    if data_inicio:
+        manutencoes = manutencoes.filter(data_servico__gte=data_inicio)
+    if data_fim:
+        manutencoes = manutencoes.filter(data_servico__lte=data_fim)
+    if placa_filtro:
+        manutencoes = manutencoes.filter(veiculo__placa__icontains=placa_filtro)
+    # Data da manutenção com a maior quilometragem (empate: a mais recente, como na ordenação do modelo)
+    data_maior_km = manutencoes.filter(veiculo=OuterRef('veiculo')).order_by(
+        F('quilometragem').desc(nulls_last=True), '-data_servico', '-criado_em'
+    ).values('data_servico')[:1]
+    por_manutencao = manutencoes.values('veiculo', 'veiculo__placa').annotate(
+        km_manutencoes=Max('quilometragem'),
+        qtd_manutencoes=Count('id'),
+        ultima_manutencao=Subquery(data_maior_km),
+    ).order_by()
+
+    km_por_placa = {}
+
+    def _placa(placa):
+        if placa not in km_por_placa:
+            km_por_placa[placa] = {
+                'placa': placa,
+                'km_ctes': 0,
+                'km_manutencoes': 0,
+                'qtd_ctes': 0,
+                'qtd_manutencoes': 0,
+                'ultima_manutencao': None,
+                'km_total_estimado': 0
+            }
+        return km_por_placa[placa]
+
+    for linha in por_cte:
+        dados_placa = _placa(linha['placa'])
+        dados_placa['km_ctes'] = linha['km_ctes']
+        dados_placa['qtd_ctes'] = linha['qtd_ctes']
+
+    for linha in por_manutencao:
+        dados_placa = _placa(linha['veiculo__placa'])
+        dados_placa['qtd_manutencoes'] = linha['qtd_manutencoes']
+        if linha['km_manutencoes']:
+            dados_placa['km_manutencoes'] = linha['km_manutencoes']
+            dados_placa['ultima_manutencao'] = linha['ultima_manutencao']
+
+    veiculos = {
+        v['placa']: v for v in Veiculo.objects.filter(placa__in=km_por_placa).values('placa', 'ativo', 'proprietario_nome')
+    }
+    dados = []
+    for placa_data in km_por_placa.values():
+        # Estimativa simples: maior valor entre KM das manutenções e soma dos CT-es
+        placa_data['km_total_estimado'] = max(placa_data['km_manutencoes'], placa_data['km_ctes'])
+        veiculo = veiculos.get(placa_data['placa'])
+        if veiculo:
+            placa_data['veiculo_ativo'] = veiculo['ativo']
+            placa_data['proprietario'] = veiculo['proprietario_nome'] or 'Não informado'
+        else:
+            placa_data['veiculo_ativo'] = False
+            placa_data['proprietario'] = 'Veículo não cadastrado'
+        dados.append(placa_data)
+
+    # Ordena por KM total estimado (maior primeiro)
+    dados.sort(key=lambda x: x['km_total_estimado'], reverse=True)
+    yield from dados
+
+
+COLUNAS_MANUTENCOES = [
+    ('id', 'inteiro'), ('veiculo_placa', 'texto'), ('data_servico', 'data'),
+    ('servico_realizado', 'texto'), ('oficina', 'texto'), ('quilometragem', 'inteiro'),
+    ('peca_utilizada', 'texto'), ('valor_peca', 'decimal'), ('valor_mao_obra', 'decimal'),
+    ('valor_total', 'decimal'), ('status', 'texto'), ('observacoes', 'texto'),
+    ('nota_fiscal', 'texto'), ('criado_em', 'data_hora'), ('atualizado_em', 'data_hora'),
+]
+
+
+def linhas_manutencoes(data_inicio, data_fim, filtros, limite=None):
+    """Manutenções pela data do serviço."""
+    qs = ManutencaoVeiculo.objects.all()
+    if data_inicio:
+        qs = qs.filter(data_servico__gte=data_inicio)
+    if data_fim:
+        qs = qs.filter(data_servico__lte=data_fim)
+    campos = [coluna[0] for coluna in COLUNAS_MANUTENCOES if coluna[0] != 'veiculo_placa']
+    for linha in qs.order_by('-data_servico', 'pk').values(*campos, 'veiculo__placa').iterator(chunk_size=TAMANHO_LOTE_RELATORIO):
+        linha['veiculo_placa'] = linha.pop('veiculo__placa')
+        yield linha
+
+
+# tipo -> (colunas, gerador de linhas, limite de linhas na geração dentro da requisição)
+# Nas tarefas em segundo plano (TarefaRelatorio) não há limite.
+RELATORIOS = {
+    'faturamento': (COLUNAS_FATURAMENTO, linhas_faturamento, None),
+    'veiculos': (COLUNAS_VEICULOS, linhas_veiculos, None),
+    'ctes': (COLUNAS_CTES, linhas_ctes, 1000),
+    'mdfes': (COLUNAS_MDFES, linhas_mdfes, 1000),
+    'pagamentos': (COLUNAS_PAGAMENTOS, linhas_pagamentos, 500),
+    'km_rodado': (COLUNAS_KM_RODADO, linhas_km_rodado, None),
+    'manutencoes': (COLUNAS_MANUTENCOES, linhas_manutencoes, None),
+}
+
+
+def limite_sincrono(tipo):
+    """Limite de linhas do relatório quando gerado dentro da requisição (None = sem limite)."""
+    return RELATORIOS[tipo][2]
+
+
+def gerar_relatorio(tipo, data_inicio=None, data_fim=None, filtros=None, limite=None):
+    """(colunas, linhas) do relatório; as linhas são geradas sob demanda. KeyError se o tipo não existir."""
+    colunas, gerador, _ = RELATORIOS[tipo]
+    logger.info("Gerando relatório '%s' com filtros: %s", tipo, filtros)
+    return colunas, gerador(data_inicio, data_fim, filtros or {}, limite=limite)
+
+
+def datas_filtros(filtros):
+    """(data_inicio, data_fim) de filtros['data_inicio'/'data_fim'] (YYYY-MM-DD). ValueError se inválidas."""
+    datas = []
+    for campo in ('data_inicio', 'data_fim'):
+        valor = filtros.get(campo)
+        if valor is None:
+            datas.append(None)
+            continue
+        try:
+            datas.append(datetime.strptime(valor, '%Y-%m-%d').date())
+        except (ValueError, TypeError):
+            raise ValueError(f"Formato de {campo} inválido. Use YYYY-MM-DD.")
+    return tuple(datas)
+
+
+# ---------------------------------------------------------------
+# Escrita nos formatos de saída
+# ---------------------------------------------------------------
+
+def valor_simples(valor, tipo):
+    """Valor para CSV/JSON: decimal como número e datas em texto (data/hora no fuso local)."""
+    if valor is None:
+        return None
+    if tipo == 'decimal':
+        return float(valor)
+    if tipo == 'data_hora':
+        return timezone.localtime(valor).strftime('%Y-%m-%d %H:%M')
+    if tipo == 'data':
+        return valor.strftime('%Y-%m-%d')
+    return valor
+
+
+def linhas_simples(colunas, linhas):
+    """Linhas como dicts de valores simples (formato json)."""
+    for linha in linhas:
+        yield {coluna[0]: valor_simples(linha.get(coluna[0]), coluna[1]) for coluna in colunas}
+
+
+def csv_relatorio(colunas, linhas):
+    """Texto CSV do relatório em pedaços (ver utils.blocos_csv)."""
+    return blocos_csv(
+        [coluna[0] for coluna in colunas],
+        ([valor_simples(linha.get(coluna[0]), coluna[1]) for coluna in colunas] for linha in linhas),
+    )
+
+
+def _formato_excel(coluna):
+    if coluna[1] == 'decimal':
+        return '#,##0.' + '0' * _casas(coluna)
+    return {'data': 'DD/MM/YYYY', 'data_hora': 'DD/MM/YYYY HH:MM'}.get(coluna[1])
+
+
+def _escrever_xlsx(colunas, linhas, arquivo, titulo):
+    verificar_formato('xlsx')
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    formatos = [_formato_excel(coluna) for coluna in colunas]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=titulo[:31])
+    ws.freeze_panes = 'A2'
+    for indice, coluna in enumerate(colunas, start=1):
+        ws.column_dimensions[get_column_letter(indice)].width = max(12, len(coluna[0]) + 2)
+
+    negrito = Font(bold=True)
+    cabecalho = []
+    for coluna in colunas:
+        celula = WriteOnlyCell(ws, value=coluna[0])
+        celula.font = negrito
+        cabecalho.append(celula)
+    ws.append(cabecalho)
+
+    for linha in linhas:
+        celulas = []
+        for coluna, formato in zip(colunas, formatos):
+            valor = linha.get(coluna[0])
+            if coluna[1] == 'data_hora' and valor is not None:
+                # O Excel não guarda fuso: grava a hora local
+                valor = timezone.localtime(valor).replace(tzinfo=None)
+            celula = WriteOnlyCell(ws, value=valor)
+            if formato:
+                celula.number_format = formato
+            celulas.append(celula)
+        ws.append(celulas)
+    wb.save(arquivo)
+
+
+def _schema_arrow(pa, colunas):
+    tipos = {
+        'texto': pa.string(),
+        'inteiro': pa.int64(),
+        'data': pa.date32(),
+        'data_hora': pa.timestamp('us', tz=settings.TIME_ZONE),
+        'booleano': pa.bool_(),
+    }
+    return pa.schema([
+        (coluna[0], pa.decimal128(18, _casas(coluna)) if coluna[1] == 'decimal' else tipos[coluna[1]])
+        for coluna in colunas
+    ])
+
+
+def _valor_arrow(valor, coluna):
+    if valor is None:
+        return None
+    if coluna[1] == 'decimal':
+        # decimal128 exige a escala exata da coluna
+        return Decimal(str(valor)).quantize(Decimal(1).scaleb(-_casas(coluna)))
+    if coluna[1] == 'texto' and not isinstance(valor, str):
+        return str(valor)
+    return valor
+
+
+def _escrever_arrow(colunas, linhas, arquivo, formato):
+    verificar_formato(formato)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema_arrow(pa, colunas)
+    if formato == 'parquet':
+        writer = pq.ParquetWriter(arquivo, schema)
+    else:
+        writer = pa.ipc.new_file(arquivo, schema)
+
+    def gravar(lote):
+        dados = {coluna[0]: [_valor_arrow(linha.get(coluna[0]), coluna) for linha in lote] for coluna in colunas}
+        writer.write_batch(pa.RecordBatch.from_pydict(dados, schema=schema))
+
+    try:
+        lote = []
+        for linha in linhas:
+            lote.append(linha)
+            if len(lote) >= TAMANHO_LOTE_RELATORIO:
+                gravar(lote)
+                lote = []
+        if lote:
+            gravar(lote)
+    finally:
+        writer.close()
+
+
+def escrever_relatorio(formato, colunas, linhas, arquivo, titulo='Relatório'):
+    """
+    Grava o relatório no arquivo binário `arquivo` (aberto para escrita) no
+    formato pedido. Levanta FormatoIndisponivel se faltar a biblioteca opcional
+    e ValueError para formatos desconhecidos.
+    """
+    if formato == 'csv':
+        for bloco in csv_relatorio(colunas, linhas):
+            arquivo.write(bloco.encode('utf-8'))
+    elif formato == 'json':
+        arquivo.write(b'[')
+        for indice, linha in enumerate(linhas_simples(colunas, linhas)):
+            arquivo.write((',' if indice else '').encode('utf-8') + json.dumps(linha, ensure_ascii=False).encode('utf-8'))
+        arquivo.write(b']')
+    elif formato == 'xlsx':
+        _escrever_xlsx(colunas, linhas, arquivo, titulo)
+    elif formato in ('parquet', 'arrow'):
+        _escrever_arrow(colunas, linhas, arquivo, formato)
+    else:
+        raise ValueError(f"Formato '{formato}' não suportado.")
+
+
+# ---------------------------------------------------------------
+# Tarefas em segundo plano (TarefaRelatorio)
+# ---------------------------------------------------------------
+
+def assinatura_relatorio(tipo, formato, filtros):
+    """Hash dos parâmetros do relatório, para reaproveitar tarefas iguais."""
+    bruto = json.dumps({'tipo': tipo, 'formato': formato, 'filtros': filtros or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(bruto.encode('utf-8')).hexdigest()
+
+
+def falhar_tarefa_relatorio(tarefa_id, mensagem):
+    """Marca como erro a tarefa ainda pendente (ex: não foi possível enfileirá-la)."""
+    return TarefaRelatorio.objects.filter(pk=tarefa_id, status='pendente').update(
+        status='erro', erro=mensagem, concluido_em=timezone.now(),
+    )
+
+
+def expirar_tarefas_relatorio(tarefas=None):
+    """
+    Marca como erro as tarefas paradas há mais de RELATORIOS_EXPIRACAO_MINUTOS,
+    contadas do início da geração (worker que morreu) ou, se ainda não começou,
+    da criação (enfileiramento que falhou), para que não sejam reaproveitadas
+    nem consultadas indefinidamente. Retorna quantas.
+    """
+    agora = timezone.now()
+    limite = agora - timedelta(minutes=settings.RELATORIOS_EXPIRACAO_MINUTOS)
+    tarefas = TarefaRelatorio.objects.all() if tarefas is None else tarefas
+    return tarefas.filter(
+        Q(iniciado_em__lt=limite) | Q(iniciado_em__isnull=True, criado_em__lt=limite),
+        status__in=('pendente', 'processando'),
+    ).update(status='erro', erro="Tempo máximo de geração excedido.", concluido_em=agora)
+
+
+def solicitar_relatorio(tipo, formato, filtros, usuario=''):
+    """
+    Retorna (tarefa, reaproveitada). Reaproveita a tarefa do mesmo usuário com os
+    mesmos parâmetros que ainda está na fila/em processamento (dentro do tempo de
+    expiração), ou que foi concluída há menos de RELATORIOS_REUSO_MINUTOS; senão
+    cria uma nova (o chamador a enfileira).
+    """
+    filtros = filtros or {}
+    assinatura = assinatura_relatorio(tipo, formato, filtros)
+    tarefas = TarefaRelatorio.objects.filter(usuario=usuario, assinatura=assinatura)
+
+    expirar_tarefas_relatorio(tarefas)
+    existente = tarefas.filter(status__in=('pendente', 'processando')).first()
+    if existente is None:
+        recente = timezone.now() - timedelta(minutes=settings.RELATORIOS_REUSO_MINUTOS)
+        existente = tarefas.filter(status='concluido', concluido_em__gte=recente).first()
+        if existente and not (existente.arquivo and existente.arquivo.storage.exists(existente.arquivo.name)):
+            existente = None
+    if existente:
+        return existente, True
+
+    tarefa = TarefaRelatorio.objects.create(
+        usuario=usuario, tipo=tipo, formato=formato, filtros=filtros, assinatura=assinatura,
+    )
+    return tarefa, False
+
+
+def _contar(linhas, contador):
+    for linha in linhas:
+        contador[0] += 1
+        yield linha
+
+
+def executar_tarefa_relatorio(tarefa_id):
+    """Gera o arquivo da tarefa em MEDIA_ROOT. Idempotente: só executa tarefas pendentes."""
+    # Marca como em processamento só se ainda estiver pendente (outro worker pode ter pego)
+    atualizadas = TarefaRelatorio.objects.filter(pk=tarefa_id, status='pendente').update(
+        status='processando', iniciado_em=timezone.now(),
+    )
+    if not atualizadas:
+        return None
+    tarefa = TarefaRelatorio.objects.get(pk=tarefa_id)
+
+    try:
+        data_inicio, data_fim = datas_filtros(tarefa.filtros)
+        colunas, linhas = gerar_relatorio(tarefa.tipo, data_inicio, data_fim, tarefa.filtros)
+        contador = [0]
+        # Gera em arquivo temporário e só depois grava no storage (qualquer backend de MEDIA)
+        with tempfile.TemporaryFile() as temporario:
+            escrever_relatorio(tarefa.formato, colunas, _contar(linhas, contador), temporario, titulo=tarefa.tipo)
+            temporario.seek(0)
+            nome = f"relatorio_{tarefa.tipo}_{timezone.localtime():%Y%m%d_%H%M%S}.{tarefa.formato}"
+            tarefa.arquivo.save(nome, File(temporario), save=False)
+        tarefa.status = 'concluido'
+        tarefa.total_linhas = contador[0]
+    except Exception as e:
+        logger.exception("Erro ao gerar relatório da tarefa %s", tarefa_id)
+        tarefa.status = 'erro'
+        tarefa.erro = str(e)
+    tarefa.concluido_em = timezone.now()
+
+    # Só grava o resultado se a tarefa ainda estiver em processamento: se ela
+    # expirou enquanto gerava, o erro já foi informado ao cliente e fica valendo.
+    gravada = TarefaRelatorio.objects.filter(pk=tarefa_id, status='processando').update(
+        status=tarefa.status, arquivo=tarefa.arquivo.name or None, total_linhas=tarefa.total_linhas,
+        erro=tarefa.erro, concluido_em=tarefa.concluido_em,
+    )
+    if not gravada:
+        logger.warning("Tarefa de relatório %s expirou durante a geração; resultado descartado.", tarefa_id)
+        if tarefa.arquivo:
+            tarefa.arquivo.delete(save=False)
+        tarefa.refresh_from_db()
+    return tarefa
+
+
+def remover_relatorios_antigos(dias=None):
+    """
+    Expira as tarefas paradas e remove as tarefas (e arquivos) criadas há mais de
+    `dias` (RELATORIOS_RETENCAO_DIAS). Retorna (expiradas, removidas).
+    """
+    expiradas = expirar_tarefas_relatorio()
+    limite = timezone.now() - timedelta(days=settings.RELATORIOS_RETENCAO_DIAS if dias is None else dias)
+    antigas = TarefaRelatorio.objects.filter(criado_em__lt=limite).exclude(status__in=('pendente', 'processando'))
+    removidas = 0
+    for tarefa in antigas.iterator():
+        if tarefa.arquivo:
+            tarefa.arquivo.delete(save=False)
+        tarefa.delete()
+        removidas += 1
+    return expiradas, removidas
@@ -0,0 +1,146 @@
+# transport/services/spool_lote.py
+
+"""
+Spool em disco para uploads em lote.
+
+Os arquivos do multipart são gravados em sequência em um único arquivo
+temporário, à medida que chegam; cada upload vira uma referência
+(caminho, offset, tamanho) em vez de um buffer em memória. Assim um lote com
+milhares de XMLs não fica inteiro na RAM, nem abre um descritor por arquivo.
+Os grupos de documentos são lidos do spool um de cada vez no processamento.
+"""
+
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework.parsers import MultiPartParser
+
+
+class SpoolLote:
+    """Arquivo temporário que recebe, em sequência, o conteúdo de todos os arquivos do lote."""
+
+    def __init__(self):
+        self._arquivo = tempfile.NamedTemporaryFile(
+            prefix='lote_xml_', suffix='.spool', dir=settings.FILE_UPLOAD_TEMP_DIR, delete=False
+        )
+        self.caminho = self._arquivo.name
+
+    def posicao(self):
+        self._arquivo.seek(0, os.SEEK_END)
+        return self._arquivo.tell()
+
+    def escrever(self, dados):
+        self._arquivo.seek(0, os.SEEK_END)
+        self._arquivo.write(dados)
+
+    def sincronizar(self):
+        if not self._arquivo.closed:
+            self._arquivo.flush()
+
+    def ler(self, offset, tamanho):
+        self._arquivo.flush()
+        self._arquivo.seek(offset)
+        return self._arquivo.read(tamanho)
+
+    def remover(self):
+        if not self._arquivo.closed:
+            self._arquivo.close()
+        try:
+            os.remove(self.caminho)
+        except FileNotFoundError:
+            pass
+
+
+class TrechoSpool:
+    """Leitura (somente) de um arquivo do lote dentro do spool, como se fosse um arquivo próprio."""
+
+    def __init__(self, spool, offset, tamanho):
+        self.spool = spool
+        self.offset = offset
+        self.tamanho = tamanho
+        self._posicao = 0
+        self.closed = False
+
+    @property
+    def caminho(self):
+        # Quem abre o caminho (outro processo) precisa ver o que ainda está no buffer
+        self.spool.sincronizar()
+        return self.spool.caminho
+
+    def read(self, n=-1):
+        restante = self.tamanho - self._posicao
+        if n is None or n < 0 or n > restante:
+            n = restante
+        if n <= 0:
+            return b''
+        dados = self.spool.ler(self.offset + self._posicao, n)
+        self._posicao += len(dados)
+        return dados
+
+    def seek(self, posicao, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            posicao += self._posicao
+        elif whence == os.SEEK_END:
+            posicao += self.tamanho
+        self._posicao = max(0, min(posicao, self.tamanho))
+        return self._posicao
+
+    def tell(self):
+        return self._posicao
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+class SpoolUploadHandler(FileUploadHandler):
+    """Upload handler que grava todos os arquivos do request em um único SpoolLote."""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.spool = None
+        self.offset = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.spool is None:
+            self.spool = SpoolLote()
+        self.offset = self.spool.posicao()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.spool.escrever(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        return UploadedFile(
+            file=TrechoSpool(self.spool, self.offset, file_size),
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if self.spool:
+            self.spool.remover()
+
+
+class MultiPartSpoolParser(MultiPartParser):
+    """
+    MultiPartParser que grava os arquivos no spool em disco.
+    O SpoolLote fica em request.spool_lote; quem processa o lote deve removê-lo ao final.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        handler = SpoolUploadHandler(request._request)
+        request.upload_handlers = [handler]
+        resultado = super().parse(stream, media_type, parser_context)
+        request.spool_lote = handler.spool
+        return resultado
@@ -0,0 +1,147 @@
+# transport/services/status_documento.py
+
+"""
+Status materializado dos documentos (CTeDocumento.status / MDFeDocumento.status).
+
+O status resume protocolo, cancelamento e encerramento em uma coluna indexada,
+para que filtros e listagens não precisem do join com protocolo/cancelamento.
+A regra fica em uma única expressão SQL (Case + Exists), usada tanto pelos
+parsers/eventos para atualizar um documento quanto por
+recalcular_status_documentos() para preencher a base em lote (migração 0009 e
+comando atualizar_status_documentos).
+
+Precedência: cancelado > encerrado (só MDF-e) > autorizado > rejeitado > pendente.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, CharField, Exists, F, OuterRef, Value, When
+
+from ..models import (
+    CTeCancelamento, CTeDocumento, CTeProtocoloAutorizacao,
+    MDFeCancelamento, MDFeDocumento, MDFeProtocoloAutorizacao,
+)
+from .cache_paineis import invalidar_paineis
+from .fatos_cte import data_fato, recalcular_fatos
+
+TAMANHO_LOTE_STATUS = 2000
+
+# Status que equivalem ao antigo filtro de documento válido (autorizado e não cancelado)
+STATUS_CTE_VALIDO = ('autorizado',)
+STATUS_MDFE_VALIDO = ('autorizado', 'encerrado')
+# Status de documentos que receberam autorização (inclusive os cancelados/encerrados depois)
+STATUS_CTE_AUTORIZADO = ('autorizado', 'cancelado')
+STATUS_MDFE_AUTORIZADO = ('autorizado', 'encerrado', 'cancelado')
+
+_ROTULOS_STATUS = dict(CTeDocumento.STATUS_CHOICES + MDFeDocumento.STATUS_CHOICES)
+
+
+def expressao_status_cte():
+    """Expressão com o status de cada CT-e, para annotate() ou update()."""
+    return Case(
+        When(Exists(CTeCancelamento.objects.filter(cte=OuterRef('pk'), c_stat=135)), then=Value('cancelado')),
+        When(Exists(CTeProtocoloAutorizacao.objects.filter(cte=OuterRef('pk'), codigo_status=100)), then=Value('autorizado')),
+        When(Exists(CTeProtocoloAutorizacao.objects.filter(cte=OuterRef('pk'))), then=Value('rejeitado')),
+        default=Value('pendente'),
+        output_field=CharField(),
+    )
+
+
+def expressao_status_mdfe():
+    """Expressão com o status de cada MDF-e, para annotate() ou update()."""
+    return Case(
+        When(Exists(MDFeCancelamento.objects.filter(mdfe=OuterRef('pk'), c_stat=135)), then=Value('cancelado')),
+        When(encerrado=True, then=Value('encerrado')),
+        When(Exists(MDFeProtocoloAutorizacao.objects.filter(mdfe=OuterRef('pk'), codigo_status=100)), then=Value('autorizado')),
+        When(Exists(MDFeProtocoloAutorizacao.objects.filter(mdfe=OuterRef('pk'))), then=Value('rejeitado')),
+        default=Value('pendente'),
+        output_field=CharField(),
+    )
+
+
+def rotulo_status(status, processado, codigo_protocolo=None):
+    """Rótulo do status exibido nas listagens e exportações (CT-e e MDF-e)."""
+    if status == 'rejeitado':
+        # Só a rejeição precisa do protocolo, para exibir o código
+        return f"Rejeitado ({codigo_protocolo})" if codigo_protocolo is not None else "Rejeitado"
+    if status == 'pendente':
+        return "Processado (s/ Prot.)" if processado else "Pendente"
+    return _ROTULOS_STATUS.get(status, status)
+
+
+def coluna_status(valor, linha):
+    """Formatador da coluna status nas exportações (linha de values() com processado e protocolo__codigo_status)."""
+    return rotulo_status(valor, linha['processado'], linha.get('protocolo__codigo_status'))
+
+
+def _status_atual(modelo, expressao, doc):
+    linhas = list(modelo.objects.filter(pk=doc.pk).annotate(s=expressao).values_list('s', flat=True).order_by()[:1])
+    return linhas[0] if linhas else doc.status
+
+
+def atualizar_status_cte(cte_doc, salvar=True):
+    """
+    Recalcula o status do CT-e a partir do protocolo/cancelamento gravados.
+    Com salvar=False só atualiza a instância (o chamador salva em seguida).
+    """
+    cte_doc.status = _status_atual(CTeDocumento, expressao_status_cte(), cte_doc)
+    if salvar:
+        cte_doc.save(update_fields=['status'])
+    return cte_doc.status
+
+
+def atualizar_status_mdfe(mdfe_doc, salvar=True):
+    """
+    Recalcula o status do MDF-e a partir do protocolo, cancelamento e encerramento gravados.
+    Com salvar=False só atualiza a instância (o chamador salva em seguida).
+    """
+    mdfe_doc.status = _status_atual(MDFeDocumento, expressao_status_mdfe(), mdfe_doc)
+    if salvar:
+        mdfe_doc.save(update_fields=['status'])
+    return mdfe_doc.status
+
+
+def recalcular_status(modelo, expressao, tamanho_lote=TAMANHO_LOTE_STATUS):
+    """Grava o status calculado de todos os documentos do modelo, em lotes. Retorna os pks alterados."""
+    ids = list(modelo.objects.order_by('pk').values_list('pk', flat=True))
+    alterados = []
+    for i in range(0, len(ids), tamanho_lote):
+        lote = modelo.objects.filter(pk__in=ids[i:i + tamanho_lote])
+        with transaction.atomic():
+            alterados.extend(
+                lote.annotate(novo_status=expressao).exclude(status=F('novo_status')).values_list('pk', flat=True)
+            )
+            lote.update(status=expressao)
+    return alterados
+
+
+def _meses_emissao(ctes_ids, tamanho_lote=TAMANHO_LOTE_STATUS):
+    meses = set()
+    for i in range(0, len(ctes_ids), tamanho_lote):
+        emissoes = CTeDocumento.objects.filter(pk__in=ctes_ids[i:i + tamanho_lote]).values_list(
+            'identificacao__data_emissao', flat=True
+        )
+        meses.update(data_fato(emissao).replace(day=1) for emissao in emissoes if emissao)
+    return sorted(meses)
+
+
+def recalcular_status_documentos(cte=True, mdfe=True, tamanho_lote=TAMANHO_LOTE_STATUS):
+    """
+    Preenche/recalcula a coluna status de CT-e e MDF-e. Os fatos diários dos meses
+    em que algum CT-e mudou de status são refeitos (a situação dos fatos é o
+    status), então a ordem em relação a recalcular_fatos_cte não importa.
+    Retorna {'cte': alterados, 'mdfe': alterados}.
+    """
+    resultado = {}
+    if cte:
+        alterados = recalcular_status(CTeDocumento, expressao_status_cte(), tamanho_lote)
+        for mes in _meses_emissao(alterados, tamanho_lote):
+            proximo_mes = (mes + timedelta(days=32)).replace(day=1)
+            recalcular_fatos(mes, proximo_mes - timedelta(days=1))
+        invalidar_paineis('cte')
+        resultado['cte'] = len(alterados)
+    if mdfe:
+        resultado['mdfe'] = len(recalcular_status(MDFeDocumento, expressao_status_mdfe(), tamanho_lote))
+        invalidar_paineis('mdfe')
+    return resultado
@@ -0,0 +1,132 @@
+# transport/services/xml_engine.py
+
+"""
+Motor de leitura de XML em passagem única.
+
+Percorre o XML uma única vez com um pull parser (ElementTree) e produz um
+índice plano de caminhos pontuados -> valores (ex: 'infCte.ide.cUF'), sem
+namespaces. Blocos repetíveis (ex: <infNFe>, <veic>) são registrados como
+grupos e coletados como listas de dicionários com caminhos relativos.
+
+Os parsers de documento consultam o índice por chave exata, sem converter o
+XML inteiro em dicionários aninhados e sem repetir a divisão de caminhos.
+"""
+
+import xml.etree.ElementTree as ET
+
+TAMANHO_BLOCO_LEITURA = 64 * 1024
+
+
+def _nome_local(tag):
+    """Remove o namespace ('{uri}nome' -> 'nome')."""
+    if tag[0] == '{':
+        return tag.rsplit('}', 1)[1]
+    return tag
+
+
+class XMLIndex:
+    """Resultado da leitura: valores escalares, grupos repetíveis e elementos presentes."""
+
+    __slots__ = ('raiz', 'raiz_attrs', 'valores', 'grupos', 'presentes')
+
+    def __init__(self):
+        self.raiz = None          # Nome local do elemento raiz
+        self.raiz_attrs = {}      # Atributos do elemento raiz
+        self.valores = {}         # 'caminho.tag' / 'caminho.@attr' -> texto
+        self.grupos = {}          # 'caminho.grupo' -> [ {caminho_relativo: texto} ]
+        self.presentes = set()    # Caminhos de todos os elementos encontrados fora de grupos
+
+    def get(self, caminho, default=None):
+        """Retorna o texto/atributo no caminho exato, ou default."""
+        valor = self.valores.get(caminho)
+        return default if valor is None else valor
+
+    def first(self, *caminhos, default=None):
+        """Retorna o primeiro valor não vazio entre os caminhos informados."""
+        for caminho in caminhos:
+            valor = self.valores.get(caminho)
+            if valor:
+                return valor
+        return default
+
+    def tem(self, caminho):
+        """Indica se o elemento existe no XML (mesmo que vazio)."""
+        return caminho in self.presentes or caminho in self.grupos
+
+    def grupo(self, caminho):
+        """Lista de itens coletados para um bloco repetível."""
+        return self.grupos.get(caminho, [])
+
+
+def indexar_xml(xml_text, ancoras=(), grupos=()):
+    """
+    Lê o XML uma única vez e devolve um XMLIndex.
+
+    ancoras: nomes locais que reiniciam o caminho (ex: 'infCte', 'protCTe'),
+             de modo que 'cteProc.CTe.infCte.ide' vira 'infCte.ide'
+             independente da raiz (cteProc, procCTe ou CTe).
+    grupos:  caminhos (já relativos às âncoras) de blocos repetíveis.
+    """
+    ancoras = frozenset(ancoras)
+    grupos = frozenset(grupos)
+    indice = XMLIndex()
+    valores = indice.valores
+    presentes = indice.presentes
+
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    caminhos = []        # Pilha de caminhos pontuados
+    tem_filhos = []      # Pilha de flags (elemento possui filhos?)
+    grupo_atual = None   # (caminho_grupo, prefixo_len, item)
+
+    def _consumir():
+        nonlocal grupo_atual
+        for evento, elem in parser.read_events():
+            if evento == 'start':
+                nome = _nome_local(elem.tag)
+                if not caminhos:
+                    indice.raiz = nome
+                    indice.raiz_attrs = dict(elem.attrib)
+                    caminho = nome
+                elif nome in ancoras:
+                    caminho = nome
+                else:
+                    caminho = caminhos[-1] + '.' + nome
+                if tem_filhos:
+                    tem_filhos[-1] = True
+                caminhos.append(caminho)
+                tem_filhos.append(False)
+
+                if grupo_atual is None and caminho in grupos:
+                    item = {}
+                    grupo_atual = (caminho, len(caminho) + 1, item)
+                    for attr, valor in elem.attrib.items():
+                        item['@' + _nome_local(attr)] = valor
+                elif grupo_atual is not None:
+                    rel = caminho[grupo_atual[1]:]
+                    for attr, valor in elem.attrib.items():
+                        grupo_atual[2][rel + '.@' + _nome_local(attr)] = valor
+                else:
+                    presentes.add(caminho)
+                    for attr, valor in elem.attrib.items():
+                        valores[caminho + '.@' + _nome_local(attr)] = valor
+            else:
+                caminho = caminhos.pop()
+                folha = not tem_filhos.pop()
+                texto = elem.text.strip() if (folha and elem.text) else None
+                if grupo_atual is not None:
+                    if caminho == grupo_atual[0]:
+                        indice.grupos.setdefault(caminho, []).append(grupo_atual[2])
+                        grupo_atual = None
+                    elif folha:
+                        grupo_atual[2][caminho[grupo_atual[1]:]] = texto or None
+                elif folha:
+                    valores[caminho] = texto or None
+                # Libera o subelemento já consumido para manter a memória constante
+                elem.clear()
+
+    for inicio in range(0, len(xml_text), TAMANHO_BLOCO_LEITURA):
+        parser.feed(xml_text[inicio:inicio + TAMANHO_BLOCO_LEITURA])
+        _consumir()
+    parser.close()
+    _consumir()
+    return indice
@@ -158,6 +158,36 @@ class ApiClient {
         return response.status === 204 ? null : response.json();
     }
 
+    /**
+     * Cursor (keyset) pagination for /api/ctes/ and /api/mdfes/.
+     * Returns { count, next, results }; pass `next` back to load the following page
+     * (null when there are no more). count is only filled when requested with
+     * options.count = 'aproximada' | 'exata'.
+     */
+    async getCursorPage(url, options = {}) {
+        const { count, pageSize, ...requestOptions } = options;
+        let pageUrl = url;
+        if (!/[?&]cursor=/.test(pageUrl)) {
+            const params = new URLSearchParams({ paginacao: 'cursor' });
+            if (pageSize) params.set('page_size', pageSize);
+            if (count) params.set('contagem', count);
+            pageUrl += (pageUrl.includes('?') ? '&' : '?') + params.toString();
+        }
+        return this.get(pageUrl, requestOptions);
+    }
+
+    /**
+     * Iterates over all cursor pages (infinite scroll / integrations):
+     *   for await (const results of apiClient.iterateCursorPages('/api/ctes/?modalidade=CIF')) { ... }
+     */
+    async *iterateCursorPages(url, options = {}) {
+        let page = await this.getCursorPage(url, options);
+        while (page) {
+            yield page.results;
+            page = page.next ? await this.getCursorPage(page.next, options) : null;
+        }
+    }
+
     /**
      * Upload file with progress tracking
      */
@@ -160,7 +160,7 @@ function onFormatoChange() {
     const formato = document.getElementById('formato').value;
     
     // Mostrar aviso para formatos não implementados
-    if (formato === 'xlsx' || formato === 'pdf') {
+    if (formato === 'pdf') {
         showNotification(
             `Formato ${formato.toUpperCase()} ainda não implementado. Será convertido para CSV.`,
             'warning'
@@ -732,7 +732,7 @@ async function baixarRelatorio() {
         let finalFormato = formato;
         
         // Converter formatos não implementados para CSV
-        if (formato === 'xlsx' || formato === 'pdf') {
+        if (formato === 'pdf') {
             finalFormato = 'csv';
             showNotification(
                 `Formato ${formato.toUpperCase()} convertido para CSV automaticamente`,
@@ -754,8 +754,12 @@ async function baixarRelatorio() {
             return;
         }
         
-        // Para outros formatos, fazer download
-        const response = await window.apiClient.request('GET', `/api/relatorios/?${queryString}`);
+        // Para outros formatos, gerar em segundo plano (relatório completo) e baixar o arquivo
+        showNotification('Gerando relatório...', 'info');
+        const tarefa = await aguardarTarefaRelatorio(
+            await window.apiClient.post('/api/relatorios/tarefas/', { tipo, formato: finalFormato, filtros })
+        );
+        const response = await window.apiClient.request('GET', tarefa.download_url);
         const blob = await response.blob();
         const url = window.URL.createObjectURL(blob);
         const a = document.createElement('a');
@@ -780,6 +784,20 @@ async function baixarRelatorio() {
     }
 }
 
+/**
+ * Consultar a tarefa de relatório até ela concluir (ou falhar)
+ */
+async function aguardarTarefaRelatorio(tarefa, intervaloMs = 2000) {
+    while (tarefa.status === 'pendente' || tarefa.status === 'processando') {
+        await new Promise(resolve => setTimeout(resolve, intervaloMs));
+        tarefa = await window.apiClient.get(`/api/relatorios/tarefas/${tarefa.id}/`);
+    }
+    if (tarefa.status !== 'concluido') {
+        throw new Error(tarefa.erro || 'Falha ao gerar o relatório');
+    }
+    return tarefa;
+}
+
 // =============== HELPERS E UTILITÁRIOS ===============
 
 /**
@@ -0,0 +1,67 @@
+# transport/tasks.py
+
+"""
+Tarefas Celery do app transport.
+
+O processamento de lotes de upload é dividido em uma tarefa por chave de
+documento (principal + eventos) e uma por CT-e/MDF-e sem chave identificada.
+Relatórios solicitados em /api/relatorios/tarefas/ são gerados por gerar_relatorio_task.
+"""
+
+import logging
+
+from celery import shared_task
+from django.db import transaction
+
+from .services.ingestao_xml import processar_grupo_lote, processar_arquivo_sem_chave_lote
+from .services.relatorios import executar_tarefa_relatorio, falhar_tarefa_relatorio
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name='transport.processar_grupo_lote')
+def processar_grupo_lote_task(lote_id, chave):
+    resultados = processar_grupo_lote(lote_id, chave)
+    return len(resultados)
+
+
+@shared_task(name='transport.processar_arquivo_sem_chave_lote')
+def processar_arquivo_sem_chave_lote_task(arquivo_id):
+    resultado = processar_arquivo_sem_chave_lote(arquivo_id)
+    return resultado['status'] if resultado else None
+
+
+@shared_task(name='transport.gerar_relatorio')
+def gerar_relatorio_task(tarefa_id):
+    tarefa = executar_tarefa_relatorio(tarefa_id)
+    return tarefa.status if tarefa else None
+
+
+def enfileirar_lote(lote, chaves, ids_sem_chave):
+    """Enfileira as tarefas do lote somente após o commit dos registros."""
+    lote_id = str(lote.id)
+
+    def _enfileirar():
+        for chave in chaves:
+            processar_grupo_lote_task.delay(lote_id, chave)
+        for arquivo_id in ids_sem_chave:
+            processar_arquivo_sem_chave_lote_task.delay(arquivo_id)
+
+    transaction.on_commit(_enfileirar)
+
+
+def enfileirar_relatorio(tarefa):
+    """
+    Enfileira a geração do relatório somente após o commit da tarefa. Se o broker
+    recusar, a tarefa vai direto para erro em vez de ficar pendente.
+    """
+    tarefa_id = str(tarefa.id)
+
+    def _enfileirar():
+        try:
+            gerar_relatorio_task.delay(tarefa_id)
+        except Exception:
+            logger.exception("Não foi possível enfileirar o relatório da tarefa %s", tarefa_id)
+            falhar_tarefa_relatorio(tarefa_id, "Não foi possível enfileirar a geração do relatório.")
+
+    transaction.on_commit(_enfileirar)
@@ -0,0 +1,84 @@
+# transport/tests/test_fatos_cte.py
+
+import tempfile
+from datetime import date
+from decimal import Decimal
+
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.db import DataError
+from django.test import TestCase
+
+from ..models import CTeDocumento, CTeFatoDiario
+from ..services.fatos_cte import aplicar_delta, contribuicao_cte, recalcular_fatos
+from ..services.ingestao_xml import processar_cte
+from ..services.parser_cte import parse_cte_completo
+from .xml_exemplos import chave_cte, criar_cte, xml_cte
+
+DIA = date(2024, 1, 15)
+
+
+def _fatos():
+    return sorted(
+        CTeFatoDiario.objects.values_list('data', 'situacao', 'placa', 'quantidade', 'valor_total', 'dist_km')
+    )
+
+
+class FatosCTeTests(TestCase):
+    """Manutenção incremental de CTeFatoDiario pelos ganchos do parser."""
+
+    def test_parser_aplica_contribuicao(self):
+        criar_cte(chave=chave_cte(1), numero=1, valor='100.00')
+        criar_cte(chave=chave_cte(2), numero=2, valor='50.25')
+
+        self.assertEqual(_fatos(), [(DIA, 'autorizado', 'ABC1D23', 2, Decimal('150.25'), 0)])
+
+    def test_reprocessamento_troca_contribuicao_antiga_pela_nova(self):
+        doc = criar_cte(valor='100.00')
+        doc.xml_original = xml_cte(valor='80.00', placa='XYZ9A99')
+        doc.save(update_fields=['xml_original'])
+        parse_cte_completo(doc)
+
+        self.assertEqual(_fatos(), [(DIA, 'autorizado', 'XYZ9A99', 1, Decimal('80.00'), 0)])
+
+    def test_incremental_igual_ao_recalculo(self):
+        for n, (valor, placa) in enumerate([('10.00', 'AAA1A11'), ('20.00', 'AAA1A11'), ('5.50', 'BBB2B22')]):
+            criar_cte(chave=chave_cte(n), numero=n, valor=valor, placa=placa)
+        incremental = _fatos()
+
+        recalcular_fatos(DIA, DIA)
+
+        self.assertEqual(_fatos(), incremental)
+
+    def test_delta_em_linha_fora_de_sincronia_limita_a_zero(self):
+        doc = criar_cte(valor='10.00')
+        dimensoes, _ = contribuicao_cte(doc.chave)
+        CTeFatoDiario.objects.filter(**dimensoes).update(quantidade=2, dist_km=50)
+
+        # Remover mais KM do que a linha tem não pode violar o CHECK da coluna
+        aplicar_delta(dimensoes, (-1, Decimal('-5.00'), -100))
+
+        fato = CTeFatoDiario.objects.get(**dimensoes)
+        self.assertEqual((fato.quantidade, fato.valor_total, fato.dist_km), (1, Decimal('5.00'), 0))
+
+    def test_erro_de_banco_na_ingestao_nao_altera_fatos(self):
+        doc = criar_cte(valor='100.00')
+        fatos = _fatos()
+        save_original = CTeDocumento.save
+
+        def save_com_erro(instancia, *args, **kwargs):
+            # Falha no save() final do processar_cte, depois do update_or_create
+            if not kwargs.get('update_fields'):
+                raise DataError('valor fora do tamanho da coluna')
+            return save_original(instancia, *args, **kwargs)
+
+        media = self.enterContext(tempfile.TemporaryDirectory())
+        with self.settings(MEDIA_ROOT=media), mock.patch.object(CTeDocumento, 'save', save_com_erro):
+            codigo, dados = processar_cte(xml_cte(valor='80.00'), ContentFile(b'', name='cte.xml'), None)
+
+        self.assertEqual(codigo, 500)
+        self.assertIn('DB Error', dados['error'])
+        self.assertEqual(_fatos(), fatos)
+        doc.refresh_from_db()
+        self.assertTrue(doc.processado)
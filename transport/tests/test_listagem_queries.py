@@ -0,0 +1,62 @@
+# transport/tests/test_listagem_queries.py
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .xml_exemplos import chave_cte, criar_cte
+
+# Sessão + usuário da autenticação e o UPDATE da sessão (BEGIN/UPDATE/COMMIT)
+QUERIES_AUTENTICACAO = 5
+
+
+class ListagemCTeQueriesTests(TestCase):
+    """Listagem e exportação de CT-e: quantidade de consultas independente do número de linhas."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_login(User.objects.create_user('operador', password='x'))
+
+    def _criar_ctes(self, quantidade):
+        for n in range(quantidade):
+            criar_cte(chave=chave_cte(n), numero=n + 1, placa=f'ABC{n:04d}')
+
+    def _conteudo(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def _assert_consultas(self, linhas, consultas, url, params=None):
+        self._criar_ctes(linhas)
+        with self.assertNumQueries(QUERIES_AUTENTICACAO + consultas):
+            response = self.client.get(url, params or {})
+            conteudo = self._conteudo(response)
+        self.assertEqual(response.status_code, 200)
+        return response, conteudo
+
+    # Página por número: count + página (placa principal vem da subconsulta anotada)
+    def test_pagina_com_uma_linha(self):
+        response, _ = self._assert_consultas(1, 2, '/api/ctes/')
+        self.assertEqual(response.data['results'][0]['placa_principal'], 'ABC0000')
+
+    def test_pagina_cheia(self):
+        response, _ = self._assert_consultas(5, 2, '/api/ctes/')
+        self.assertEqual(len(response.data['results']), 5)
+
+    # Página por cursor: só a consulta da página (sem count)
+    def test_pagina_cursor_com_uma_linha(self):
+        response, _ = self._assert_consultas(1, 1, '/api/ctes/', {'paginacao': 'cursor'})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_pagina_cursor_com_muitas_linhas(self):
+        response, _ = self._assert_consultas(30, 1, '/api/ctes/', {'paginacao': 'cursor', 'page_size': 50})
+        self.assertEqual([r['placa_principal'] for r in response.data['results']][-1], 'ABC0000')
+        self.assertEqual(len(response.data['results']), 30)
+
+    # Exportação CSV: existência + leitura em blocos com values()
+    def test_exportacao_com_uma_linha(self):
+        _, conteudo = self._assert_consultas(1, 2, '/api/ctes/export/')
+        self.assertEqual(len(conteudo.decode('utf-8-sig').splitlines()), 2)
+
+    def test_exportacao_com_muitas_linhas(self):
+        _, conteudo = self._assert_consultas(30, 2, '/api/ctes/export/')
+        self.assertEqual(len(conteudo.decode('utf-8-sig').splitlines()), 31)
+        self.assertIn(chave_cte(29), conteudo.decode('utf-8-sig'))
@@ -0,0 +1,66 @@
+# transport/tests/test_parser_cte.py
+
+from decimal import Decimal
+
+from django.test import TestCase
+
+from ..models import CTeDocumento, CTeDocumentoTransportado, CTeVeiculoRodoviario
+from ..services.parser_cte import extrair_cte, parse_cte_completo
+from .xml_exemplos import CHAVE_CTE, criar_cte, xml_cte
+
+
+class ParserCTeTests(TestCase):
+    """Parser de passagem única: o XML de exemplo precisa chegar inteiro aos modelos CTe*."""
+
+    def test_persiste_todas_as_secoes(self):
+        doc = criar_cte()
+
+        self.assertTrue(doc.processado)
+        self.assertEqual(doc.status, 'autorizado')
+        self.assertEqual(doc.modalidade, 'FOB')
+        self.assertEqual(doc.versao, '4.00')
+
+        self.assertEqual(doc.identificacao.numero, 123)
+        self.assertEqual((doc.identificacao.uf_ini, doc.identificacao.uf_fim), ('SC', 'SP'))
+        self.assertEqual(doc.emitente.cnpj, '12345678000199')
+        # Endereço do remetente vem de <enderReme>
+        self.assertEqual((doc.remetente.razao_social, doc.remetente.logradouro), ('REM', 'R2'))
+        self.assertEqual(doc.destinatario.nome_municipio, 'SAO PAULO')
+
+        self.assertEqual(doc.prestacao.valor_total_prestado, Decimal('1500.50'))
+        self.assertEqual(
+            list(doc.prestacao.componentes.order_by('nome').values_list('nome', 'valor')),
+            [('FRETE PESO', Decimal('1000.00')), ('PEDAGIO', Decimal('500.50'))],
+        )
+
+        documentos = doc.documentos_transportados.order_by('tipo_documento', 'chave_nfe')
+        self.assertEqual([d.tipo_documento for d in documentos], ['NF', 'NFe', 'NFe'])
+        self.assertEqual(documentos[0].bc_icms_nf, Decimal('10.00'))
+
+        veiculo = doc.modal_rodoviario.veiculos.get()
+        self.assertEqual((veiculo.placa, veiculo.tara, veiculo.prop_cnpj), ('ABC1D23', 8000, '33333333000133'))
+        self.assertEqual(doc.modal_rodoviario.motoristas.get().cpf, '12345678901')
+
+        self.assertEqual(doc.protocolo.codigo_status, 100)
+        self.assertEqual(doc.suplementar.qr_code_url, 'https://qr')
+
+    def test_reprocessar_nao_duplica_filhos(self):
+        doc = criar_cte()
+        parse_cte_completo(doc)
+
+        self.assertEqual(CTeDocumentoTransportado.objects.filter(cte=doc).count(), 3)
+        self.assertEqual(CTeVeiculoRodoviario.objects.filter(modal__cte=doc).count(), 1)
+
+    def test_grafias_de_infcte_norm_sao_equivalentes(self):
+        oficial = xml_cte()
+        alternativa = oficial.replace('infCTeNorm>', 'infCteNorm>')
+        self.assertNotEqual(oficial, alternativa)
+
+        self.assertEqual(extrair_cte(oficial, CHAVE_CTE), extrair_cte(alternativa, CHAVE_CTE))
+
+    def test_xml_sem_infcte_marca_nao_processado(self):
+        doc = CTeDocumento.objects.create(chave=CHAVE_CTE, xml_original='<cteProc><outro/></cteProc>')
+
+        self.assertFalse(parse_cte_completo(doc))
+        doc.refresh_from_db()
+        self.assertFalse(doc.processado)
@@ -0,0 +1,48 @@
+# transport/tests/xml_exemplos.py
+
+"""XML de exemplo usados nos testes (CT-e 4.00 autorizado, modal rodoviário)."""
+
+from ..models import CTeDocumento
+from ..services.parser_cte import parse_cte_completo
+
+CHAVE_CTE = '42240112345678000199570010000001231000001234'
+
+CTE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<cteProc xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">
+<CTe><infCte Id="CTe{chave}" versao="4.00">
+<ide><cUF>42</cUF><cCT>00000123</cCT><CFOP>6353</CFOP><natOp>PRESTACAO</natOp><mod>57</mod><serie>1</serie><nCT>{numero}</nCT><dhEmi>{data_emissao}</dhEmi><tpImp>1</tpImp><tpEmis>1</tpEmis><cDV>4</cDV><tpAmb>1</tpAmb><tpCTe>0</tpCTe><procEmi>0</procEmi><verProc>1.0</verProc><cMunEnv>4205407</cMunEnv><xMunEnv>FLORIANOPOLIS</xMunEnv><UFEnv>SC</UFEnv><modal>01</modal><tpServ>0</tpServ><cMunIni>4205407</cMunIni><xMunIni>FLORIANOPOLIS</xMunIni><UFIni>SC</UFIni><cMunFim>3550308</cMunFim><xMunFim>SAO PAULO</xMunFim><UFFim>SP</UFFim><retira>0</retira><indIEToma>1</indIEToma><toma3><toma>3</toma></toma3></ide>
+<compl><xObs>Frete FOB</xObs><ObsCont xCampo="A"><xTexto>t1</xTexto></ObsCont><ObsCont xCampo="B"><xTexto>t2</xTexto></ObsCont></compl>
+<emit><CNPJ>12345678000199</CNPJ><IE>1</IE><xNome>EMIT</xNome><enderEmit><xLgr>Rua</xLgr><nro>1</nro><xBairro>C</xBairro><cMun>4205407</cMun><xMun>FLORIANOPOLIS</xMun><UF>SC</UF></enderEmit><CRT>3</CRT></emit>
+<rem><CNPJ>11111111000111</CNPJ><xNome>REM</xNome><enderReme><xLgr>R2</xLgr><nro>2</nro><xBairro>B</xBairro><cMun>4205407</cMun><xMun>FLORIANOPOLIS</xMun><UF>SC</UF></enderReme></rem>
+<dest><CNPJ>22222222000122</CNPJ><xNome>DEST</xNome><enderDest><xLgr>R3</xLgr><nro>3</nro><xBairro>B</xBairro><cMun>3550308</cMun><xMun>SAO PAULO</xMun><UF>SP</UF></enderDest></dest>
+<vPrest><vTPrest>{valor}</vTPrest><vRec>{valor}</vRec><Comp><xNome>FRETE PESO</xNome><vComp>1000.00</vComp></Comp><Comp><xNome>PEDAGIO</xNome><vComp>500.50</vComp></Comp></vPrest>
+<imp><ICMS><ICMS00><CST>00</CST><vBC>1500.50</vBC><pICMS>12.00</pICMS><vICMS>180.06</vICMS></ICMS00></ICMS><vTotTrib>180.06</vTotTrib></imp>
+<infCTeNorm><infCarga><vCarga>50000.00</vCarga><proPred>ALIMENTOS</proPred><infQ><cUnid>01</cUnid><tpMed>PESO BRUTO</tpMed><qCarga>1000.0000</qCarga></infQ><infQ><cUnid>03</cUnid><tpMed>UNIDADE</tpMed><qCarga>10.0000</qCarga></infQ></infCarga>
+<infDoc><infNFe><chave>42240111111111000111550010000000011000000010</chave></infNFe><infNFe><chave>42240111111111000111550010000000021000000020</chave></infNFe><infNF><mod>01</mod><serie>1</serie><nDoc>55</nDoc><dEmi>2024-01-10</dEmi><vBC>10</vBC><vICMS>1</vICMS><vBCST>0</vBCST><vST>0</vST><vProd>10</vProd><vNF>10</vNF><nCFOP>5102</nCFOP></infNF></infDoc>
+<infModal versaoModal="4.00"><rodo><RNTRC>12345678</RNTRC><veic><placa>{placa}</placa><tara>8000</tara><prop><CNPJ>33333333000133</CNPJ><xNome>PROP</xNome></prop></veic><moto><xNome>JOAO</xNome><CPF>12345678901</CPF></moto></rodo></infModal></infCTeNorm>
+<autXML><CNPJ>44444444000144</CNPJ></autXML>
+</infCte><infCTeSupl><qrCodCTe>https://qr</qrCodCTe></infCTeSupl></CTe>
+<protCTe versao="4.00"><infProt><tpAmb>1</tpAmb><verAplic>X</verAplic><chCTe>{chave}</chCTe><dhRecbto>2024-01-15T10:01:00-03:00</dhRecbto><nProt>{protocolo}</nProt><digVal>abc</digVal><cStat>100</cStat><xMotivo>Autorizado</xMotivo></infProt></protCTe>
+</cteProc>"""
+
+
+def xml_cte(chave=CHAVE_CTE, numero=123, data_emissao='2024-01-15T10:00:00-03:00', placa='ABC1D23', valor='1500.50'):
+    """XML do CT-e de exemplo com os campos que variam entre documentos."""
+    return CTE_XML.format(
+        chave=chave, numero=numero, data_emissao=data_emissao, placa=placa, valor=valor,
+        protocolo=f'1422400{numero:08d}',  # número do protocolo é único
+    )
+
+
+def chave_cte(n):
+    """Chave de 44 dígitos distinta para o n-ésimo CT-e de teste."""
+    return f'4224011234567800019957001{n:019d}'
+
+
+def criar_cte(**campos):
+    """Cria o CTeDocumento com o XML de exemplo e o processa com o parser."""
+    campos.setdefault('chave', CHAVE_CTE)
+    doc = CTeDocumento.objects.create(chave=campos['chave'], xml_original=xml_cte(**campos))
+    parse_cte_completo(doc)
+    doc.refresh_from_db()
+    return doc
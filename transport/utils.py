@@ -1,30 +1,116 @@
 import csv
-from io import StringIO
+from datetime import datetime, time, timedelta
 
-from django.http import HttpResponse
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework.response import Response
 from rest_framework import status
 
 
-def csv_response(queryset, serializer_class, filename):
-    """Return CSV as an :class:`HttpResponse` for the given queryset."""
+# Linhas lidas do banco por vez nas exportações (iterator(chunk_size=...))
+TAMANHO_BLOCO_EXPORTACAO = 2000
+# Linhas de CSV agrupadas em cada pedaço enviado ao cliente
+LINHAS_POR_ENVIO_CSV = 500
+
+
+class _Eco:
+    """Pseudo-arquivo para o csv.writer: devolve a linha formatada em vez de gravá-la."""
+
+    def write(self, valor):
+        return valor
+
+
+def formato_data_hora(formato):
+    """Formatador de coluna para DateTimeField no fuso local (ex: '%d/%m/%Y %H:%M')."""
+    def formatar(valor, linha):
+        return timezone.localtime(valor).strftime(formato) if valor else None
+    return formatar
+
+
+def data_hora_iso(valor, linha):
+    """DateTimeField no fuso local em ISO 8601, como na API."""
+    return timezone.localtime(valor).isoformat() if valor else None
+
+
+def moeda_brl(valor, linha):
+    """Valor monetário no formato 'R$ 1.234,56'."""
+    if valor is None:
+        return None
+    return f"R$ {valor:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+
+def blocos_csv(cabecalho, linhas):
+    """
+    Texto CSV (com BOM) do cabeçalho e das linhas (listas de valores), em
+    pedaços de LINHAS_POR_ENVIO_CSV linhas.
+    """
+    writer = csv.writer(_Eco())
+    # BOM para o Excel reconhecer o UTF-8
+    yield '\ufeff' + writer.writerow(cabecalho)
+    bloco = []
+    for linha in linhas:
+        bloco.append(writer.writerow(linha))
+        if len(bloco) >= LINHAS_POR_ENVIO_CSV:
+            yield ''.join(bloco)
+            bloco = []
+    if bloco:
+        yield ''.join(bloco)
+
+
+def linhas_csv(queryset, colunas, campos_extras=(), chunk_size=TAMANHO_BLOCO_EXPORTACAO):
+    """
+    Gera o CSV do queryset em pedaços de texto, com memória constante.
+
+    `colunas` é uma lista de nomes de campo (o cabeçalho é o próprio nome), ou de
+    (cabeçalho, campo) / (cabeçalho, campo, formatador): `campo` é um lookup de
+    values() (ex: 'identificacao__numero') ou uma anotação do queryset, e o
+    formatador recebe (valor, linha) com a linha inteira do values().
+    `campos_extras` são lidos só para uso dos formatadores.
+    """
+    colunas = [(coluna, coluna) if isinstance(coluna, str) else coluna for coluna in colunas]
+    campos = list(dict.fromkeys([coluna[1] for coluna in colunas] + list(campos_extras)))
+    linhas = queryset.prefetch_related(None).values(*campos).iterator(chunk_size=chunk_size)
+    return blocos_csv(
+        [coluna[0] for coluna in colunas],
+        (
+            [coluna[2](linha[coluna[1]], linha) if len(coluna) > 2 else linha[coluna[1]] for coluna in colunas]
+            for linha in linhas
+        ),
+    )
+
+
+def csv_streaming_response(queryset, colunas, filename, campos_extras=()):
+    """:class:`StreamingHttpResponse` com o CSV do queryset (ver linhas_csv)."""
+    response = StreamingHttpResponse(linhas_csv(queryset, colunas, campos_extras), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def csv_response(queryset, colunas, filename, campos_extras=()):
+    """CSV do queryset em streaming, ou 404 se não houver dados."""
     if not queryset.exists():
         return Response({"error": "Não há dados para gerar o relatório CSV."},
                        status=status.HTTP_404_NOT_FOUND)
+    return csv_streaming_response(queryset, colunas, filename, campos_extras)
 
-    serializer = serializer_class(queryset, many=True)
-    data = serializer.data
 
-    if not data:
-        return Response({"error": "Não há dados serializados para gerar o relatório CSV."},
-                       status=status.HTTP_404_NOT_FOUND)
+def inicio_do_dia(dia):
+    """Meia-noite do dia no fuso atual, como datetime aware."""
+    return timezone.make_aware(datetime.combine(dia, time.min))
 
-    field_names = list(data[0].keys())
-    output = StringIO()
-    writer = csv.DictWriter(output, fieldnames=field_names)
-    writer.writeheader()
-    writer.writerows(data)
 
-    response = HttpResponse(output.getvalue(), content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return response
+def filtro_periodo(campo, data_inicio=None, data_fim=None):
+    """
+    Q para o DateTimeField `campo` entre os dias data_inicio e data_fim (inclusive).
+
+    Equivale a campo__date__gte/__lte no fuso atual, mas compara a coluna com
+    limites [meia-noite de data_inicio, meia-noite do dia seguinte a data_fim),
+    sem o cast para data, para que o índice da coluna seja usado.
+    """
+    filtro = Q()
+    if data_inicio:
+        filtro &= Q(**{f'{campo}__gte': inicio_do_dia(data_inicio)})
+    if data_fim:
+        filtro &= Q(**{f'{campo}__lt': inicio_do_dia(data_fim + timedelta(days=1))})
+    return filtro
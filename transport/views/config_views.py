@@ -3,30 +3,25 @@
 # Imports padrão
 import os
 import json
-import csv
 import subprocess
 import tempfile
 import hashlib
 import shutil
 import traceback
-from io import StringIO
-from datetime import datetime
 from django.utils import timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
 # Imports Django
-from django.http import HttpResponse, JsonResponse, FileResponse
+from django.http import JsonResponse, FileResponse, StreamingHttpResponse
 from django.conf import settings
 from django.db import transaction
-from django.db.models import Sum
-from django.db.models.functions import TruncMonth
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ValidationError
 
 # Imports Django REST Framework
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
@@ -38,24 +33,22 @@ from ..serializers.config_serializers import ( # Use .. para voltar um nível
     ParametroSistemaSerializer,
     ConfiguracaoEmpresaSerializer,
     RegistroBackupSerializer,
+    SolicitacaoRelatorioSerializer,
+    TarefaRelatorioSerializer,
     # Adicionar serializers de relatórios se/quando criados
 )
-from ..serializers.vehicle_serializers import VeiculoSerializer, ManutencaoVeiculoSerializer
-from ..serializers.payment_serializers import PagamentoAgregadoSerializer, PagamentoProprioSerializer
 from ..models import (
     ParametroSistema,
     ConfiguracaoEmpresa,
     RegistroBackup,
-    Veiculo,
-    CTePrestacaoServico,
-    CTeDocumento,
-    CTeIdentificacao,
-    MDFeDocumento,
-    MDFeIdentificacao,
-    PagamentoAgregado,
-    PagamentoProprio,
-    ManutencaoVeiculo,
+    TarefaRelatorio,
 )
+from ..services.relatorios import (
+    FORMATOS_RELATORIO, RELATORIOS, TIPOS_CONTEUDO, FormatoIndisponivel,
+    csv_relatorio, datas_filtros, escrever_relatorio, expirar_tarefas_relatorio,
+    gerar_relatorio, limite_sincrono, linhas_simples, solicitar_relatorio, verificar_formato,
+)
+from ..tasks import enfileirar_relatorio
 
 # ===============================================================
 # ==> APIS PARA CONFIGURAÇÃO DO SISTEMA
@@ -378,6 +371,13 @@ class BackupAPIView(viewsets.ViewSet):
             return Response({"error": f"Erro inesperado ao gerar backup: {str(e)}"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def retrieve(self, request, *args, **kwargs):
+        tarefa = self.get_object()
+        # Tarefa parada (broker fora/worker morto) passa a erro para o cliente parar de consultar
+        if expirar_tarefas_relatorio(TarefaRelatorio.objects.filter(pk=tarefa.pk)):
+            tarefa.refresh_from_db()
+        return Response(self.get_serializer(tarefa).data)
+
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """Baixar um arquivo de backup existente pelo ID do registro."""
@@ -469,8 +469,10 @@ class BackupAPIView(viewsets.ViewSet):
 class RelatorioAPIView(APIView):
     """
     API para geração de relatórios em diversos formatos.
-    Suporta diferentes tipos de relatórios e formatos de saída.
-    Funcionalidade pendente de implementação.
+    Suporta diferentes tipos de relatórios e formatos de saída; as definições
+    (colunas tipadas e geradores de linhas) ficam em services/relatorios.py.
+    Gera dentro da requisição, com limite de linhas em alguns tipos (header
+    X-Relatorio-Limite); relatórios completos via TarefaRelatorioViewSet.
     """
     permission_classes = [IsAuthenticated]
 
@@ -479,7 +481,8 @@ class RelatorioAPIView(APIView):
         Endpoint para gerar relatórios.
         Parâmetros via query string:
         - tipo: Tipo de relatório (faturamento, veiculos, ctes, mdfes, pagamentos, km_rodado, manutencoes) - obrigatório
-        - formato: Formato de saída (csv, xlsx, pdf, json) - opcional, default csv
+        - formato: Formato de saída (csv, json, xlsx, parquet, arrow) - opcional, default csv.
+          xlsx requer openpyxl e parquet/arrow requerem pyarrow (501 se não instalados)
         - filtros: JSON (URL encoded) com filtros específicos para o relatório (ex: data_inicio, data_fim, placa, etc.) - opcional
         """
         params = request.query_params
@@ -497,443 +500,118 @@ class RelatorioAPIView(APIView):
             return Response({"error": "Formato de 'filtros' inválido. Deve ser um objeto JSON válido (URL encoded)."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Processar datas comuns se fornecidas nos filtros
-        data_inicio = None
-        data_fim = None
-        if 'data_inicio' in filtros:
-            try: data_inicio = datetime.strptime(filtros['data_inicio'], '%Y-%m-%d').date()
-            except (ValueError, TypeError): return Response({"error": "Formato de data_inicio inválido. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
-        if 'data_fim' in filtros:
-            try: data_fim = datetime.strptime(filtros['data_fim'], '%Y-%m-%d').date()
-            except (ValueError, TypeError): return Response({"error": "Formato de data_fim inválido. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # --- Chamada da Lógica de Geração Específica ---
-        # A implementação real ocorreria aqui, chamando funções auxiliares
         try:
-            if tipo == 'faturamento':
-                dados = self._gerar_relatorio_faturamento(data_inicio, data_fim, filtros)
-            elif tipo == 'veiculos':
-                dados = self._gerar_relatorio_veiculos(filtros)
-            elif tipo == 'ctes':
-                dados = self._gerar_relatorio_ctes(data_inicio, data_fim, filtros)
-            elif tipo == 'mdfes':
-                dados = self._gerar_relatorio_mdfes(data_inicio, data_fim, filtros)
-            elif tipo == 'pagamentos':
-                dados = self._gerar_relatorio_pagamentos(data_inicio, data_fim, filtros)
-            elif tipo == 'km_rodado':
-                dados = self._gerar_relatorio_km_rodado(data_inicio, data_fim, filtros)
-            elif tipo == 'manutencoes':
-                dados = self._gerar_relatorio_manutencoes(data_inicio, data_fim, filtros)
-            else:
-                 return Response({"error": f"Tipo de relatório '{tipo}' não suportado ou não implementado."}, status=status.HTTP_400_BAD_REQUEST)
+            data_inicio, data_fim = datas_filtros(filtros)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if tipo not in RELATORIOS:
+            return Response({"error": f"Tipo de relatório '{tipo}' não suportado ou não implementado."}, status=status.HTTP_400_BAD_REQUEST)
+        if formato not in FORMATOS_RELATORIO:
+            # pdf: ainda não implementado (requer reportlab, weasyprint ou similar)
+            return Response({"error": f"Formato '{formato}' não suportado."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Dentro da requisição vale o limite de linhas do relatório; sem limite só em segundo plano
+            limite = limite_sincrono(tipo)
+            colunas, linhas = gerar_relatorio(tipo, data_inicio, data_fim, filtros, limite=limite)
+            nome_arquivo = f"relatorio_{tipo}_{timezone.now().strftime('%Y%m%d')}.{formato}"
 
             # --- Formatação da Saída ---
             if formato == 'csv':
-                 filename = f"relatorio_{tipo}_{timezone.now().strftime('%Y%m%d')}.csv"
-                 return self._gerar_csv(dados, filename)
+                response = StreamingHttpResponse(csv_relatorio(colunas, linhas), content_type=TIPOS_CONTEUDO['csv'])
+                response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
             elif formato == 'json':
-                 return Response(dados)
-            # elif formato == 'xlsx':
-            #    # Implementar geração de XLSX (requer openpyxl ou similar)
-            #    return Response({"error": "Formato XLSX não implementado."}, status=501)
-            # elif formato == 'pdf':
-            #    # Implementar geração de PDF (requer reportlab, weasyprint ou similar)
-            #    return Response({"error": "Formato PDF não implementado."}, status=501)
+                response = Response(list(linhas_simples(colunas, linhas)))
             else:
-                 return Response({"error": f"Formato '{formato}' não suportado."}, status=status.HTTP_400_BAD_REQUEST)
+                # xlsx/parquet/arrow: gravados em arquivo temporário (memória limitada) e enviados em seguida
+                arquivo = tempfile.TemporaryFile()
+                try:
+                    escrever_relatorio(formato, colunas, linhas, arquivo, titulo=tipo)
+                except FormatoIndisponivel as e:
+                    arquivo.close()
+                    return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+                arquivo.seek(0)
+                response = FileResponse(arquivo, as_attachment=True, filename=nome_arquivo, content_type=TIPOS_CONTEUDO[formato])
+
+            if limite:
+                # Avisa o cliente que o resultado pode estar truncado (use /api/relatorios/tarefas/ para o completo)
+                response['X-Relatorio-Limite'] = str(limite)
+            return response
 
         except Exception as e:
             logger.warning("Erro ao gerar relatório '%s': %s", tipo, e)
             traceback.print_exc()
             return Response({"error": f"Erro interno ao gerar relatório: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    # --- Métodos Auxiliares de Geração (NÃO IMPLEMENTADOS) ---
-    def _gerar_relatorio_faturamento(self, data_inicio, data_fim, filtros):
-        """Gera dados agregados de faturamento por mês."""
-        qs = CTePrestacaoServico.objects.select_related('cte__identificacao')
-        if data_inicio:
-            qs = qs.filter(cte__identificacao__data_emissao__date__gte=data_inicio)
-        if data_fim:
-            qs = qs.filter(cte__identificacao__data_emissao__date__lte=data_fim)
-
-        agregados = qs.annotate(mes=TruncMonth('cte__identificacao__data_emissao'))\
-            .values('mes')\
-            .annotate(valor=Sum('valor_total_prestado'))\
-            .order_by('mes')
-
-        dados = []
-        for item in agregados:
-            mes = item['mes'].strftime('%Y-%m') if item['mes'] else 'N/A'
-            dados.append({'mes': mes, 'valor': float(item['valor'] or 0)})
-        return dados
-
-    def _gerar_relatorio_veiculos(self, filtros):
-        """Retorna dados do cadastro de veículos."""
-        qs = Veiculo.objects.all()
-        if 'ativo' in filtros:
-            qs = qs.filter(ativo=bool(filtros['ativo']))
-        if 'placa' in filtros:
-            qs = qs.filter(placa__icontains=filtros['placa'])
-        serializer = VeiculoSerializer(qs, many=True)
-        return serializer.data
-
-    def _gerar_relatorio_ctes(self, data_inicio, data_fim, filtros):
-        """Gera dados para o relatório de CT-es."""
-        logger.info("INFO: Gerando relatório de CT-es com filtros: %s", filtros)
-        
-        # Busca CT-es com dados básicos
-        qs = CTeDocumento.objects.select_related(
-            'identificacao', 'emitente', 'remetente', 'destinatario', 'prestacao'
-        ).prefetch_related('modal_rodoviario__veiculos')
-        
-        # Filtros por data
-        if data_inicio:
-            qs = qs.filter(identificacao__data_emissao__date__gte=data_inicio)
-        if data_fim:
-            qs = qs.filter(identificacao__data_emissao__date__lte=data_fim)
-            
-        # Filtros específicos
-        if 'chave' in filtros and filtros['chave']:
-            qs = qs.filter(chave__icontains=filtros['chave'])
-        if 'numero' in filtros and filtros['numero']:
-            qs = qs.filter(identificacao__numero=filtros['numero'])
-        if 'emitente' in filtros and filtros['emitente']:
-            qs = qs.filter(emitente__razao_social__icontains=filtros['emitente'])
-        if 'modalidade' in filtros and filtros['modalidade']:
-            qs = qs.filter(modalidade=filtros['modalidade'])
-        if 'processado' in filtros:
-            qs = qs.filter(processado=bool(filtros['processado']))
-            
-        # Limita quantidade para performance
-        qs = qs.order_by('-identificacao__data_emissao')[:1000]
-        
-        dados = []
-        for cte in qs:
-            # Pega placa do primeiro veículo se existir
-            placa = None
-            if hasattr(cte, 'modal_rodoviario') and cte.modal_rodoviario:
-                veiculos = cte.modal_rodoviario.veiculos.first()
-                if veiculos:
-                    placa = veiculos.placa
-                    
-            dados.append({
-                'chave': cte.chave,
-                'numero': cte.identificacao.numero if hasattr(cte, 'identificacao') else None,
-                'data_emissao': cte.identificacao.data_emissao.strftime('%Y-%m-%d %H:%M') if hasattr(cte, 'identificacao') and cte.identificacao.data_emissao else None,
-                'emitente': cte.emitente.razao_social if hasattr(cte, 'emitente') else None,
-                'remetente': cte.remetente.razao_social if hasattr(cte, 'remetente') else None,
-                'destinatario': cte.destinatario.razao_social if hasattr(cte, 'destinatario') else None,
-                'valor_total': float(cte.prestacao.valor_total_prestado) if hasattr(cte, 'prestacao') and cte.prestacao.valor_total_prestado else 0,
-                'modalidade': cte.modalidade or 'N/A',
-                'processado': cte.processado,
-                'placa': placa,
-                'km_distancia': cte.identificacao.dist_km if hasattr(cte, 'identificacao') else None,
-            })
-            
-        return dados
-
-    def _gerar_relatorio_mdfes(self, data_inicio, data_fim, filtros):
-        """Gera dados para o relatório de MDF-es."""
-        logger.info("INFO: Gerando relatório de MDF-es com filtros: %s", filtros)
-        
-        # Busca MDF-es com dados básicos
-        qs = MDFeDocumento.objects.select_related(
-            'identificacao', 'emitente', 'totais'
-        ).prefetch_related(
-            'modal_rodoviario__veiculo_tracao',
-            'condutores',
-            'docs_vinculados_mdfe'
+
+class TarefaRelatorioViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Relatórios gerados em segundo plano, sem limite de linhas.
+
+    - POST /api/relatorios/tarefas/ {tipo, formato, filtros}: cria a tarefa (ou
+      reaproveita uma igual em andamento/recente) e retorna o id (202 enquanto não conclui)
+    - GET /api/relatorios/tarefas/: tarefas do usuário
+    - GET /api/relatorios/tarefas/{id}/: situação da tarefa (download_url quando concluída)
+    - GET /api/relatorios/tarefas/{id}/download/: arquivo gerado
+    """
+    serializer_class = TarefaRelatorioSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        tarefas = TarefaRelatorio.objects.all()
+        if not self.request.user.is_staff:
+            tarefas = tarefas.filter(usuario=self.request.user.username)
+        return tarefas
+
+    def create(self, request, *args, **kwargs):
+        entrada = SolicitacaoRelatorioSerializer(data=request.data)
+        entrada.is_valid(raise_exception=True)
+        dados = entrada.validated_data
+        try:
+            verificar_formato(dados['formato'])
+        except FormatoIndisponivel as e:
+            return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        with transaction.atomic():
+            tarefa, reaproveitada = solicitar_relatorio(
+                dados['tipo'], dados['formato'], dados['filtros'], usuario=request.user.username
+            )
+            if not reaproveitada:
+                enfileirar_relatorio(tarefa)
+        logger.info(
+            "Relatório %s.%s solicitado por %s: tarefa %s%s",
+            tarefa.tipo, tarefa.formato, request.user.username, tarefa.id, " (reaproveitada)" if reaproveitada else "",
         )
-        
-        # Filtros por data
-        if data_inicio:
-            qs = qs.filter(identificacao__dh_emi__date__gte=data_inicio)
-        if data_fim:
-            qs = qs.filter(identificacao__dh_emi__date__lte=data_fim)
-            
-        # Filtros específicos
-        if 'chave' in filtros and filtros['chave']:
-            qs = qs.filter(chave__icontains=filtros['chave'])
-        if 'numero' in filtros and filtros['numero']:
-            qs = qs.filter(identificacao__n_mdf=filtros['numero'])
-        if 'emitente' in filtros and filtros['emitente']:
-            qs = qs.filter(emitente__razao_social__icontains=filtros['emitente'])
-        if 'encerrado' in filtros:
-            qs = qs.filter(encerrado=bool(filtros['encerrado']))
-        if 'processado' in filtros:
-            qs = qs.filter(processado=bool(filtros['processado']))
-            
-        # Limita quantidade para performance
-        qs = qs.order_by('-identificacao__dh_emi')[:1000]
-        
-        dados = []
-        for mdfe in qs:
-            # Pega placa do veículo de tração
-            placa_tracao = None
-            if hasattr(mdfe, 'modal_rodoviario') and mdfe.modal_rodoviario and hasattr(mdfe.modal_rodoviario, 'veiculo_tracao'):
-                placa_tracao = mdfe.modal_rodoviario.veiculo_tracao.placa
-                
-            # Conta CT-es vinculados
-            qtd_ctes = mdfe.docs_vinculados_mdfe.count()
-            
-            # Pega primeiro condutor
-            condutor = mdfe.condutores.first()
-            condutor_nome = condutor.nome if condutor else None
-            
-            dados.append({
-                'chave': mdfe.chave,
-                'numero': mdfe.identificacao.n_mdf if hasattr(mdfe, 'identificacao') else None,
-                'data_emissao': mdfe.identificacao.dh_emi.strftime('%Y-%m-%d %H:%M') if hasattr(mdfe, 'identificacao') and mdfe.identificacao.dh_emi else None,
-                'emitente': mdfe.emitente.razao_social if hasattr(mdfe, 'emitente') else None,
-                'uf_inicio': mdfe.identificacao.uf_ini if hasattr(mdfe, 'identificacao') else None,
-                'uf_fim': mdfe.identificacao.uf_fim if hasattr(mdfe, 'identificacao') else None,
-                'placa_tracao': placa_tracao,
-                'condutor': condutor_nome,
-                'qtd_ctes': qtd_ctes,
-                'valor_carga': float(mdfe.totais.v_carga) if hasattr(mdfe, 'totais') and mdfe.totais.v_carga else 0,
-                'peso_carga': float(mdfe.totais.q_carga) if hasattr(mdfe, 'totais') and mdfe.totais.q_carga else 0,
-                'encerrado': mdfe.encerrado,
-                'data_encerramento': mdfe.data_encerramento.strftime('%Y-%m-%d') if mdfe.data_encerramento else None,
-                'processado': mdfe.processado,
-            })
-            
-        return dados
-
-    def _gerar_relatorio_pagamentos(self, data_inicio, data_fim, filtros):
-        """Gera dados para o relatório de pagamentos (agregados e próprios)."""
-        logger.info("INFO: Gerando relatório de pagamentos com filtros: %s", filtros)
-        
-        dados = []
-        tipo_pagamento = filtros.get('tipo', 'todos')  # 'agregado', 'proprio' ou 'todos'
-        
-        # Pagamentos Agregados
-        if tipo_pagamento in ['agregado', 'todos']:
-            qs_agregados = PagamentoAgregado.objects.select_related('cte__identificacao')
-            
-            # Filtros por data (usando data_prevista)
-            if data_inicio:
-                qs_agregados = qs_agregados.filter(data_prevista__gte=data_inicio)
-            if data_fim:
-                qs_agregados = qs_agregados.filter(data_prevista__lte=data_fim)
-                
-            # Filtros específicos
-            if 'status' in filtros and filtros['status']:
-                qs_agregados = qs_agregados.filter(status=filtros['status'])
-            if 'placa' in filtros and filtros['placa']:
-                qs_agregados = qs_agregados.filter(placa__icontains=filtros['placa'])
-            if 'condutor' in filtros and filtros['condutor']:
-                qs_agregados = qs_agregados.filter(condutor_nome__icontains=filtros['condutor'])
-                
-            # Limita quantidade
-            qs_agregados = qs_agregados.order_by('-data_prevista')[:500]
-            
-            for pag in qs_agregados:
-                dados.append({
-                    'tipo': 'Agregado',
-                    'id': pag.id,
-                    'cte_numero': pag.cte.identificacao.numero if hasattr(pag.cte, 'identificacao') else None,
-                    'placa': pag.placa,
-                    'condutor': pag.condutor_nome,
-                    'cpf_condutor': pag.condutor_cpf,
-                    'valor_frete': float(pag.valor_frete_total),
-                    'percentual_repasse': float(pag.percentual_repasse),
-                    'valor_repassado': float(pag.valor_repassado),
-                    'status': pag.status,
-                    'data_prevista': pag.data_prevista.strftime('%Y-%m-%d'),
-                    'data_pagamento': pag.data_pagamento.strftime('%Y-%m-%d') if pag.data_pagamento else None,
-                    'observacoes': pag.obs or '',
-                })
-        
-        # Pagamentos Próprios
-        if tipo_pagamento in ['proprio', 'todos']:
-            qs_proprios = PagamentoProprio.objects.select_related('veiculo')
-            
-            # Filtros por data (usando periodo - mais complexo)
-            if data_inicio or data_fim:
-                periodo_filters = []
-                if data_inicio:
-                    periodo_inicio = data_inicio.strftime('%Y-%m')
-                    periodo_filters.append(('periodo__gte', periodo_inicio))
-                if data_fim:
-                    periodo_fim = data_fim.strftime('%Y-%m')
-                    periodo_filters.append(('periodo__lte', periodo_fim))
-                for field, value in periodo_filters:
-                    qs_proprios = qs_proprios.filter(**{field: value})
-                    
-            # Filtros específicos
-            if 'status' in filtros and filtros['status']:
-                qs_proprios = qs_proprios.filter(status=filtros['status'])
-            if 'placa' in filtros and filtros['placa']:
-                qs_proprios = qs_proprios.filter(veiculo__placa__icontains=filtros['placa'])
-                
-            # Limita quantidade
-            qs_proprios = qs_proprios.order_by('-periodo')[:500]
-            
-            for pag in qs_proprios:
-                dados.append({
-                    'tipo': 'Próprio',
-                    'id': pag.id,
-                    'cte_numero': None,  # Não se aplica a pagamentos próprios
-                    'placa': pag.veiculo.placa,
-                    'condutor': 'Condutor Próprio',
-                    'cpf_condutor': None,
-                    'valor_frete': None,  # Não se aplica
-                    'percentual_repasse': None,  # Não se aplica
-                    'valor_repassado': float(pag.valor_total_pagar),
-                    'status': pag.status,
-                    'data_prevista': None,  # Pagamentos próprios usam período
-                    'data_pagamento': pag.data_pagamento.strftime('%Y-%m-%d') if pag.data_pagamento else None,
-                    'observacoes': pag.obs or '',
-                    'periodo': pag.periodo,
-                    'km_total': pag.km_total_periodo,
-                    'valor_base_faixa': float(pag.valor_base_faixa) if pag.valor_base_faixa else 0,
-                    'ajustes': float(pag.ajustes),
-                })
-            
-        return dados
-
-    def _gerar_relatorio_km_rodado(self, data_inicio, data_fim, filtros):
-        """Gera dados para o relatório de KM rodado baseado em CT-es e manutenções."""
-        logger.info("INFO: Gerando relatório de KM rodado com filtros: %s", filtros)
-        
-        dados = []
-        
-        # Agrupa dados por placa para calcular KM total
-        km_por_placa = {}
-        
-        # KM dos CT-es (campo dist_km)
-        qs_ctes = CTeDocumento.objects.select_related('identificacao').prefetch_related('modal_rodoviario__veiculos')
-        
-        # Filtros por data
-        if data_inicio:
-            qs_ctes = qs_ctes.filter(identificacao__data_emissao__date__gte=data_inicio)
-        if data_fim:
-            qs_ctes = qs_ctes.filter(identificacao__data_emissao__date__lte=data_fim)
-            
-        # Filtro por placa se especificado
-        if 'placa' in filtros and filtros['placa']:
-            qs_ctes = qs_ctes.filter(modal_rodoviario__veiculos__placa__icontains=filtros['placa'])
-            
-        # Processa CT-es para somar KM
-        for cte in qs_ctes:
-            if hasattr(cte, 'modal_rodoviario') and cte.modal_rodoviario:
-                for veiculo in cte.modal_rodoviario.veiculos.all():
-                    placa = veiculo.placa
-                    km = cte.identificacao.dist_km if hasattr(cte, 'identificacao') and cte.identificacao.dist_km else 0
-                    
-                    if placa not in km_por_placa:
-                        km_por_placa[placa] = {
-                            'placa': placa,
-                            'km_ctes': 0,
-                            'km_manutencoes': 0,
-                            'qtd_ctes': 0,
-                            'qtd_manutencoes': 0,
-                            'ultima_manutencao': None,
-                            'km_total_estimado': 0
-                        }
-                    
-                    km_por_placa[placa]['km_ctes'] += km
-                    km_por_placa[placa]['qtd_ctes'] += 1
-        
-        # KM das manutenções (quilometragem registrada)
-        qs_manutencoes = ManutencaoVeiculo.objects.select_related('veiculo')
-        
-        # Filtros por data
-        if data_inicio:
-            qs_manutencoes = qs_manutencoes.filter(data_servico__gte=data_inicio)
-        if data_fim:
-            qs_manutencoes = qs_manutencoes.filter(data_servico__lte=data_fim)
-            
-        # Filtro por placa se especificado
-        if 'placa' in filtros and filtros['placa']:
-            qs_manutencoes = qs_manutencoes.filter(veiculo__placa__icontains=filtros['placa'])
-            
-        # Processa manutenções
-        for manutencao in qs_manutencoes:
-            placa = manutencao.veiculo.placa
-            km = manutencao.quilometragem or 0
-            
-            if placa not in km_por_placa:
-                km_por_placa[placa] = {
-                    'placa': placa,
-                    'km_ctes': 0,
-                    'km_manutencoes': 0,
-                    'qtd_ctes': 0,
-                    'qtd_manutencoes': 0,
-                    'ultima_manutencao': None,
-                    'km_total_estimado': 0
-                }
-            
-            # Para manutenções, usa a maior quilometragem como referência
-            if km > km_por_placa[placa]['km_manutencoes']:
-                km_por_placa[placa]['km_manutencoes'] = km
-                km_por_placa[placa]['ultima_manutencao'] = manutencao.data_servico.strftime('%Y-%m-%d')
-            
-            km_por_placa[placa]['qtd_manutencoes'] += 1
-        
-        # Converte para lista e calcula estimativas
-        for placa_data in km_por_placa.values():
-            # Estimativa simples: maior valor entre KM das manutenções e soma dos CT-es
-            km_estimado = max(placa_data['km_manutencoes'], placa_data['km_ctes'])
-            placa_data['km_total_estimado'] = km_estimado
-            
-            # Informações do veículo
-            try:
-                veiculo = Veiculo.objects.get(placa=placa_data['placa'])
-                placa_data['veiculo_ativo'] = veiculo.ativo
-                placa_data['proprietario'] = veiculo.proprietario_nome or 'Não informado'
-            except Veiculo.DoesNotExist:
-                placa_data['veiculo_ativo'] = False
-                placa_data['proprietario'] = 'Veículo não cadastrado'
-            
-            dados.append(placa_data)
-        
-        # Ordena por KM total estimado (maior primeiro)
-        dados.sort(key=lambda x: x['km_total_estimado'], reverse=True)
-        
-        return dados
-
-    def _gerar_relatorio_manutencoes(self, data_inicio, data_fim, filtros):
-        """Gera dados para o relatório de manutenções."""
-        logger.info("INFO: Gerando relatório de manutenções com filtros: %s", filtros)
-        # Exemplo básico de busca (sem filtros específicos da API, apenas data)
-        qs = ManutencaoVeiculo.objects.all()
-        if data_inicio: qs = qs.filter(data_servico__gte=data_inicio)
-        if data_fim: qs = qs.filter(data_servico__lte=data_fim)
-        # Aplicar outros filtros de 'filtros' aqui...
-        serializer = ManutencaoVeiculoSerializer(qs, many=True)
-        return serializer.data # Retorna dados serializados para CSV/JSON
-
-    # --- Método Auxiliar para Gerar CSV ---
-    def _gerar_csv(self, dados, nome_arquivo):
-        """Função auxiliar para gerar arquivos CSV a partir de uma lista de dicts."""
-        if not dados or not isinstance(dados, list):
-            # Se dados não for uma lista, retorna erro ou mensagem
-            if isinstance(dados, dict) and 'message' in dados:
-                return Response(dados, status=status.HTTP_501_NOT_IMPLEMENTED) # Retorna msg de não implementado
-            return Response({"error": "Formato de dados inválido para gerar CSV."},
-                           status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        # Se a lista estiver vazia, retorna CSV vazio com mensagem
-        if len(dados) == 0:
-            output = StringIO()
-            output.write("Nenhum dado encontrado para os filtros especificados.\n")
-            response = HttpResponse(output.getvalue(), content_type='text/csv; charset=utf-8')
-            response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
-            return response
-            
-        # Verifica se o primeiro item é um dicionário
-        if not isinstance(dados[0], dict):
-            return Response({"error": "Formato de dados inválido para gerar CSV."},
-                           status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Pega cabeçalhos do primeiro dicionário
-        fieldnames = list(dados[0].keys())
-        output = StringIO()
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
+        # Sem broker a tarefa roda no commit: relê a situação atual
+        tarefa.refresh_from_db()
+        resposta = self.get_serializer(tarefa).data
+        resposta['reaproveitada'] = reaproveitada
+        pronta = tarefa.status in ('concluido', 'erro')
+        return Response(resposta, status=status.HTTP_200_OK if pronta else status.HTTP_202_ACCEPTED)
 
-        writer.writeheader()
-        writer.writerows(dados)
+    def retrieve(self, request, *args, **kwargs):
+        tarefa = self.get_object()
+        # Tarefa parada (broker fora/worker morto) passa a erro para o cliente parar de consultar
+        if expirar_tarefas_relatorio(TarefaRelatorio.objects.filter(pk=tarefa.pk)):
+            tarefa.refresh_from_db()
+        return Response(self.get_serializer(tarefa).data)
 
-        response = HttpResponse(output.getvalue(), content_type='text/csv; charset=utf-8') # Adiciona charset
-        response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
-        return response
\ No newline at end of file
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Baixa o arquivo do relatório concluído."""
+        tarefa = self.get_object()
+        if tarefa.status != 'concluido' or not tarefa.arquivo:
+            return Response(
+                {"error": "Relatório ainda não disponível.", "status": tarefa.status},
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            arquivo = tarefa.arquivo.open('rb')
+        except FileNotFoundError:
+            return Response({"error": "Arquivo do relatório não encontrado (expirado)."}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(
+            arquivo, as_attachment=True, filename=os.path.basename(tarefa.arquivo.name),
+            content_type=TIPOS_CONTEUDO.get(tarefa.formato),
+        )
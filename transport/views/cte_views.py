@@ -1,13 +1,11 @@
 # transport/views/cte_views.py
 
 # Imports padrão
-import csv
-from datetime import datetime, timedelta
-from io import StringIO
+from datetime import datetime
 
 # Imports Django
 from django.http import HttpResponse
-from django.db.models import Q, Sum, Count, F
+from django.db.models import Q, Sum, Count, F, Exists, OuterRef
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 
@@ -40,98 +38,12 @@ from ..models import (
     CTeComponenteValor
 )
 from ..services.parser_cte import parse_cte_completo
+from ..services.ingestao_xml import hash_conteudo_xml
+from ..services.fatos_cte import placa_principal, registrar_alteracao_cte
 from ..services.dacte_generator import gerar_dacte_pdf
-
-
-def generate_csv_from_queryset(queryset, serializer_class):
-    """Gera CSV a partir de um queryset usando um serializer."""
-    output = StringIO()
-    
-    # Se não houver dados, retorna CSV vazio
-    if not queryset.exists():
-        writer = csv.writer(output)
-        writer.writerow(['Nenhum registro encontrado'])
-        output.seek(0)
-        return output.getvalue()
-    
-    # Serializa os dados
-    serializer = serializer_class(queryset, many=True)
-    data = serializer.data
-    
-    if not data:
-        writer = csv.writer(output)
-        writer.writerow(['Nenhum registro encontrado'])
-        output.seek(0)
-        return output.getvalue()
-    
-    # Obtém os campos do primeiro item e traduz para português
-    field_mapping = {
-        'id': 'ID',
-        'chave': 'Chave de Acesso',
-        'numero_cte': 'Número CT-e',
-        'serie_cte': 'Série',
-        'data_emissao': 'Data Emissão',
-        'modalidade': 'Modalidade',
-        'remetente_nome': 'Remetente',
-        'remetente_cnpj': 'CNPJ Remetente',
-        'destinatario_nome': 'Destinatário',
-        'destinatario_cnpj': 'CNPJ Destinatário',
-        'emitente_nome': 'Emitente',
-        'emitente_cnpj': 'CNPJ Emitente',
-        'uf_inicio': 'UF Início',
-        'uf_fim': 'UF Fim',
-        'valor_total': 'Valor Total',
-        'valor_recebido': 'Valor a Receber',
-        'placa_principal': 'Placa',
-        'status': 'Status',
-        'protocolo_numero': 'Protocolo',
-        'protocolo_data': 'Data Autorização',
-        'protocolo_codigo_status': 'Código Status',
-        'processado': 'Processado',
-        'data_upload': 'Data Upload'
-    }
-    
-    # Campos ordenados para o CSV
-    ordered_fields = [
-        'chave', 'numero_cte', 'serie_cte', 'data_emissao', 'modalidade',
-        'remetente_nome', 'remetente_cnpj', 'destinatario_nome', 'destinatario_cnpj',
-        'uf_inicio', 'uf_fim', 'valor_total', 'status', 'protocolo_numero'
-    ]
-    
-    # Filtra apenas os campos que existem nos dados
-    available_fields = [f for f in ordered_fields if f in data[0]]
-    fieldnames = [field_mapping.get(f, f) for f in available_fields]
-    
-    # Cria o CSV
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-    
-    for item in data:
-        # Cria row apenas com campos disponíveis
-        row = {}
-        for field in available_fields:
-            value = item.get(field, '')
-            # Formata valores especiais
-            if field == 'data_emissao' and value:
-                try:
-                    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                    value = dt.strftime('%d/%m/%Y %H:%M')
-                except:
-                    pass
-            elif field == 'valor_total' and value:
-                try:
-                    value = f"R$ {float(value):,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-                except:
-                    pass
-            elif field == 'modalidade' and not value:
-                value = 'N/I'
-            
-            row[field_mapping.get(field, field)] = value if value is not None else ''
-        
-        writer.writerow(row)
-    
-    output.seek(0)
-    return output.getvalue()
+from ..services.status_documento import STATUS_CTE_AUTORIZADO, coluna_status
+from ..pagination import DocumentosPagination
+from ..utils import csv_streaming_response, filtro_periodo, formato_data_hora, moeda_brl
 
 
 # ===============================================================
@@ -164,8 +76,28 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
     - autorizado: true/false
     - cancelado: true/false
     - q: Texto para busca geral
+
+    Paginação: por página (padrão) ou por cursor com paginacao=cursor
+    (+ page_size e contagem=aproximada|exata); no modo cursor a ordem é
+    sempre a de upload mais recente e o parâmetro ordering é ignorado.
     """
     permission_classes = [IsAuthenticated]
+    pagination_class = DocumentosPagination
+
+    # Colunas do CSV de export: (cabeçalho, campo de values(), formatador)
+    COLUNAS_EXPORTACAO = [
+        ('Chave de Acesso', 'chave'),
+        ('Número CT-e', 'identificacao__numero'),
+        ('Série', 'identificacao__serie'),
+        ('Data Emissão', 'identificacao__data_emissao', formato_data_hora('%d/%m/%Y %H:%M')),
+        ('Modalidade', 'modalidade', lambda valor, linha: valor or 'N/I'),
+        ('Remetente', 'remetente__razao_social'),
+        ('Destinatário', 'destinatario__razao_social'),
+        ('UF Início', 'identificacao__uf_ini'),
+        ('UF Fim', 'identificacao__uf_fim'),
+        ('Valor Total', 'prestacao__valor_total_prestado', moeda_brl),
+        ('Status', 'status', coluna_status),
+    ]
 
     def get_serializer_class(self):
         """Define o serializer com base na ação."""
@@ -180,7 +112,8 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         Otimizações incluídas:
         - select_related para relações 1-1
         - prefetch_related para relações 1-N
-        - distinct() para evitar duplicatas
+        - placa principal anotada por subconsulta (sem uma query por linha na lista/export)
+        - filtros sobre relações 1-N via Exists, sem precisar de distinct()
         """
         # Base queryset com otimizações
         queryset = CTeDocumento.objects.select_related(
@@ -192,10 +125,14 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
             'protocolo',
             'cancelamento',
             'modal_rodoviario'
-        ).prefetch_related(
-            'modal_rodoviario__veiculos',
-            'prestacao__componentes'
+        ).annotate(
+            placa_principal_annotation=placa_principal()
         ).order_by('-data_upload')
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(
+                'modal_rodoviario__veiculos',
+                'prestacao__componentes'
+            )
 
         # Parâmetros da query
         params = self.request.query_params
@@ -207,15 +144,14 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         if data_inicio:
             try:
                 data_inicio_dt = datetime.strptime(data_inicio, '%Y-%m-%d').date()
-                queryset = queryset.filter(identificacao__data_emissao__date__gte=data_inicio_dt)
+                queryset = queryset.filter(filtro_periodo('identificacao__data_emissao', data_inicio=data_inicio_dt))
             except ValueError:
                 logger.warning(f"Data início inválida: {data_inicio}")
         
         if data_fim:
             try:
-                # Adiciona 1 dia para incluir todo o dia final
-                data_fim_dt = datetime.strptime(data_fim, '%Y-%m-%d').date() + timedelta(days=1)
-                queryset = queryset.filter(identificacao__data_emissao__date__lt=data_fim_dt)
+                data_fim_dt = datetime.strptime(data_fim, '%Y-%m-%d').date()
+                queryset = queryset.filter(filtro_periodo('identificacao__data_emissao', data_fim=data_fim_dt))
             except ValueError:
                 logger.warning(f"Data fim inválida: {data_fim}")
 
@@ -249,9 +185,9 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         # Filtro por placa
         placa = params.get('placa')
         if placa:
-            queryset = queryset.filter(
-                modal_rodoviario__veiculos__placa__iexact=placa
-            )
+            queryset = queryset.filter(Exists(
+                CTeVeiculoRodoviario.objects.filter(modal__cte=OuterRef('pk'), placa__iexact=placa)
+            ))
 
         # Filtro por status de processamento
         processado = params.get('processado')
@@ -264,22 +200,18 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         if autorizado is not None:
             is_authorized = autorizado.lower() in ['true', '1', 'sim']
             if is_authorized:
-                queryset = queryset.filter(protocolo__codigo_status=100)
+                queryset = queryset.filter(status__in=STATUS_CTE_AUTORIZADO)
             else:
-                queryset = queryset.filter(
-                    Q(protocolo__isnull=True) | ~Q(protocolo__codigo_status=100)
-                )
+                queryset = queryset.exclude(status__in=STATUS_CTE_AUTORIZADO)
 
         # Filtro por status de cancelamento
         cancelado = params.get('cancelado')
         if cancelado is not None:
             is_canceled = cancelado.lower() in ['true', '1', 'sim']
             if is_canceled:
-                queryset = queryset.filter(cancelamento__c_stat=135)
+                queryset = queryset.filter(status='cancelado')
             else:
-                queryset = queryset.filter(
-                    Q(cancelamento__isnull=True) | ~Q(cancelamento__c_stat=135)
-                )
+                queryset = queryset.exclude(status='cancelado')
 
         # Filtro por texto (busca geral)
         texto = params.get('q')
@@ -305,40 +237,29 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
             if ordering in valid_orderings:
                 queryset = queryset.order_by(ordering)
 
-        return queryset.distinct()
+        return queryset
 
     @action(detail=False, methods=['get'])
     def export(self, request):
         """
         Exporta os CT-es filtrados para CSV.
         
-        Usa os mesmos filtros da listagem.
+        Usa os mesmos filtros da listagem, sem limite de registros: o arquivo é
+        gerado em streaming, lendo o banco em blocos.
         Retorna arquivo CSV com encoding UTF-8 BOM para Excel.
         """
-        # Obtém queryset filtrado
         queryset = self.get_queryset()
-        
-        # Limita a quantidade de registros para evitar timeout
-        max_export = 10000
-        if queryset.count() > max_export:
-            return Response(
-                {"error": f"Limite de exportação excedido. Máximo {max_export} registros."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Gera o CSV
-        csv_content = generate_csv_from_queryset(queryset, CTeDocumentoListSerializer)
-        
-        # Prepara a resposta HTTP
         filename = f"ctes_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        response = HttpResponse(content_type='text/csv; charset=utf-8-sig')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        # Adiciona BOM para UTF-8 (melhora compatibilidade com Excel)
-        response.write('\ufeff')
-        response.write(csv_content)
-        
-        return response
+
+        if not queryset.exists():
+            response = HttpResponse('\ufeffNenhum registro encontrado\r\n', content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+
+        return csv_streaming_response(
+            queryset, self.COLUNAS_EXPORTACAO, filename,
+            campos_extras=('processado', 'protocolo__codigo_status'),
+        )
 
     @action(detail=True, methods=['get'])
     def xml(self, request, pk=None):
@@ -536,7 +457,8 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         Reprocessa o XML do CT-e.
         
         Útil quando houve alteração no parser ou erro no processamento inicial.
-        Requer que o XML original esteja disponível.
+        Requer que o XML original esteja disponível. Um CT-e já processado com
+        o mesmo XML só é reprocessado com 'forcar=true'.
         """
         cte = self.get_object()
 
@@ -553,16 +475,25 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        hash_conteudo = hash_conteudo_xml(cte.xml_original)
+        forcar = str(request.query_params.get('forcar') or request.data.get('forcar') or '').lower() in ['true', '1', 'sim']
+        if cte.processado and cte.hash_conteudo == hash_conteudo and not forcar:
+            return Response({
+                "message": "CT-e inalterado desde o último processamento. Use 'forcar=true' para reprocessar.",
+                "inalterado": True,
+                "cte": {"chave": cte.chave, "processado": cte.processado}
+            })
+
         # Log da operação
         logger.info(f"Iniciando reprocessamento do CT-e {cte.chave} por {request.user}")
 
-        # Reset do status
-        cte.processado = False
-        cte.save(update_fields=['processado'])
-
         try:
-            # Executa o parser
-            resultado = parse_cte_completo(cte)
+            # Reset do status e parser; a contribuição antiga nos fatos diários é medida antes do reset
+            with registrar_alteracao_cte(cte.chave):
+                cte.processado = False
+                cte.hash_conteudo = hash_conteudo
+                cte.save(update_fields=['processado', 'hash_conteudo'])
+                resultado = parse_cte_completo(cte)
             
             if resultado:
                 # Atualiza timestamp
@@ -592,8 +523,9 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         except Exception as e:
             logger.error(f"Erro ao reprocessar CT-e {cte.chave}: {str(e)}", exc_info=True)
             
-            # Garante que fica marcado como não processado
-            CTeDocumento.objects.filter(pk=cte.pk).update(processado=False)
+            # Garante que fica marcado como não processado (e fora dos fatos diários)
+            with registrar_alteracao_cte(cte.chave):
+                CTeDocumento.objects.filter(pk=cte.pk).update(processado=False)
             
             return Response(
                 {"error": f"Erro durante o reprocessamento: {str(e)}"},
@@ -613,8 +545,8 @@ class CTeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         stats = queryset.aggregate(
             total=Count('id'),
             processados=Count('id', filter=Q(processado=True)),
-            autorizados=Count('id', filter=Q(protocolo__codigo_status=100)),
-            cancelados=Count('id', filter=Q(cancelamento__c_stat=135)),
+            autorizados=Count('id', filter=Q(status__in=STATUS_CTE_AUTORIZADO)),
+            cancelados=Count('id', filter=Q(status='cancelado')),
             valor_total=Sum('prestacao__valor_total_prestado'),
             valor_receber=Sum('prestacao__valor_recebido')
         )
@@ -6,8 +6,8 @@ from datetime import date, datetime, timedelta, timezone
 from decimal import Decimal
 
 # Imports Django
-from django.db.models import Q, Sum, Count, Case, When, Value, CharField, DecimalField
-from django.db.models.functions import Coalesce, TruncDate, TruncMonth
+from django.db.models import Q, Sum, Count, Case, When, Value, CharField, DecimalField, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, TruncMonth
 from django.shortcuts import get_object_or_404 # Pode ser necessário em futuras expansões
 
 # Imports Django REST Framework
@@ -23,16 +23,39 @@ from ..serializers.dashboard_serializers import (  # Use .. para voltar um níve
     FinanceiroDetalheSerializer, CtePainelSerializer, MdfePainelSerializer,
     GeograficoPainelSerializer, AlertaPagamentoSerializer, AlertaSistemaSerializer
 )
+from ..services.cache_paineis import cache_painel
+from ..services.status_documento import STATUS_MDFE_VALIDO
+from ..utils import filtro_periodo
 from ..models import (  # Modelos usados para consultas nos painéis
     CTeDocumento, MDFeDocumento,
     CTeIdentificacao, CTePrestacaoServico, CTeRemetente, CTEDestinatario,
     CTeProtocoloAutorizacao, CTeCancelamento, CTeModalRodoviario, CTeVeiculoRodoviario,
     MDFeIdentificacao, MDFeProtocoloAutorizacao, MDFeCancelamento, MDFeModalRodoviario,
     MDFeVeiculoTracao, MDFeVeiculoReboque, MDFeDocumentosVinculados,
-    PagamentoAgregado, PagamentoProprio, AlertaSistema,
+    PagamentoAgregado, PagamentoProprio, AlertaSistema, CTeFatoDiario,
     # Adicione outros modelos se forem usados nas queries dos painéis
 )
 
+# ===============================================================
+# ==> FATOS DIÁRIOS DE CT-e
+# ===============================================================
+# Os totais de CT-e dos painéis vêm de CTeFatoDiario (mantida por services/fatos_cte.py),
+# já agregada por dia e dimensão; 'autorizado' equivale ao filtro de CT-e válido
+# (processado, protocolo 100 e não cancelado).
+
+def _fatos_periodo(data_inicio, data_fim):
+    """Fatos diários de CT-e do período, com data_fim inclusiva."""
+    return CTeFatoDiario.objects.filter(data__gte=data_inicio, data__lte=data_fim)
+
+def _fatos_validos(data_inicio, data_fim):
+    return _fatos_periodo(data_inicio, data_fim).filter(situacao='autorizado')
+
+def _soma_valor(**kwargs):
+    return Coalesce(Sum('valor_total', **kwargs), Decimal('0'))
+
+def _soma_qtd():
+    return Coalesce(Sum('quantidade'), 0, output_field=IntegerField())
+
 # ===============================================================
 # ==> APIS PARA DASHBOARDS e PAINÉIS
 # ===============================================================
@@ -43,6 +66,7 @@ class DashboardGeralAPIView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @cache_painel('cte', 'mdfe')
     def get(self, request, format=None):
         """Retorna dados consolidados para o dashboard geral."""
         params = request.query_params
@@ -71,25 +95,21 @@ class DashboardGeralAPIView(APIView):
             except ValueError:
                 return Response({"error": "Formato de data inválido. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Ajusta data_fim para incluir o dia inteiro
-        data_fim_query = data_fim + timedelta(days=1)
-
         # Construir filtros para consultas
-        filtro_periodo_cte = Q(identificacao__data_emissao__date__gte=data_inicio, identificacao__data_emissao__date__lt=data_fim_query)
-        filtro_periodo_mdfe = Q(identificacao__dh_emi__date__gte=data_inicio, identificacao__dh_emi__date__lt=data_fim_query)
-        filtro_cte_valido = Q(processado=True, protocolo__codigo_status=100) & ~Q(cancelamento__c_stat=135)
-        filtro_mdfe_valido = Q(processado=True, protocolo__codigo_status=100) & ~Q(cancelamento__c_stat=135)
+        filtro_periodo_mdfe = filtro_periodo('identificacao__dh_emi', data_inicio, data_fim)
+        filtro_mdfe_valido = Q(processado=True, status__in=STATUS_MDFE_VALIDO)
 
         # === Obter dados para cards ===
-        ctes_validos_qs = CTeDocumento.objects.filter(filtro_periodo_cte & filtro_cte_valido)
-        total_ctes = ctes_validos_qs.count()
+        fatos_validos = _fatos_validos(data_inicio, data_fim)
         total_mdfes = MDFeDocumento.objects.filter(filtro_periodo_mdfe & filtro_mdfe_valido).count()
 
-        agregados_frete = ctes_validos_qs.aggregate(
-            total=Coalesce(Sum('prestacao__valor_total_prestado'), Decimal('0')),
-            cif=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='CIF')), Decimal('0')),
-            fob=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='FOB')), Decimal('0'))
+        agregados_frete = fatos_validos.aggregate(
+            qtd=_soma_qtd(),
+            total=_soma_valor(),
+            cif=_soma_valor(filter=Q(modalidade='CIF')),
+            fob=_soma_valor(filter=Q(modalidade='FOB'))
         )
+        total_ctes = agregados_frete['qtd']
         valor_total_fretes = agregados_frete['total']
         valor_cif = agregados_frete['cif']
         valor_fob = agregados_frete['fob']
@@ -97,11 +117,9 @@ class DashboardGeralAPIView(APIView):
         # === Dados para gráficos ===
         evolucao_mensal = []
         if periodo == 'mes': # Diário
-             ctes_agrupados = ctes_validos_qs.annotate(
-                 data=TruncDate('identificacao__data_emissao')
-             ).values('data').annotate(
-                 valor_cif=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='CIF')), Decimal('0')),
-                 valor_fob=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='FOB')), Decimal('0'))
+             ctes_agrupados = fatos_validos.values('data').annotate(
+                 valor_cif=_soma_valor(filter=Q(modalidade='CIF')),
+                 valor_fob=_soma_valor(filter=Q(modalidade='FOB'))
              ).order_by('data')
              for item in ctes_agrupados:
                  evolucao_mensal.append({
@@ -111,11 +129,11 @@ class DashboardGeralAPIView(APIView):
                      'total': float(item['valor_cif'] + item['valor_fob'])
                  })
         else: # Mensal (Trimestre ou Ano)
-            ctes_agrupados = ctes_validos_qs.annotate(
-                mes=TruncMonth('identificacao__data_emissao')
+            ctes_agrupados = fatos_validos.annotate(
+                mes=TruncMonth('data')
             ).values('mes').annotate(
-                valor_cif=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='CIF')), Decimal('0')),
-                valor_fob=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='FOB')), Decimal('0'))
+                valor_cif=_soma_valor(filter=Q(modalidade='CIF')),
+                valor_fob=_soma_valor(filter=Q(modalidade='FOB'))
             ).order_by('mes')
             for item in ctes_agrupados:
                 if item['mes']: # Evitar erro se mes for None
@@ -143,12 +161,9 @@ class DashboardGeralAPIView(APIView):
             data_inicio_anterior = data_inicio - timedelta(days=30) # Exemplo fallback
             data_fim_anterior = data_fim - timedelta(days=30)
 
-        data_fim_anterior_query = data_fim_anterior + timedelta(days=1)
-        filtro_anterior_cte = Q(identificacao__data_emissao__date__gte=data_inicio_anterior, identificacao__data_emissao__date__lt=data_fim_anterior_query)
-
-        valor_total_fretes_anterior = CTeDocumento.objects.filter(
-            filtro_anterior_cte & filtro_cte_valido
-        ).aggregate(total=Coalesce(Sum('prestacao__valor_total_prestado'), Decimal('0')))['total']
+        valor_total_fretes_anterior = _fatos_validos(
+            data_inicio_anterior, data_fim_anterior
+        ).aggregate(total=_soma_valor())['total']
 
         crescimento_percentual = 0.0
         if valor_total_fretes_anterior > 0:
@@ -212,6 +227,7 @@ class FinanceiroPainelAPIView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @cache_painel('cte')
     def get(self, request):
         params = request.query_params
         periodo = params.get('periodo', 'ano')
@@ -239,20 +255,12 @@ class FinanceiroPainelAPIView(APIView):
             except ValueError:
                 return Response({"error": "Formato de data inválido. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Ajusta data_fim para incluir o dia inteiro
-        data_fim_query = data_fim + timedelta(days=1)
-
-        # Filtros para consultas
-        filtro_periodo_cte = Q(identificacao__data_emissao__date__gte=data_inicio, identificacao__data_emissao__date__lt=data_fim_query)
-        filtro_cte_valido = Q(processado=True, protocolo__codigo_status=100) & ~Q(cancelamento__c_stat=135)
-
         # === Cards com indicadores ===
-        ctes_validos_qs = CTeDocumento.objects.filter(filtro_periodo_cte & filtro_cte_valido)
-        agregados = ctes_validos_qs.aggregate(
-            total_faturamento=Coalesce(Sum('prestacao__valor_total_prestado'), Decimal('0')),
-            total_ctes=Count('id'),
-            valor_cif=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='CIF')), Decimal('0')),
-            valor_fob=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='FOB')), Decimal('0'))
+        agregados = _fatos_validos(data_inicio, data_fim).aggregate(
+            total_faturamento=_soma_valor(),
+            total_ctes=_soma_qtd(),
+            valor_cif=_soma_valor(filter=Q(modalidade='CIF')),
+            valor_fob=_soma_valor(filter=Q(modalidade='FOB'))
         )
 
         faturamento_total = agregados['total_faturamento']
@@ -266,17 +274,14 @@ class FinanceiroPainelAPIView(APIView):
 
         # Faturamento mensal (considerando um período maior para gráfico de tendência, ex: último ano)
         ano_atras = data_inicio - timedelta(days=365) # Ajuste conforme necessário
-        filtro_grafico_cte = Q(identificacao__data_emissao__date__gte=ano_atras, identificacao__data_emissao__date__lt=data_fim_query)
 
-        faturamento_por_mes = CTeDocumento.objects.filter(
-            filtro_grafico_cte & filtro_cte_valido
-        ).annotate(
-            mes=TruncMonth('identificacao__data_emissao')
+        faturamento_por_mes = _fatos_validos(ano_atras, data_fim).annotate(
+            mes=TruncMonth('data')
         ).values('mes').annotate(
-            faturamento=Coalesce(Sum('prestacao__valor_total_prestado'), Decimal('0')),
-            cif=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='CIF')), Decimal('0')),
-            fob=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='FOB')), Decimal('0')),
-            entregas=Count('id')
+            faturamento=_soma_valor(),
+            cif=_soma_valor(filter=Q(modalidade='CIF')),
+            fob=_soma_valor(filter=Q(modalidade='FOB')),
+            entregas=_soma_qtd()
         ).order_by('mes')
 
         # Formatar dados para o gráfico
@@ -320,6 +325,7 @@ class FinanceiroMensalAPIView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @cache_painel('cte')
     def get(self, request):
         # Obter mês/ano específico ou período
         mes_param = request.query_params.get('mes') # Formato AAAA-MM
@@ -346,21 +352,14 @@ class FinanceiroMensalAPIView(APIView):
              data_inicio = date(data_fim.year, data_fim.month, 1)
 
 
-        # Filtro para CT-es no período, válidos
-        data_fim_query = data_fim + timedelta(days=1)
-        filtro_periodo_cte = Q(identificacao__data_emissao__date__gte=data_inicio, identificacao__data_emissao__date__lt=data_fim_query)
-        filtro_cte_valido = Q(processado=True, protocolo__codigo_status=100) & ~Q(cancelamento__c_stat=135)
-
-        ctes = CTeDocumento.objects.filter(filtro_periodo_cte & filtro_cte_valido)
-
-        # Agrupa por mês
-        faturamento_por_mes = ctes.annotate(
-            mes_agg=TruncMonth('identificacao__data_emissao')
+        # Agrupa por mês os CT-es válidos do período
+        faturamento_por_mes = _fatos_validos(data_inicio, data_fim).annotate(
+            mes_agg=TruncMonth('data')
         ).values('mes_agg').annotate(
-            faturamento=Coalesce(Sum('prestacao__valor_total_prestado'), Decimal('0')),
-            cif=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='CIF')), Decimal('0')),
-            fob=Coalesce(Sum('prestacao__valor_total_prestado', filter=Q(modalidade='FOB')), Decimal('0')),
-            entregas=Count('id')
+            faturamento=_soma_valor(),
+            cif=_soma_valor(filter=Q(modalidade='CIF')),
+            fob=_soma_valor(filter=Q(modalidade='FOB')),
+            entregas=_soma_qtd()
         ).order_by('mes_agg')
 
         # Formatar dados
@@ -384,6 +383,7 @@ class FinanceiroDetalheAPIView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @cache_painel('cte')
     def get(self, request):
         params = request.query_params
         tipo = params.get('group', 'cliente') # cliente, veiculo, origem, destino
@@ -399,11 +399,9 @@ class FinanceiroDetalheAPIView(APIView):
         except ValueError:
             return Response({"error": "Formato de data inválido. Use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
 
-        data_fim_query = data_fim + timedelta(days=1)
-
         # Filtro base
-        filtro_base = Q(identificacao__data_emissao__date__gte=data_inicio, identificacao__data_emissao__date__lt=data_fim_query) & \
-                      Q(processado=True, protocolo__codigo_status=100) & ~Q(cancelamento__c_stat=135)
+        filtro_base = filtro_periodo('identificacao__data_emissao', data_inicio, data_fim) & \
+                      Q(processado=True, status='autorizado')
 
         ctes = CTeDocumento.objects.filter(filtro_base)
         resultados = []
@@ -500,6 +498,7 @@ class CtePainelAPIView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @cache_painel('cte')
     def get(self, request):
         params = request.query_params
         data_inicio_str = params.get('data_inicio')
@@ -517,33 +516,32 @@ class CtePainelAPIView(APIView):
             except ValueError:
                 return Response({"error": "Formato de data inválido. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
 
-        data_fim_query = data_fim + timedelta(days=1)
-
-        # Filtros para consultas
-        filtro_periodo = Q(identificacao__data_emissao__date__gte=data_inicio, identificacao__data_emissao__date__lt=data_fim_query)
-        filtro_valido = Q(processado=True, protocolo__codigo_status=100) & ~Q(cancelamento__c_stat=135)
-        ctes_no_periodo = CTeDocumento.objects.filter(filtro_periodo)
+        # Fatos do período (todas as situações) e apenas dos CT-es válidos
+        fatos_periodo = _fatos_periodo(data_inicio, data_fim)
+        fatos_validos = fatos_periodo.filter(situacao='autorizado')
 
         # === Card com totais ===
-        ctes_validos_qs = ctes_no_periodo.filter(filtro_valido)
-        total_ctes_validos = ctes_validos_qs.count()
-        valor_total = ctes_validos_qs.aggregate(t=Coalesce(Sum('prestacao__valor_total_prestado'), Decimal('0')))['t']
+        por_situacao = {
+            f['situacao']: f for f in fatos_periodo.values('situacao').annotate(qtd=_soma_qtd(), valor=_soma_valor())
+        }
+        total_ctes_validos = por_situacao.get('autorizado', {}).get('qtd', 0)
+        valor_total = por_situacao.get('autorizado', {}).get('valor', Decimal('0'))
 
-        total_autorizados = ctes_no_periodo.filter(protocolo__codigo_status=100, cancelamento__isnull=True).count()
-        total_cancelados = ctes_no_periodo.filter(cancelamento__c_stat=135).count()
-        total_rejeitados = ctes_no_periodo.filter(protocolo__isnull=False).exclude(protocolo__codigo_status=100).exclude(cancelamento__c_stat=135).count()
+        total_autorizados = total_ctes_validos
+        total_cancelados = por_situacao.get('cancelado', {}).get('qtd', 0)
+        total_rejeitados = por_situacao.get('rejeitado', {}).get('qtd', 0)
 
         # === Distribuição por cliente (destinatário) ===
-        clientes = ctes_validos_qs.values(
-            'destinatario__cnpj', 'destinatario__razao_social'
+        clientes = fatos_validos.values(
+            'destinatario_cnpj', 'destinatario_nome'
         ).annotate(
-            qtd=Count('id'),
-            valor=Sum('prestacao__valor_total_prestado')
+            qtd=_soma_qtd(),
+            valor=_soma_valor()
         ).order_by('-valor')[:10] # Top 10
 
         grafico_cliente = []
         for c in clientes:
-            nome = c['destinatario__razao_social'] or 'Sem Razão Social'
+            nome = c['destinatario_nome'] or 'Sem Razão Social'
             grafico_cliente.append({
                 'label': f"{nome[:25]}{'...' if len(nome)>25 else ''}", # Truncar nome
                 'valor': float(c['valor'] or 0),
@@ -551,9 +549,9 @@ class CtePainelAPIView(APIView):
             })
 
         # === Distribuição por modalidade (CIF/FOB) ===
-        distribuidor = ctes_validos_qs.values('modalidade').annotate(
-            qtd=Count('id'),
-            valor=Sum('prestacao__valor_total_prestado')
+        distribuidor = fatos_validos.values('modalidade').annotate(
+            qtd=_soma_qtd(),
+            valor=_soma_valor()
         ).order_by('modalidade')
 
         grafico_distribuidor = []
@@ -569,11 +567,11 @@ class CtePainelAPIView(APIView):
         tabela_cliente = []
         for c in clientes:
              ticket_medio = (c['valor'] / c['qtd']) if c['qtd'] else Decimal('0.00')
-             cnpj = c['destinatario__cnpj'] or ''
+             cnpj = c['destinatario_cnpj'] or ''
              if len(cnpj) == 14: cnpj = f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
 
              tabela_cliente.append({
-                 'nome': c['destinatario__razao_social'] or 'Sem Razão Social',
+                 'nome': c['destinatario_nome'] or 'Sem Razão Social',
                  'cnpj': cnpj,
                  'qtd': c['qtd'] or 0,
                  'valor': float(c['valor'] or 0),
@@ -605,6 +603,7 @@ class MdfePainelAPIView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @cache_painel('mdfe', 'cte')
     def get(self, request):
         params = request.query_params
         data_inicio_str = params.get('data_inicio')
@@ -622,52 +621,70 @@ class MdfePainelAPIView(APIView):
              except ValueError:
                  return Response({"error": "Formato de data inválido. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
 
-        data_fim_query = data_fim + timedelta(days=1)
-
         # Filtros MDF-e
-        filtro_periodo_mdfe = Q(identificacao__dh_emi__date__gte=data_inicio, identificacao__dh_emi__date__lt=data_fim_query)
-        filtro_mdfe_valido = Q(processado=True, protocolo__codigo_status=100) & ~Q(cancelamento__c_stat=135)
+        filtro_periodo_mdfe = filtro_periodo('identificacao__dh_emi', data_inicio, data_fim)
+        filtro_mdfe_valido = Q(processado=True, status__in=STATUS_MDFE_VALIDO)
         mdfes_no_periodo = MDFeDocumento.objects.filter(filtro_periodo_mdfe)
 
         # Filtros CT-e (para eficiência)
-        filtro_periodo_cte = Q(identificacao__data_emissao__date__gte=data_inicio, identificacao__data_emissao__date__lt=data_fim_query)
-        filtro_cte_valido = Q(processado=True, protocolo__codigo_status=100) & ~Q(cancelamento__c_stat=135)
+        filtro_periodo_cte = filtro_periodo('identificacao__data_emissao', data_inicio, data_fim)
+        filtro_cte_valido = Q(processado=True, status='autorizado')
+
+        # === Card com totais (uma única agregação) ===
+        cards = mdfes_no_periodo.aggregate(
+            total_mdfes=Count('id', filter=filtro_mdfe_valido),
+            total_autorizados=Count('id', filter=Q(status='autorizado')),
+            total_encerrados=Count('id', filter=Q(status='encerrado')),
+            total_cancelados=Count('id', filter=Q(status='cancelado')),
+        )
 
-        # === Card com totais ===
-        total_mdfes = mdfes_no_periodo.filter(filtro_mdfe_valido).count()
-        total_autorizados = mdfes_no_periodo.filter(protocolo__codigo_status=100, cancelamento__isnull=True, encerrado=False).count()
-        total_encerrados = mdfes_no_periodo.filter(protocolo__codigo_status=100, cancelamento__isnull=True, encerrado=True).count()
-        total_cancelados = mdfes_no_periodo.filter(cancelamento__c_stat=135).count()
+        # Documentos vinculados de cada MDF-e, como subconsulta (evita o GROUP BY sobre o join)
+        mdfes_validos = mdfes_no_periodo.filter(filtro_mdfe_valido).annotate(
+            total_docs=Coalesce(Subquery(
+                MDFeDocumentosVinculados.objects.filter(mdfe=OuterRef('pk'))
+                .values('mdfe').annotate(c=Count('id')).values('c')
+            ), Value(0), output_field=IntegerField())
+        )
 
-        # === Gráfico de relação CT-e por MDF-e ===
-        mdfes_com_ctes = mdfes_no_periodo.filter(filtro_mdfe_valido).annotate(total_ctes=Count('docs_vinculados_mdfe'))
+        # === Gráfico de relação CT-e por MDF-e (faixas calculadas no banco) ===
+        faixas = mdfes_validos.annotate(
+            faixa=Case(
+                When(total_docs=0, then=Value('0 CT-es')),
+                When(total_docs=1, then=Value('1 CT-e')),
+                When(total_docs__lte=5, then=Value('2 a 5 CT-es')),
+                When(total_docs__lte=10, then=Value('6 a 10 CT-es')),
+                default=Value('11+ CT-es'),
+                output_field=CharField(),
+            )
+        ).values('faixa').annotate(contagem=Count('id')).order_by()
         cte_mdfe_distribuicao = {'0 CT-es': 0, '1 CT-e': 0, '2 a 5 CT-es': 0, '6 a 10 CT-es': 0, '11+ CT-es': 0}
-        for mdfe in mdfes_com_ctes:
-            qtd = mdfe.total_ctes
-            if qtd == 0: cte_mdfe_distribuicao['0 CT-es'] += 1
-            elif qtd == 1: cte_mdfe_distribuicao['1 CT-e'] += 1
-            elif 2 <= qtd <= 5: cte_mdfe_distribuicao['2 a 5 CT-es'] += 1
-            elif 6 <= qtd <= 10: cte_mdfe_distribuicao['6 a 10 CT-es'] += 1
-            else: cte_mdfe_distribuicao['11+ CT-es'] += 1
+        for f in faixas:
+            cte_mdfe_distribuicao[f['faixa']] = f['contagem']
 
         grafico_cte_mdfe = [{'categoria': cat, 'contagem': cont} for cat, cont in cte_mdfe_distribuicao.items()]
 
-        # === Top veículos utilizados em MDF-es ===
-        veiculos_tracao = mdfes_no_periodo.filter(
-            filtro_mdfe_valido, modal_rodoviario__veiculo_tracao__isnull=False
-        ).values('modal_rodoviario__veiculo_tracao__placa').annotate(total=Count('id')).order_by('-total')[:10]
-        top_veiculos = [{'placa': v['modal_rodoviario__veiculo_tracao__placa'], 'total': v['total']} for v in veiculos_tracao if v['modal_rodoviario__veiculo_tracao__placa']]
+        # === Top veículos utilizados em MDF-es e tabela por veículo (um único GROUP BY por placa) ===
+        veiculos_tracao = mdfes_validos.filter(
+            modal_rodoviario__veiculo_tracao__isnull=False
+        ).exclude(
+            modal_rodoviario__veiculo_tracao__placa=''
+        ).values('modal_rodoviario__veiculo_tracao__placa').annotate(
+            total=Count('id'),
+            total_documentos=Sum('total_docs'),
+            encerrados=Count('id', filter=Q(encerrado=True)),
+        ).order_by('-total', 'modal_rodoviario__veiculo_tracao__placa')[:10]
 
-        # === Tabela de MDF-es por veículo (Top 5) ===
+        top_veiculos = []
         tabela_mdfe_veiculo = []
-        for v in top_veiculos[:5]:
-            placa = v['placa']
-            mdfes_veiculo = mdfes_no_periodo.filter(filtro_mdfe_valido, modal_rodoviario__veiculo_tracao__placa=placa)
-            total_mdfes_veiculo = mdfes_veiculo.count()
-            total_docs = MDFeDocumentosVinculados.objects.filter(mdfe__in=mdfes_veiculo).count()
-            encerrados = mdfes_veiculo.filter(encerrado=True).count()
+        for v in veiculos_tracao:
+            placa = v['modal_rodoviario__veiculo_tracao__placa']
+            total_mdfes_veiculo = v['total']
+            top_veiculos.append({'placa': placa, 'total': total_mdfes_veiculo})
+            if len(tabela_mdfe_veiculo) >= 5:
+                continue
+            total_docs = v['total_documentos'] or 0
+            encerrados = v['encerrados']
             percentual_encerrados = (encerrados / total_mdfes_veiculo * 100) if total_mdfes_veiculo else 0
-
             tabela_mdfe_veiculo.append({
                 'placa': placa, 'total_mdfes': total_mdfes_veiculo, 'total_documentos': total_docs,
                 'media_docs': round(total_docs / total_mdfes_veiculo, 2) if total_mdfes_veiculo else 0,
@@ -686,8 +703,7 @@ class MdfePainelAPIView(APIView):
         response_data = {
             'filtros': {'data_inicio': data_inicio.isoformat(), 'data_fim': data_fim.isoformat()},
             'cards': {
-                'total_mdfes': total_mdfes, 'total_autorizados': total_autorizados,
-                'total_encerrados': total_encerrados, 'total_cancelados': total_cancelados,
+                **cards,
                 'total_ctes_periodo': total_ctes_periodo, 'total_ctes_em_mdfes': total_ctes_em_mdfes
             },
             'grafico_cte_mdfe': grafico_cte_mdfe,
@@ -706,6 +722,7 @@ class GeograficoPainelAPIView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @cache_painel('cte')
     def get(self, request):
         params = request.query_params
         data_inicio_str = params.get('data_inicio')
@@ -723,76 +740,71 @@ class GeograficoPainelAPIView(APIView):
              except ValueError:
                  return Response({"error": "Formato de data inválido. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
 
-        data_fim_query = data_fim + timedelta(days=1)
-
-        # Filtros
-        filtro_periodo = Q(identificacao__data_emissao__date__gte=data_inicio, identificacao__data_emissao__date__lt=data_fim_query)
-        filtro_valido = Q(processado=True, protocolo__codigo_status=100) & ~Q(cancelamento__c_stat=135)
-        ctes_validos_qs = CTeDocumento.objects.filter(filtro_periodo & filtro_valido)
+        fatos_validos = _fatos_validos(data_inicio, data_fim)
 
         # === Principais origens ===
-        origens = ctes_validos_qs.values(
-            'identificacao__codigo_mun_ini', 'identificacao__nome_mun_ini', 'identificacao__uf_ini'
+        origens = fatos_validos.values(
+            'codigo_mun_ini', 'nome_mun_ini', 'uf_ini'
         ).annotate(
-            total=Count('id'),
-            valor=Sum('prestacao__valor_total_prestado')
+            total=_soma_qtd(),
+            valor=_soma_valor()
         ).order_by('-total')[:10] # Top 10 por quantidade
 
         top_origens = [{
-            'municipio': o['identificacao__nome_mun_ini'], 'uf': o['identificacao__uf_ini'],
-            'codigo': o['identificacao__codigo_mun_ini'], 'total': o['total'],
+            'municipio': o['nome_mun_ini'], 'uf': o['uf_ini'],
+            'codigo': o['codigo_mun_ini'], 'total': o['total'],
             'valor': float(o['valor'] or 0)
-        } for o in origens if o['identificacao__nome_mun_ini'] and o['identificacao__uf_ini']]
+        } for o in origens if o['nome_mun_ini'] and o['uf_ini']]
 
         # === Principais destinos ===
-        destinos = ctes_validos_qs.values(
-            'identificacao__codigo_mun_fim', 'identificacao__nome_mun_fim', 'identificacao__uf_fim'
+        destinos = fatos_validos.values(
+            'codigo_mun_fim', 'nome_mun_fim', 'uf_fim'
         ).annotate(
-            total=Count('id'),
-            valor=Sum('prestacao__valor_total_prestado')
+            total=_soma_qtd(),
+            valor=_soma_valor()
         ).order_by('-total')[:10]
 
         top_destinos = [{
-            'municipio': d['identificacao__nome_mun_fim'], 'uf': d['identificacao__uf_fim'],
-            'codigo': d['identificacao__codigo_mun_fim'], 'total': d['total'],
+            'municipio': d['nome_mun_fim'], 'uf': d['uf_fim'],
+            'codigo': d['codigo_mun_fim'], 'total': d['total'],
             'valor': float(d['valor'] or 0)
-        } for d in destinos if d['identificacao__nome_mun_fim'] and d['identificacao__uf_fim']]
+        } for d in destinos if d['nome_mun_fim'] and d['uf_fim']]
 
         # === Rotas mais frequentes ===
-        rotas = ctes_validos_qs.values(
-            'identificacao__codigo_mun_ini', 'identificacao__nome_mun_ini', 'identificacao__uf_ini',
-            'identificacao__codigo_mun_fim', 'identificacao__nome_mun_fim', 'identificacao__uf_fim'
+        rotas = fatos_validos.values(
+            'codigo_mun_ini', 'nome_mun_ini', 'uf_ini',
+            'codigo_mun_fim', 'nome_mun_fim', 'uf_fim'
         ).annotate(
-            total=Count('id'),
-            valor_total=Sum('prestacao__valor_total_prestado'),
-            km_total=Sum('identificacao__dist_km') # Soma KM total da rota
+            total=_soma_qtd(),
+            valor_total=_soma_valor(),
+            km_total=Coalesce(Sum('dist_km'), 0, output_field=IntegerField()) # Soma KM total da rota
         ).order_by('-total')[:15] # Top 15
 
         rotas_frequentes = []
         for r in rotas:
-            origem = r['identificacao__nome_mun_ini']
-            uf_ini = r['identificacao__uf_ini']
-            destino = r['identificacao__nome_mun_fim']
-            uf_fim = r['identificacao__uf_fim']
+            origem = r['nome_mun_ini']
+            uf_ini = r['uf_ini']
+            destino = r['nome_mun_fim']
+            uf_fim = r['uf_fim']
 
             if origem and uf_ini and destino and uf_fim:
                  rotas_frequentes.append({
-                     'origem': {'municipio': origem, 'uf': uf_ini, 'codigo': r['identificacao__codigo_mun_ini']},
-                     'destino': {'municipio': destino, 'uf': uf_fim, 'codigo': r['identificacao__codigo_mun_fim']},
+                     'origem': {'municipio': origem, 'uf': uf_ini, 'codigo': r['codigo_mun_ini']},
+                     'destino': {'municipio': destino, 'uf': uf_fim, 'codigo': r['codigo_mun_fim']},
                      'total': r['total'],
                      'valor': float(r['valor_total'] or 0),
                      'km_total': float(r['km_total'] or 0) # Adiciona KM
                  })
 
         # === Dados para mapa de rotas (simplificado - Top 5 fluxos por UF) ===
-        rotas_mapa_uf = ctes_validos_qs.values('identificacao__uf_ini', 'identificacao__uf_fim')\
-            .annotate(contagem=Count('id'), valor=Sum('prestacao__valor_total_prestado'))\
+        rotas_mapa_uf = fatos_validos.values('uf_ini', 'uf_fim')\
+            .annotate(contagem=_soma_qtd(), valor=_soma_valor())\
             .order_by('-contagem')[:5]
 
         rotas_mapa = [{
-            'uf_ini': r['identificacao__uf_ini'], 'uf_fim': r['identificacao__uf_fim'],
+            'uf_ini': r['uf_ini'], 'uf_fim': r['uf_fim'],
             'contagem': r['contagem'], 'valor': float(r['valor'] or 0)
-        } for r in rotas_mapa_uf if r['identificacao__uf_ini'] and r['identificacao__uf_fim']]
+        } for r in rotas_mapa_uf if r['uf_ini'] and r['uf_fim']]
 
 
         # Compilar resposta
@@ -814,6 +826,7 @@ class AlertasPagamentoAPIView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @cache_painel('pagamento', 'cte')
     def get(self, request, format=None):
         params = request.query_params
         dias_limite = int(params.get('dias', 7)) # Padrão: 7 dias
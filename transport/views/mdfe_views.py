@@ -1,11 +1,12 @@
 # transport/views/mdfe_views.py
 
 # Imports padrão
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Imports Django
 from django.http import HttpResponse
-from django.db.models import Q
+from django.db.models import Q, Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.shortcuts import get_object_or_404 # Usado internamente
 
@@ -37,18 +38,49 @@ from ..models import ( # Modelos usados pelo ViewSet e filtros
     CTeDocumento # Usado na action 'documentos'
 )
 from ..services.parser_mdfe import parse_mdfe_completo  # Serviço usado na action reprocessar
+from ..services.ingestao_xml import hash_conteudo_xml
+from ..services.status_documento import STATUS_MDFE_AUTORIZADO, coluna_status
 from ..services.damdfe_generator import gerar_damdfe_pdf  # Importar o gerador de DAMDFE
-from ..utils import csv_response
+from ..pagination import DocumentosPagination
+from ..utils import csv_response, data_hora_iso, filtro_periodo, formato_data_hora
 
 # ===============================================================
 # ==> APIS PARA MDF-e
 # ===============================================================
 
 class MDFeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
-    """API para consulta de MDF-es."""
+    """
+    API para consulta de MDF-es.
+    Paginação por página (padrão) ou por cursor com paginacao=cursor (ver transport/pagination.py).
+    """
     # queryset definido em get_queryset
     # serializer_class definido em get_serializer_class
     permission_classes = [IsAuthenticated]
+    pagination_class = DocumentosPagination
+
+    # Colunas lidas por MDFeDocumentoListSerializer (listagem)
+    CAMPOS_LISTAGEM = (
+        'id', 'chave', 'processado', 'data_upload', 'encerrado', 'status',
+        'identificacao__n_mdf', 'identificacao__dh_emi', 'identificacao__uf_ini', 'identificacao__uf_fim',
+        'modal_rodoviario__id', 'modal_rodoviario__veiculo_tracao__placa',
+        'protocolo__codigo_status',
+    )
+
+    # Colunas do CSV de export (mesmos campos da listagem), lidas com values()
+    COLUNAS_EXPORTACAO = [
+        'id',
+        'chave',
+        ('numero_mdfe', 'identificacao__n_mdf'),
+        ('data_emissao', 'identificacao__dh_emi', formato_data_hora('%d/%m/%Y %H:%M')),
+        ('uf_inicio', 'identificacao__uf_ini'),
+        ('uf_fim', 'identificacao__uf_fim'),
+        ('placa_tracao', 'modal_rodoviario__veiculo_tracao__placa'),
+        ('documentos_count', 'docs_count_annotation'),
+        ('status', 'status', coluna_status),
+        'processado',
+        ('data_upload', 'data_upload', data_hora_iso),
+        'encerrado',
+    ]
 
     def get_serializer_class(self):
         """Define o serializer com base na ação."""
@@ -56,17 +88,20 @@ class MDFeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
             return MDFeDocumentoDetailSerializer
         return MDFeDocumentoListSerializer
 
-    def get_queryset(self):
-        """
-        Permite filtrar os MDF-es por diversos parâmetros.
-        
-        Otimizações incluídas:
-        - select_related para relações 1-1
-        - prefetch_related para relações 1-N
-        - distinct() para evitar duplicatas
-        """
-        # Base queryset com otimizações para evitar N+1 queries
-        queryset = MDFeDocumento.objects.select_related(
+    def _plano_listagem(self, queryset):
+        """Só as colunas da listagem, com a contagem de documentos em subconsulta (sem prefetch)."""
+        return queryset.select_related(
+            'identificacao', 'modal_rodoviario__veiculo_tracao', 'protocolo'
+        ).only(*self.CAMPOS_LISTAGEM).annotate(
+            docs_count_annotation=Coalesce(Subquery(
+                MDFeDocumentosVinculados.objects.filter(mdfe=OuterRef('pk'))
+                .values('mdfe').annotate(c=Count('id')).values('c')
+            ), Value(0), output_field=IntegerField())
+        )
+
+    def _plano_detalhe(self, queryset):
+        """Grafo completo usado por MDFeDocumentoDetailSerializer."""
+        return queryset.select_related(
             'identificacao',
             'emitente', 
             'modal_rodoviario',
@@ -89,6 +124,7 @@ class MDFeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
             'municipios_descarga__docs_vinculados_municipio__cte_relacionado__remetente',
             'municipios_descarga__docs_vinculados_municipio__cte_relacionado__destinatario',
             'municipios_descarga__docs_vinculados_municipio__cte_relacionado__prestacao',
+            'municipios_descarga__docs_vinculados_municipio__cte_relacionado__modal_rodoviario__veiculos',
             'municipios_descarga__docs_vinculados_municipio__produtos_perigosos',
             'condutores',
             'modal_rodoviario__veiculos_reboque',
@@ -99,7 +135,19 @@ class MDFeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
             'seguros_carga__averbacoes',
             'lacres_rodoviarios',
             'autorizados_xml'
-        ).order_by('-data_upload')
+        )
+
+    def get_queryset(self):
+        """
+        Permite filtrar os MDF-es por diversos parâmetros.
+        
+        Plano de consulta por ação:
+        - list/export: only() das colunas da listagem + contagem de documentos em subconsulta
+        - retrieve: select_related/prefetch_related de todo o grafo do detalhe
+        - demais ações de um MDF-e (xml, damdfe, reprocessar, documentos) carregam o que usam
+        - filtros sobre relações 1-N via Exists, sem precisar de distinct()
+        """
+        queryset = MDFeDocumento.objects.order_by('-data_upload')
         
         params = self.request.query_params
 
@@ -107,11 +155,15 @@ class MDFeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         data_inicio = params.get('data_inicio')
         data_fim = params.get('data_fim')
         if data_inicio:
-            queryset = queryset.filter(identificacao__dh_emi__date__gte=data_inicio)
+            try:
+                data_inicio_obj = datetime.strptime(data_inicio, '%Y-%m-%d').date()
+                queryset = queryset.filter(filtro_periodo('identificacao__dh_emi', data_inicio=data_inicio_obj))
+            except ValueError:
+                pass
         if data_fim:
             try:
-                data_fim_obj = datetime.strptime(data_fim, '%Y-%m-%d').date() + timedelta(days=1)
-                queryset = queryset.filter(identificacao__dh_emi__date__lt=data_fim_obj)
+                data_fim_obj = datetime.strptime(data_fim, '%Y-%m-%d').date()
+                queryset = queryset.filter(filtro_periodo('identificacao__dh_emi', data_fim=data_fim_obj))
             except ValueError:
                 pass
 
@@ -135,7 +187,7 @@ class MDFeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         if placa:
             queryset = queryset.filter(
                 Q(modal_rodoviario__veiculo_tracao__placa=placa) |
-                Q(modal_rodoviario__veiculos_reboque__placa=placa)
+                Exists(MDFeVeiculoReboque.objects.filter(modal__mdfe=OuterRef('pk'), placa=placa))
             )
 
         # Filtro por status de processamento
@@ -149,18 +201,18 @@ class MDFeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
         if autorizado is not None:
             is_authorized = autorizado.lower() == 'true'
             if is_authorized:
-                queryset = queryset.filter(protocolo__codigo_status=100)
+                queryset = queryset.filter(status__in=STATUS_MDFE_AUTORIZADO)
             else:
-                queryset = queryset.filter(Q(protocolo__isnull=True) | ~Q(protocolo__codigo_status=100))
+                queryset = queryset.exclude(status__in=STATUS_MDFE_AUTORIZADO)
 
         # Filtro por status de cancelamento
         cancelado = params.get('cancelado')
         if cancelado is not None:
             is_canceled = cancelado.lower() == 'true'
             if is_canceled:
-                queryset = queryset.filter(cancelamento__c_stat=135)
+                queryset = queryset.filter(status='cancelado')
             else:
-                queryset = queryset.filter(Q(cancelamento__isnull=True) | ~Q(cancelamento__c_stat=135))
+                queryset = queryset.exclude(status='cancelado')
 
         # Filtro por status de encerramento
         encerrado = params.get('encerrado')
@@ -177,15 +229,19 @@ class MDFeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
                 Q(modal_rodoviario__veiculo_tracao__placa__icontains=texto)
             )
 
-        return queryset.distinct()
+        if self.action in ('list', 'export'):
+            return self._plano_listagem(queryset)
+        if self.action == 'retrieve':
+            return self._plano_detalhe(queryset)
+        return queryset
 
     # --- Actions ---
     @action(detail=False, methods=['get'])
     def export(self, request):
-        """Exporta os MDF-es filtrados para CSV."""
+        """Exporta os MDF-es filtrados para CSV (streaming, sem limite de registros)."""
         queryset = self.get_queryset()
         filename = f"mdfes_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        return csv_response(queryset, MDFeDocumentoListSerializer, filename)
+        return csv_response(queryset, self.COLUNAS_EXPORTACAO, filename, campos_extras=('protocolo__codigo_status',))
 
     @action(detail=True, methods=['get'])
     def xml(self, request, pk=None):
@@ -255,15 +311,25 @@ class MDFeDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=True, methods=['post'])
     def reprocessar(self, request, pk=None):
-        """Endpoint para solicitar o reprocessamento de um MDF-e."""
+        """
+        Endpoint para solicitar o reprocessamento de um MDF-e.
+        Um MDF-e já processado com o mesmo XML só é reprocessado com 'forcar=true'.
+        """
         mdfe = self.get_object()
 
         if not mdfe.xml_original:
             return Response({"error": "XML original não encontrado. Reprocessamento impossível."},
                            status=status.HTTP_400_BAD_REQUEST)
 
+        hash_conteudo = hash_conteudo_xml(mdfe.xml_original)
+        forcar = str(request.query_params.get('forcar') or request.data.get('forcar') or '').lower() in ['true', '1', 'sim']
+        if mdfe.processado and mdfe.hash_conteudo == hash_conteudo and not forcar:
+            return Response({"message": "MDF-e inalterado desde o último processamento. Use 'forcar=true' para reprocessar.",
+                             "inalterado": True})
+
         mdfe.processado = False
-        mdfe.save(update_fields=['processado'])
+        mdfe.hash_conteudo = hash_conteudo
+        mdfe.save(update_fields=['processado', 'hash_conteudo'])
 
         try:
             success = parse_mdfe_completo(mdfe)
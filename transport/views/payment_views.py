@@ -3,11 +3,11 @@
 # Imports padrão
 import re
 from datetime import date, datetime, timedelta, timezone
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 
 # Imports Django
 from django.http import HttpResponse
-from django.db.models import Q, Sum, OuterRef, Exists
+from django.db.models import Q, Sum
 from django.utils import timezone
 from django.shortcuts import get_object_or_404 # Usado internamente
 from django.db import transaction
@@ -41,13 +41,31 @@ from ..models import (  # Modelos usados pelos ViewSets
 )
 # Funções utilitárias de outros módulos (se necessário)
 # Ex: from ..utils import format_currency
-from ..utils import csv_response
+from ..utils import csv_response, data_hora_iso, filtro_periodo, formato_data_hora
+from ..services.cache_paineis import invalidar_paineis
+from ..services.pagamentos_agregados import gerar_pagamentos_agregados
 
 
 # ===============================================================
 # ==> APIS PARA PAGAMENTOS
 # ===============================================================
 
+class InvalidaPaineisPagamentoMixin:
+    """Gravações de pagamentos invalidam o cache dos painéis que dependem deles."""
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        invalidar_paineis('pagamento')
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        invalidar_paineis('pagamento')
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        invalidar_paineis('pagamento')
+
+
 class FaixaKMViewSet(viewsets.ModelViewSet):
     """API para CRUD de Faixas de KM para pagamento."""
     queryset = FaixaKM.objects.all().order_by('min_km')
@@ -104,12 +122,25 @@ class FaixaKMViewSet(viewsets.ModelViewSet):
         return queryset.filter(q1 | q2 | q3).exists()
 
 
-class PagamentoAgregadoViewSet(viewsets.ModelViewSet):
+class PagamentoAgregadoViewSet(InvalidaPaineisPagamentoMixin, viewsets.ModelViewSet):
     """API para gerenciar pagamentos a motoristas agregados."""
     queryset = PagamentoAgregado.objects.all().order_by('-data_prevista')
     serializer_class = PagamentoAgregadoSerializer
     permission_classes = [IsAuthenticated]
 
+    # Colunas do CSV de export (campos de leitura do serializer), lidas com values()
+    COLUNAS_EXPORTACAO = [
+        'id',
+        ('cte_chave', 'cte__chave'),
+        ('cte_numero', 'cte__identificacao__numero'),
+        ('cte_data_emissao', 'cte__identificacao__data_emissao', formato_data_hora('%d/%m/%Y')),
+        'placa', 'condutor_cpf', 'condutor_nome',
+        'valor_frete_total', 'percentual_repasse', 'valor_repassado',
+        'obs', 'status', 'data_prevista', 'data_pagamento',
+        ('criado_em', 'criado_em', data_hora_iso),
+        ('atualizado_em', 'atualizado_em', data_hora_iso),
+    ]
+
     def get_queryset(self):
         """Permite filtrar pagamentos por diversos parâmetros."""
         queryset = super().get_queryset()
@@ -149,7 +180,6 @@ class PagamentoAgregadoViewSet(viewsets.ModelViewSet):
         return queryset
 
     @action(detail=False, methods=['post'])
-    @transaction.atomic # Garante que a geração seja atômica
     def gerar(self, request):
         """
         Endpoint para gerar registros de pagamentos agregados em lote.
@@ -158,17 +188,23 @@ class PagamentoAgregadoViewSet(viewsets.ModelViewSet):
         - data_fim: Data final para filtrar CT-es (YYYY-MM-DD)
         - percentual: Percentual de repasse (opcional, padrão: 25%)
         - data_prevista: Data prevista para pagamento (opcional, padrão: hoje - YYYY-MM-DD)
+        - simular: true para apenas pré-visualizar (nada é gravado; retorna totais e prévia)
+
+        A geração é feita em blocos, cada um em sua transação (ver services/pagamentos_agregados.py).
         """
         data_inicio = request.data.get('data_inicio')
         data_fim = request.data.get('data_fim')
         percentual = request.data.get('percentual', 25.0)
         data_prevista_str = request.data.get('data_prevista', date.today().isoformat())
+        simular = str(request.data.get('simular', '')).lower() in ('1', 'true', 'sim')
 
         if not data_inicio or not data_fim:
             return Response({"error": "Parâmetros data_inicio e data_fim são obrigatórios"},
                            status=status.HTTP_400_BAD_REQUEST)
 
         try:
+            data_inicio = datetime.strptime(data_inicio, '%Y-%m-%d').date()
+            data_fim = datetime.strptime(data_fim, '%Y-%m-%d').date()
             data_prevista = datetime.strptime(data_prevista_str, '%Y-%m-%d').date()
             percentual_decimal = Decimal(str(percentual))
             if not (0 < percentual_decimal <= 100):
@@ -177,90 +213,39 @@ class PagamentoAgregadoViewSet(viewsets.ModelViewSet):
             return Response({"error": f"Parâmetro inválido: {e}"},
                            status=status.HTTP_400_BAD_REQUEST)
 
-        # Buscar CT-es válidos, com veículo agregado, no período, que ainda não têm pagamento
-        ctes_sem_pagamento = CTeDocumento.objects.filter(
-            Q(identificacao__data_emissao__date__gte=data_inicio) &
-            Q(identificacao__data_emissao__date__lte=data_fim) &
-            Q(processado=True) &
-            Q(protocolo__codigo_status=100) & # Autorizado
-            ~Q(cancelamento__c_stat=135) & # Não cancelado
-            Q(modal_rodoviario__veiculos__tipo_proprietario='02') & # Veículo Agregado
-            ~Exists(PagamentoAgregado.objects.filter(cte=OuterRef('pk'))) # Sem pagamento existente
-        ).select_related(
-            'prestacao', 'identificacao', 'modal_rodoviario' # Seleciona dados relacionados
-        ).prefetch_related(
-            'modal_rodoviario__veiculos', 'modal_rodoviario__motoristas' # Prefetch dados ManyToMany
-        ).distinct() # Garante que cada CT-e apareça uma vez
-
-        contador = {'criados': 0, 'erros': 0, 'avisos': 0}
-        erros_detalhados = []
-        avisos_detalhados = []
-
-        for cte in ctes_sem_pagamento:
-            try:
-                # Verificar se CT-e tem prestação e modal rodoviário
-                if not hasattr(cte, 'prestacao') or not cte.prestacao:
-                     avisos_detalhados.append(f"CT-e {cte.chave}: Sem dados de prestação, ignorado.")
-                     contador['avisos'] += 1
-                     continue
-                if not hasattr(cte, 'modal_rodoviario') or not cte.modal_rodoviario:
-                     avisos_detalhados.append(f"CT-e {cte.chave}: Sem dados de modal rodoviário, ignorado.")
-                     contador['avisos'] += 1
-                     continue
-
-                # Encontrar o primeiro veículo agregado no CT-e
-                veiculo_agregado = next((v for v in cte.modal_rodoviario.veiculos.all() if v.tipo_proprietario == '02'), None)
-                if not veiculo_agregado:
-                    avisos_detalhados.append(f"CT-e {cte.chave}: Nenhum veículo com tipo '02' (Agregado) encontrado, ignorado.")
-                    contador['avisos'] += 1
-                    continue
-
-                # Buscar motorista principal (se houver)
-                motorista = cte.modal_rodoviario.motoristas.first()
-                motorista_nome = motorista.nome if motorista else (veiculo_agregado.proprietario_nome or "Motorista Agregado")
-                motorista_cpf = motorista.cpf if motorista else None
-
-                # Criar pagamento
-                PagamentoAgregado.objects.create(
-                    cte=cte,
-                    placa=veiculo_agregado.placa,
-                    condutor_nome=motorista_nome,
-                    condutor_cpf=motorista_cpf,
-                    valor_frete_total=cte.prestacao.valor_total_prestado,
-                    percentual_repasse=percentual_decimal,
-                    # valor_repassado é calculado no save()
-                    data_prevista=data_prevista,
-                    status='pendente'
-                )
-                contador['criados'] += 1
-            except Exception as e:
-                erros_detalhados.append(f"CT-e {cte.chave}: {str(e)}")
-                contador['erros'] += 1
+        resultado = gerar_pagamentos_agregados(
+            data_inicio, data_fim, percentual_decimal, data_prevista, simular=simular
+        )
 
-        status_final = status.HTTP_201_CREATED if contador['criados'] > 0 else status.HTTP_200_OK
-        return Response({
-            "message": f"Geração de pagamentos concluída.",
-            "criados": contador['criados'],
-            "erros": contador['erros'],
-            "avisos": contador['avisos'], # Avisos sobre CTes ignorados
-            "detalhes_erros": erros_detalhados,
-            "detalhes_avisos": avisos_detalhados
-        }, status=status_final)
+        if simular:
+            return Response({"message": "Simulação da geração de pagamentos (nada foi gravado).", "simulacao": True, **resultado})
+        status_final = status.HTTP_201_CREATED if resultado['criados'] > 0 else status.HTTP_200_OK
+        return Response({"message": "Geração de pagamentos concluída.", **resultado}, status=status_final)
 
     @action(detail=False, methods=['get'])
     def export(self, request):
         """Exporta os pagamentos agregados filtrados para CSV."""
         queryset = self.get_queryset()
         filename = f"pagamentos_agregados_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        return csv_response(queryset, self.get_serializer_class(), filename)
+        return csv_response(queryset, self.COLUNAS_EXPORTACAO, filename)
 
 
-class PagamentoProprioViewSet(viewsets.ModelViewSet):
+class PagamentoProprioViewSet(InvalidaPaineisPagamentoMixin, viewsets.ModelViewSet):
     """API para gerenciar pagamentos a motoristas próprios."""
     queryset = PagamentoProprio.objects.all().order_by('-periodo')
     serializer_class = PagamentoProprioSerializer
     permission_classes = [IsAuthenticated]
 
+    # Colunas do CSV de export (campos de leitura do serializer), lidas com values()
+    COLUNAS_EXPORTACAO = [
+        'id',
+        ('veiculo_placa', 'veiculo__placa'),
+        'periodo', 'km_total_periodo', 'valor_base_faixa', 'ajustes', 'valor_total_pagar',
+        'status', 'data_pagamento', 'obs',
+        ('criado_em', 'criado_em', data_hora_iso),
+        ('atualizado_em', 'atualizado_em', data_hora_iso),
+    ]
+
     def get_queryset(self):
         """Permite filtrar pagamentos por diversos parâmetros."""
         queryset = super().get_queryset()
@@ -325,12 +310,11 @@ class PagamentoProprioViewSet(viewsets.ModelViewSet):
             # Usar Coalesce(Sum(...), 0) para tratar caso de não haver CTes
             from django.db.models.functions import Coalesce
             km_total = CTeDocumento.objects.filter(
+                filtro_periodo('identificacao__data_emissao', data_inicio, data_fim),
                 modal_rodoviario__veiculos__placa=veiculo.placa,
-                identificacao__data_emissao__date__gte=data_inicio,
-                identificacao__data_emissao__date__lte=data_fim,
                 processado=True,
-                protocolo__codigo_status=100 # Autorizado
-            ).exclude(cancelamento__c_stat=135).aggregate( # Não cancelado
+                status='autorizado' # Autorizado e não cancelado
+            ).aggregate(
                 total_km=Coalesce(Sum('identificacao__dist_km'), 0)
             )['total_km']
 
@@ -530,6 +514,8 @@ class PagamentoProprioViewSet(viewsets.ModelViewSet):
                 resultados['erros'] += 1
                 resultados['detalhes'].append({'veiculo': veiculo.placa, 'status': 'erro', 'motivo': str(e)})
 
+        if resultados['criados']:
+            invalidar_paineis('pagamento')
         return Response({
             "message": f"Geração de pagamentos concluída.",
             "criados": resultados['criados'],
@@ -543,4 +529,4 @@ class PagamentoProprioViewSet(viewsets.ModelViewSet):
         """Exporta os pagamentos próprios filtrados para CSV."""
         queryset = self.get_queryset()
         filename = f"pagamentos_proprios_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        return csv_response(queryset, self.get_serializer_class(), filename)
+        return csv_response(queryset, self.COLUNAS_EXPORTACAO, filename)
@@ -6,7 +6,7 @@ from decimal import Decimal
 
 # Imports Django
 from django.http import HttpResponse
-from django.db.models import Q, Sum, Count
+from django.db.models import Q, Sum, Count, Exists, OuterRef
 from django.db.models.functions import Coalesce, TruncMonth, TruncDate # TruncDate usado implicitamente por TruncMonth
 from django.utils import timezone
 from django.shortcuts import get_object_or_404 # Usado internamente
@@ -26,11 +26,14 @@ from ..models import ( # Modelos usados pelos ViewSets
     Veiculo,
     ManutencaoVeiculo,
     CTeDocumento, # Usado em VeiculoViewSet.estatisticas
-    MDFeDocumento # Usado em VeiculoViewSet.estatisticas
+    CTeVeiculoRodoviario,
+    MDFeDocumento, # Usado em VeiculoViewSet.estatisticas
+    MDFeVeiculoReboque,
 )
 # Importar FaixaKM se a lógica de pagamento for integrada aqui no futuro
 # from ..models import FaixaKM
-from ..utils import csv_response
+from ..services.status_documento import STATUS_MDFE_VALIDO
+from ..utils import csv_response, data_hora_iso
 
 
 # ===============================================================
@@ -43,6 +46,15 @@ class VeiculoViewSet(viewsets.ModelViewSet):
     serializer_class = VeiculoSerializer
     permission_classes = [IsAuthenticated]
 
+    # Colunas do CSV de export (campos do serializer), lidas com values()
+    COLUNAS_EXPORTACAO = [
+        'id', 'placa', 'renavam', 'tara', 'capacidade_kg', 'capacidade_m3',
+        'tipo_proprietario', 'proprietario_cnpj', 'proprietario_cpf',
+        'proprietario_nome', 'rntrc_proprietario', 'uf_proprietario', 'ativo',
+        ('criado_em', 'criado_em', data_hora_iso),
+        ('atualizado_em', 'atualizado_em', data_hora_iso),
+    ]
+
     def get_queryset(self):
         """Permite filtrar veículos por diversos parâmetros."""
         queryset = super().get_queryset()
@@ -75,14 +87,14 @@ class VeiculoViewSet(viewsets.ModelViewSet):
                 Q(rntrc_proprietario__icontains=texto)
             )
 
-        return queryset.distinct() # Adiciona distinct para evitar duplicatas com filtros Q
+        return queryset # Só campos do próprio veículo: não há duplicatas
 
     @action(detail=False, methods=['get'])
     def export(self, request):
         """Exporta os veículos filtrados para CSV."""
         queryset = self.get_queryset()
         filename = f"veiculos_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        return csv_response(queryset, self.get_serializer_class(), filename)
+        return csv_response(queryset, self.COLUNAS_EXPORTACAO, filename)
 
     @action(detail=True, methods=['get'])
     def estatisticas(self, request, pk=None):
@@ -106,15 +118,15 @@ class VeiculoViewSet(viewsets.ModelViewSet):
 
         # Vincular com documentos (CT-e e MDF-e válidos)
         total_ctes = CTeDocumento.objects.filter(
-            modal_rodoviario__veiculos__placa=veiculo.placa, # Filtra pelo relacionamento
-            protocolo__codigo_status=100 # Apenas autorizados
-        ).exclude(cancelamento__c_stat=135).count() # Exclui cancelados
+            Exists(CTeVeiculoRodoviario.objects.filter(modal__cte=OuterRef('pk'), placa=veiculo.placa)),
+            status='autorizado' # Apenas autorizados e não cancelados
+        ).count()
 
         total_mdfes = MDFeDocumento.objects.filter(
             Q(modal_rodoviario__veiculo_tracao__placa=veiculo.placa) |
-            Q(modal_rodoviario__veiculos_reboque__placa=veiculo.placa), # Checa tração e reboque
-            protocolo__codigo_status=100 # Apenas autorizados
-        ).exclude(cancelamento__c_stat=135).distinct().count() # Exclui cancelados e garante contagem única
+            Exists(MDFeVeiculoReboque.objects.filter(modal__mdfe=OuterRef('pk'), placa=veiculo.placa)), # Checa tração e reboque
+            status__in=STATUS_MDFE_VALIDO # Apenas autorizados/encerrados e não cancelados
+        ).count()
 
         return Response({
             'veiculo': {
@@ -143,6 +155,17 @@ class ManutencaoVeiculoViewSet(viewsets.ModelViewSet):
     serializer_class = ManutencaoVeiculoSerializer
     permission_classes = [IsAuthenticated]
 
+    # Colunas do CSV de export (campos de leitura do serializer), lidas com values()
+    COLUNAS_EXPORTACAO = [
+        'id',
+        ('veiculo_placa', 'veiculo__placa'),
+        'data_servico', 'servico_realizado', 'oficina', 'quilometragem',
+        'peca_utilizada', 'valor_peca', 'valor_mao_obra', 'valor_total',
+        'status', 'observacoes', 'nota_fiscal',
+        ('criado_em', 'criado_em', data_hora_iso),
+        ('atualizado_em', 'atualizado_em', data_hora_iso),
+    ]
+
     def get_queryset(self):
         """Permite filtrar manutenções por diversos parâmetros."""
         queryset = super().get_queryset()
@@ -194,7 +217,7 @@ class ManutencaoVeiculoViewSet(viewsets.ModelViewSet):
         """Exporta as manutenções filtradas para CSV."""
         queryset = self.get_queryset()
         filename = f"manutencoes_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        return csv_response(queryset, self.get_serializer_class(), filename)
+        return csv_response(queryset, self.COLUNAS_EXPORTACAO, filename)
 
 
 class ManutencaoPainelViewSet(viewsets.ViewSet):